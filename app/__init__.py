@@ -270,7 +270,12 @@ Tüm liste endpoint'leri pagination destekler:
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
-    socketio.init_app(app, cors_allowed_origins="*")
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        message_queue=app.config.get("SOCKETIO_MESSAGE_QUEUE"),
+        channel=app.config.get("SOCKETIO_CHANNEL", "awaxen-socketio"),
+    )
     Swagger(app)
     
     # Initialize Celery with app context
@@ -281,11 +286,11 @@ Tüm liste endpoint'leri pagination destekler:
     from .models import (  # noqa: F401
         Role, Permission,
         Organization, User, Gateway, Integration,
-        SmartDevice, SmartAsset, DeviceTelemetry,
+        SmartDevice, SmartAsset, DeviceTelemetry, DeviceTelemetryWide,
         MarketPrice, Automation, AutomationLog, Notification,
-        VppRule, Wallet, WalletTransaction, AuditLog,
+        VppRule, Wallet, WalletTransaction, WalletActivity, AuditLog,
         AIAnalysisTask, AIDetection,
-        EnergySavings, DeviceStateLog,
+        EnergySavings, DeviceStateLog, OrgDailyStats,
     )
 
     # Create tables and seed data
@@ -326,8 +331,25 @@ Tüm liste endpoint'leri pagination destekler:
             "database": "connected" if db.engine else "disconnected"
         }
 
+    # Dashboard KPI snapshot'ı: cihaz / bildirim / cüzdan commit'lerini dinle
+    from .services.org_kpis import register_kpi_listeners
+    register_kpi_listeners()
+
+    # Socket oturumları: kullanıcının organizasyonu / aktifliği değişince eski room'lardan çıkar
+    from .services.socket_auth import register_socket_auth_listeners
+    register_socket_auth_listeners()
+
+    # Cüzdan sıralaması: bakiye / organizasyon commit'lerini sorted set'e yansıt
+    from .services.leaderboard import register_leaderboard_listeners
+    register_leaderboard_listeners()
+
+    # Cüzdan aktivite indeksi: WalletTransaction yazımlarıyla aynı transaction'da güncellenir
+    from .services.wallet_activity import register_activity_listeners
+    register_activity_listeners()
+
     # Register Socket.IO event handlers
     from . import realtime  # noqa: F401
+    realtime.redis_pubsub.init_app(app)
 
     # Initialize MQTT client
     if app.config.get("MQTT_AUTO_START", True):
@@ -6,7 +6,7 @@ from flask import g, request
 
 from app.extensions import db
 from app.models import User, Organization, Role
-from app.auth import get_current_user_id
+from app.auth import get_current_user_id, load_db_user, set_db_user
 
 # Yapı: { org_id: { "data": {...}, "timestamp": 1701234567 } }
 weather_cache: Dict[str, Dict[str, Any]] = {}
@@ -14,12 +14,12 @@ CACHE_TIMEOUT = 900  # 15 Dakika (Saniye cinsinden)
 
 
 def get_current_user() -> Optional[User]:
-    """Token'dan gelen kullanıcıyı DB'de bul veya oluştur."""
+    """Token'dan gelen kullanıcıyı DB'de bul veya oluştur (request başına tek sorgu)."""
     auth0_id = get_current_user_id()
     if not auth0_id:
         return None
 
-    user = User.query.filter_by(auth0_id=auth0_id).first()
+    user = load_db_user()
     if not user:
         token_info = g.current_user
         
@@ -44,6 +44,7 @@ def get_current_user() -> Optional[User]:
         )
         db.session.add(user)
         db.session.commit()
+        set_db_user(user)
     return user
 
 
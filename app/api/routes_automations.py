@@ -18,6 +18,8 @@ from app.api.helpers import (
     paginate_response,
 )
 from app.services.automation_engine import automation_engine
+from app.services.automation_rules import get_rule_cache
+from app.services.automation_triggers import get_automation_trigger_index
 from app.auth import requires_auth
 from app.exceptions import (
     error_response, success_response, not_found_response,
@@ -424,6 +426,7 @@ def create_automation():
     
     db.session.add(automation)
     db.session.commit()
+    get_automation_trigger_index().invalidate()
     
     return jsonify(automation.to_dict()), 201
 
@@ -495,6 +498,8 @@ def update_automation(automation_id):
         automation.asset_id = data["asset_id"]
     
     db.session.commit()
+    get_rule_cache().invalidate(automation.id)
+    get_automation_trigger_index().invalidate()
     
     return jsonify(automation.to_dict())
 
@@ -539,6 +544,8 @@ def delete_automation(automation_id):
     
     db.session.delete(automation)
     db.session.commit()
+    get_rule_cache().invalidate(automation_id)
+    get_automation_trigger_index().invalidate()
     
     return jsonify({"message": "Automation deleted"}), 200
 
@@ -577,6 +584,7 @@ def toggle_automation(automation_id):
     
     automation.is_active = not automation.is_active
     db.session.commit()
+    get_automation_trigger_index().invalidate()
     
     return jsonify({
         "id": str(automation.id),
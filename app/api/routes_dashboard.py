@@ -1,29 +1,25 @@
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 from flask import Blueprint, jsonify, current_app, request
 from flasgger import swag_from
-from sqlalchemy import func, text, and_, cast, Date
+from sqlalchemy import func, and_, cast, Date
 
 from app.auth import requires_auth
 from app.api.helpers import get_current_user
 from app.extensions import db
 from app.models import (
     SmartDevice,
-    MarketPrice,
-    Wallet,
-    WalletTransaction,
-    Notification,
     AutomationLog,
     Automation,
     Organization,
     EnergySavings,
-    DeviceTelemetry,
 )
+from app.services.latest_values import get_latest_value_store
+from app.services.dashboard_stats import day_range, get_daily_stats_store
+from app.services.leaderboard import get_leaderboard_store
+from app.services.org_kpis import get_org_kpi_store
 
 bp = Blueprint('dashboard', __name__)
 
-CHEAP_PRICE_THRESHOLD = 2.0  # TL
-EXPENSIVE_PRICE_THRESHOLD = 3.5 # TL
-
 @bp.route("/summary", methods=["GET"])
 @requires_auth
 @swag_from({
@@ -39,7 +35,9 @@ EXPENSIVE_PRICE_THRESHOLD = 3.5 # TL
                     "kpis": {"type": "object", "description": "Altyapı ve Tüketim"},
                     "market_status": {"type": "object", "description": "EPİAŞ ve Öneri"},
                     "wallet_summary": {"type": "object", "description": "Oyunlaştırma"},
-                    "active_alerts_count": {"type": "integer"}
+                    "active_alerts_count": {"type": "integer"},
+                    "stale_after": {"type": "string", "format": "date-time", "description": "KPI snapshot'ının geçerlilik sonu"},
+                    "stale": {"type": "boolean", "description": "Snapshot son uzlaştırmadan bu yana eskidiyse true"}
                 }
             }
         }
@@ -54,26 +52,33 @@ def get_dashboard_summary():
         return jsonify({"error": "Organizasyon bulunamadı"}), 400
 
     org_id = user.organization_id
-    now = datetime.utcnow()
-    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
 
-    # 2. Veri Toplama (Aggregation)
+    # 2. Veri Toplama: KPI snapshot'ından tek okuma (bkz. services/org_kpis)
     try:
+        snapshot = get_org_kpi_store().summary(org_id, user.id)
+        market = snapshot["market"]
+        wallet = snapshot["wallet"]
+
         # A. Altyapı Verileri (Infrastructure)
         total_power = _get_total_active_power(org_id)
-        daily_consumption = _get_daily_consumption(org_id, day_start)
+        daily_consumption = snapshot["energy_today_kwh"]
         
         # B. Maliyet Hesabı (Cost)
-        avg_price = _get_average_market_price(day_start)
-        daily_cost = round(daily_consumption * avg_price, 2)
+        daily_cost = round(daily_consumption * market["average_price_today"], 2)
+
+        # C. Sistem Sağlığı (Health): (Online / Toplam) * 100
+        total_devices = snapshot["devices_total"]
+        online_devices = snapshot["devices_online"]
+        grid_score = int((online_devices / total_devices) * 100) if total_devices else 100
 
-        # C. Sistem Sağlığı (Health)
-        grid_score = _get_grid_health_score(org_id)
-        
         # D. Pazar ve Cüzdan (Intelligence & Gamification)
-        market_info = _get_market_status()
-        wallet_info = _get_wallet_summary(user, day_start)
-        alerts_count = _get_active_alerts_count(org_id)
+        market_info = {key: market[key] for key in ("current_price", "status", "next_cheap_slot", "currency")}
+        wallet_info = {
+            "balance": wallet["balance"],
+            "todays_earnings": wallet["todays_earnings"],
+            "level": wallet["level"],
+            "rank": (get_leaderboard_store().rank(org_id, user.id) or 0) if wallet["wallet_id"] else 0,
+        }
 
         # 3. Yanıt Oluşturma (DTO)
         response = {
@@ -82,12 +87,14 @@ def get_dashboard_summary():
                 "total_daily_consumption_kwh": round(daily_consumption, 2),
                 "daily_cost_try": daily_cost,                       # Finans Kartı için
                 "grid_health_score": grid_score,                    # Sağlık Barı için
-                "online_devices_count": _get_online_device_count(org_id)
+                "online_devices_count": online_devices
             },
             "market_status": market_info,                           # Traffic Light için
             "wallet_summary": wallet_info,                          # Wallet Kartı için
-            "active_alerts_count": alerts_count,                    # Zil üzerindeki badge
-            "quick_actions": _get_quick_actions()                   # Butonlar
+            "active_alerts_count": snapshot["alerts_unread"],       # Zil üzerindeki badge
+            "quick_actions": _get_quick_actions(),                  # Butonlar
+            "stale_after": snapshot["stale_after"],
+            "stale": snapshot["stale"]
         }
         
         return jsonify(response), 200
@@ -101,148 +108,16 @@ def get_dashboard_summary():
 
 def _get_total_active_power(org_id):
     """
-    Tüm cihazların SON gönderdiği 'power_w' değerini toplar.
-    TimescaleDB optimize sorgusu.
-    """
-    sql = text("""
-        SELECT COALESCE(SUM(latest_power), 0)
-        FROM (
-            SELECT DISTINCT ON (t.device_id) t.value AS latest_power
-            FROM device_telemetry t
-            JOIN smart_devices d ON d.id = t.device_id
-            WHERE d.organization_id = :org_id
-              AND t.key = 'power_w'
-              AND t.time > NOW() - INTERVAL '1 hour'
-            ORDER BY t.device_id, t.time DESC
-        ) AS subquery
-    """)
-    result = db.session.execute(sql, {"org_id": org_id}).scalar()
-    return float(result or 0)
-
-def _get_daily_consumption(org_id, day_start):
+    Tüm cihazların son 1 saatte gönderdiği SON 'power' değerini toplar.
     """
-    Bugün harcanan toplam enerji (kWh).
-    Mantık: (Bugünkü Son Okuma - Bugünkü İlk Okuma)
-    """
-    # Basitleştirilmiş: energy_total_kwh kümülatif artıyorsa max-min yapılabilir.
-    # Şimdilik basitçe saatlik tüketimlerin toplamı varsayalım.
-    sql = text("""
-        SELECT COALESCE(SUM(t.value), 0)
-        FROM device_telemetry t
-        JOIN smart_devices d ON d.id = t.device_id
-        WHERE d.organization_id = :org_id
-          AND t.key = 'energy_total_kwh'
-          AND t.time >= :day_start
-    """)
-    result = db.session.execute(sql, {"org_id": org_id, "day_start": day_start}).scalar()
-    return float(result or 0)
-
-def _get_average_market_price(day_start):
-    """Bugünün ortalama elektrik fiyatı (TL)."""
-    avg = (
-        db.session.query(func.avg(MarketPrice.price))
-        .filter(MarketPrice.time >= day_start)
-        .scalar()
-    )
-    return float(avg or 0)
-
-def _get_grid_health_score(org_id):
-    """Sistem Sağlık Skoru: (Online / Toplam) * 100"""
-    total = SmartDevice.query.filter_by(organization_id=org_id).count()
-    if total == 0: return 100
-    online = SmartDevice.query.filter_by(organization_id=org_id, is_online=True).count()
-    return int((online / total) * 100)
-
-def _get_online_device_count(org_id):
-    return SmartDevice.query.filter_by(organization_id=org_id, is_online=True).count()
-
-def _get_market_status():
-    """Şu anki piyasa durumu ve yapay zeka önerisi."""
-    now = datetime.utcnow()
-    
-    # En son fiyatı bul
-    latest = MarketPrice.query.filter(MarketPrice.time <= now)\
-        .order_by(MarketPrice.time.desc()).first()
-    
-    current_price = float(latest.price) if latest else 0.0
-    
-    # Durum Belirle
-    if current_price < CHEAP_PRICE_THRESHOLD:
-        status = "cheap"
-    elif current_price > EXPENSIVE_PRICE_THRESHOLD:
-        status = "expensive"
-    else:
-        status = "normal"
-        
-    # Gelecek ucuz saati bul
-    next_slot = "Şu an!"
-    if status == "expensive":
-        future = MarketPrice.query.filter(
-            MarketPrice.time > now, 
-            MarketPrice.price < CHEAP_PRICE_THRESHOLD
-        ).order_by(MarketPrice.time.asc()).first()
-        
-        if future:
-            next_slot = future.time.strftime("%H:%00")
-            
-    return {
-        "current_price": current_price,
-        "status": status,
-        "next_cheap_slot": next_slot,
-        "currency": "TL/MWh"
-    }
-
-def _get_wallet_summary(user, day_start):
-    """Kullanıcı cüzdan özeti."""
-    wallet = Wallet.query.filter_by(user_id=user.id).first()
-    
-    if not wallet:
-        return {"balance": 0, "todays_earnings": 0, "rank": 0, "level": 1}
-
-    # Bugün kazanılan
-    today_earn = db.session.query(func.sum(WalletTransaction.amount))\
-        .filter(
-            WalletTransaction.wallet_id == wallet.id,
-            WalletTransaction.created_at >= day_start,
-            WalletTransaction.amount > 0
-        ).scalar() or 0.0
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+    snapshot = get_latest_value_store().get_org_snapshot(org_id)
+    return float(sum(
+        values["power"][1]
+        for values in snapshot.values()
+        if "power" in values and values["power"][0] >= since
+    ))
 
-    # Leaderboard sıralaması hesapla
-    rank = _calculate_user_rank(wallet)
-
-    return {
-        "balance": float(wallet.balance),
-        "todays_earnings": float(today_earn),
-        "level": wallet.level,
-        "rank": rank
-    }
-
-
-def _calculate_user_rank(wallet: Wallet) -> int:
-    """Kullanıcının organizasyon içindeki sıralamasını hesapla."""
-    if not wallet or not wallet.user:
-        return 0
-    
-    org_id = wallet.user.organization_id
-    if not org_id:
-        return 0
-    
-    # Aynı organizasyondaki kullanıcıları bakiyeye göre sırala
-    higher_ranked = db.session.query(func.count(Wallet.id)).join(
-        Wallet.user
-    ).filter(
-        Wallet.user.has(organization_id=org_id),
-        Wallet.balance > wallet.balance
-    ).scalar() or 0
-    
-    return higher_ranked + 1  # 1-indexed rank
-
-def _get_active_alerts_count(org_id):
-    """Okunmamış kritik bildirim sayısı."""
-    return Notification.query.filter_by(
-        organization_id=org_id, 
-        is_read=False
-    ).count()
 
 def _get_quick_actions():
     """Frontend'deki butonlar için konfigürasyon."""
@@ -371,25 +246,26 @@ def get_dashboard_statistics():
     start_date, end_date = _parse_date_range(start_date_str, end_date_str, period)
     
     try:
-        # Get organization for pricing
-        org = Organization.query.get(org_id)
-        electricity_price = float(org.electricity_price_kwh) if org and org.electricity_price_kwh else 2.5
-        currency = org.currency if org else "TRY"
+        # Kapanmış günler org_daily_stats'tan, bugün canlı (bkz. services/dashboard_stats)
+        stats = get_daily_stats_store()
+        first_day, last_day = day_range(start_date, end_date)
+        sections = stats.get_cached(org_id, first_day, last_day)
         
-        # Energy statistics
-        energy_stats = _get_energy_statistics(org_id, start_date, end_date)
-        
-        # Savings statistics
-        savings_stats = _get_savings_statistics(org_id, start_date, end_date, electricity_price, currency)
-        
-        # Device statistics
-        device_stats = _get_device_statistics(org_id, start_date, end_date)
-        
-        # Automation statistics
-        automation_stats = _get_automation_statistics(org_id, start_date, end_date)
-        
-        # Cost statistics
-        cost_stats = _get_cost_statistics(org_id, start_date, end_date, electricity_price, currency)
+        if sections is None:
+            # Get organization for pricing
+            org = Organization.query.get(org_id)
+            electricity_price = float(org.electricity_price_kwh) if org and org.electricity_price_kwh else 2.5
+            currency = org.currency if org else "TRY"
+            
+            facts = stats.facts(org_id, first_day, last_day)
+            sections = {
+                "energy": _get_energy_statistics(facts),
+                "savings": _get_savings_statistics(facts, electricity_price, currency),
+                "devices": _get_device_statistics(org_id),
+                "automations": _get_automation_statistics(org_id, facts),
+                "costs": _get_cost_statistics(facts, electricity_price, currency)
+            }
+            stats.set_cached(org_id, first_day, last_day, sections)
         
         response = {
             "period": {
@@ -397,11 +273,7 @@ def get_dashboard_statistics():
                 "end_date": end_date.isoformat(),
                 "days": (end_date - start_date).days + 1
             },
-            "energy": energy_stats,
-            "savings": savings_stats,
-            "devices": device_stats,
-            "automations": automation_stats,
-            "costs": cost_stats
+            **sections
         }
         
         return jsonify(response), 200
@@ -411,120 +283,63 @@ def get_dashboard_statistics():
         return jsonify({"error": "İstatistik hesaplanırken hata oluştu"}), 500
 
 
-def _get_energy_statistics(org_id, start_date, end_date):
-    """Enerji tüketim istatistikleri."""
-    # Total consumption in period
-    sql = text("""
-        SELECT 
-            COALESCE(SUM(t.value), 0) as total_consumption,
-            COALESCE(AVG(t.value), 0) as avg_daily_consumption,
-            COALESCE(MAX(t.value), 0) as peak_consumption
-        FROM device_telemetry t
-        JOIN smart_devices d ON d.id = t.device_id
-        WHERE d.organization_id = :org_id
-          AND t.key = 'energy_total_kwh'
-          AND t.time >= :start_date
-          AND t.time <= :end_date
-    """)
-    result = db.session.execute(sql, {
-        "org_id": org_id, 
-        "start_date": start_date,
-        "end_date": end_date
-    }).fetchone()
-    
-    # Daily breakdown
-    daily_sql = text("""
-        SELECT 
-            DATE(t.time) as date,
-            COALESCE(SUM(t.value), 0) as consumption
-        FROM device_telemetry t
-        JOIN smart_devices d ON d.id = t.device_id
-        WHERE d.organization_id = :org_id
-          AND t.key = 'energy_total_kwh'
-          AND t.time >= :start_date
-          AND t.time <= :end_date
-        GROUP BY DATE(t.time)
-        ORDER BY DATE(t.time)
-    """)
-    daily_result = db.session.execute(daily_sql, {
-        "org_id": org_id,
-        "start_date": start_date,
-        "end_date": end_date
-    }).fetchall()
+def _get_energy_statistics(facts):
+    """Enerji tüketim istatistikleri (günlük özetlerin toplamı)."""
+    days = [day for day in facts if day["energy_count"]]
+    total = sum(day["energy_sum"] for day in days)
+    count = sum(day["energy_count"] for day in days)
+    peak = max((day["energy_max"] for day in days), default=0.0)
     
     return {
-        "total_consumption_kwh": round(float(result[0] or 0), 2),
-        "avg_daily_consumption_kwh": round(float(result[1] or 0), 2),
-        "peak_consumption_kwh": round(float(result[2] or 0), 2),
+        "total_consumption_kwh": round(total, 2),
+        "avg_daily_consumption_kwh": round(total / count if count else 0.0, 2),
+        "peak_consumption_kwh": round(peak, 2),
         "daily_breakdown": [
-            {"date": str(row[0]), "consumption_kwh": round(float(row[1]), 2)}
-            for row in daily_result
+            {"date": day["date"], "consumption_kwh": round(day["energy_sum"], 2)}
+            for day in days
         ]
     }
 
 
-def _get_savings_statistics(org_id, start_date, end_date, electricity_price, currency):
+def _get_savings_statistics(facts, electricity_price, currency):
     """Tasarruf istatistikleri."""
-    # Query savings from EnergySavings table
-    savings = db.session.query(
-        func.sum(EnergySavings.energy_saved_kwh).label('total_energy'),
-        func.sum(EnergySavings.money_saved).label('total_money'),
-        func.sum(EnergySavings.off_duration_minutes).label('total_minutes')
-    ).filter(
-        EnergySavings.organization_id == org_id,
-        EnergySavings.date >= start_date.date(),
-        EnergySavings.date <= end_date.date()
-    ).first()
-    
-    # Daily savings breakdown
-    daily_savings = db.session.query(
-        EnergySavings.date,
-        func.sum(EnergySavings.energy_saved_kwh).label('energy'),
-        func.sum(EnergySavings.money_saved).label('money')
-    ).filter(
-        EnergySavings.organization_id == org_id,
-        EnergySavings.date >= start_date.date(),
-        EnergySavings.date <= end_date.date()
-    ).group_by(EnergySavings.date).order_by(EnergySavings.date).all()
+    days = [day for day in facts if day["savings_count"]]
     
     # Savings by source type
-    by_source = db.session.query(
-        EnergySavings.source_type,
-        func.sum(EnergySavings.energy_saved_kwh).label('energy'),
-        func.sum(EnergySavings.money_saved).label('money')
-    ).filter(
-        EnergySavings.organization_id == org_id,
-        EnergySavings.date >= start_date.date(),
-        EnergySavings.date <= end_date.date()
-    ).group_by(EnergySavings.source_type).all()
+    by_source = {}
+    for day in days:
+        for source, (energy, money) in day["savings_by_source"].items():
+            totals = by_source.setdefault(source, [0.0, 0.0])
+            totals[0] += energy
+            totals[1] += money
     
     return {
-        "total_energy_saved_kwh": round(float(savings[0] or 0), 2),
-        "total_money_saved": round(float(savings[1] or 0), 2),
-        "total_off_duration_hours": round(float(savings[2] or 0) / 60, 1),
+        "total_energy_saved_kwh": round(sum(day["energy_saved_kwh"] for day in days), 2),
+        "total_money_saved": round(sum(day["money_saved"] for day in days), 2),
+        "total_off_duration_hours": round(sum(day["off_duration_minutes"] for day in days) / 60, 1),
         "currency": currency,
         "electricity_price_kwh": electricity_price,
         "daily_breakdown": [
             {
-                "date": str(row[0]),
-                "energy_saved_kwh": round(float(row[1] or 0), 2),
-                "money_saved": round(float(row[2] or 0), 2)
+                "date": day["date"],
+                "energy_saved_kwh": round(day["energy_saved_kwh"], 2),
+                "money_saved": round(day["money_saved"], 2)
             }
-            for row in daily_savings
+            for day in days
         ],
         "by_source": [
             {
-                "source": row[0],
-                "energy_saved_kwh": round(float(row[1] or 0), 2),
-                "money_saved": round(float(row[2] or 0), 2)
+                "source": source,
+                "energy_saved_kwh": round(energy, 2),
+                "money_saved": round(money, 2)
             }
-            for row in by_source
+            for source, (energy, money) in sorted(by_source.items(), key=lambda item: str(item[0]))
         ]
     }
 
 
-def _get_device_statistics(org_id, start_date, end_date):
-    """Cihaz istatistikleri."""
+def _get_device_statistics(org_id):
+    """Cihaz istatistikleri (anlık durum; dönemden bağımsız)."""
     # Device counts
     total_devices = SmartDevice.query.filter_by(organization_id=org_id, is_active=True).count()
     online_devices = SmartDevice.query.filter_by(organization_id=org_id, is_active=True, is_online=True).count()
@@ -572,42 +387,16 @@ def _get_device_statistics(org_id, start_date, end_date):
     }
 
 
-def _get_automation_statistics(org_id, start_date, end_date):
+def _get_automation_statistics(org_id, facts):
     """Otomasyon istatistikleri."""
-    # Automation counts
+    # Automation counts (anlık durum)
     total_automations = Automation.query.filter_by(organization_id=org_id).count()
     active_automations = Automation.query.filter_by(organization_id=org_id, is_active=True).count()
     
-    # Automation logs in period
-    total_triggers = AutomationLog.query.filter(
-        AutomationLog.organization_id == org_id,
-        AutomationLog.triggered_at >= start_date,
-        AutomationLog.triggered_at <= end_date
-    ).count()
-    
-    successful_triggers = AutomationLog.query.filter(
-        AutomationLog.organization_id == org_id,
-        AutomationLog.triggered_at >= start_date,
-        AutomationLog.triggered_at <= end_date,
-        AutomationLog.status == "success"
-    ).count()
-    
-    failed_triggers = AutomationLog.query.filter(
-        AutomationLog.organization_id == org_id,
-        AutomationLog.triggered_at >= start_date,
-        AutomationLog.triggered_at <= end_date,
-        AutomationLog.status == "failed"
-    ).count()
-    
-    # Daily automation triggers
-    daily_triggers = db.session.query(
-        func.date(AutomationLog.triggered_at).label('date'),
-        func.count(AutomationLog.id).label('count')
-    ).filter(
-        AutomationLog.organization_id == org_id,
-        AutomationLog.triggered_at >= start_date,
-        AutomationLog.triggered_at <= end_date
-    ).group_by(func.date(AutomationLog.triggered_at)).order_by(func.date(AutomationLog.triggered_at)).all()
+    # Automation logs in period (günlük özetlerden)
+    total_triggers = sum(day["automation_triggers"] for day in facts)
+    successful_triggers = sum(day["automation_success"] for day in facts)
+    failed_triggers = sum(day["automation_failed"] for day in facts)
     
     return {
         "total_automations": total_automations,
@@ -617,76 +406,36 @@ def _get_automation_statistics(org_id, start_date, end_date):
         "failed_triggers": failed_triggers,
         "success_rate": round((successful_triggers / total_triggers * 100) if total_triggers > 0 else 0, 1),
         "daily_triggers": [
-            {"date": str(row[0]), "count": row[1]}
-            for row in daily_triggers
+            {"date": day["date"], "count": day["automation_triggers"]}
+            for day in facts if day["automation_triggers"]
         ]
     }
 
 
-def _get_cost_statistics(org_id, start_date, end_date, electricity_price, currency):
+def _get_cost_statistics(facts, electricity_price, currency):
     """Maliyet istatistikleri."""
     # Get energy consumption
-    sql = text("""
-        SELECT COALESCE(SUM(t.value), 0) as total_consumption
-        FROM device_telemetry t
-        JOIN smart_devices d ON d.id = t.device_id
-        WHERE d.organization_id = :org_id
-          AND t.key = 'energy_total_kwh'
-          AND t.time >= :start_date
-          AND t.time <= :end_date
-    """)
-    result = db.session.execute(sql, {
-        "org_id": org_id,
-        "start_date": start_date,
-        "end_date": end_date
-    }).scalar() or 0
-    
-    total_consumption = float(result)
+    energy_days = [day for day in facts if day["energy_count"]]
+    total_consumption = sum(day["energy_sum"] for day in energy_days)
     total_cost = total_consumption * electricity_price
     
     # Get savings
-    savings = db.session.query(
-        func.sum(EnergySavings.money_saved)
-    ).filter(
-        EnergySavings.organization_id == org_id,
-        EnergySavings.date >= start_date.date(),
-        EnergySavings.date <= end_date.date()
-    ).scalar() or 0
-    
-    # Daily cost breakdown
-    daily_sql = text("""
-        SELECT 
-            DATE(t.time) as date,
-            COALESCE(SUM(t.value), 0) as consumption
-        FROM device_telemetry t
-        JOIN smart_devices d ON d.id = t.device_id
-        WHERE d.organization_id = :org_id
-          AND t.key = 'energy_total_kwh'
-          AND t.time >= :start_date
-          AND t.time <= :end_date
-        GROUP BY DATE(t.time)
-        ORDER BY DATE(t.time)
-    """)
-    daily_result = db.session.execute(daily_sql, {
-        "org_id": org_id,
-        "start_date": start_date,
-        "end_date": end_date
-    }).fetchall()
+    savings = sum(day["money_saved"] for day in facts)
     
     return {
         "total_consumption_kwh": round(total_consumption, 2),
         "total_cost": round(total_cost, 2),
-        "total_savings": round(float(savings), 2),
-        "net_cost": round(total_cost - float(savings), 2),
+        "total_savings": round(savings, 2),
+        "net_cost": round(total_cost - savings, 2),
         "currency": currency,
         "electricity_price_kwh": electricity_price,
         "daily_breakdown": [
             {
-                "date": str(row[0]),
-                "consumption_kwh": round(float(row[1]), 2),
-                "cost": round(float(row[1]) * electricity_price, 2)
+                "date": day["date"],
+                "consumption_kwh": round(day["energy_sum"], 2),
+                "cost": round(day["energy_sum"] * electricity_price, 2)
             }
-            for row in daily_result
+            for day in energy_days
         ]
     }
 
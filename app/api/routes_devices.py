@@ -11,7 +11,11 @@ from .helpers import get_current_user, get_pagination_params, get_filter_params,
 from app.models import SmartDevice, SmartAsset
 from app.extensions import db
 from app.auth import requires_auth
-from app.services.shelly_service import get_shelly_service
+from app.services.device_commands import CommandResult, DeviceCommand, get_command_dispatcher
+from app.services.device_resolver import get_device_resolver
+from app.services.anomaly_stats import get_hourly_stats_store
+from app.services.latest_values import get_latest_value_store
+from app.services.shelly_status import get_shelly_status_cache
 from app.exceptions import (
     error_response, success_response, not_found_response, 
     unauthorized_response, ValidationError, DatabaseError
@@ -170,9 +174,14 @@ def get_device_detail(device_id):
         format: uuid
         required: true
         description: Cihaz UUID
+      - name: refresh
+        in: query
+        type: boolean
+        default: false
+        description: Shelly durumunu snapshot yerine Shelly Cloud'dan yeniden çek
     responses:
       200:
-        description: Cihaz detayları
+        description: Cihaz detayları (Shelly cihazlarında live_status snapshot'ı ile)
         schema:
           $ref: '#/definitions/SmartDevice'
       401:
@@ -192,7 +201,16 @@ def get_device_detail(device_id):
     if not device:
         return jsonify({"error": "Device not found"}), 404
 
-    return jsonify(device.to_dict())
+    payload = device.to_dict()
+    if device.brand == 'shelly' and device.external_id:
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
+        try:
+            payload["live_status"] = get_shelly_status_cache().get(device, refresh=refresh)
+        except Exception as e:
+            logger.warning(f"[Devices] Shelly durumu alınamadı ({device.id}): {e}")
+            payload["live_status"] = None
+
+    return jsonify(payload)
 
 
 @api_bp.route('/devices/<uuid:device_id>', methods=['PUT'])
@@ -274,6 +292,7 @@ def update_device(device_id):
         device.settings = data["settings"]
     
     db.session.commit()
+    get_device_resolver().invalidate_device(device)
     
     return jsonify({
         "message": "Device updated",
@@ -326,6 +345,9 @@ def delete_device(device_id):
 
     device.is_active = False
     db.session.commit()
+    get_device_resolver().invalidate_device(device)
+    get_latest_value_store().forget_device(device.id)
+    get_hourly_stats_store().forget(device.id)
     
     return jsonify({"message": "Device deleted"})
 
@@ -400,43 +422,32 @@ def bulk_device_action():
     if not devices:
         return jsonify({"error": "No devices found or access denied"}), 404
 
+    invalid_value = False
+    if value is not None:
+        try:
+            value = int(value)
+            invalid_value = not 0 <= value <= 100
+        except (TypeError, ValueError):
+            invalid_value = True
+
+    if invalid_value:
+        # Komut gönderilmez; her cihaz için hata döner
+        command_results = [
+            CommandResult(DeviceCommand(device, action), False, "Invalid value: integer between 0 and 100 expected")
+            for device in devices
+        ]
+    else:
+        # Komutlar paralel gönderilir (entegrasyon başına sınırlı, komut başına deadline)
+        commands = [DeviceCommand(device, action, value) for device in devices]
+        command_results = get_command_dispatcher().dispatch(commands)
+
+    devices_by_id = {device.id: device for device in devices}
+    now = datetime.utcnow()
     results = []
-    for device in devices:
-        success = True
-        message = "OK"
-
-        if device.brand == "shelly":
-            service = get_shelly_service(str(device.organization_id))
-            if not service:
-                success = False
-                message = "Shelly integration not configured"
-            else:
-                try:
-                    if action == "on":
-                        success = service.turn_on(device)
-                    elif action == "off":
-                        success = service.turn_off(device)
-                    elif action == "toggle":
-                        success = service.toggle(device)
-
-                    if success and value is not None and device.device_type in ["dimmer", "rgbw"]:
-                        success = service.set_power_limit(device, int(value))
-                except Exception as exc:
-                    success = False
-                    message = str(exc)
-        else:
-            # Placeholder - farklı markalar için ileride eklenecek
-            success = True
-            message = f"{device.brand or 'device'} control not implemented, skipping"
-
-        if success:
-            device.last_seen = datetime.utcnow()
-        results.append({
-            "device_id": str(device.id),
-            "name": device.name,
-            "success": success,
-            "message": message,
-        })
+    for result in command_results:
+        if result.success:
+            devices_by_id[result.command.device_id].last_seen = now
+        results.append(result.to_dict())
 
     db.session.commit()
     return jsonify({
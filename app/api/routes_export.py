@@ -304,8 +304,8 @@ def quick_telemetry_export():
     if not device:
         return jsonify({"error": "Device not found"}), 404
     
-    from app.models import DeviceTelemetry
     from app.api.helpers import parse_iso_datetime
+    from app.services.telemetry_store import get_telemetry_store
     
     start_date = parse_iso_datetime(request.args.get("start_date"))
     end_date = parse_iso_datetime(request.args.get("end_date"))
@@ -318,12 +318,10 @@ def quick_telemetry_export():
     if not end_date:
         end_date = utcnow()
     
+    store = get_telemetry_store()
+    
     # Kayıt sayısını kontrol et
-    count = DeviceTelemetry.query.filter(
-        DeviceTelemetry.device_id == device_id,
-        DeviceTelemetry.time >= start_date,
-        DeviceTelemetry.time <= end_date
-    ).count()
+    count = store.count(start_date, end_date, device_ids=[device.id])
     
     if count > 10000:
         return jsonify({
@@ -333,11 +331,7 @@ def quick_telemetry_export():
         }), 413
     
     # Verileri çek
-    records = DeviceTelemetry.query.filter(
-        DeviceTelemetry.device_id == device_id,
-        DeviceTelemetry.time >= start_date,
-        DeviceTelemetry.time <= end_date
-    ).order_by(DeviceTelemetry.time.asc()).limit(limit).all()
+    records = store.history(start_date, end_date, device_ids=[device.id], limit=limit)
     
     if format_type == "json":
         return jsonify({
@@ -346,7 +340,10 @@ def quick_telemetry_export():
             "start_date": start_date.isoformat(),
             "end_date": end_date.isoformat(),
             "row_count": len(records),
-            "data": [r.to_dict() for r in records]
+            "data": [
+                {**r, "time": r["time"].isoformat(), "device_id": str(r["device_id"])}
+                for r in records
+            ]
         })
     
     # CSV format
@@ -358,19 +355,13 @@ def quick_telemetry_export():
     writer = csv.writer(output)
     
     # Header
-    headers = ["time", "power_w", "voltage", "current", "energy_total_kwh", "temperature", "humidity"]
+    headers = ["time", "power", "voltage", "current", "energy", "temperature", "humidity"]
     writer.writerow(headers)
     
     # Data
     for r in records:
-        writer.writerow([
-            r.time.isoformat() if r.time else "",
-            r.power_w or "",
-            r.voltage or "",
-            r.current or "",
-            r.energy_total_kwh or "",
-            r.temperature or "",
-            r.humidity or ""
+        writer.writerow([r["time"].isoformat()] + [
+            r.get(key) if r.get(key) is not None else "" for key in headers[1:]
         ])
     
     output.seek(0)
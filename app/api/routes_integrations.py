@@ -13,7 +13,7 @@ from app.api.helpers import (
     get_pagination_params,
     paginate_response,
 )
-from app.services.shelly_service import ShellyService
+from app.services.shelly_service import ShellyService, get_shelly_registry
 from app.auth import requires_auth
 
 integrations_bp = Blueprint("integrations", __name__)
@@ -206,6 +206,7 @@ def create_integration():
     
     db.session.add(integration)
     db.session.commit()
+    get_shelly_registry().invalidate(integration.organization_id)
     
     return jsonify(integration.to_dict()), 201
 
@@ -261,6 +262,7 @@ def update_integration(integration_id):
         integration.status = data["status"]
     
     db.session.commit()
+    get_shelly_registry().invalidate(integration.organization_id)
     
     return jsonify(integration.to_dict(include_tokens=True))
 
@@ -293,6 +295,7 @@ def delete_integration(integration_id):
     
     integration.is_active = False
     db.session.commit()
+    get_shelly_registry().invalidate(integration.organization_id)
     
     return jsonify({"message": "Integration deactivated"}), 200
 
@@ -73,6 +73,117 @@ def get_version():
     })
 
 
+@meta_bp.route("/ingest", methods=["GET"])
+@requires_auth
+@swag_from({
+    "tags": ["Meta"],
+    "summary": "Telemetri ingest kuyruğu metrikleri",
+    "responses": {
+        200: {
+            "description": "Batch writer backpressure ve throughput metrikleri",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "queue_depth": {"type": "integer", "example": 120},
+                    "queue_capacity": {"type": "integer", "example": 20000},
+                    "enqueued": {"type": "integer"},
+                    "dropped": {"type": "integer"},
+                    "rows_written": {"type": "integer"},
+                    "batches": {"type": "integer"},
+                    "last_flush_ms": {"type": "number"},
+                }
+            },
+        }
+    },
+})
+def get_ingest_metrics():
+    from app.services.telemetry_writer import get_telemetry_writer
+
+    return jsonify(get_telemetry_writer().metrics())
+
+
+@meta_bp.route("/realtime", methods=["GET"])
+@requires_auth
+@swag_from({
+    "tags": ["Meta"],
+    "summary": "Real-time telemetri emitter metrikleri",
+    "responses": {
+        200: {
+            "description": "telemetry_batch kuyruk derinliği ve birleştirme metrikleri",
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "pending_devices": {"type": "integer", "example": 340},
+                    "pending_rooms": {"type": "integer"},
+                    "max_pending": {"type": "integer"},
+                    "updates": {"type": "integer"},
+                    "coalesced": {"type": "integer"},
+                    "dropped": {"type": "integer"},
+                    "flushes": {"type": "integer"},
+                    "events_emitted": {"type": "integer"},
+                    "devices_emitted": {"type": "integer"},
+                    "delta_events_emitted": {"type": "integer"},
+                    "delta_bytes": {"type": "integer"},
+                    "last_flush_ms": {"type": "number"},
+                    "rate_hz": {"type": "number", "example": 2.0},
+                    "socket_auth": {
+                        "type": "object",
+                        "description": "Socket kimlik doğrulama ve kullanıcı cache'i",
+                        "properties": {
+                            "sessions": {"type": "integer"},
+                            "verified": {"type": "integer"},
+                            "reused": {"type": "integer"},
+                            "rejected": {"type": "integer"},
+                            "user_lookups": {"type": "integer"},
+                            "user_cache_hits": {"type": "integer"},
+                        },
+                    },
+                }
+            },
+        }
+    },
+})
+def get_realtime_metrics():
+    from app.services.realtime_emitter import get_telemetry_emitter
+    from app.services.socket_auth import get_socket_authenticator
+
+    return jsonify({**get_telemetry_emitter().metrics(), "socket_auth": get_socket_authenticator().metrics()})
+
+
+@meta_bp.route("/http", methods=["GET"])
+@requires_auth
+@swag_from({
+    "tags": ["Meta"],
+    "summary": "Dış HTTP entegrasyon metrikleri",
+    "responses": {
+        200: {
+            "description": "Host başına istek, latency ve circuit breaker durumu",
+            "schema": {
+                "type": "object",
+                "additionalProperties": {
+                    "type": "object",
+                    "properties": {
+                        "requests": {"type": "integer"},
+                        "errors": {"type": "integer"},
+                        "rejected": {"type": "integer"},
+                        "avg_ms": {"type": "number"},
+                        "p50_ms": {"type": "number"},
+                        "p95_ms": {"type": "number"},
+                        "max_ms": {"type": "number"},
+                        "last_status": {"type": "integer"},
+                        "circuit": {"type": "string", "example": "closed"},
+                    }
+                },
+            },
+        }
+    },
+})
+def get_http_metrics():
+    from app.services.http_client import get_http_client
+
+    return jsonify(get_http_client().metrics())
+
+
 @meta_bp.route("/changelog", methods=["GET"])
 @requires_auth
 @swag_from({
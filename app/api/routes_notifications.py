@@ -11,6 +11,7 @@ from .helpers import get_current_user, get_pagination_params, paginate_response
 from app.extensions import db
 from app.models import Notification, NotificationStatus, UserSettings
 from app.auth import requires_auth
+from app.services.org_kpis import get_org_kpi_store
 
 
 @api_bp.route('/notifications', methods=['GET'])
@@ -262,6 +263,9 @@ def mark_all_as_read():
     })
     
     db.session.commit()
+    if updated and user.organization_id:
+        # Bulk update ORM event'i üretmez; okunmamış sayısını SQL'den yeniden hesapla
+        get_org_kpi_store().reconcile([user.organization_id])
     
     return jsonify({
         "message": "All notifications marked as read",
@@ -19,6 +19,7 @@ from app.api.helpers import (
     apply_sorting,
 )
 from app.auth import requires_auth
+from app.services.socket_auth import get_socket_authenticator
 
 organizations_bp = Blueprint("organizations", __name__)
 
@@ -264,6 +265,7 @@ def create_organization():
         user.organization_id = org.id
     
     db.session.commit()
+    get_socket_authenticator().invalidate_user(user.auth0_id)
     
     return jsonify(org.to_dict()), 201
 
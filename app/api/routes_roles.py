@@ -8,7 +8,7 @@ from flask import jsonify, request
 from . import api_bp
 from app.extensions import db
 from app.models import Role, Permission
-from app.auth import requires_auth, requires_role, requires_permission, get_db_user
+from app.auth import requires_auth, requires_role, requires_permission, get_db_user, get_role_permission_cache
 
 
 # ==========================================
@@ -305,6 +305,7 @@ def update_role(role_id):
         role.permissions = permissions
     
     db.session.commit()
+    get_role_permission_cache().invalidate(role.id)
     
     return jsonify({
         "message": "Rol güncellendi",
@@ -1,42 +1,41 @@
 """Telemetri endpoint'leri - v6.0 (TimescaleDB + Real-Time)."""
-from datetime import datetime, timedelta
+import math
+from datetime import datetime, timedelta, timezone
 from flask import jsonify, request
-from sqlalchemy import func
+from sqlalchemy import update
 
 from . import api_bp
 from .helpers import get_current_user, parse_iso_datetime
 from app.extensions import db
-from app.models import SmartDevice, DeviceTelemetry
+from app.models import SmartDevice
 from app.auth import requires_auth
-from app.realtime import emit_telemetry, emit_device_status, redis_pubsub
+from app.services.device_resolver import get_device_resolver
+from app.services.latest_values import get_latest_value_store
+from app.services.realtime_emitter import get_telemetry_emitter
+from app.services.telemetry_store import get_telemetry_store
+from app.services.telemetry_writer import bulk_load_telemetry, publish_ingested
+
+MAX_KEY_LENGTH = 50  # DeviceTelemetry.key kolon uzunluğu
 
 
 def _prepare_single(payload: dict):
     """
-    Tek bir telemetri kaydını hazırla.
+    Tek bir telemetri kaydını doğrula ve satırlarını hazırla.
     
     Raspberry Pi / Edge Agent formatını destekler:
     - device_id: UUID veya external_id (string) olabilir
     - Veriler doğrudan payload içinde veya 'data' objesi içinde olabilir
     
-    DeviceTelemetry key-value yapısında çalışır:
-    - Her ölçüm (power, voltage, vb.) ayrı bir satır olarak kaydedilir
+    Ölçümler (time, device_id, key, value) satırları olarak döner;
+    depolama düzenine (narrow/wide) telemetri store'u karar verir.
+    
+    Raises:
+        ValueError: Cihaz bulunamadı veya ölçüm değeri geçersiz
     """
-    device = None
     device_identifier = payload.get('device_id') or payload.get('external_id')
     
-    if device_identifier:
-        # Önce UUID olarak dene
-        try:
-            from uuid import UUID
-            UUID(str(device_identifier))
-            device = SmartDevice.query.filter_by(id=device_identifier).first()
-        except (ValueError, AttributeError):
-            pass
-        
-        # UUID değilse external_id olarak ara
-        if not device:
-            device = SmartDevice.query.filter_by(external_id=str(device_identifier)).first()
+    # UUID veya external_id (DeviceResolver cache'i üzerinden)
+    device = get_device_resolver().resolve(device_identifier)
     
     if not device:
         raise ValueError(f"Device not found: {device_identifier}")
@@ -58,87 +57,138 @@ def _prepare_single(payload: dict):
     # None değerleri temizle
     data = {k: v for k, v in data.items() if v is not None}
 
-    # Timestamp varsa kullan, yoksa şimdiki zaman
+    # Timestamp varsa kullan, yoksa şimdiki zaman (naive değerler UTC kabul edilir)
     timestamp = None
     if payload.get('timestamp'):
         timestamp = parse_iso_datetime(payload['timestamp'])
     if not timestamp:
-        timestamp = datetime.utcnow()
+        timestamp = datetime.now(timezone.utc)
+    elif timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
 
-    # DeviceTelemetry key-value yapısında: her ölçüm ayrı satır
-    telemetry_records = []
+    # Her ölçüm ayrı satır (store wide düzende cihaz/zaman başına pivotlar)
+    rows = []
     for key, value in data.items():
-        if value is not None:
-            telemetry = DeviceTelemetry(
-                time=timestamp,
-                device_id=device.id,
-                key=key,
-                value=float(value),
-            )
-            db.session.add(telemetry)
-            telemetry_records.append(telemetry)
-
-    was_offline = not device.is_online
-    device.is_online = True
-    device.last_seen = datetime.utcnow()
+        if len(str(key)) > MAX_KEY_LENGTH:
+            raise ValueError(f"Telemetry key too long: {key}")
+        try:
+            numeric = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for '{key}': {value!r}")
+        if not math.isfinite(numeric):
+            raise ValueError(f"Invalid value for '{key}': {value!r}")
+        rows.append((timestamp, device.id, str(key), numeric))
 
-    return device, telemetry_records, data, was_offline
+    return device, timestamp, rows, data
 
 
 def _handle_telemetry_ingest(raw_payload):
-    try:
-        payload = raw_payload
-        if payload is None:
-            return jsonify({"error": "Invalid JSON payload"}), 400
+    """
+    Telemetri batch'ini toplu olarak yaz.
+    
+    Her entry ayrı doğrulanır; hatalı entry'ler (bilinmeyen cihaz, geçersiz
+    değer) reddedilir ve raporlanır, geçerli satırlar tek bir bulk load
+    (PostgreSQL COPY) ile yazılır.
+    """
+    payload = raw_payload
+    if payload is None:
+        return jsonify({"error": "Invalid JSON payload"}), 400
 
-        payload_list = payload if isinstance(payload, list) else [payload]
-        if not payload_list:
-            return jsonify({"error": "Telemetry payload is empty"}), 400
+    payload_list = payload if isinstance(payload, list) else [payload]
+    if not payload_list:
+        return jsonify({"error": "Telemetry payload is empty"}), 400
 
-        processed = []
+    processed = []
+    errors = []
 
-        for entry in payload_list:
-            if not isinstance(entry, dict):
-                raise ValueError("Each telemetry entry must be an object")
+    for index, entry in enumerate(payload_list):
+        if not isinstance(entry, dict):
+            errors.append({"index": index, "error": "Each telemetry entry must be an object"})
+            continue
+        try:
             processed.append(_prepare_single(entry))
-
-        db.session.commit()
-
-        # Real-time yayınları commit sonrası yap
-        for device, telemetry_records, data, was_offline in processed:
-            org_id = str(device.organization_id) if device.organization_id else None
-            if not org_id:
-                continue
-
-            # İlk kaydın zamanını al
-            first_time = telemetry_records[0].time if telemetry_records else None
-            
-            emit_telemetry(org_id, str(device.id), {
-                **data,
-                "time": first_time.isoformat() if first_time else None
+        except ValueError as e:
+            errors.append({
+                "index": index,
+                "device_id": entry.get('device_id') or entry.get('external_id'),
+                "error": str(e),
             })
 
-            if was_offline:
-                emit_device_status(org_id, str(device.id), {
-                    "is_online": True,
-                    "last_seen": device.last_seen.isoformat(),
-                    "event": "device_online"
-                })
-
-        if len(processed) == 1:
-            device = processed[0][0]
-            return jsonify({"status": "success", "device_id": str(device.id)}), 201
-
+    if not processed:
+        # Tek entry'lik legacy istekler için eski hata formatı korunur
         return jsonify({
-            "status": "success",
-            "processed": len(processed),
-            "device_ids": [str(device.id) for device, *_ in processed]
-        }), 201
+            "error": errors[0]["error"] if len(errors) == 1 else "No valid telemetry entries",
+            "accepted": 0,
+            "rejected": len(errors),
+            "errors": errors,
+        }), 400
 
+    last_seen = datetime.now(timezone.utc)
+    try:
+        accepted_rows = bulk_load_telemetry(
+            row for _, _, rows, _ in processed for row in rows
+        )
+
+        # Offline -> online geçişi DB'deki duruma göre belirlenir (başka process /
+        # watchdog offline işaretlemiş olabilir); sonra tüm cihazların last_seen'i
+        device_ids = list({device.id for device, *_ in processed})
+        came_online = set(db.session.execute(
+            update(SmartDevice)
+            .where(SmartDevice.id.in_(device_ids), SmartDevice.is_online.isnot(True))
+            .values(is_online=True, last_seen=last_seen)
+            .returning(SmartDevice.id)
+        ).scalars())
+        db.session.execute(
+            update(SmartDevice)
+            .where(SmartDevice.id.in_(device_ids))
+            .values(is_online=True, last_seen=last_seen)
+        )
+
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 400
 
+    publish_ingested([row for _, _, rows, _ in processed for row in rows])
+
+    # Real-time yayınları commit sonrası yap: cihaz başına en güncel okuma
+    latest = {}
+    for device, timestamp, _, data in processed:
+        current = latest.get(device.id)
+        if current is None or timestamp >= current[1]:
+            latest[device.id] = (device, timestamp, data)
+
+    resolver = get_device_resolver()
+    emitter = get_telemetry_emitter()
+    for device, timestamp, data in latest.values():
+        resolver.mark_online(device.id)
+        org_id = str(device.organization_id) if device.organization_id else None
+        if not org_id:
+            continue
+
+        status = None
+        if device.id in came_online:
+            status = {
+                "is_online": True,
+                "last_seen": last_seen.isoformat(),
+                "event": "device_online"
+            }
+        emitter.update(org_id, device.id, data={**data, "time": timestamp.isoformat()}, status=status)
+
+    if len(payload_list) == 1:
+        device = processed[0][0]
+        return jsonify({"status": "success", "device_id": str(device.id)}), 201
+
+    return jsonify({
+        "status": "partial" if errors else "success",
+        "processed": len(processed),
+        "accepted": len(processed),
+        "rejected": len(errors),
+        "accepted_rows": accepted_rows,
+        "errors": errors,
+        "device_ids": list(dict.fromkeys(str(device.id) for device, *_ in processed))
+    }), 201
+
 
 @api_bp.route('/telemetry', methods=['POST'])
 def receive_telemetry():
@@ -208,17 +258,36 @@ def ingest_telemetry():
             status:
               type: string
               example: success
+              description: success | partial (bazı entry'ler reddedildi)
             processed:
               type: integer
               example: 50
+            accepted:
+              type: integer
+              example: 49
+            rejected:
+              type: integer
+              example: 1
+            accepted_rows:
+              type: integer
+              example: 245
+            errors:
+              type: array
+              items:
+                type: object
+                properties:
+                  index:
+                    type: integer
+                  device_id:
+                    type: string
+                  error:
+                    type: string
             device_ids:
               type: array
               items:
                 type: string
       400:
-        description: Geçersiz payload
-      404:
-        description: Cihaz bulunamadı
+        description: Geçersiz payload veya tüm entry'ler reddedildi
     """
     return _handle_telemetry_ingest(request.get_json(silent=True))
 
@@ -259,7 +328,7 @@ def get_telemetry_history():
           type: string
           enum: [raw, 5m, 15m, 1h, 6h, 1d]
           default: raw
-        description: "Downsampling aralığı. raw seçilirse ham veriler döner, diğer değerlerde ortalama alınır."
+        description: "Downsampling aralığı. raw seçilirse ham veriler döner, diğer değerlerde ortalama alınır (aralığı karşılayan en kaba continuous aggregate rollup'ından - 5m/1h/1d). Kayıtlar depolama düzeninden bağımsız olarak zaman başına tek obje (power, voltage, current, energy, temperature, humidity) şeklindedir."
       - in: query
         name: limit
         required: false
@@ -294,59 +363,34 @@ def get_telemetry_history():
 
     # Varsayılan: son 24 saat
     if not start:
-        start = datetime.utcnow() - timedelta(hours=24)
+        start = datetime.now(timezone.utc) - timedelta(hours=24)
     if not end:
-        end = datetime.utcnow()
-
-    base_filters = [
-        DeviceTelemetry.device_id == device_id,
-        DeviceTelemetry.time >= start,
-        DeviceTelemetry.time <= end
-    ]
+        end = datetime.now(timezone.utc)
 
     interval_map = {
-        "5m": "5 minutes",
-        "15m": "15 minutes",
-        "1h": "1 hour",
-        "6h": "6 hours",
-        "1d": "1 day",
+        "5m": timedelta(minutes=5),
+        "15m": timedelta(minutes=15),
+        "1h": timedelta(hours=1),
+        "6h": timedelta(hours=6),
+        "1d": timedelta(days=1),
     }
 
+    store = get_telemetry_store()
+
     if interval and interval.lower() in interval_map:
-        bucket_interval = interval_map[interval.lower()]
-        bucket = func.time_bucket(bucket_interval, DeviceTelemetry.time).label("bucket")
-
-        agg_query = db.session.query(
-            bucket,
-            func.avg(DeviceTelemetry.power_w).label("power_w"),
-            func.avg(DeviceTelemetry.voltage).label("voltage"),
-            func.avg(DeviceTelemetry.current).label("current"),
-            func.avg(DeviceTelemetry.energy_total_kwh).label("energy_total_kwh"),
-            func.avg(DeviceTelemetry.temperature).label("temperature"),
-            func.avg(DeviceTelemetry.humidity).label("humidity"),
-        ).filter(*base_filters).group_by(bucket).order_by(bucket.asc())
-
-        rows = agg_query.all()
-        response = []
-        for row in rows:
-            response.append({
-                "time": row.bucket.isoformat() if row.bucket else None,
-                "power_w": float(row.power_w) if row.power_w is not None else None,
-                "voltage": float(row.voltage) if row.voltage is not None else None,
-                "current": float(row.current) if row.current is not None else None,
-                "energy_total_kwh": float(row.energy_total_kwh) if row.energy_total_kwh is not None else None,
-                "temperature": float(row.temperature) if row.temperature is not None else None,
-                "humidity": float(row.humidity) if row.humidity is not None else None,
+        buckets = store.aggregate(device.id, start, end, interval_map[interval.lower()])
+        return jsonify([
+            {
+                **_serialize_record(bucket),
                 "interval": interval.lower(),
                 "aggregated": True,
-            })
-        return jsonify(response)
+            }
+            for bucket in buckets
+        ])
 
-    query = DeviceTelemetry.query.filter(*base_filters)
+    records = store.history(start, end, device_ids=[device.id], limit=limit)
 
-    records = query.order_by(DeviceTelemetry.time.asc()).limit(limit).all()
-
-    return jsonify([r.to_dict() for r in records])
+    return jsonify([_serialize_record(r) for r in records])
 
 
 @api_bp.route('/telemetry/latest', methods=['GET'])
@@ -384,11 +428,25 @@ def get_latest_telemetry():
     if not device:
         return jsonify({"error": "Device not found"}), 404
 
-    latest = DeviceTelemetry.query.filter_by(
-        device_id=device_id
-    ).order_by(DeviceTelemetry.time.desc()).first()
+    # Last-known-value store (O(1)); kanonik olmayan key'ler için store'a düş
+    snapshot = get_latest_value_store().get_device_snapshot(device)
+    if snapshot:
+        latest = {"time": max(ts for ts, _ in snapshot.values()), "device_id": device.id}
+        latest.update({key: value for key, (_, value) in snapshot.items()})
+    else:
+        latest = get_telemetry_store().latest(device.id)
 
     if not latest:
         return jsonify({"error": "No telemetry data found"}), 404
 
-    return jsonify(latest.to_dict())
+    return jsonify(_serialize_record(latest))
+
+
+def _serialize_record(record: dict) -> dict:
+    """Store kaydını JSON'a çevir (time ISO, device_id string)."""
+    result = dict(record)
+    if result.get("time") is not None:
+        result["time"] = result["time"].isoformat()
+    if result.get("device_id") is not None:
+        result["device_id"] = str(result["device_id"])
+    return result
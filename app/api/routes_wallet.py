@@ -3,8 +3,8 @@ Wallet (Cüzdan) API - Oyunlaştırma ve Ödül Sistemi.
 
 Awaxen Coin (AWX) yönetimi, işlem geçmişi ve seviye sistemi.
 """
-from datetime import date, datetime, timedelta
 from decimal import Decimal
+from uuid import UUID
 
 from flask import jsonify, request
 
@@ -13,6 +13,8 @@ from .helpers import get_current_user, get_pagination_params, paginate_response
 from app.extensions import db
 from app.models import Wallet, WalletTransaction, User
 from app.auth import requires_auth
+from app.services.leaderboard import get_leaderboard_store
+from app.services.wallet_activity import get_activity, wallet_stats
 
 
 @api_bp.route('/wallet', methods=['GET'])
@@ -335,8 +337,6 @@ def get_wallet_stats():
       401:
         description: Yetkisiz erişim
     """
-    from sqlalchemy import func
-    
     user = get_current_user()
     if not user:
         return jsonify({"error": "Unauthorized"}), 401
@@ -350,78 +350,8 @@ def get_wallet_stats():
             "streak_days": 0,
         })
     
-    # Bu ay başlangıcı
-    now = datetime.utcnow()
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # Bu ayki toplam kazanç
-    monthly_earned = db.session.query(func.sum(WalletTransaction.amount)).filter(
-        WalletTransaction.wallet_id == wallet.id,
-        WalletTransaction.transaction_type == "reward",
-        WalletTransaction.created_at >= month_start
-    ).scalar() or 0
-    
-    # Bu ayki işlem sayısı
-    monthly_count = WalletTransaction.query.filter(
-        WalletTransaction.wallet_id == wallet.id,
-        WalletTransaction.created_at >= month_start
-    ).count()
-    
-    # En çok ödül alınan kategori
-    top_category = db.session.query(
-        WalletTransaction.category,
-        func.sum(WalletTransaction.amount).label('total')
-    ).filter(
-        WalletTransaction.wallet_id == wallet.id,
-        WalletTransaction.transaction_type == "reward"
-    ).group_by(WalletTransaction.category).order_by(
-        func.sum(WalletTransaction.amount).desc()
-    ).first()
-    
-    # Streak hesaplama: Ardışık gün sayısı (ödül alınan)
-    streak_days = _calculate_streak_days(wallet.id)
-    
-    return jsonify({
-        "total_earned_this_month": float(monthly_earned),
-        "total_transactions_this_month": monthly_count,
-        "top_category": top_category[0] if top_category else None,
-        "streak_days": streak_days,
-    })
-
-
-def _calculate_streak_days(wallet_id) -> int:
-    """
-    Ardışık gün sayısını hesapla (son kaç gündür ödül alınmış).
-    
-    Örnek: Bugün, dün ve önceki gün ödül aldıysa streak = 3
-    """
-    today = date.today()
-    streak = 0
-    
-    # Son 365 günü kontrol et (makul bir limit)
-    for i in range(365):
-        check_date = today - timedelta(days=i)
-        day_start = datetime.combine(check_date, datetime.min.time())
-        day_end = datetime.combine(check_date, datetime.max.time())
-        
-        # O gün ödül var mı?
-        has_reward = WalletTransaction.query.filter(
-            WalletTransaction.wallet_id == wallet_id,
-            WalletTransaction.transaction_type == "reward",
-            WalletTransaction.amount > 0,
-            WalletTransaction.created_at >= day_start,
-            WalletTransaction.created_at <= day_end
-        ).first()
-        
-        if has_reward:
-            streak += 1
-        else:
-            # Bugün değilse streak kırıldı
-            if i > 0:
-                break
-            # Bugün ödül yoksa streak 0
-    
-    return streak
+    # Aylık özetler ve streak bitmap'i tek satırdan (bkz. services/wallet_activity)
+    return jsonify(wallet_stats(get_activity(wallet.id)))
 
 
 @api_bp.route('/wallet/leaderboard', methods=['GET'])
@@ -439,7 +369,12 @@ def get_leaderboard():
         in: query
         type: integer
         default: 10
-        description: Kaç kullanıcı gösterilsin
+        description: Kaç kullanıcı gösterilsin (sayfa boyutu, max 50)
+      - name: page
+        in: query
+        type: integer
+        default: 1
+        description: Sayfa numarası
     responses:
       200:
         description: Liderlik tablosu
@@ -461,6 +396,9 @@ def get_leaderboard():
                     type: integer
             my_rank:
               type: integer
+            total:
+              type: integer
+              description: Sıralamadaki kullanıcı sayısı
       401:
         description: Yetkisiz erişim
     """
@@ -470,38 +408,39 @@ def get_leaderboard():
     
     limit = request.args.get('limit', 10, type=int)
     limit = min(limit, 50)  # Max 50
+    page = max(1, request.args.get('page', 1, type=int))
+    offset = (page - 1) * limit
+    
+    # Organizasyon sıralaması Redis sorted set'ten (bkz. services/leaderboard)
+    board = get_leaderboard_store()
+    top = board.top(user.organization_id, offset=offset, limit=limit)
     
-    # Organizasyondaki kullanıcıların cüzdanları
-    leaderboard_query = db.session.query(
-        Wallet, User
-    ).join(User).filter(
-        User.organization_id == user.organization_id,
-        Wallet.is_active == True
-    ).order_by(Wallet.balance.desc()).limit(limit).all()
+    # Sadece sayfadaki kullanıcıların adları / seviyeleri
+    rows = db.session.query(User, Wallet.level).join(Wallet, Wallet.user_id == User.id).filter(
+        User.id.in_([UUID(user_id) for user_id, _ in top])
+    ).all() if top else []
+    profiles = {str(u.id): (u, level) for u, level in rows}
     
     leaderboard = []
-    for rank, (wallet, u) in enumerate(leaderboard_query, 1):
+    for rank, (user_id, balance) in enumerate(top, offset + 1):
+        if user_id not in profiles:
+            continue
+        u, level = profiles[user_id]
         leaderboard.append({
             "rank": rank,
-            "user_id": str(u.id),
+            "user_id": user_id,
             "user_name": u.full_name or u.email.split("@")[0],
-            "balance": float(wallet.balance) if wallet.balance else 0,
-            "level": wallet.level,
+            "balance": balance,
+            "level": level,
         })
     
     # Kullanıcının sırası
-    my_wallet = Wallet.query.filter_by(user_id=user.id).first()
-    my_rank = None
-    if my_wallet:
-        higher_count = Wallet.query.join(User).filter(
-            User.organization_id == user.organization_id,
-            Wallet.balance > (my_wallet.balance or 0)
-        ).count()
-        my_rank = higher_count + 1
+    my_rank = board.rank(user.organization_id, user.id)
     
     return jsonify({
         "leaderboard": leaderboard,
         "my_rank": my_rank,
+        "total": board.size(user.organization_id),
     })
 
 
@@ -21,9 +21,14 @@ from flask import Blueprint, current_app, jsonify, request
 from sqlalchemy import func
 
 from app.extensions import db
-from app.models import User, SmartDevice, Wallet, Automation, MarketPrice, DeviceTelemetry, Organization
+from app.models import User, SmartDevice, Wallet, Automation, MarketPrice, Organization
 from app.services import get_current_market_price
 from app.services.savings_service import SavingsService
+from app.services.device_resolver import get_device_resolver
+from app.services.http_client import get_http_client
+from app.services.latest_values import get_latest_value_store
+from app.services.telemetry_store import get_telemetry_store, normalize_key
+from app.services.telemetry_writer import publish_ingested
 
 bp = Blueprint("webhooks", __name__)
 
@@ -411,7 +416,7 @@ def answer_callback(callback_id, token):
     """Callback query'yi onayla."""
     url = f"{TELEGRAM_API_URL}{token}/answerCallbackQuery"
     try:
-        requests.post(url, json={"callback_query_id": callback_id}, timeout=5)
+        get_http_client().post(url, json={"callback_query_id": callback_id}, timeout=5)
     except requests.RequestException:
         pass
 
@@ -427,7 +432,7 @@ def send_telegram_message(chat_id, text, token, parse_mode=None, reply_markup=No
         payload["reply_markup"] = reply_markup
     
     try:
-        requests.post(url, json=payload, timeout=10)
+        get_http_client().post(url, json=payload, timeout=10)
     except requests.RequestException as exc:
         current_app.logger.error(f"[Telegram] sendMessage failed: {exc}")
 
@@ -465,9 +470,9 @@ def handle_device_detail(chat_id, user, device_id, token):
         return jsonify({"status": "not_found"}), 200
     
     # Son telemetri
-    last_telemetry = DeviceTelemetry.query.filter_by(
-        device_id=device.id
-    ).order_by(DeviceTelemetry.time.desc()).first()
+    last_telemetry = {
+        key: value for key, (_, value) in get_latest_value_store().get_device_snapshot(device).items()
+    }
     
     status_emoji = "🟢" if device.is_online else "🔴"
     status_text = "Çevrimiçi" if device.is_online else "Çevrimdışı"
@@ -484,16 +489,16 @@ def handle_device_detail(chat_id, user, device_id, token):
     
     if last_telemetry:
         msg += f"\n📊 *Son Ölçümler*\n"
-        if last_telemetry.power_w is not None:
-            msg += f"⚡ Güç: {last_telemetry.power_w:.1f} W\n"
-        if last_telemetry.voltage is not None:
-            msg += f"🔋 Voltaj: {last_telemetry.voltage:.1f} V\n"
-        if last_telemetry.current is not None:
-            msg += f"⚡ Akım: {last_telemetry.current:.2f} A\n"
-        if last_telemetry.temperature is not None:
-            msg += f"🌡️ Sıcaklık: {last_telemetry.temperature:.1f}°C\n"
-        if last_telemetry.energy_total_kwh is not None:
-            msg += f"📈 Toplam: {last_telemetry.energy_total_kwh:.2f} kWh\n"
+        if last_telemetry.get("power") is not None:
+            msg += f"⚡ Güç: {last_telemetry['power']:.1f} W\n"
+        if last_telemetry.get("voltage") is not None:
+            msg += f"🔋 Voltaj: {last_telemetry['voltage']:.1f} V\n"
+        if last_telemetry.get("current") is not None:
+            msg += f"⚡ Akım: {last_telemetry['current']:.2f} A\n"
+        if last_telemetry.get("temperature") is not None:
+            msg += f"🌡️ Sıcaklık: {last_telemetry['temperature']:.1f}°C\n"
+        if last_telemetry.get("energy") is not None:
+            msg += f"📈 Toplam: {last_telemetry['energy']:.2f} kWh\n"
     
     # Kontrol butonları
     toggle_text = "🔴 Kapat" if device.is_online else "🟢 Aç"
@@ -727,12 +732,9 @@ def handle_report_daily(chat_id, user, token):
     start_of_day = datetime.combine(today, datetime.min.time()).replace(tzinfo=TR_TIMEZONE)
     
     # Günlük tüketim
-    daily_consumption = db.session.query(
-        func.sum(DeviceTelemetry.power_w)
-    ).join(SmartDevice).filter(
-        SmartDevice.organization_id == user.organization_id,
-        DeviceTelemetry.time >= start_of_day
-    ).scalar() or 0
+    daily_consumption = get_telemetry_store().sum_values(
+        "power", start_of_day, organization_id=user.organization_id
+    )
     
     # kWh'e çevir (ortalama güç * saat sayısı / 1000)
     hours_passed = (datetime.now(TR_TIMEZONE) - start_of_day).total_seconds() / 3600
@@ -990,25 +992,17 @@ def homeassistant_device_webhook():
             power = attributes.get("power") or attributes.get("current_power_w")
             energy = attributes.get("energy") or attributes.get("total_energy_kwh")
             
+            now = datetime.now(timezone.utc)
+            rows = []
             if power is not None:
-                telemetry = DeviceTelemetry(
-                    time=datetime.now(timezone.utc),
-                    device_id=device.id,
-                    key="power_w",
-                    value=float(power)
-                )
-                db.session.add(telemetry)
-            
+                rows.append((now, device.id, "power", float(power)))
             if energy is not None:
-                telemetry = DeviceTelemetry(
-                    time=datetime.now(timezone.utc),
-                    device_id=device.id,
-                    key="energy_total_kwh",
-                    value=float(energy)
-                )
-                db.session.add(telemetry)
+                rows.append((now, device.id, "energy", float(energy)))
+            if rows:
+                get_telemetry_store().write(rows)
             
             db.session.commit()
+            publish_ingested(rows)
             
             return jsonify({
                 "status": "success",
@@ -1040,6 +1034,8 @@ def homeassistant_telemetry_webhook():
             return jsonify({"error": "devices array required"}), 400
         
         processed = 0
+        now = datetime.now(timezone.utc)
+        rows = []
         
         for device_data in devices_data:
             entity_id = device_data.get("entity_id")
@@ -1055,32 +1051,18 @@ def homeassistant_telemetry_webhook():
             device_name = parts[0]
             metric = parts[1]
             
-            device = SmartDevice.query.filter(
-                SmartDevice.external_id.ilike(f"%{device_name}%")
-            ).first()
+            device = get_device_resolver().resolve_by_name(device_name)
             
             if device:
-                key_map = {
-                    "power": "power_w",
-                    "energy": "energy_total_kwh",
-                    "temperature": "temperature_c",
-                    "humidity": "humidity_pct"
-                }
-                telemetry_key = key_map.get(metric, metric)
-                
                 try:
-                    telemetry = DeviceTelemetry(
-                        time=datetime.now(timezone.utc),
-                        device_id=device.id,
-                        key=telemetry_key,
-                        value=float(state)
-                    )
-                    db.session.add(telemetry)
+                    rows.append((now, device.id, normalize_key(metric), float(state)))
                     processed += 1
                 except (ValueError, TypeError):
                     pass
         
+        get_telemetry_store().write(rows)
         db.session.commit()
+        publish_ingested(rows)
         return jsonify({"status": "success", "processed": processed}), 200
         
     except Exception as e:
@@ -1108,6 +1090,7 @@ def homeassistant_discovery_webhook():
         
         created = 0
         updated = 0
+        touched = []
         
         for device_data in devices_data:
             entity_id = device_data.get("entity_id")
@@ -1129,6 +1112,7 @@ def homeassistant_discovery_webhook():
                 existing.model = model
                 existing.is_online = True
                 existing.last_seen = datetime.now(timezone.utc)
+                touched.append(existing)
                 updated += 1
             else:
                 new_device = SmartDevice(
@@ -1145,9 +1129,16 @@ def homeassistant_discovery_webhook():
                     is_active=True
                 )
                 db.session.add(new_device)
+                touched.append(new_device)
                 created += 1
         
         db.session.commit()
+        
+        # Yeni/güncellenen cihazlar bir sonraki okumada yeniden çözümlensin
+        resolver = get_device_resolver()
+        for device in touched:
+            resolver.invalidate_device(device)
+        
         return jsonify({"status": "success", "created": created, "updated": updated}), 200
         
     except Exception as e:
@@ -3,17 +3,226 @@ Auth0 JWT Token doğrulama decorator'ı.
 Frontend'den gelen Bearer Token'ı çözer ve kullanıcı bilgisini request'e ekler.
 """
 
+import hashlib
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
+from typing import Any, Dict, Optional, Tuple
 
 import jwt
+import requests
 from flask import request, jsonify, g
-from jwt import PyJWKClient
+
+logger = logging.getLogger(__name__)
 
 # Auth0 ayarları (.env'den okunacak)
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "dev-xxxxx.us.auth0.com")
 AUTH0_AUDIENCE = os.getenv("AUTH0_AUDIENCE", "https://api.awaxen.com")
 ALGORITHMS = ["RS256"]
+JWKS_URL = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+JWKS_REFRESH_SECONDS = 600        # Bu süreden eski anahtar seti arka planda yenilenir
+JWKS_MISS_COOLDOWN_SECONDS = 30   # Bilinmeyen kid için en sık yeniden çekme aralığı
+JWKS_FETCH_TIMEOUT_SECONDS = 5
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_MAX_SECONDS = 300     # exp daha uzaksa bile doğrulanmış token en fazla bu kadar cache'lenir
+ROLE_PERMISSIONS_TTL_SECONDS = 60  # Diğer worker'larda rol yetki değişikliği en geç bu sürede görünür
+
+
+class JwksCache:
+    """
+    Process genelinde Auth0 imza anahtarı cache'i.
+    
+    - Anahtarlar kid ile bellekte tutulur; istek başına ağ çağrısı yok
+    - JWKS_REFRESH_SECONDS'tan eski set arka planda yenilenir (istekler beklemez)
+    - Bilinmeyen kid (anahtar rotasyonu) seti hemen yeniden çeker; cooldown ile sınırlı
+    - Çekme tek kilit altında: soğuk cache'te eşzamanlı istekler tek fetch'i bekler
+    """
+    
+    def __init__(
+        self,
+        url: str = JWKS_URL,
+        refresh_interval: float = JWKS_REFRESH_SECONDS,
+        miss_cooldown: float = JWKS_MISS_COOLDOWN_SECONDS,
+    ):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.miss_cooldown = miss_cooldown
+        
+        self._keys: Dict[str, Any] = {}
+        self._fetched_at: Optional[float] = None
+        self._miss_fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+    
+    def get_key(self, kid: Optional[str]):
+        """
+        kid'in public key'i.
+        
+        Raises:
+            jwt.InvalidTokenError: Anahtar yeniden çekmeden sonra da bulunamadı
+            jwt.PyJWKClientConnectionError: JWKS çekilemedi
+        """
+        key = self._keys.get(kid)
+        if key is not None:
+            self._maybe_refresh()
+            return key
+        
+        with self._fetch_lock:
+            key = self._keys.get(kid)  # Beklerken başka bir istek çekmiş olabilir
+            now = time.monotonic()
+            if key is None and self._fetched_at is None:
+                self._load()  # İlk yükleme
+                key = self._keys.get(kid)
+            elif key is None and now - self._miss_fetched_at >= self.miss_cooldown:
+                self._miss_fetched_at = now
+                self._load()
+                key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Signing key not found: {kid}")
+        return key
+    
+    def refresh(self) -> None:
+        """Anahtar setini şimdi yeniden çek."""
+        with self._fetch_lock:
+            self._load()
+    
+    def _load(self) -> None:
+        # Lazy import: app.services paketi app.auth'u import eden modüller içeriyor
+        from app.services.http_client import get_http_client
+        
+        try:
+            response = get_http_client().get(self.url, timeout=JWKS_FETCH_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            jwks = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise jwt.PyJWKClientConnectionError(f"JWKS alınamadı: {e}") from e
+        
+        keys = {}
+        for jwk in jwks.get("keys", []):
+            if not jwk.get("kid") or jwk.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[jwk["kid"]] = jwt.PyJWK(jwk).key
+            except jwt.PyJWKError as e:
+                logger.warning(f"[Auth] JWKS anahtarı atlandı ({jwk.get('kid')}): {e}")
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+    
+    def _maybe_refresh(self) -> None:
+        if self._fetched_at is None or time.monotonic() - self._fetched_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="jwks-refresh", daemon=True).start()
+    
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            # Eski anahtarlarla devam; cooldown sonra tekrar denenir
+            logger.warning(f"[Auth] JWKS arka plan yenilemesi başarısız: {e}")
+            self._fetched_at = time.monotonic() - self.refresh_interval + self.miss_cooldown
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+class TokenCache:
+    """
+    Doğrulanmış token'ların kısa ömürlü LRU'su.
+    
+    Anahtar token'ın SHA-256'sı; kayıt token'ın exp'inde (en fazla
+    TOKEN_CACHE_MAX_SECONDS sonra) düşer.
+    """
+    
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, max_ttl: float = TOKEN_CACHE_MAX_SECONDS):
+        self.maxsize = max(1, maxsize)
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, token_hash: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return entry[1]
+    
+    def put(self, token_hash: str, claims: dict) -> None:
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        expires_at = min(exp, time.time() + self.max_ttl)
+        with self._lock:
+            self._entries[token_hash] = (expires_at, claims)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_jwks_cache: Optional[JwksCache] = None
+_token_cache: Optional[TokenCache] = None
+_singleton_lock = threading.Lock()
+
+
+def get_jwks_cache() -> JwksCache:
+    """JWKS cache singleton'ı döndür."""
+    global _jwks_cache
+    if _jwks_cache is None:
+        with _singleton_lock:
+            if _jwks_cache is None:
+                _jwks_cache = JwksCache()
+    return _jwks_cache
+
+
+def get_token_cache() -> TokenCache:
+    """Doğrulanmış token cache singleton'ı döndür."""
+    global _token_cache
+    if _token_cache is None:
+        with _singleton_lock:
+            if _token_cache is None:
+                _token_cache = TokenCache()
+    return _token_cache
+
+
+def decode_token(token: str) -> dict:
+    """
+    Token'ı doğrula ve claim'leri döndür.
+    
+    Daha önce doğrulanmış token'lar TokenCache'ten (imza kontrolü olmadan)
+    döner; diğerleri bellekteki JWKS anahtarıyla doğrulanır.
+    
+    Raises:
+        jwt.PyJWTError: Geçersiz / süresi dolmuş token
+    """
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    token_cache = get_token_cache()
+    claims = token_cache.get(token_hash)
+    if claims is None:
+        kid = jwt.get_unverified_header(token).get("kid")
+        claims = jwt.decode(
+            token,
+            get_jwks_cache().get_key(kid),
+            algorithms=ALGORITHMS,
+            audience=AUTH0_AUDIENCE,
+            issuer=f"https://{AUTH0_DOMAIN}/",
+        )
+        token_cache.put(token_hash, claims)
+    return dict(claims)
 
 
 def get_token_from_header():
@@ -52,19 +261,8 @@ def requires_auth(f):
             return jsonify({"error": "Token bulunamadı", "code": "missing_token"}), 401
 
         try:
-            # Auth0'un public key'lerini al
-            jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
-            jwks_client = PyJWKClient(jwks_url)
-            signing_key = jwks_client.get_signing_key_from_jwt(token)
-
-            # Token'ı doğrula ve decode et
-            payload = jwt.decode(
-                token,
-                signing_key.key,
-                algorithms=ALGORITHMS,
-                audience=AUTH0_AUDIENCE,
-                issuer=f"https://{AUTH0_DOMAIN}/",
-            )
+            # Cache'li JWKS anahtarıyla doğrula (daha önce doğrulanmış token'lar LRU'dan)
+            payload = decode_token(token)
 
             # Kullanıcı bilgisini request context'e ekle
             g.current_user = payload
@@ -90,6 +288,94 @@ def get_current_user_id():
     return None
 
 
+class RolePermissionCache:
+    """
+    Rol başına yetki kodu kümesi (request'ler arası, TTL'li).
+    
+    routes_roles güncellemelerinde invalidate edilir; diğer process'lerde
+    değişiklik en geç ROLE_PERMISSIONS_TTL_SECONDS sonra görünür.
+    """
+    
+    def __init__(self, ttl: float = ROLE_PERMISSIONS_TTL_SECONDS):
+        self.ttl = ttl
+        self._codes: Dict[str, Tuple[float, frozenset]] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, role_id) -> frozenset:
+        if role_id is None:
+            return frozenset()
+        key = str(role_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._codes.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        
+        from app.extensions import db
+        from app.models import Permission, role_permissions
+        
+        rows = db.session.query(Permission.code).join(
+            role_permissions, role_permissions.c.permission_id == Permission.id
+        ).filter(role_permissions.c.role_id == role_id).all()
+        codes = frozenset(row.code for row in rows)
+        with self._lock:
+            self._codes[key] = (now + self.ttl, codes)
+        return codes
+    
+    def invalidate(self, role_id=None) -> None:
+        with self._lock:
+            if role_id is None:
+                self._codes.clear()
+            else:
+                self._codes.pop(str(role_id), None)
+
+
+_role_permission_cache: Optional[RolePermissionCache] = None
+
+
+def get_role_permission_cache() -> RolePermissionCache:
+    """Rol yetki cache singleton'ı döndür."""
+    global _role_permission_cache
+    if _role_permission_cache is None:
+        with _singleton_lock:
+            if _role_permission_cache is None:
+                _role_permission_cache = RolePermissionCache()
+    return _role_permission_cache
+
+
+def load_db_user():
+    """
+    Token'daki kullanıcıyı request başına bir kez yükle.
+    
+    Kullanıcı, organizasyonu ve rolü tek sorguda gelir (yetki kodları
+    RolePermissionCache'ten); sonuç g.db_user / g.permissions'a yazılır.
+    Aynı request'teki sonraki çağrılar (requires_role, requires_permission,
+    get_db_user, get_current_user) DB'ye gitmez.
+    """
+    if g.get("db_user_loaded"):
+        return g.db_user
+    
+    from sqlalchemy.orm import joinedload, lazyload
+    from app.models import Role, User
+    
+    user = None
+    auth0_id = get_current_user_id()
+    if auth0_id:
+        user = User.query.options(
+            joinedload(User.organization),
+            joinedload(User.role).options(lazyload(Role.permissions)),
+        ).filter_by(auth0_id=auth0_id).first()
+    set_db_user(user)
+    return user
+
+
+def set_db_user(user) -> None:
+    """Request'in kullanıcısını g'ye yaz (yeni oluşturulan kullanıcılar için de)."""
+    g.db_user = user
+    g.permissions = user.permission_codes if user is not None else frozenset()
+    g.db_user_loaded = True
+
+
 def requires_role(*allowed_roles):
     """
     Rol bazlı yetkilendirme decorator'ı.
@@ -108,14 +394,11 @@ def requires_role(*allowed_roles):
     def decorator(f):
         @wraps(f)
         def decorated(*args, **kwargs):
-            # Lazy import to avoid circular dependency
-            from app.models import User
-            
             auth0_id = get_current_user_id()
             if not auth0_id:
                 return jsonify({"error": "Kullanıcı bulunamadı", "code": "user_not_found"}), 401
             
-            user = User.query.filter_by(auth0_id=auth0_id).first()
+            user = load_db_user()
             if not user:
                 return jsonify({"error": "Kullanıcı veritabanında bulunamadı", "code": "user_not_in_db"}), 401
             
@@ -129,9 +412,6 @@ def requires_role(*allowed_roles):
                     "your_role": user_role_code
                 }), 403
             
-            # Kullanıcıyı g'ye ekle (endpoint'te tekrar sorgu yapılmasın)
-            g.db_user = user
-            
             return f(*args, **kwargs)
         return decorated
     return decorator
@@ -155,26 +435,23 @@ def requires_permission(*required_permissions):
     def decorator(f):
         @wraps(f)
         def decorated(*args, **kwargs):
-            from app.models import User
-            
             auth0_id = get_current_user_id()
             if not auth0_id:
                 return jsonify({"error": "Kullanıcı bulunamadı", "code": "user_not_found"}), 401
             
-            user = User.query.filter_by(auth0_id=auth0_id).first()
+            user = load_db_user()
             if not user:
                 return jsonify({"error": "Kullanıcı veritabanında bulunamadı", "code": "user_not_in_db"}), 401
             
             # Yetki kontrolü (herhangi biri yeterli)
-            if not user.has_any_permission(*required_permissions):
+            if g.permissions.isdisjoint(required_permissions):
                 return jsonify({
                     "error": "Bu işlem için yetkiniz yok",
                     "code": "forbidden",
                     "required_permissions": list(required_permissions),
-                    "your_permissions": [p.code for p in user.role.permissions] if user.role else []
+                    "your_permissions": sorted(g.permissions)
                 }), 403
             
-            g.db_user = user
             return f(*args, **kwargs)
         return decorated
     return decorator
@@ -182,15 +459,6 @@ def requires_permission(*required_permissions):
 
 def get_db_user():
     """
-    requires_role/requires_permission decorator'ı tarafından cache'lenen kullanıcıyı döndür.
-    Eğer yoksa veritabanından çeker.
+    Request'in kullanıcısını döndür (load_db_user ile request başına tek sorgu).
     """
-    if hasattr(g, 'db_user') and g.db_user:
-        return g.db_user
-    
-    # Fallback: veritabanından çek
-    from app.models import User
-    auth0_id = get_current_user_id()
-    if auth0_id:
-        return User.query.filter_by(auth0_id=auth0_id).first()
-    return None
+    return load_db_user()
@@ -47,6 +47,43 @@ class Config:
     MQTT_SENSOR_TOPIC = os.environ.get("MQTT_SENSOR_TOPIC", "awaxen/sensors/#")
     MQTT_CLIENT_ID = os.environ.get("MQTT_CLIENT_ID", "awaxen-backend")
     MQTT_AUTO_START = os.environ.get("MQTT_AUTO_START", "true").lower() not in ("0", "false", "no", "off")
+    # $share/<grup>/<topic> ile mesajları instance'lar arasında dağıt. GÜVENLİ DEĞİL: aynı cihazın
+    # okumaları farklı instance'lara düşer ve cihaz başına process içi durum (saatlik istatistik
+    # delta'ları, CompactEncoder baseline'ı, son değer kopyaları) bozulur. Varsayılan kapalı;
+    # ölçeklenmiş kurulumda MQTT tek instance'ta tüketilir (docker-compose mqtt_ingest).
+    MQTT_SHARED_GROUP = os.environ.get("MQTT_SHARED_GROUP", "")
+    
+    # Telemetry batch writer (MQTT ingest)
+    TELEMETRY_BATCH_SIZE = int(os.environ.get("TELEMETRY_BATCH_SIZE", "500"))
+    TELEMETRY_BATCH_INTERVAL_MS = int(os.environ.get("TELEMETRY_BATCH_INTERVAL_MS", "200"))
+    TELEMETRY_QUEUE_SIZE = int(os.environ.get("TELEMETRY_QUEUE_SIZE", "20000"))
+    TELEMETRY_WRITER_WORKERS = int(os.environ.get("TELEMETRY_WRITER_WORKERS", "2"))
+    # Telemetri depolama düzeni: narrow (key-value) | wide (cihaz başına tek satır)
+    TELEMETRY_STORAGE_LAYOUT = os.environ.get("TELEMETRY_STORAGE_LAYOUT", "narrow").lower()
+    
+    # Cihaz komut dispatcher'ı (otomasyon aksiyonları, bulk action)
+    DEVICE_COMMAND_WORKERS = int(os.environ.get("DEVICE_COMMAND_WORKERS", "32"))
+    DEVICE_COMMAND_PER_INTEGRATION = int(os.environ.get("DEVICE_COMMAND_PER_INTEGRATION", "8"))
+    DEVICE_COMMAND_DEADLINE_SECONDS = float(os.environ.get("DEVICE_COMMAND_DEADLINE_SECONDS", "10"))
+    DEVICE_COMMAND_RETRIES = int(os.environ.get("DEVICE_COMMAND_RETRIES", "2"))
+    
+    # Dış entegrasyonlar için ortak HTTP client (keep-alive havuzu, retry, circuit breaker)
+    HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "32"))
+    HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+    HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.3"))
+    HTTP_CIRCUIT_FAILURES = int(os.environ.get("HTTP_CIRCUIT_FAILURES", "5"))
+    HTTP_CIRCUIT_RESET_SECONDS = float(os.environ.get("HTTP_CIRCUIT_RESET_SECONDS", "30"))
+    
+    # Real-time (Socket.IO) - Redis message queue ile çoklu instance / Celery emit'leri
+    REDIS_URL = os.environ.get("REDIS_URL")
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", os.environ.get("REDIS_URL"))
+    SOCKETIO_CHANNEL = os.environ.get("SOCKETIO_CHANNEL", "awaxen-socketio")
+    REALTIME_PUBSUB_ENABLED = os.environ.get("REALTIME_PUBSUB_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+    # Telemetri yayınları room başına birleştirilip bu hızda telemetry_batch olarak gönderilir
+    REALTIME_EMIT_RATE_HZ = float(os.environ.get("REALTIME_EMIT_RATE_HZ", "2"))
+    REALTIME_EMIT_MAX_PENDING = int(os.environ.get("REALTIME_EMIT_MAX_PENDING", "50000"))
+    # Kompakt delta formatı (telemetry_delta; subscribe_telemetry ile seçilir)
+    REALTIME_COMPACT_ENABLED = os.environ.get("REALTIME_COMPACT_ENABLED", "true").lower() not in ("0", "false", "no", "off")
     
     # Telegram
     TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
@@ -54,6 +91,8 @@ class Config:
     # Auth0
     AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN", "dev-xxxxx.us.auth0.com")
     AUTH0_AUDIENCE = os.environ.get("AUTH0_AUDIENCE", "https://api.awaxen.com")
+    # Socket.IO: auth0_id -> kullanıcı/organizasyon eşlemesinin cache süresi
+    SOCKET_IDENTITY_TTL_SECONDS = int(os.environ.get("SOCKET_IDENTITY_TTL_SECONDS", "300"))
     
     # MinIO/S3
     MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT", "localhost:9000")
@@ -94,6 +133,8 @@ class TestingConfig(Config):
     
     # Disable external services in tests
     MQTT_AUTO_START = False
+    SOCKETIO_MESSAGE_QUEUE = None
+    REALTIME_PUBSUB_ENABLED = False
     
     # Faster password hashing for tests
     BCRYPT_LOG_ROUNDS = 4
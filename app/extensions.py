@@ -60,7 +60,13 @@ def init_celery(app, celery_instance):
                 'schedule': crontab(hour=3, minute=0),
                 'kwargs': {'days_to_keep': 90},
             },
-            # Otomasyon kontrol - Her dakika
+            # Otomasyon zaman sınırları - Her dakika (sadece sınırı gelen otomasyonlar)
+            'dispatch-automation-time-boundaries': {
+                'task': 'app.tasks.automation_tasks.dispatch_time_boundaries',
+                'schedule': crontab(minute='*'),
+            },
+            # Otomasyon kontrol - Her dakika (olay bazlı tetiklemenin kaçırdıkları için güvenlik ağı;
+            # always/constant ve sadece cihaz durumuna bağlı trigger'lar indekslenmez)
             'check-automations-every-minute': {
                 'task': 'app.tasks.automation_tasks.check_automations',
                 'schedule': 60.0,
@@ -70,11 +76,36 @@ def init_celery(app, celery_instance):
                 'task': 'app.tasks.integration_tasks.sync_all_integrations',
                 'schedule': 3600.0,
             },
+            # Shelly durum snapshot'ı - Her 30 saniye (entegrasyon başına tek all_status)
+            'poll-shelly-statuses': {
+                'task': 'app.tasks.integration_tasks.poll_shelly_statuses',
+                'schedule': 30.0,
+            },
             # Watchdog - Cihaz sağlık kontrolü - Her 5 dakika
             'watchdog-check-devices': {
                 'task': 'app.tasks.monitoring_tasks.check_device_health',
                 'schedule': 300.0,  # 5 dakika
             },
+            # Dashboard KPI snapshot'ı SQL ile uzlaştırma - Her 5 dakika
+            'reconcile-org-kpis': {
+                'task': 'app.tasks.monitoring_tasks.reconcile_org_kpis',
+                'schedule': 300.0,
+            },
+            # Cüzdan sıralamaları wallets tablosuyla uzlaştırma - Her 15 dakika
+            'reconcile-leaderboards': {
+                'task': 'app.tasks.monitoring_tasks.reconcile_leaderboards',
+                'schedule': 900.0,
+            },
+            # Enerji tasarrufları (durum log aralıkları, saatlik fiyat) - Her 10 dakika
+            'compute-energy-savings': {
+                'task': 'app.tasks.monitoring_tasks.compute_energy_savings',
+                'schedule': 600.0,
+            },
+            # Dashboard istatistik günlük özetleri - Her gece 03:20 (00:20 UTC; günler UTC)
+            'rollup-daily-stats': {
+                'task': 'app.tasks.monitoring_tasks.rollup_daily_stats',
+                'schedule': crontab(hour=3, minute=20),
+            },
             # Anomaly Detection - Her 10 dakika
             'anomaly-detection': {
                 'task': 'app.tasks.monitoring_tasks.check_anomalies',
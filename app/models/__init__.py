@@ -10,10 +10,10 @@ from app.models.organization import Organization
 from app.models.user import User, UserSettings, UserInvite
 from app.models.gateway import Gateway
 from app.models.integration import Integration
-from app.models.device import SmartDevice, SmartAsset, DeviceTelemetry
+from app.models.device import SmartDevice, SmartAsset, DeviceTelemetry, DeviceTelemetryWide
 from app.models.automation import Automation, AutomationLog, VppRule
 from app.models.market import MarketPrice
-from app.models.wallet import Wallet, WalletTransaction
+from app.models.wallet import Wallet, WalletTransaction, WalletActivity
 from app.models.notification import Notification
 from app.models.audit import AuditLog
 from app.models.weather import WeatherData, WeatherForecast
@@ -22,6 +22,7 @@ from app.models.firmware import Firmware, FirmwareUpdate
 from app.models.export import DataExport
 from app.models.ai_analysis import AIAnalysisTask, AIDetection, AITaskStatus, DefectType
 from app.models.savings import EnergySavings, DeviceStateLog
+from app.models.statistics import OrgDailyStats
 from app.models.enums import (
     OrganizationType,
     DeviceStatus,
@@ -58,6 +59,7 @@ __all__ = [
     "SmartDevice",
     "SmartAsset",
     "DeviceTelemetry",
+    "DeviceTelemetryWide",
     # Automation
     "Automation",
     "AutomationLog",
@@ -67,6 +69,7 @@ __all__ = [
     # Wallet
     "Wallet",
     "WalletTransaction",
+    "WalletActivity",
     # Notification
     "Notification",
     # Audit
@@ -92,4 +95,6 @@ __all__ = [
     # Savings
     "EnergySavings",
     "DeviceStateLog",
+    # Statistics
+    "OrgDailyStats",
 ]
@@ -169,6 +169,46 @@ class DeviceTelemetry(db.Model):
         }
 
 
+class DeviceTelemetryWide(db.Model):
+    """
+    Cihaz Telemetri Verisi (wide layout) - TimescaleDB Hypertable.
+    
+    Her (time, device_id) için tek satır, her metrik tipli bir kolon.
+    6 metrikli prizlerde key-value tablosuna göre ~6 kat daha az satır;
+    time_bucket aggregasyonları tek satır üzerinden çalışır.
+    TELEMETRY_STORAGE_LAYOUT=wide ile aktif edilir.
+    """
+    __tablename__ = "device_telemetry_wide"
+    
+    __table_args__ = (
+        db.Index('idx_telemetry_wide_device_time', 'device_id', 'time'),
+    )
+
+    time = db.Column(db.DateTime(timezone=True), primary_key=True, nullable=False)
+    device_id = db.Column(UUID(as_uuid=True), db.ForeignKey("smart_devices.id", ondelete="CASCADE"), primary_key=True)
+    
+    power = db.Column(db.Float)  # W
+    voltage = db.Column(db.Float)  # V
+    current = db.Column(db.Float)  # A
+    energy = db.Column(db.Float)  # kWh (kümülatif)
+    temperature = db.Column(db.Float)  # °C
+    humidity = db.Column(db.Float)  # %
+    quality = db.Column(db.Integer, default=1)
+
+    def to_dict(self) -> dict:
+        return {
+            "time": self.time.isoformat() if self.time else None,
+            "device_id": str(self.device_id),
+            "power": self.power,
+            "voltage": self.voltage,
+            "current": self.current,
+            "energy": self.energy,
+            "temperature": self.temperature,
+            "humidity": self.humidity,
+            "quality": self.quality,
+        }
+
+
 # TimescaleDB Hypertable - Migration'da manuel çalıştırılmalı
 # 
 # Production'da aşağıdaki SQL'leri migration olarak çalıştırın:
@@ -185,3 +225,5 @@ class DeviceTelemetry(db.Model):
 #
 # -- Retention policy (90 günden eski veriler silinsin)
 # SELECT add_retention_policy('device_telemetry', INTERVAL '90 days');
+#
+# device_telemetry_wide için: migrations/versions/002_add_device_telemetry_wide.py
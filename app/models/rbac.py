@@ -91,7 +91,8 @@ class Role(db.Model):
     
     def has_permission(self, permission_code: str) -> bool:
         """Bu rolde belirtilen yetki var mı?"""
-        return any(p.code == permission_code for p in self.permissions)
+        from app.auth import get_role_permission_cache
+        return permission_code in get_role_permission_cache().get(self.id)
     
     @classmethod
     def get_by_code(cls, code: str) -> Optional["Role"]:
@@ -258,4 +259,7 @@ class Role(db.Model):
                         role.permissions.append(perm)
         
         db.session.commit()
+        
+        from app.auth import get_role_permission_cache
+        get_role_permission_cache().invalidate()
         return True
@@ -0,0 +1,49 @@
+"""
+Awaxen Models - Daily Statistics.
+
+Dashboard istatistikleri için organizasyon başına günlük özet (daily facts) tablosu.
+Kapanmış günler bir kez hesaplanır; ay/yıl görünümleri bu satırların toplamıdır.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+
+from app.extensions import db
+
+
+def utcnow() -> datetime:
+    """Timezone-aware UTC datetime döndür."""
+    return datetime.now(timezone.utc)
+
+
+class OrgDailyStats(db.Model):
+    """
+    Organizasyonun bir günlük enerji / tasarruf / otomasyon özeti.
+
+    Satırlar services/dashboard_stats tarafından üretilir; elle yazılmaz.
+    Enerji alanları (sum, max, count) günler arasında birleştirilebilir:
+    dönem ortalaması = sum(energy_sum) / sum(energy_count).
+    """
+    __tablename__ = "org_daily_stats"
+
+    organization_id = db.Column(UUID(as_uuid=True), db.ForeignKey("organizations.id", ondelete="CASCADE"), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+
+    # Enerji (telemetri 'energy' okumaları)
+    energy_sum = db.Column(db.Float, default=0.0, nullable=False)
+    energy_max = db.Column(db.Float, default=0.0, nullable=False)
+    energy_count = db.Column(db.Integer, default=0, nullable=False)
+
+    # Tasarruf (energy_savings)
+    savings_count = db.Column(db.Integer, default=0, nullable=False)
+    energy_saved_kwh = db.Column(db.Float, default=0.0, nullable=False)
+    money_saved = db.Column(db.Float, default=0.0, nullable=False)
+    off_duration_minutes = db.Column(db.Integer, default=0, nullable=False)
+    savings_by_source = db.Column(JSONB, default=dict)  # {source_type: [kwh, money]}
+
+    # Otomasyon (automation_logs)
+    automation_triggers = db.Column(db.Integer, default=0, nullable=False)
+    automation_success = db.Column(db.Integer, default=0, nullable=False)
+    automation_failed = db.Column(db.Integer, default=0, nullable=False)
+
+    computed_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
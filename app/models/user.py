@@ -68,23 +68,23 @@ class User(db.Model):
             data["permissions"] = [p.code for p in self.role.permissions]
         return data
     
+    @property
+    def permission_codes(self) -> frozenset:
+        """Rolün yetki kodları (request'ler arası cache'ten; set lookup için)."""
+        from app.auth import get_role_permission_cache
+        return get_role_permission_cache().get(self.role_id)
+    
     def has_permission(self, permission_code: str) -> bool:
         """Kullanıcının belirtilen yetkisi var mı?"""
-        if not self.role:
-            return False
-        return self.role.has_permission(permission_code)
+        return permission_code in self.permission_codes
     
     def has_any_permission(self, *permission_codes: str) -> bool:
         """Kullanıcının belirtilen yetkilerden herhangi biri var mı?"""
-        if not self.role:
-            return False
-        return any(self.role.has_permission(code) for code in permission_codes)
+        return not self.permission_codes.isdisjoint(permission_codes)
     
     def has_all_permissions(self, *permission_codes: str) -> bool:
         """Kullanıcının belirtilen tüm yetkileri var mı?"""
-        if not self.role:
-            return False
-        return all(self.role.has_permission(code) for code in permission_codes)
+        return self.permission_codes.issuperset(permission_codes)
     
     def is_admin(self) -> bool:
         """Kullanıcı admin mi?"""
@@ -149,3 +149,26 @@ class WalletTransaction(db.Model):
             "extra_data": self.extra_data or {},
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
+
+
+class WalletActivity(db.Model):
+    """
+    Cüzdan Aktivite İndeksi - Streak ve aylık istatistikler için özet.
+    
+    WalletTransaction yazımlarıyla aynı transaction'da güncellenir
+    (bkz. services/wallet_activity); işlem tablosu taranmadan okunur.
+    """
+    __tablename__ = "wallet_activity"
+
+    wallet_id = db.Column(UUID(as_uuid=True), db.ForeignKey("wallets.id", ondelete="CASCADE"), primary_key=True)
+    
+    # Ödül günleri bitmap'i: bit i = reward_start + i günü (UTC) pozitif ödül var
+    reward_start = db.Column(db.Date)
+    reward_days = db.Column(db.LargeBinary, default=b"", nullable=False)
+    
+    # Aylık özet: {"YYYY-MM": {"earned": ödül toplamı, "count": işlem sayısı}}
+    monthly = db.Column(JSONB, default=dict)
+    # Kategori bazında tüm zamanların ödül toplamı: {kategori: toplam}
+    category_totals = db.Column(JSONB, default=dict)
+    
+    updated_at = db.Column(db.DateTime(timezone=True), default=utcnow, onupdate=utcnow)
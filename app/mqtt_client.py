@@ -4,26 +4,34 @@ from __future__ import annotations
 
 import json
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Any, Optional
 from uuid import uuid4
 
 import paho.mqtt.client as mqtt
 
 from app.extensions import db, socketio
-from app.models import SmartDevice, Gateway, DeviceTelemetry
-from app.realtime import emit_sensor_alert
+from app.models import Gateway
+from app.services.device_resolver import DeviceRef, get_device_resolver
+from app.services.realtime_emitter import get_telemetry_emitter
+from app.services.telemetry_writer import (
+    extract_readings,
+    get_telemetry_writer,
+    init_telemetry_writer,
+)
 
 logger = logging.getLogger(__name__)
 
 _client: Optional[mqtt.Client] = None
 
 
-def _resolve_device(payload: dict[str, Any]) -> Optional[SmartDevice]:
+def _resolve_device(payload: dict[str, Any]) -> Optional[DeviceRef]:
     """
-    Payload'dan SmartDevice çözümle.
-    external_id veya device_id ile arama yapar.
+    Payload'dan cihaz çözümle (DeviceResolver cache'i üzerinden).
+    external_id veya device_uuid ile arama yapar.
     """
+    resolver = get_device_resolver()
+    
     # external_id ile ara (Shelly ID, MAC adresi vb.)
     external_id = (
         payload.get("external_id")
@@ -33,17 +41,14 @@ def _resolve_device(payload: dict[str, Any]) -> Optional[SmartDevice]:
     )
     
     if external_id:
-        device = SmartDevice.query.filter_by(external_id=str(external_id)).first()
+        device = resolver.resolve(external_id)
         if device:
             return device
     
     # UUID ile ara
     device_uuid = payload.get("device_uuid")
     if device_uuid:
-        try:
-            return SmartDevice.query.filter_by(id=device_uuid).first()
-        except Exception:
-            pass
+        return resolver.resolve(device_uuid)
     
     return None
 
@@ -62,29 +67,30 @@ def _resolve_gateway(payload: dict[str, Any]) -> Optional[Gateway]:
     return None
 
 
-def _persist_telemetry(device: SmartDevice, data: dict[str, Any]):
-    """Telemetri verisini DeviceTelemetry tablosuna kaydet."""
-    telemetry = DeviceTelemetry(
-        device_id=device.id,
-        power_w=data.get("power") or data.get("power_w"),
-        voltage=data.get("voltage"),
-        current=data.get("current"),
-        energy_total_kwh=data.get("energy") or data.get("energy_total_kwh"),
-        temperature=data.get("temperature") or data.get("temp"),
-        humidity=data.get("humidity"),
-        raw_data=data,
-    )
-    db.session.add(telemetry)
-    
-    # Cihaz durumunu güncelle
-    device.is_online = True
-    device.last_seen = datetime.utcnow()
-    
-    db.session.commit()
-    return telemetry
+def _persist_telemetry(device: DeviceRef, data: dict[str, Any]) -> int:
+    """
+    Telemetri verisini batch writer kuyruğuna bırak.
 
+    Ölçümler kanonik key'lere çevrilir; writer bunları mikro-batch'ler
+    halinde telemetri store'una (narrow/wide düzen) tek INSERT ile yazar ve cihazın
+    is_online/last_seen alanlarını günceller. Writer çalışmıyorsa
+    (ör. MQTT_AUTO_START kapalı) senkron yazılır.
 
-def _check_realtime_anomaly(device: SmartDevice, power_w: float):
+    Returns:
+        Kuyruğa alınan ölçüm sayısı
+    """
+    readings = extract_readings(data)
+    writer = get_telemetry_writer()
+    timestamp = datetime.now(timezone.utc)
+
+    if writer.running:
+        writer.submit(device.id, timestamp, readings)
+    else:
+        writer.write_now([(device.id, timestamp, readings)])
+    return len(readings)
+
+
+def _check_realtime_anomaly(device: DeviceRef, power_w: float):
     """
     Real-time anomaly kontrolü.
     Telemetri geldiğinde anında kontrol et ve bildirim oluştur.
@@ -125,8 +131,8 @@ def _handle_sensor_payload(app, payload: dict[str, Any], topic: str):
     MQTT mesajını işle:
     1. Device'ı çözümle
     2. Telemetri kaydet
-    3. Socket.IO ile canlı veri gönder
-    4. Real-time anomaly kontrolü
+    3. Real-time anomaly kontrolü
+    4. Canlı veriyi birleştirilmiş telemetry_batch yayınına ekle
     """
     logger.debug(f"[MQTT] Payload alındı: {payload}")
     
@@ -148,8 +154,8 @@ def _handle_sensor_payload(app, payload: dict[str, Any], topic: str):
         
         # Telemetri kaydet
         try:
-            telemetry = _persist_telemetry(device, data)
-            logger.info(f"[MQTT] Telemetri kaydedildi: device={device.external_id}")
+            _persist_telemetry(device, data)
+            logger.debug(f"[MQTT] Telemetri kuyruğa alındı: device={device.external_id}")
         except Exception as exc:
             logger.warning(f"Telemetri kaydedilemedi: {exc}")
             db.session.rollback()
@@ -160,35 +166,8 @@ def _handle_sensor_payload(app, payload: dict[str, Any], topic: str):
         if power_w is not None:
             _check_realtime_anomaly(device, float(power_w))
         
-        # Socket.IO ile canlı veri gönder
-        if device.organization_id:
-            room = f"org_{device.organization_id}"
-            socketio.emit(
-                "telemetry",
-                {
-                    "device_id": str(device.id),
-                    "external_id": device.external_id,
-                    "name": device.name,
-                    "data": data,
-                    "timestamp": datetime.utcnow().isoformat(),
-                },
-                room=room,
-            )
-        
-        # Eski format için de emit et (geriye uyumluluk)
-        emit_sensor_alert(
-            None,  # user_id artık organization bazlı
-            {
-                "sensorType": data.get("sensor_type", "power"),
-                "value": data.get("power") or data.get("value"),
-                "device": {
-                    "id": str(device.id),
-                    "external_id": device.external_id,
-                    "name": device.name,
-                },
-                "topic": topic,
-            },
-        )
+        # Canlı veri: organizasyon room'una birleştirilmiş batch ile (REALTIME_EMIT_RATE_HZ)
+        get_telemetry_emitter().update(device.organization_id, device.id, data=data)
     
     except Exception:
         logger.exception(f"MQTT payload işlenirken hata: topic={topic}")
@@ -203,6 +182,16 @@ def _on_connect(client: mqtt.Client, userdata, flags, reason_code):
         logger.error(f"[MQTT] Bağlantı hatası: rc={reason_code}")
         return
 
+    shared_group = app.config.get("MQTT_SHARED_GROUP")
+    if shared_group:
+        # Shared subscription: broker mesajları gruptaki instance'lar arasında dağıtır
+        # (cihaz bazında değil; cihaz başına process içi durum tutarsızlaşır)
+        logger.warning(
+            f"[MQTT] MQTT_SHARED_GROUP={shared_group} etkin: aynı cihazın okumaları farklı "
+            "instance'lara düşebilir, cihaz başına durum tutarsız olur"
+        )
+        topic = f"$share/{shared_group}/{topic}"
+
     result, mid = client.subscribe(topic)
     logger.info(f"[MQTT] Subscribe: topic={topic}, result={result}")
 
@@ -304,40 +293,12 @@ def _parse_homeassistant_topic(topic: str, payload_text: str) -> Optional[dict[s
     return None
 
 
-def _resolve_device_by_ha_entity(entity_id: str, device_name: str) -> Optional[SmartDevice]:
+def _resolve_device_by_ha_entity(entity_id: str, device_name: str) -> Optional[DeviceRef]:
     """
     Home Assistant entity_id veya device_name ile cihaz bul.
-    Önce external_id ile, sonra isim benzerliği ile arar.
+    Önce external_id ile, sonra isim benzerliği ile arar (sonuç cache'lenir).
     """
-    # 1. Tam external_id eşleşmesi (switch.tapo_priz_103)
-    device = SmartDevice.query.filter_by(external_id=entity_id).first()
-    if device:
-        return device
-    
-    # 2. Entity ID'nin son kısmı ile ara (tapo_priz_103)
-    short_id = entity_id.split('.')[-1] if '.' in entity_id else entity_id
-    device = SmartDevice.query.filter_by(external_id=short_id).first()
-    if device:
-        return device
-    
-    # 3. Device name ile ara
-    device = SmartDevice.query.filter_by(external_id=device_name).first()
-    if device:
-        return device
-    
-    # 4. İsim benzerliği ile ara (LIKE query)
-    device = SmartDevice.query.filter(
-        SmartDevice.external_id.ilike(f"%{device_name}%")
-    ).first()
-    if device:
-        return device
-    
-    # 5. Name alanında ara
-    device = SmartDevice.query.filter(
-        SmartDevice.name.ilike(f"%{device_name}%")
-    ).first()
-    
-    return device
+    return get_device_resolver().resolve_ha_entity(entity_id, device_name)
 
 
 def _handle_homeassistant_message(app, ha_payload: dict[str, Any], topic: str):
@@ -370,10 +331,6 @@ def _handle_homeassistant_message(app, ha_payload: dict[str, Any], topic: str):
         )
         return
     
-    # Cihaz durumunu güncelle
-    device.is_online = True
-    device.last_seen = datetime.utcnow()
-    
     # State değişikliği varsa kaydet (savings için)
     if "state" in ha_payload and domain in ('switch', 'light'):
         new_state = 'on' if ha_payload.get("is_on") else 'off'
@@ -387,63 +344,19 @@ def _handle_homeassistant_message(app, ha_payload: dict[str, Any], topic: str):
         except Exception as e:
             logger.debug(f"[MQTT-HA] Savings kaydedilemedi: {e}")
     
-    # Telemetri verisi varsa kaydet
-    if any(k in ha_payload for k in ('power', 'power_w', 'energy', 'voltage', 'current', 'temperature', 'humidity')):
-        try:
-            telemetry = _persist_telemetry(device, ha_payload)
-            logger.info(f"[MQTT-HA] Telemetri kaydedildi: {device.name}")
-        except Exception as e:
-            logger.warning(f"[MQTT-HA] Telemetri kaydedilemedi: {e}")
-            db.session.rollback()
-    else:
-        db.session.commit()
-    
-    # Socket.IO ile Frontend'e gönder
-    if device.organization_id:
-        room = f"org_{device.organization_id}"
-        
-        # Telemetri event'i
-        socketio.emit(
-            "telemetry",
-            {
-                "device_id": str(device.id),
-                "external_id": device.external_id,
-                "name": device.name,
-                "data": ha_payload,
-                "timestamp": datetime.utcnow().isoformat(),
-            },
-            room=room,
-        )
-        
-        # Device update event'i (state değişiklikleri için)
-        if "state" in ha_payload:
-            socketio.emit(
-                "device_status",
-                {
-                    "device_id": str(device.id),
-                    "external_id": device.external_id,
-                    "name": device.name,
-                    "is_online": True,
-                    "is_on": ha_payload.get("is_on"),
-                    "state": ha_payload.get("state"),
-                    "timestamp": datetime.utcnow().isoformat(),
-                },
-                room=room,
-            )
+    # Telemetri kaydet (ölçüm yoksa sadece is_online/last_seen güncellenir)
+    try:
+        _persist_telemetry(device, ha_payload)
+        logger.debug(f"[MQTT-HA] Telemetri kuyruğa alındı: {device.name}")
+    except Exception as e:
+        logger.warning(f"[MQTT-HA] Telemetri kaydedilemedi: {e}")
+        db.session.rollback()
     
-    # Global broadcast (tüm bağlı client'lara)
-    socketio.emit(
-        "device_update",
-        {
-            "device_id": str(device.id) if device else None,
-            "entity_id": entity_id,
-            "device_name": device.name if device else device_name,
-            "domain": domain,
-            "data": ha_payload,
-            "timestamp": datetime.utcnow().isoformat(),
-        },
-        namespace="/",
-    )
+    # Frontend'e organizasyon room'u üzerinden birleştirilmiş batch ile gönder
+    status = None
+    if "state" in ha_payload:
+        status = {"is_online": True, "is_on": ha_payload.get("is_on"), "state": ha_payload.get("state")}
+    get_telemetry_emitter().update(device.organization_id, device.id, data=ha_payload, status=status)
 
 
 def _on_message(client: mqtt.Client, userdata, message):
@@ -484,6 +397,25 @@ def _on_disconnect(client: mqtt.Client, userdata, reason_code):
     # Paho MQTT v2.0+ otomatik reconnect yapıyor, sadece log
 
 
+def shutdown_mqtt_client(timeout: float = 10.0) -> None:
+    """
+    MQTT bağlantısını kapat ve telemetri kuyruğunu boşalt.
+
+    Yeni mesaj alımı önce durdurulur, ardından writer kuyruğundaki
+    okumalar veritabanına yazılır (drain-on-shutdown).
+    """
+    global _client
+    if _client is not None:
+        try:
+            _client.loop_stop()
+            _client.disconnect()
+        except Exception as exc:
+            logger.debug(f"[MQTT] Disconnect hatası: {exc}")
+        _client = None
+
+    get_telemetry_writer().stop(timeout=timeout)
+
+
 def init_mqtt_client(app, reconnect_delay_min: float = 1.0, reconnect_delay_max: float = 120.0):
     """
     MQTT client'ı başlat - sonsuz reconnect döngüsü ile.
@@ -493,6 +425,7 @@ def init_mqtt_client(app, reconnect_delay_min: float = 1.0, reconnect_delay_max:
         reconnect_delay_min: Minimum reconnect bekleme süresi (saniye)
         reconnect_delay_max: Maximum reconnect bekleme süresi (saniye)
     """
+    import atexit
     import time
     import threading
 
@@ -505,6 +438,10 @@ def init_mqtt_client(app, reconnect_delay_min: float = 1.0, reconnect_delay_max:
         logger.warning("[MQTT] MQTT_BROKER_URL tanımlı değil")
         return None
 
+    # Telemetri batch writer - network thread'i DB yazımından ayırır
+    init_telemetry_writer(app)
+    atexit.register(shutdown_mqtt_client)
+
     broker_host = _sanitize_broker_url(raw_url)
     port = int(app.config.get("MQTT_BROKER_PORT", 1883))
 
@@ -14,6 +14,19 @@ Room yapısı:
 - device:{device_id} - Cihaz telemetrisi
 - dashboard:{org_id} - Dashboard güncellemeleri
 - prices - Fiyat güncellemeleri (global)
+- telemetry:{format}:{org_id} - Birleştirilmiş telemetri (json | compact | msgpack)
+
+Kimlik doğrulama:
+- authenticate event'i JWT'yi doğrular (cache'li JWKS, bkz. services/socket_auth);
+  user/org room'ları client'ın gönderdiği id'lerden değil DB'deki kullanıcıdan seçilir
+- Org/cihaz/kullanıcı room'larına katılım sadece doğrulanmış bağlantılara ve kendi
+  organizasyonlarına açıktır (prices herkese açık)
+
+Yatay ölçekleme:
+- Socket.IO, SOCKETIO_MESSAGE_QUEUE (Redis) üzerinden emit'leri tüm instance'lara dağıtır;
+  Celery task'larından yapılan emit'ler de client'lara ulaşır
+- RedisPubSub, awaxen:* kanallarını client bağlı her process'te arka plan
+  greenlet'inde dinler ve sadece o process'in client'larına iletir
 """
 
 from __future__ import annotations
@@ -21,6 +34,8 @@ from __future__ import annotations
 import os
 import json
 import logging
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from typing import Any, Optional
 from functools import wraps
@@ -39,6 +54,13 @@ ROOM_DEVICE = "device:"
 ROOM_DASHBOARD = "dashboard:"
 ROOM_PRICES = "prices"
 ROOM_ALERTS = "alerts:"
+ROOM_TELEMETRY = "telemetry:"
+
+PUBSUB_RETRY_MIN_SECONDS = 1.0
+PUBSUB_RETRY_MAX_SECONDS = 30.0
+
+# RedisPubSub handler'ları içindeyken emit'ler message queue'ya gitmez (her process kendi client'larına iletir)
+_delivery = threading.local()
 
 
 # ==========================================
@@ -60,17 +82,37 @@ def _dashboard_room(org_id: int | str) -> str:
 def _alert_room(org_id: int | str) -> str:
     return f"{ROOM_ALERTS}{org_id}"
 
+def _telemetry_room(org_id: int | str, fmt: str = "json") -> str:
+    return f"{ROOM_TELEMETRY}{fmt}:{org_id}"
+
 
 # ==========================================
 # Emit Helpers - Backend'den Frontend'e
 # ==========================================
 
+def _socket_emit(event: str, message: Any, **kwargs) -> None:
+    """socketio.emit; Redis Pub/Sub teslimatında message queue atlanır."""
+    if getattr(_delivery, "local_only", False):
+        kwargs["ignore_queue"] = True
+    socketio.emit(event, message, **kwargs)
+
+
+@contextmanager
+def _local_delivery():
+    previous = getattr(_delivery, "local_only", False)
+    _delivery.local_only = True
+    try:
+        yield
+    finally:
+        _delivery.local_only = previous
+
+
 def emit_to_user(event: str, payload: dict[str, Any], user_id: int | str) -> None:
     """Belirli bir kullanıcıya event gönder."""
     if user_id in (None, ""):
         return
     message = _add_timestamp(payload)
-    socketio.emit(event, message, room=_user_room(user_id))
+    _socket_emit(event, message, room=_user_room(user_id))
     logger.debug(f"Emit to user {user_id}: {event}")
 
 
@@ -79,7 +121,7 @@ def emit_to_org(event: str, payload: dict[str, Any], org_id: int | str) -> None:
     if org_id in (None, ""):
         return
     message = _add_timestamp(payload)
-    socketio.emit(event, message, room=_org_room(org_id))
+    _socket_emit(event, message, room=_org_room(org_id))
     logger.debug(f"Emit to org {org_id}: {event}")
 
 
@@ -88,7 +130,7 @@ def emit_to_device_subscribers(event: str, payload: dict[str, Any], device_id: i
     if device_id in (None, ""):
         return
     message = _add_timestamp(payload)
-    socketio.emit(event, message, room=_device_room(device_id))
+    _socket_emit(event, message, room=_device_room(device_id))
 
 
 def emit_to_dashboard(event: str, payload: dict[str, Any], org_id: int | str) -> None:
@@ -96,20 +138,27 @@ def emit_to_dashboard(event: str, payload: dict[str, Any], org_id: int | str) ->
     if org_id in (None, ""):
         return
     message = _add_timestamp(payload)
-    socketio.emit(event, message, room=_dashboard_room(org_id))
+    _socket_emit(event, message, room=_dashboard_room(org_id))
+
+
+def emit_telemetry_frame(event: str, payload: Any, org_id: int | str, fmt: str = "json") -> None:
+    """Birleştirilmiş telemetri frame'ini organizasyonun ilgili format room'una gönder."""
+    if org_id in (None, ""):
+        return
+    _socket_emit(event, payload, room=_telemetry_room(org_id, fmt))
 
 
 def broadcast_price_update(payload: dict[str, Any]) -> None:
     """Fiyat güncellemesini tüm dinleyicilere gönder."""
     message = _add_timestamp(payload)
-    socketio.emit("price_update", message, room=ROOM_PRICES)
+    _socket_emit("price_update", message, room=ROOM_PRICES)
     logger.info(f"Price update broadcast: {payload.get('price', 'N/A')} TL/kWh")
 
 
 def broadcast_global(event: str, payload: dict[str, Any]) -> None:
     """Tüm bağlı kullanıcılara event gönder."""
     message = _add_timestamp(payload)
-    socketio.emit(event, message, broadcast=True)
+    _socket_emit(event, message, broadcast=True)
 
 
 def _add_timestamp(payload: dict) -> dict:
@@ -210,6 +259,74 @@ def emit_energy_summary(org_id: str, summary: dict) -> None:
     emit_to_dashboard("energy_summary", payload, org_id)
 
 
+# ==========================================
+# Socket Auth Helpers
+# ==========================================
+
+def _current_identity():
+    from app.services.socket_auth import get_socket_authenticator
+    return get_socket_authenticator().identity(request.sid)
+
+
+def authenticated_only(f):
+    """Event handler'ı sadece authenticate ile doğrulanmış bağlantılara aç."""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if _current_identity() is None:
+            emit("auth_error", {"error": "Önce authenticate gerekli", "code": "missing_token"})
+            return None
+        return f(*args, **kwargs)
+    return wrapped
+
+
+def revoke_user_sessions(user_id: str, auth0_id: Optional[str] = None) -> int:
+    """
+    Kullanıcının bu process'teki bağlantılarını room'lardan çıkar ve kimliği bırak.
+    
+    Organizasyonu değişen / pasifleştirilen kullanıcı eski organizasyonun
+    room'larında kalmaz; client auth_error (session_revoked) alır ve yeniden
+    authenticate olur (pasif kullanıcı reddedilir).
+    
+    Returns:
+        Düşürülen bağlantı sayısı
+    """
+    from app.services.realtime_codec import get_compact_subscribers
+    from app.services.socket_auth import get_socket_authenticator
+    
+    sids = get_socket_authenticator().revoke_user(user_id, auth0_id)
+    for sid in sids:
+        for room in list(socketio.server.rooms(sid, namespace="/")):
+            if room != sid:
+                socketio.server.leave_room(sid, room, namespace="/")
+        get_compact_subscribers().remove(sid)
+        with _local_delivery():
+            _socket_emit("auth_error", {
+                "error": "Oturum yetkileri değişti, yeniden authenticate gerekli",
+                "code": "session_revoked",
+            }, room=sid)
+    if sids:
+        logger.info(f"Revoked {len(sids)} socket session(s) of user {user_id}")
+    return len(sids)
+
+
+def _authorized_org(data: Any) -> Optional[str]:
+    """
+    İstenen org_id'yi bağlantının organizasyonuyla doğrula.
+    
+    org_id verilmezse kullanıcının organizasyonu kullanılır; başka bir
+    organizasyon istenirse subscribe_error gönderilip None döner.
+    """
+    org_id = _current_identity().organization_id
+    requested = data.get("org_id") if isinstance(data, dict) else None
+    if not org_id:
+        emit("subscribe_error", {"error": "Kullanıcının organizasyonu yok"})
+        return None
+    if requested and str(requested) != org_id:
+        emit("subscribe_error", {"error": "Bu organizasyona erişim yetkiniz yok", "code": "forbidden"})
+        return None
+    return org_id
+
+
 # ==========================================
 # Socket.IO Event Handlers
 # ==========================================
@@ -219,6 +336,8 @@ def handle_connect():
     """Yeni bağlantı kurulduğunda."""
     sid = request.sid
     logger.info(f"Client connected: {sid}")
+    # Client'ı olan process'ler Redis kanallarını dinler
+    redis_pubsub.start()
     emit("connected", {
         "message": "Awaxen Real-Time bağlantısı kuruldu",
         "sid": sid,
@@ -229,7 +348,12 @@ def handle_connect():
 @socketio.on("disconnect")
 def handle_disconnect():
     """Bağlantı koptuğunda."""
+    from app.services.realtime_codec import get_compact_subscribers
+    from app.services.socket_auth import get_socket_authenticator
+    
     sid = request.sid
+    get_socket_authenticator().forget(sid)
+    get_compact_subscribers().remove(sid)
     logger.info(f"Client disconnected: {sid}")
 
 
@@ -240,18 +364,26 @@ def handle_authenticate(data):
     
     Client gönderir:
     {
-        "token": "JWT_TOKEN",
-        "user_id": "uuid",
-        "org_id": "uuid"
+        "token": "JWT_TOKEN"
     }
+    
+    user_id / org_id gönderilse de dikkate alınmaz; room'lar token'daki
+    kullanıcının DB kaydından seçilir.
     """
-    user_id = data.get("user_id")
-    org_id = data.get("org_id")
+    from app.exceptions import AuthenticationError
+    from app.services.socket_auth import get_socket_authenticator
     
-    if not user_id:
-        emit("auth_error", {"error": "user_id required"})
+    token = data.get("token") if isinstance(data, dict) else None
+    try:
+        identity = get_socket_authenticator().authenticate(request.sid, token)
+    except AuthenticationError as e:
+        emit("auth_error", e.to_dict())
+        logger.info(f"Socket authentication rejected ({request.sid}): {e.code}")
         return
     
+    user_id = identity.user_id
+    org_id = identity.organization_id
+    
     # Kullanıcı room'una katıl
     join_room(_user_room(user_id))
     
@@ -260,6 +392,8 @@ def handle_authenticate(data):
         join_room(_org_room(org_id))
         join_room(_dashboard_room(org_id))
         join_room(_alert_room(org_id))
+        # Varsayılan telemetri formatı; subscribe_telemetry ile değiştirilebilir
+        join_room(_telemetry_room(org_id, "json"))
     
     emit("authenticated", {
         "user_id": user_id,
@@ -271,11 +405,13 @@ def handle_authenticate(data):
 
 
 @socketio.on("join_user_room")
-def handle_join_user_room(data):
-    """Kullanıcı room'una katıl."""
-    user_id = data.get("user_id") if isinstance(data, dict) else None
-    if not user_id:
-        emit("join_error", {"error": "user_id zorunludur"})
+@authenticated_only
+def handle_join_user_room(data=None):
+    """Kullanıcı room'una katıl (sadece kendi room'u)."""
+    user_id = _current_identity().user_id
+    requested = data.get("user_id") if isinstance(data, dict) else None
+    if requested and str(requested) != user_id:
+        emit("join_error", {"error": "Sadece kendi kullanıcı room'unuza katılabilirsiniz", "code": "forbidden"})
         return
 
     room = _user_room(user_id)
@@ -297,16 +433,28 @@ def handle_leave_user_room(data):
 
 
 @socketio.on("subscribe_device")
+@authenticated_only
 def handle_subscribe_device(data):
     """
     Cihaz telemetrisine abone ol.
     
-    Dashboard'da belirli bir cihazın grafiğini izlemek için.
+    Dashboard'da belirli bir cihazın grafiğini izlemek için. Cihaz
+    kullanıcının organizasyonunda olmalı (cache'li cihaz sözlüğünden kontrol).
     """
-    device_id = data.get("device_id")
+    from app.services.realtime_codec import get_device_dictionary_registry
+    
+    device_id = data.get("device_id") if isinstance(data, dict) else None
     if not device_id:
         emit("subscribe_error", {"error": "device_id required"})
         return
+    org_id = _current_identity().organization_id
+    registry = get_device_dictionary_registry()
+    if not org_id or (
+        str(device_id) not in registry.get(org_id).index
+        and str(device_id) not in registry.get(org_id, refresh=True).index
+    ):
+        emit("subscribe_error", {"error": "Cihaz bulunamadı", "code": "forbidden"})
+        return
     
     room = _device_room(device_id)
     join_room(room)
@@ -342,11 +490,11 @@ def handle_unsubscribe_prices(data=None):
 
 
 @socketio.on("subscribe_dashboard")
-def handle_subscribe_dashboard(data):
+@authenticated_only
+def handle_subscribe_dashboard(data=None):
     """Dashboard güncellemelerine abone ol."""
-    org_id = data.get("org_id")
+    org_id = _authorized_org(data)
     if not org_id:
-        emit("subscribe_error", {"error": "org_id required"})
         return
     
     room = _dashboard_room(org_id)
@@ -354,6 +502,56 @@ def handle_subscribe_dashboard(data):
     emit("subscribed", {"room": room, "type": "dashboard"})
 
 
+@socketio.on("subscribe_telemetry")
+@authenticated_only
+def handle_subscribe_telemetry(data):
+    """
+    Telemetri formatını seç (json | compact | msgpack).
+    
+    compact/msgpack için önce cihaz sözlüğü (device_dictionary) gönderilir;
+    ardından telemetry_delta frame'leri sayısal indeks + değişen alanlarla gelir.
+    """
+    from app.services.realtime_codec import (
+        FORMATS, MSGPACK_AVAILABLE, get_compact_subscribers, get_device_dictionary_registry,
+    )
+    
+    org_id = _authorized_org(data)
+    fmt = (data.get("format") or "json") if isinstance(data, dict) else "json"
+    if not org_id:
+        return
+    if fmt not in FORMATS:
+        emit("subscribe_error", {"error": f"Unsupported format: {fmt}"})
+        return
+    if fmt == "msgpack" and not MSGPACK_AVAILABLE:
+        fmt = "compact"
+    
+    for other in FORMATS:
+        if other != fmt:
+            leave_room(_telemetry_room(org_id, other))
+    room = _telemetry_room(org_id, fmt)
+    join_room(room)
+    
+    # Emitter delta'ları sadece compact/msgpack abonesi olan organizasyonlar için hesaplar
+    if fmt == "json":
+        get_compact_subscribers().remove(request.sid)
+    else:
+        get_compact_subscribers().add(org_id, request.sid)
+        emit("device_dictionary", get_device_dictionary_registry().get(org_id).to_dict())
+    emit("subscribed", {"room": room, "type": "telemetry", "format": fmt})
+
+
+@socketio.on("get_device_dictionary")
+@authenticated_only
+def handle_get_device_dictionary(data=None):
+    """Cihaz sözlüğünü yeniden gönder (delta'daki v sözlükle uyuşmadığında)."""
+    from app.services.realtime_codec import get_device_dictionary_registry
+    
+    org_id = _authorized_org(data)
+    if not org_id:
+        return
+    emit("device_dictionary", get_device_dictionary_registry().get(org_id, refresh=True).to_dict())
+
+
 @socketio.on("ping")
 def handle_ping(data=None):
     """Heartbeat - bağlantı kontrolü."""
@@ -370,11 +568,16 @@ class RedisPubSub:
     
     Birden fazla backend instance'ı arasında mesaj senkronizasyonu.
     Celery task'larından real-time event gönderimi.
+    
+    publish() her process'ten çağrılabilir; dinleme döngüsü ilk Socket.IO
+    bağlantısında arka plan task'ı (gevent altında greenlet) olarak başlar.
     """
     
     def __init__(self):
         self._redis = None
         self._pubsub = None
+        self._listening = False
+        self._lock = threading.Lock()
         self._channels = {
             "awaxen:telemetry": self._handle_telemetry,
             "awaxen:device_status": self._handle_device_status,
@@ -382,16 +585,18 @@ class RedisPubSub:
             "awaxen:notification": self._handle_notification,
             "awaxen:automation": self._handle_automation,
             "awaxen:broadcast": self._handle_broadcast,
+            "awaxen:user_access": self._handle_user_access,
         }
     
     def init_app(self, app):
         """Flask app ile initialize et."""
-        redis_url = app.config.get("REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/1"))
+        if not app.config.get("REALTIME_PUBSUB_ENABLED", True):
+            return
+        redis_url = app.config.get("REDIS_URL") or os.getenv("REDIS_URL", "redis://localhost:6379/1")
         
         try:
             import redis
             self._redis = redis.from_url(redis_url)
-            self._pubsub = self._redis.pubsub()
             logger.info(f"Redis Pub/Sub initialized: {redis_url}")
         except Exception as e:
             logger.warning(f"Redis Pub/Sub initialization failed: {e}")
@@ -410,16 +615,58 @@ class RedisPubSub:
             logger.error(f"Redis publish error: {e}")
             return False
     
+    def start(self) -> bool:
+        """Dinleme döngüsünü arka planda başlat (idempotent)."""
+        with self._lock:
+            if self._listening or not self._redis:
+                return False
+            self._listening = True
+        socketio.start_background_task(self._listen)
+        return True
+    
+    def stop(self) -> None:
+        """Dinleme döngüsünü durdur."""
+        with self._lock:
+            self._listening = False
+            pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+    
     def subscribe(self):
         """Tüm channel'lara abone ol."""
-        if not self._pubsub:
+        if not self._redis:
             return
         
         try:
-            self._pubsub.subscribe(**{ch: self._message_handler for ch in self._channels})
+            self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(*self._channels)
             logger.info(f"Subscribed to Redis channels: {list(self._channels.keys())}")
         except Exception as e:
             logger.error(f"Redis subscribe error: {e}")
+            self._pubsub = None
+    
+    def _listen(self):
+        """Abone ol ve mesajları işle; bağlantı koparsa backoff ile yeniden bağlan."""
+        delay = PUBSUB_RETRY_MIN_SECONDS
+        while self._listening:
+            self.subscribe()
+            pubsub = self._pubsub
+            if pubsub is not None:
+                try:
+                    for message in pubsub.listen():
+                        delay = PUBSUB_RETRY_MIN_SECONDS
+                        self._message_handler(message)
+                        if not self._listening:
+                            break
+                except Exception as e:
+                    if self._listening:
+                        logger.warning(f"Redis Pub/Sub bağlantısı koptu: {e}")
+            if self._listening:
+                socketio.sleep(delay)
+                delay = min(delay * 2, PUBSUB_RETRY_MAX_SECONDS)
     
     def _message_handler(self, message):
         """Redis'ten gelen mesajları işle."""
@@ -434,7 +681,9 @@ class RedisPubSub:
             data = json.loads(message["data"])
             handler = self._channels.get(channel)
             if handler:
-                handler(data)
+                # Mesaj her process'e ayrı ulaşır; message queue'dan tekrar yayılmasın
+                with _local_delivery():
+                    handler(data)
         except Exception as e:
             logger.error(f"Redis message handler error: {e}")
     
@@ -478,6 +727,12 @@ class RedisPubSub:
         payload = data.get("payload", {})
         broadcast_global(event, payload)
     
+    def _handle_user_access(self, data):
+        """Organizasyonu / aktifliği değişen kullanıcının bu process'teki bağlantılarını düşür."""
+        user_id = data.get("user_id")
+        if user_id:
+            revoke_user_sessions(user_id, data.get("auth0_id"))
+    
     # Convenience methods for publishing
     def publish_telemetry(self, org_id: str, device_id: str, data: dict):
         """Telemetri verisi yayınla."""
@@ -509,6 +764,13 @@ class RedisPubSub:
             "user_id": user_id,
             **notification
         })
+    
+    def publish_user_access(self, user_id: str, auth0_id: Optional[str]):
+        """Kullanıcının organizasyon / aktiflik değişikliğini tüm process'lere duyur."""
+        return self.publish("awaxen:user_access", {
+            "user_id": user_id,
+            "auth0_id": auth0_id
+        })
 
 
 # Global instance
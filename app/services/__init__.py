@@ -5,7 +5,7 @@ Bu paket, routes'tan çağrılan tüm iş mantığı fonksiyonlarını içerir.
 """
 
 # v6.0 Core Services
-from .shelly_service import ShellyService, get_shelly_service
+from .shelly_service import ShellyService, get_shelly_registry, get_shelly_service
 from .automation_engine import AutomationEngine, automation_engine, check_all_automations
 from .market_service import (
     save_market_prices,
@@ -51,6 +51,7 @@ __all__ = [
     # v6.0 Core
     "ShellyService",
     "get_shelly_service",
+    "get_shelly_registry",
     "AutomationEngine",
     "automation_engine",
     "check_all_automations",
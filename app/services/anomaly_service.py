@@ -13,13 +13,18 @@ from __future__ import annotations
 
 import logging
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 from uuid import UUID
 
-from sqlalchemy import func, and_
+import numpy as np
+from sqlalchemy import insert
 
 from app.extensions import db
-from app.models import SmartDevice, DeviceTelemetry, Notification
+from app.models import Organization, SmartDevice, Notification, User, Role
+from app.services.anomaly_stats import get_hourly_stats_store
+from app.services.latest_values import get_latest_value_store
+from app.services.org_kpis import record_new_alerts
+from app.services.telemetry_store import get_telemetry_store
 
 logger = logging.getLogger(__name__)
 
@@ -64,35 +69,15 @@ class AnomalyDetector:
         Returns:
             {mean, std, min, max, count}
         """
+        stats_store = get_hourly_stats_store()
+        if stats_store.lookback_days == self.lookback_days:
+            # Ingest sırasında artımlı güncellenen istatistikler (bellek içi)
+            return stats_store.get(device_id, hour=hour)
+
         cutoff = datetime.now(timezone.utc) - timedelta(days=self.lookback_days)
         
-        query = db.session.query(
-            func.avg(DeviceTelemetry.power_w).label("mean"),
-            func.stddev(DeviceTelemetry.power_w).label("std"),
-            func.min(DeviceTelemetry.power_w).label("min"),
-            func.max(DeviceTelemetry.power_w).label("max"),
-            func.count(DeviceTelemetry.id).label("count"),
-        ).filter(
-            DeviceTelemetry.device_id == device_id,
-            DeviceTelemetry.created_at >= cutoff,
-            DeviceTelemetry.power_w.isnot(None),
-        )
-        
-        # Saatlik pattern için filtrele
-        if hour is not None:
-            query = query.filter(
-                func.extract("hour", DeviceTelemetry.created_at) == hour
-            )
-        
-        result = query.first()
-        
-        return {
-            "mean": float(result.mean) if result.mean else 0.0,
-            "std": float(result.std) if result.std else 0.0,
-            "min": float(result.min) if result.min else 0.0,
-            "max": float(result.max) if result.max else 0.0,
-            "count": int(result.count) if result.count else 0,
-        }
+        # Farklı lookback: saatlik pattern için hour filtresi store tarafında uygulanır
+        return get_telemetry_store().stats(device_id, "power", cutoff, hour=hour)
 
     def calculate_zscore(
         self,
@@ -143,6 +128,18 @@ class AnomalyDetector:
         # Ani güç artışı kontrolü (basit çarpan)
         power_ratio = current_power / stats["mean"] if stats["mean"] > 0 else 0
         
+        return self._build_anomaly(device_id, current_power, stats, zscore, power_ratio, current_hour)
+
+    def _build_anomaly(
+        self,
+        device_id: UUID,
+        current_power: float,
+        stats: Dict[str, float],
+        zscore: float,
+        power_ratio: float,
+        hour: Optional[int],
+    ) -> Optional[Dict[str, Any]]:
+        """Hesaplanmış z-score ve güç oranından anomaly dict'i oluştur (yoksa None)."""
         anomaly = None
         
         # Z-Score anormalliği
@@ -173,7 +170,7 @@ class AnomalyDetector:
         if anomaly:
             anomaly["device_id"] = str(device_id)
             anomaly["stats"] = stats
-            anomaly["hour"] = current_hour
+            anomaly["hour"] = hour
             logger.warning(f"[Anomaly] Tespit edildi: {anomaly['type']} - device={device_id}")
         
         return anomaly
@@ -212,6 +209,9 @@ class AnomalyDetector:
         Returns:
             Anomaly listesi
         """
+        if get_hourly_stats_store().lookback_days == self.lookback_days:
+            return self.check_devices_batch([organization_id])
+        
         devices = SmartDevice.query.filter_by(
             organization_id=organization_id,
             is_online=True,
@@ -221,21 +221,87 @@ class AnomalyDetector:
         
         for device in devices:
             # Son telemetri verisini al
-            latest = DeviceTelemetry.query.filter_by(
-                device_id=device.id
-            ).order_by(
-                DeviceTelemetry.created_at.desc()
-            ).first()
+            latest = get_latest_value_store().get_latest(device, "power")
             
-            if not latest or latest.power_w is None:
+            if not latest:
                 continue
             
-            anomaly = self.check_power_anomaly(device.id, latest.power_w)
+            anomaly = self.check_power_anomaly(device.id, latest[1])
+            if anomaly:
+                anomaly["device_name"] = device.name
+                anomaly["device_external_id"] = device.external_id
+                anomalies.append(anomaly)
+        
+        return anomalies
+
+    def check_devices_batch(
+        self,
+        organization_ids: Optional[Sequence[UUID]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Toplu (vektörel) anomaly taraması.
+        
+        Online cihazlar tek sorguda, son güç değerleri LKV'den tek Redis
+        pipeline'ı ile, saatlik istatistikler HourlyStatsStore'dan alınır;
+        z-score ve spike oranları NumPy dizileri üzerinde hesaplanır.
+        
+        Args:
+            organization_ids: Taranacak organizasyonlar (None ise tüm aktif organizasyonlar)
+        
+        Returns:
+            Anomaly listesi (her kayıtta organization_id bulunur)
+        """
+        query = db.session.query(
+            SmartDevice.id, SmartDevice.organization_id, SmartDevice.name, SmartDevice.external_id,
+        ).filter(SmartDevice.is_online.is_(True))
+        if organization_ids is None:
+            query = query.join(Organization, Organization.id == SmartDevice.organization_id).filter(
+                Organization.is_active.is_(True)
+            )
+        else:
+            query = query.filter(SmartDevice.organization_id.in_(list(organization_ids)))
+        devices = query.all()
+        if not devices:
+            return []
+        
+        latest = get_latest_value_store().get_latest_many(
+            [(device.id, device.organization_id) for device in devices], "power"
+        )
+        devices = [device for device in devices if device.id in latest]
+        if not devices:
+            return []
+        
+        current_hour = datetime.now(timezone.utc).hour
+        stats = get_hourly_stats_store().get_many([device.id for device in devices], hour=current_hour)
+        
+        n = len(devices)
+        current = np.fromiter((latest[d.id][1] for d in devices), dtype=np.float64, count=n)
+        mean = np.fromiter((stats[d.id]["mean"] for d in devices), dtype=np.float64, count=n)
+        std = np.fromiter((stats[d.id]["std"] for d in devices), dtype=np.float64, count=n)
+        count = np.fromiter((stats[d.id]["count"] for d in devices), dtype=np.float64, count=n)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            zscore = np.where(std > 0, (current - mean) / std, 0.0)
+            power_ratio = np.where(mean > 0, current / mean, 0.0)
+        
+        # Yeterli verisi olan ve z-score ya da spike eşiğini aşan cihazlar
+        flagged = (count >= self.min_samples) & (
+            (np.abs(zscore) > self.zscore_threshold) | (power_ratio > POWER_SPIKE_MULTIPLIER)
+        )
+        
+        anomalies = []
+        for i in np.flatnonzero(flagged):
+            device = devices[i]
+            anomaly = self._build_anomaly(
+                device.id, float(current[i]), stats[device.id], float(zscore[i]), float(power_ratio[i]), current_hour,
+            )
             if anomaly:
+                anomaly["organization_id"] = str(device.organization_id)
                 anomaly["device_name"] = device.name
                 anomaly["device_external_id"] = device.external_id
                 anomalies.append(anomaly)
         
+        logger.info(f"[Anomaly] Toplu tarama: {n} cihaz, {len(anomalies)} anormallik")
         return anomalies
 
 
@@ -282,6 +348,72 @@ def create_anomaly_notification(
     return notification
 
 
+def create_anomaly_notifications(anomalies: Sequence[Dict[str, Any]]) -> int:
+    """
+    Toplu tarama sonuçları için bildirimleri tek INSERT ile oluştur.
+    
+    Yüksek ve orta seviye anomaliler, ilgili organizasyonun aktif admin
+    kullanıcılarına bildirilir (alıcılar tek sorguda çekilir). Commit
+    çağıran tarafa bırakılır.
+    
+    Args:
+        anomalies: check_devices_batch çıktısı (organization_id içerir)
+    
+    Returns:
+        Oluşturulan bildirim sayısı
+    """
+    from app.models.enums import NotificationStatus
+    
+    notify = [a for a in anomalies if a.get("severity") in ("high", "medium")]
+    if not notify:
+        return 0
+    
+    org_ids = {UUID(a["organization_id"]) for a in notify}
+    recipients: Dict[UUID, List[UUID]] = {}
+    for user_id, org_id in db.session.query(User.id, User.organization_id).join(
+        Role, Role.id == User.role_id
+    ).filter(
+        User.organization_id.in_(list(org_ids)),
+        User.is_active.is_(True),
+        Role.code.in_(("admin", "super_admin")),
+    ):
+        recipients.setdefault(org_id, []).append(user_id)
+    
+    severity_emoji = {"high": "🚨", "medium": "⚠️", "low": "📊"}
+    rows = []
+    for anomaly in notify:
+        org_id = UUID(anomaly["organization_id"])
+        for user_id in recipients.get(org_id, []):
+            rows.append({
+                "organization_id": org_id,
+                "user_id": user_id,
+                "title": f"{severity_emoji.get(anomaly['severity'], '📊')} Olağandışı Aktivite Tespit Edildi",
+                "message": anomaly.get("message", "Anormallik tespit edildi"),
+                "type": "anomaly",
+                "reference_id": anomaly.get("device_id"),
+                "reference_type": "device",
+                "data": {
+                    "anomaly_type": anomaly.get("type"),
+                    "severity": anomaly.get("severity"),
+                    "device_id": anomaly.get("device_id"),
+                    "device_name": anomaly.get("device_name"),
+                    "current_value": anomaly.get("current_value"),
+                    "expected_value": anomaly.get("expected_value"),
+                    "zscore": anomaly.get("zscore"),
+                },
+                "status": NotificationStatus.PENDING.value,
+            })
+    
+    if rows:
+        db.session.execute(insert(Notification), rows)
+        # Core INSERT ORM flush listener'larını tetiklemez; alerts_unread commit'te ayrıca artırılır
+        counts: Dict[UUID, int] = {}
+        for row in rows:
+            counts[row["organization_id"]] = counts.get(row["organization_id"], 0) + 1
+        record_new_alerts(db.session, counts)
+    return len(rows)
+
+
 # Singleton instance
 _anomaly_detector: Optional[AnomalyDetector] = None
 
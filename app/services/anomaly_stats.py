@@ -0,0 +1,488 @@
+"""
+Anomaly Stats - Cihaz/saat bazında artımlı (incremental) güç istatistikleri.
+
+AnomalyDetector her okumada 7 günlük raw telemetri üzerinde AVG/STDDEV
+çalıştırmak yerine buradaki hazır istatistikleri kullanır:
+
+- Her (cihaz, günün saati) hücresi için ağırlıklı toplam / kare toplamı (mean/variance)
+- Üstel azalma (exponential decay): eski okumaların ağırlığı LOOKBACK süresinde e^-1'e iner
+- Ingest sonrası observe() ile güncellenir (MQTT writer, HTTP ingest, HA webhook'ları)
+- Process'ler son flush'tan beri biriken delta'larını periyodik olarak Redis'e ekler
+  (Lua script'i hücreyi ortak zamana azaltıp toplar); aynı cihaz/saati yazan
+  process'ler birbirinin üzerine yazmaz
+- İlk erişimde Redis'ten, yoksa telemetri store'undan (tek GROUP BY sorgusu) yüklenir
+
+Real-time kontrolde get() sadece bellek içi aritmetiktir.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from app.services.telemetry_store import TelemetryRow, get_telemetry_store, normalize_key
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+STATS_KEY_PREFIX = "awaxen:anomaly:hourly:v3:"  # v2 (sabit epoch'a ölçekli toplamlar) hash'leri TTL ile silinir
+STATS_REDIS_TTL_SECONDS = 30 * 24 * 3600
+STATS_LOOKBACK_DAYS = 7  # Decay zaman sabiti (AnomalyDetector.LOOKBACK_DAYS ile aynı)
+STATS_PERSIST_INTERVAL_SECONDS = 30  # Değişen hücrelerin Redis'e yazılma aralığı
+STATS_RELOAD_SECONDS = 300  # Başka process'lerin güncellemelerini Redis'ten tekrar okuma aralığı
+STATS_LOAD_CHUNK_SIZE = 5000  # Toplu yüklemede tek sorgu / Redis pipeline'ındaki cihaz sayısı
+REDIS_RETRY_SECONDS = 30
+HOURS = 24
+
+# Delta/başlangıç hücrelerini Redis'teki hücreyle birleştirir. Toplamlar her hücrenin kendi
+# son okuma zamanına göre tutulur; iki hücre daha yeni olanın zamanına azaltılıp toplanır.
+# ARGV[1] = tau, ardından (saat, w, s, q, min, max, zaman, seed) sekizlileri;
+# seed = 1 ise hücre sadece Redis'te yoksa yazılır (DB'den türetilen başlangıç değeri)
+_MERGE_CELLS = """
+local tau = tonumber(ARGV[1])
+local function fmt(x) return string.format('%.17g', x) end
+for i = 2, #ARGV, 8 do
+    local hour = ARGV[i]
+    local w, s, q = tonumber(ARGV[i + 1]), tonumber(ARGV[i + 2]), tonumber(ARGV[i + 3])
+    local low, high, ts = tonumber(ARGV[i + 4]), tonumber(ARGV[i + 5]), tonumber(ARGV[i + 6])
+    local current = redis.call('HMGET', KEYS[1], hour .. ':w', hour .. ':s', hour .. ':q',
+        hour .. ':min', hour .. ':max', hour .. ':t')
+    if current[1] and current[6] then
+        if ARGV[i + 7] == '1' then
+            w = nil
+        else
+            local current_ts = tonumber(current[6])
+            local t = math.max(ts, current_ts)
+            local mine, theirs = math.exp(-(t - ts) / tau), math.exp(-(t - current_ts) / tau)
+            w = w * mine + tonumber(current[1]) * theirs
+            s = s * mine + tonumber(current[2]) * theirs
+            q = q * mine + tonumber(current[3]) * theirs
+            if math.abs(ts - current_ts) <= tau then
+                low = math.min(low, tonumber(current[4]))
+                high = math.max(high, tonumber(current[5]))
+            elseif current_ts > ts then
+                low, high = tonumber(current[4]), tonumber(current[5])
+            end
+            ts = t
+        end
+    end
+    if w then
+        redis.call('HSET', KEYS[1], hour .. ':w', fmt(w), hour .. ':s', fmt(s), hour .. ':q', fmt(q),
+            hour .. ':min', fmt(low), hour .. ':max', fmt(high), hour .. ':t', fmt(ts))
+    end
+end
+"""
+
+
+def _decay(elapsed: float, tau: float) -> float:
+    return math.exp(-max(elapsed, 0.0) / tau)
+
+
+class RunningStats:
+    """
+    Üstel azalmalı ağırlıklı istatistik (tek hücre), toplanabilir biçimde.
+
+    Toplamlar hücrenin son okuma zamanına (updated_at) göre tutulur: t anındaki okuma
+    e^-((updated_at - t) / tau) ağırlığıyla eklenir; weight = Σw, total = Σw·x,
+    total_sq = Σw·x². Yeni okuma geldiğinde toplamlar aradaki süre kadar azaltılır,
+    okuma 1 ağırlığıyla eklenir. Ağırlıklar hiçbir zaman 1'i geçmez (taşma olmaz);
+    iki hücre daha yeni olanın zamanına azaltılarak toplanır (merge).
+    """
+
+    __slots__ = ("weight", "total", "total_sq", "min", "max", "updated_at")
+
+    def __init__(self, weight=0.0, total=0.0, total_sq=0.0, min_value=math.inf, max_value=-math.inf, updated_at=0.0):
+        self.weight = weight
+        self.total = total
+        self.total_sq = total_sq
+        self.min = min_value
+        self.max = max_value
+        self.updated_at = updated_at
+
+    def update(self, value: float, ts: float, tau: float) -> None:
+        self.merge(RunningStats(1.0, value, value * value, value, value, ts), tau)
+
+    def merge(self, other: "RunningStats", tau: float) -> None:
+        """Başka bir hücreyi (delta veya başka process'in hücresi) bu hücreye ekle."""
+        if other.weight <= 0:
+            return
+        if self.weight <= 0:
+            self.weight, self.total, self.total_sq = other.weight, other.total, other.total_sq
+            self.min, self.max, self.updated_at = other.min, other.max, other.updated_at
+            return
+        if abs(other.updated_at - self.updated_at) > tau:
+            # Lookback süresinden uzun boşluk: min/max yeni hücreninkilerle başlar
+            if other.updated_at > self.updated_at:
+                self.min, self.max = other.min, other.max
+        else:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        updated_at = max(self.updated_at, other.updated_at)
+        mine, theirs = _decay(updated_at - self.updated_at, tau), _decay(updated_at - other.updated_at, tau)
+        self.weight = self.weight * mine + other.weight * theirs
+        self.total = self.total * mine + other.total * theirs
+        self.total_sq = self.total_sq * mine + other.total_sq * theirs
+        self.updated_at = updated_at
+
+    def snapshot(self, now: float, tau: float) -> Dict[str, float]:
+        """{mean, std, min, max, count} (count = şimdiki zamana göre azaltılmış efektif örnek sayısı)."""
+        if self.weight <= 0:
+            return _empty_stats()
+        mean = self.total / self.weight
+        variance = max(0.0, self.total_sq / self.weight - mean * mean)
+        # Son okuma anındaki efektif örnek sayısı (örneklem std düzeltmesi için)
+        effective = self.weight
+        std = math.sqrt(variance * effective / (effective - 1.0)) if effective > 1.0 else 0.0
+        return {
+            "mean": mean,
+            "std": std,
+            "min": self.min,
+            "max": self.max,
+            "count": int(round(self.weight * _decay(now - self.updated_at, tau))),
+        }
+
+    def copy(self) -> "RunningStats":
+        return RunningStats(self.weight, self.total, self.total_sq, self.min, self.max, self.updated_at)
+
+    def merge_args(self, hour: int, seed: bool = False) -> Tuple[object, ...]:
+        """_MERGE_CELLS argümanları."""
+        return (
+            hour, repr(self.weight), repr(self.total), repr(self.total_sq),
+            repr(self.min), repr(self.max), repr(self.updated_at), "1" if seed else "0",
+        )
+
+    @classmethod
+    def from_fields(cls, fields: Dict[str, str]) -> Optional["RunningStats"]:
+        """Redis alanlarından ({w, s, q, min, max, t}) hücre oluştur."""
+        try:
+            return cls(
+                float(fields["w"]), float(fields["s"]), float(fields["q"]),
+                float(fields["min"]), float(fields["max"]), float(fields["t"]),
+            )
+        except (KeyError, ValueError, TypeError):
+            return None
+
+    @classmethod
+    def from_aggregates(cls, stats: Dict[str, float], updated_at: float, tau: float) -> "RunningStats":
+        """SQL aggregate'lerinden (count/mean/std) başlangıç hücresi oluştur."""
+        count = float(stats["count"])
+        weight = count
+        variance = (stats["std"] ** 2) * (count - 1.0) / count if count else 0.0
+        return cls(
+            weight=weight,
+            total=stats["mean"] * weight,
+            total_sq=(variance + stats["mean"] ** 2) * weight,
+            min_value=stats["min"] if count else math.inf,
+            max_value=stats["max"] if count else -math.inf,
+            updated_at=updated_at,
+        )
+
+
+class HourlyStatsStore:
+    """
+    Cihaz başına 24 saatlik RunningStats hücreleri.
+
+    Kullanım:
+        stats = get_hourly_stats_store()
+        stats.observe_rows([(ts, device.id, "power", 45.5)])
+        stats.get(device.id, hour=14)  # {mean, std, min, max, count}
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = REDIS_URL,
+        lookback_days: int = STATS_LOOKBACK_DAYS,
+        persist_interval: float = STATS_PERSIST_INTERVAL_SECONDS,
+    ):
+        self.redis_url = redis_url
+        self.lookback_days = lookback_days
+        self.tau = lookback_days * 86400.0
+        self.persist_interval = persist_interval
+
+        self._cells: Dict[UUID, List[Optional[RunningStats]]] = {}
+        self._loaded_at: Dict[UUID, float] = {}
+        # Son flush'tan beri bu process'te biriken delta hücreleri ve DB'den türetilen başlangıç hücreleri
+        self._dirty: Dict[UUID, Dict[int, RunningStats]] = {}
+        self._seeds: Dict[UUID, Dict[int, RunningStats]] = {}
+        self._last_persist = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._redis = None
+        self._script = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Public API
+    # ------------------------------------------
+
+    def get(self, device_id: UUID, hour: Optional[int] = None) -> Dict[str, float]:
+        """
+        Cihazın (saat bazlı) güç istatistikleri.
+
+        Args:
+            hour: 0-23 (UTC); None ise 24 hücre birleştirilir
+
+        Returns:
+            {mean, std, min, max, count}
+        """
+        return self.get_many([device_id], hour=hour)[device_id]
+
+    def get_many(self, device_ids: Sequence[UUID], hour: Optional[int] = None) -> Dict[UUID, Dict[str, float]]:
+        """
+        Birden fazla cihazın istatistikleri (toplu anomaly taraması için).
+
+        Eksik cihazlar tek Redis pipeline'ı / tek SQL sorgusu ile yüklenir.
+
+        Returns:
+            {device_id: {mean, std, min, max, count}}
+        """
+        self._ensure_loaded_many(device_ids)
+        now = time.time()
+        result: Dict[UUID, Dict[str, float]] = {}
+        with self._lock:
+            for device_id in device_ids:
+                cells = self._cells.get(device_id) or [None] * HOURS
+                if hour is not None:
+                    cell = cells[hour]
+                    result[device_id] = cell.snapshot(now, self.tau) if cell else _empty_stats()
+                else:
+                    result[device_id] = _combine([c.snapshot(now, self.tau) for c in cells if c])
+        return result
+
+    def observe(self, device_id: UUID, ts: datetime, value: float) -> None:
+        """Yeni güç okumasını istatistiklere ekle."""
+        self.observe_rows([(ts, device_id, "power", value)])
+
+    def observe_rows(self, rows: Iterable[TelemetryRow]) -> int:
+        """
+        Ingest edilen satırlardan güç okumalarını işle.
+
+        Returns:
+            İşlenen okuma sayısı
+        """
+        readings: List[Tuple[UUID, datetime, float]] = [
+            (device_id, ts, float(value))
+            for ts, device_id, key, value in rows
+            if value is not None and normalize_key(key) == "power"
+        ]
+        if not readings:
+            return 0
+
+        self._ensure_loaded_many({device_id for device_id, _, _ in readings})
+
+        with self._lock:
+            for device_id, ts, value in readings:
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                hour = ts.astimezone(timezone.utc).hour
+                cells = self._cells.setdefault(device_id, [None] * HOURS)
+                if cells[hour] is None:
+                    cells[hour] = RunningStats()
+                cells[hour].update(value, ts.timestamp(), self.tau)
+                delta = self._dirty.setdefault(device_id, {})
+                if hour not in delta:
+                    delta[hour] = RunningStats()
+                delta[hour].update(value, ts.timestamp(), self.tau)
+            persist_due = time.monotonic() - self._last_persist >= self.persist_interval
+
+        if persist_due:
+            self.flush()
+        return len(readings)
+
+    def flush(self) -> int:
+        """
+        Son flush'tan beri biriken delta'ları Redis'e ekle.
+
+        Hücreler Lua script'iyle Redis'tekilerle birleştirilir (ortak zamana azaltılıp toplanır);
+        DB'den türetilen başlangıç hücreleri yalnızca Redis'te hücre yoksa yazılır.
+
+        Returns:
+            Yazılan hücre sayısı
+        """
+        with self._lock:
+            deltas, self._dirty = self._dirty, {}
+            seeds, self._seeds = self._seeds, {}
+            self._last_persist = time.monotonic()
+
+        client = self._client()
+        if client is None or not (deltas or seeds):
+            return 0
+        written = 0
+        try:
+            pipe = client.pipeline(transaction=False)
+            for device_id in set(seeds) | set(deltas):
+                key = f"{STATS_KEY_PREFIX}{device_id}"
+                args: List[object] = [self.tau]
+                for hour, cell in seeds.get(device_id, {}).items():
+                    args.extend(cell.merge_args(hour, seed=True))
+                for hour, cell in deltas.get(device_id, {}).items():
+                    args.extend(cell.merge_args(hour))
+                self._script(keys=[key], args=args, client=pipe)
+                pipe.expire(key, STATS_REDIS_TTL_SECONDS)
+                written += (len(args) - 1) // 8
+            pipe.execute()
+        except Exception as e:
+            self._redis_error(e)
+            return 0
+        return written
+
+    def forget(self, device_id: UUID) -> None:
+        """Cihazın bellek içi istatistiklerini at (bir sonraki erişimde yeniden yüklenir)."""
+        with self._lock:
+            self._cells.pop(device_id, None)
+            self._loaded_at.pop(device_id, None)
+            self._dirty.pop(device_id, None)
+            self._seeds.pop(device_id, None)
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _ensure_loaded_many(self, device_ids: Iterable[UUID]) -> None:
+        """
+        Bellekte olmayan (veya RELOAD süresi geçmiş) cihazları yükle.
+
+        Redis'ten tek pipeline ile, Redis'te olmayan ve hiç yüklenmemiş
+        cihazlar için telemetri store'undan tek GROUP BY sorgusu ile.
+        """
+        now = time.monotonic()
+        pending: Dict[UUID, Optional[float]] = {}
+        with self._lock:
+            for device_id in device_ids:
+                loaded_at = self._loaded_at.get(device_id)
+                unflushed = device_id in self._dirty or device_id in self._seeds
+                if loaded_at is not None and (now - loaded_at < STATS_RELOAD_SECONDS or unflushed):
+                    continue
+                # Diğer thread'ler yükleme sırasında bellek içi değerleri kullanır
+                self._loaded_at[device_id] = now
+                pending[device_id] = loaded_at
+        if not pending:
+            return
+
+        loaded = self._load_from_redis(list(pending))
+        cold = [device_id for device_id, loaded_at in pending.items() if device_id not in loaded and loaded_at is None]
+        bootstrapped = self._load_from_store(cold) if cold else {}
+
+        with self._lock:
+            for device_id, cells in list(loaded.items()) + list(bootstrapped.items()):
+                if device_id in self._dirty or device_id in self._seeds:
+                    continue
+                self._cells[device_id] = cells
+                filled = {h for h, cell in enumerate(cells) if cell}
+                if device_id in bootstrapped and filled:
+                    # DB'den türetilen başlangıç değerleri de Redis'e yazılsın (kopya: delta'lar ayrı tutulur)
+                    self._seeds[device_id] = {hour: cells[hour].copy() for hour in filled}
+
+    def _load_from_redis(self, device_ids: List[UUID]) -> Dict[UUID, List[Optional[RunningStats]]]:
+        client = self._client()
+        if client is None:
+            return {}
+        results = []
+        try:
+            for offset in range(0, len(device_ids), STATS_LOAD_CHUNK_SIZE):
+                pipe = client.pipeline(transaction=False)
+                for device_id in device_ids[offset:offset + STATS_LOAD_CHUNK_SIZE]:
+                    pipe.hgetall(f"{STATS_KEY_PREFIX}{device_id}")
+                results.extend(pipe.execute())
+        except Exception as e:
+            self._redis_error(e)
+            return {}
+
+        loaded: Dict[UUID, List[Optional[RunningStats]]] = {}
+        for device_id, raw in zip(device_ids, results):
+            if not raw:
+                continue
+            fields: Dict[int, Dict[str, str]] = {}
+            for field, value in raw.items():
+                hour, _, name = str(field).partition(":")
+                if hour.isdigit() and int(hour) < HOURS:
+                    fields.setdefault(int(hour), {})[name] = value
+            cells: List[Optional[RunningStats]] = [None] * HOURS
+            for hour, values in fields.items():
+                cells[hour] = RunningStats.from_fields(values)
+            loaded[device_id] = cells
+        return loaded
+
+    def _load_from_store(self, device_ids: List[UUID]) -> Dict[UUID, List[Optional[RunningStats]]]:
+        """Cold start: son LOOKBACK günün saatlik istatistikleri (chunk başına tek sorgu)."""
+        loaded: Dict[UUID, List[Optional[RunningStats]]] = {device_id: [None] * HOURS for device_id in device_ids}
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.lookback_days)
+        now = time.time()
+        store = get_telemetry_store()
+        for offset in range(0, len(device_ids), STATS_LOAD_CHUNK_SIZE):
+            chunk = device_ids[offset:offset + STATS_LOAD_CHUNK_SIZE]
+            try:
+                hourly = store.hourly_stats_many(chunk, "power", cutoff)
+            except Exception as e:
+                logger.warning(f"[AnomalyStats] Geçmiş istatistikler yüklenemedi ({len(chunk)} cihaz): {e}")
+                continue
+            for device_id, by_hour in hourly.items():
+                for hour, stats in by_hour.items():
+                    if stats["count"]:
+                        loaded[device_id][hour] = RunningStats.from_aggregates(stats, now, self.tau)
+        return loaded
+
+    def _client(self):
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._script = client.register_script(_MERGE_CELLS)
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[AnomalyStats] Redis kullanılamıyor, bellek içi istatistiklerle devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+def _empty_stats() -> Dict[str, float]:
+    return {"mean": 0.0, "std": 0.0, "min": 0.0, "max": 0.0, "count": 0}
+
+
+def _combine(snapshots: List[Dict[str, float]]) -> Dict[str, float]:
+    """Saatlik hücreleri tek istatistikte birleştir (paralel Welford birleştirme)."""
+    total = sum(s["count"] for s in snapshots)
+    if not total:
+        return _empty_stats()
+    mean = sum(s["mean"] * s["count"] for s in snapshots) / total
+    m2 = sum(
+        (s["std"] ** 2) * max(s["count"] - 1, 0) + s["count"] * (s["mean"] - mean) ** 2
+        for s in snapshots
+    )
+    return {
+        "mean": mean,
+        "std": math.sqrt(m2 / (total - 1)) if total > 1 else 0.0,
+        "min": min(s["min"] for s in snapshots),
+        "max": max(s["max"] for s in snapshots),
+        "count": total,
+    }
+
+
+# Singleton instance
+_hourly_stats_store: Optional[HourlyStatsStore] = None
+
+
+def get_hourly_stats_store() -> HourlyStatsStore:
+    """Hourly stats store singleton'ı döndür."""
+    global _hourly_stats_store
+    if _hourly_stats_store is None:
+        _hourly_stats_store = HourlyStatsStore()
+    return _hourly_stats_store
@@ -6,18 +6,26 @@ Celery task'ları bu servisi kullanır.
 """
 import logging
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional, Tuple
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import selectinload
 
 from app.extensions import db
-from app.models import (
-    Automation, AutomationLog, MarketPrice, 
-    SmartAsset, SmartDevice, DeviceTelemetry
-)
-from app.services.shelly_service import get_shelly_service
+from app.models import Automation, AutomationLog, SmartAsset
+from app.services.device_commands import DeviceCommand, get_command_dispatcher
 from app.services.savings_service import SavingsService
+from app.services.automation_rules import EvaluationContext, get_rule_cache
 
 logger = logging.getLogger(__name__)
 
+# Otomasyon aksiyon tipi -> cihaz komutu
+ACTION_COMMANDS = {
+    'turn_on': 'on',
+    'turn_off': 'off',
+    'toggle': 'toggle',
+    'set_power': 'set_power',
+}
+
 
 class AutomationEngine:
     """
@@ -30,39 +38,23 @@ class AutomationEngine:
             success = engine.execute(automation)
     """
     
-    def evaluate(self, automation: Automation) -> Tuple[bool, str]:
+    def evaluate(
+        self,
+        automation: Automation,
+        context: Optional[EvaluationContext] = None,
+    ) -> Tuple[bool, str]:
         """
         Otomasyon kurallarını değerlendir.
         
         Args:
             automation: Değerlendirilecek otomasyon
+            context: Tick boyunca paylaşılan değerlendirme bağlamı (None ise yeni oluşturulur)
         
         Returns:
             (should_trigger, reason) tuple
         """
-        rules = automation.rules or {}
-        trigger = rules.get('trigger', {})
-        conditions = rules.get('conditions', [])
-        
-        # Önce koşulları kontrol et
-        for condition in conditions:
-            condition_met, reason = self._evaluate_condition(condition, automation)
-            if not condition_met:
-                return False, f"Condition not met: {reason}"
-        
-        # Ana tetikleyiciyi değerlendir
-        trigger_type = trigger.get('type')
-        
-        if trigger_type == 'price':
-            return self._evaluate_price_trigger(trigger)
-        elif trigger_type == 'time_range':
-            return self._evaluate_time_trigger(trigger)
-        elif trigger_type == 'sensor':
-            return self._evaluate_sensor_trigger(trigger, automation.asset)
-        elif trigger_type == 'always':
-            return True, "Always trigger"
-        
-        return False, f"Unknown trigger type: {trigger_type}"
+        rule = get_rule_cache().get(automation)
+        return rule.evaluate(context or EvaluationContext(), automation)
     
     def execute(self, automation: Automation) -> bool:
         """
@@ -74,63 +66,52 @@ class AutomationEngine:
         Returns:
             True if successful
         """
-        rules = automation.rules or {}
-        action = rules.get('action', {})
-        action_type = action.get('type')
+        return self.execute_many([automation])[0]
+    
+    def execute_many(self, automations: Sequence[Automation]) -> List[bool]:
+        """
+        Birden fazla otomasyonun aksiyonunu eşzamanlı çalıştır.
         
-        asset = automation.asset
-        if not asset:
-            return False
+        Cihaz komutları DeviceCommandDispatcher ile paralel gönderilir;
+        durum kayıtları (tasarruf hesabı) sonrasında bu thread'de yazılır.
         
-        device = asset.device
-        if not device:
-            return False
+        Returns:
+            Otomasyonlarla aynı sırada başarı listesi
+        """
+        outcomes = [False] * len(automations)
+        commands, owners = [], []
+        for i, automation in enumerate(automations):
+            command = self._build_command(automation)
+            if command is not None:
+                commands.append(command)
+                owners.append(i)
         
         try:
-            success = False
-            
-            if action_type == 'turn_on':
-                success = self._control_device(device, 'on')
-                # Record state change for savings calculation
-                if success:
-                    SavingsService.record_device_state_change(
-                        device_id=str(device.id),
-                        new_state='on',
-                        triggered_by='automation',
-                        automation_id=str(automation.id)
-                    )
-            elif action_type == 'turn_off':
-                success = self._control_device(device, 'off')
-                # Record state change for savings calculation
-                if success:
-                    SavingsService.record_device_state_change(
-                        device_id=str(device.id),
-                        new_state='off',
-                        triggered_by='automation',
-                        automation_id=str(automation.id)
-                    )
-            elif action_type == 'toggle':
-                success = self._control_device(device, 'toggle')
-            elif action_type == 'set_power':
-                power_level = action.get('value', 100)
-                success = self._set_power(device, power_level)
-                # Record dimmed state for partial savings
-                if success and power_level < 100:
-                    SavingsService.record_device_state_change(
-                        device_id=str(device.id),
-                        new_state='dimmed',
-                        power_level=power_level,
-                        triggered_by='automation',
-                        automation_id=str(automation.id)
-                    )
-            
-            return success
-            
+            results = get_command_dispatcher().dispatch(commands)
         except Exception as e:
             logger.exception(f"Automation execution error: {e}")
-            return False
+            return outcomes
+        
+        now = datetime.now(timezone.utc)
+        for i, result in zip(owners, results):
+            outcomes[i] = result.success
+            if not result.success:
+                continue
+            automation = automations[i]
+            if result.command.brand == 'shelly':
+                automation.asset.device.last_seen = now
+            try:
+                self._record_state_change(automation, result.command)
+            except Exception as e:
+                logger.exception(f"Automation state record error: {e}")
+        
+        return outcomes
     
-    def run_automation(self, automation: Automation) -> dict:
+    def run_automation(
+        self,
+        automation: Automation,
+        context: Optional[EvaluationContext] = None,
+    ) -> dict:
         """
         Tek bir otomasyonu değerlendir ve çalıştır.
         
@@ -143,7 +124,7 @@ class AutomationEngine:
             }
         """
         try:
-            should_trigger, reason = self.evaluate(automation)
+            should_trigger, reason = self.evaluate(automation, context)
             
             if not should_trigger:
                 return {
@@ -183,173 +164,92 @@ class AutomationEngine:
                 'error': str(e)
             }
     
-    def _evaluate_condition(self, condition: dict, automation: Automation) -> Tuple[bool, str]:
-        """Ek koşulu değerlendir."""
-        condition_type = condition.get('type')
-        
-        if condition_type == 'time_range':
-            return self._evaluate_time_trigger(condition)
-        elif condition_type == 'day_of_week':
-            return self._evaluate_day_condition(condition)
-        elif condition_type == 'device_state':
-            return self._evaluate_device_state(condition, automation.asset)
-        
-        return True, "Unknown condition type (ignored)"
-    
-    def _evaluate_price_trigger(self, trigger: dict) -> Tuple[bool, str]:
-        """Fiyat eşiği kontrolü."""
-        operator = trigger.get('operator', '<')
-        threshold = trigger.get('value', 0)
-        
-        # Son fiyatı al
-        current_price = MarketPrice.query.order_by(MarketPrice.time.desc()).first()
-        
-        if not current_price:
-            return False, "No price data available"
+    def run_automations(
+        self,
+        automations: Sequence[Automation],
+        context: Optional[EvaluationContext] = None,
+    ) -> List[dict]:
+        """
+        Otomasyonları toplu değerlendir; tetiklenenlerin aksiyonlarını eşzamanlı çalıştır.
         
-        price = current_price.price
+        Returns:
+            Her otomasyon için run_automation formatında sonuç (aynı sırada)
+        """
+        context = context or EvaluationContext()
+        results: List[dict] = []
+        triggered: List[Tuple[int, Automation, str]] = []
         
-        comparisons = {
-            '<': lambda p, t: p < t,
-            '>': lambda p, t: p > t,
-            '<=': lambda p, t: p <= t,
-            '>=': lambda p, t: p >= t,
-            '==': lambda p, t: p == t,
-        }
+        for automation in automations:
+            try:
+                should_trigger, reason = self.evaluate(automation, context)
+            except Exception as e:
+                results.append({'triggered': False, 'executed': False, 'reason': 'Error', 'error': str(e)})
+                continue
+            results.append({'triggered': should_trigger, 'executed': False, 'reason': reason})
+            if should_trigger:
+                triggered.append((len(results) - 1, automation, reason))
         
-        compare_func = comparisons.get(operator)
-        if compare_func and compare_func(price, threshold):
-            return True, f"Price {price:.2f} TL/kWh {operator} {threshold}"
+        if not triggered:
+            return results
         
-        return False, f"Price {price:.2f} TL/kWh does not meet {operator} {threshold}"
-    
-    def _evaluate_time_trigger(self, trigger: dict) -> Tuple[bool, str]:
-        """Zaman aralığı kontrolü."""
-        start_time = trigger.get('start', '00:00')
-        end_time = trigger.get('end', '23:59')
-        days = trigger.get('days', [0, 1, 2, 3, 4, 5, 6])
+        outcomes = self.execute_many([automation for _, automation, _ in triggered])
         
         now = datetime.now(timezone.utc)
-        current_time = now.strftime('%H:%M')
-        current_day = now.weekday()
-        
-        # Gün kontrolü
-        if current_day not in days:
-            return False, f"Today ({current_day}) not in scheduled days"
-        
-        # Normal aralık
-        if start_time <= end_time:
-            if start_time <= current_time <= end_time:
-                return True, f"Time {current_time} in range {start_time}-{end_time}"
-        else:
-            # Gece yarısını geçen aralık (örn: 22:00 - 06:00)
-            if current_time >= start_time or current_time <= end_time:
-                return True, f"Time {current_time} in overnight range {start_time}-{end_time}"
-        
-        return False, f"Time {current_time} outside range {start_time}-{end_time}"
-    
-    def _evaluate_day_condition(self, condition: dict) -> Tuple[bool, str]:
-        """Gün koşulu kontrolü."""
-        days = condition.get('days', [0, 1, 2, 3, 4, 5, 6])
-        current_day = datetime.now().weekday()
-        
-        if current_day in days:
-            return True, f"Day {current_day} is in allowed days"
-        return False, f"Day {current_day} not in allowed days"
-    
-    def _evaluate_sensor_trigger(self, trigger: dict, asset: SmartAsset) -> Tuple[bool, str]:
-        """Sensör değeri kontrolü."""
-        if not asset or not asset.device:
-            return False, "No device linked to asset"
-        
-        sensor_key = trigger.get('key', 'power')
-        operator = trigger.get('operator', '>')
-        threshold = trigger.get('value', 0)
-        
-        # Son telemetri verisini al
-        latest = DeviceTelemetry.query.filter_by(
-            device_id=asset.device.id,
-            key=sensor_key
-        ).order_by(DeviceTelemetry.time.desc()).first()
-        
-        if not latest:
-            return False, f"No telemetry data for {sensor_key}"
-        
-        value = latest.value
-        
-        comparisons = {
-            '<': lambda v, t: v < t,
-            '>': lambda v, t: v > t,
-            '<=': lambda v, t: v <= t,
-            '>=': lambda v, t: v >= t,
-            '==': lambda v, t: v == t,
-        }
+        for (index, automation, reason), success in zip(triggered, outcomes):
+            db.session.add(AutomationLog(
+                organization_id=automation.organization_id,
+                automation_id=automation.id,
+                action_taken=automation.rules.get('action', {}).get('type', 'unknown'),
+                reason=reason,
+                status='success' if success else 'failed'
+            ))
+            automation.last_triggered_at = now
+            automation.trigger_count = (automation.trigger_count or 0) + 1
+            results[index]['executed'] = success
         
-        compare_func = comparisons.get(operator)
-        if compare_func and compare_func(value, threshold):
-            return True, f"Sensor {sensor_key}={value} {operator} {threshold}"
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Automation log commit error: {e}")
+            for index, _, _ in triggered:
+                results[index].update({'triggered': False, 'executed': False, 'reason': 'Error', 'error': str(e)})
         
-        return False, f"Sensor {sensor_key}={value} does not meet {operator} {threshold}"
+        return results
     
-    def _evaluate_device_state(self, condition: dict, asset: SmartAsset) -> Tuple[bool, str]:
-        """Cihaz durumu kontrolü."""
-        if not asset or not asset.device:
-            return False, "No device linked"
-        
-        expected_state = condition.get('state')  # 'on', 'off', 'online'
-        device = asset.device
-        
-        if expected_state == 'online':
-            if device.is_online:
-                return True, "Device is online"
-            return False, "Device is offline"
-        
-        # Shelly cihazları için gerçek durumu kontrol et
-        if device.brand == 'shelly':
-            service = get_shelly_service(str(device.organization_id))
-            if service:
-                try:
-                    status = service.get_device_status(device)
-                    current_state = 'on' if status.get('output', False) else 'off'
-                    
-                    if current_state == expected_state:
-                        return True, f"Device is {current_state}"
-                    return False, f"Device is {current_state}, expected {expected_state}"
-                except Exception as e:
-                    return False, f"Could not get device status: {e}"
+    @staticmethod
+    def _build_command(automation: Automation) -> Optional[DeviceCommand]:
+        """Otomasyon aksiyonunu cihaz komutuna çevir (cihaz/aksiyon yoksa None)."""
+        action = (automation.rules or {}).get('action', {})
+        command_action = ACTION_COMMANDS.get(action.get('type'))
         
-        # Diğer markalar için veritabanındaki son durumu kullan
-        return True, "Device state check based on last known state"
-    
-    def _control_device(self, device: SmartDevice, action: str) -> bool:
-        """Cihazı kontrol et."""
-        if device.brand == 'shelly':
-            service = get_shelly_service(str(device.organization_id))
-            if service:
-                if action == 'on':
-                    return service.turn_on(device)
-                elif action == 'off':
-                    return service.turn_off(device)
-                elif action == 'toggle':
-                    return service.toggle(device)
+        asset = automation.asset
+        device = asset.device if asset else None
+        if device is None or command_action is None:
+            return None
         
-        # Diğer markalar için placeholder (gelecekte Tapo, Tuya vb. eklenecek)
-        logger.info(f"[ENGINE] Device brand '{device.brand}' not yet supported, would {action} {device.name}")
-        return True
+        value = action.get('value', 100) if command_action == 'set_power' else None
+        return DeviceCommand(device, command_action, value)
     
-    def _set_power(self, device: SmartDevice, power_level: int) -> bool:
-        """Güç seviyesi ayarla (dimmer, RGBW vb. için)."""
-        if device.brand == 'shelly' and device.device_type in ['dimmer', 'rgbw']:
-            service = get_shelly_service(str(device.organization_id))
-            if service:
-                try:
-                    return service.set_power_limit(device, power_level)
-                except Exception as e:
-                    logger.error(f"[ENGINE] Shelly power control error: {e}")
-                    return False
-        
-        logger.warning(f"[ENGINE] Power control not supported for {device.brand}/{device.device_type}")
-        return False
+    @staticmethod
+    def _record_state_change(automation: Automation, command: DeviceCommand) -> None:
+        """Tasarruf hesabı için durum değişikliğini kaydet."""
+        if command.action in ('on', 'off'):
+            SavingsService.record_device_state_change(
+                device_id=str(command.device_id),
+                new_state=command.action,
+                triggered_by='automation',
+                automation_id=str(automation.id)
+            )
+        elif command.action == 'set_power' and command.value < 100:
+            # Record dimmed state for partial savings
+            SavingsService.record_device_state_change(
+                device_id=str(command.device_id),
+                new_state='dimmed',
+                power_level=command.value,
+                triggered_by='automation',
+                automation_id=str(automation.id)
+            )
 
 
 # Singleton instance
@@ -362,19 +262,20 @@ def check_all_automations() -> dict:
     
     Celery task tarafından çağrılır.
     """
-    active_automations = Automation.query.filter_by(is_active=True).all()
+    active_automations = Automation.query.filter_by(is_active=True).options(
+        selectinload(Automation.asset).selectinload(SmartAsset.device)
+    ).all()
     
-    results = []
-    triggered_count = 0
+    # Fiyat, sensör değerleri ve cihaz durumları tick başına bir kez okunur
+    context = EvaluationContext()
+    context.prefetch(active_automations)
+    get_rule_cache().prune(a.id for a in active_automations)
     
-    for automation in active_automations:
-        result = automation_engine.run_automation(automation)
+    results = automation_engine.run_automations(active_automations, context)
+    for automation, result in zip(active_automations, results):
         result['automation_id'] = str(automation.id)
         result['name'] = automation.name
-        results.append(result)
-        
-        if result.get('triggered'):
-            triggered_count += 1
+    triggered_count = sum(1 for result in results if result.get('triggered'))
     
     return {
         'status': 'success',
@@ -0,0 +1,420 @@
+"""
+Automation Rules - Otomasyon kurallarının derlenmesi ve tick bazlı değerlendirme bağlamı.
+
+`rules` JSONB her değerlendirmede yeniden yorumlanmak yerine bir kez
+predicate nesnelerine derlenir ve (automation.id, updated_at) ile cache'lenir;
+kural güncellendiğinde updated_at değiştiği için tüm process'lerde yeniden derlenir.
+
+EvaluationContext bir tick boyunca paylaşılan verileri tutar:
+- Güncel piyasa fiyatı (tek sorgu)
+- Sensör trigger'larının son değerleri (LKV'den toplu, eksikler için key başına tek sorgu)
+- Shelly cihaz durumları (ShellyStatusCache snapshot'ı; eskiyse organizasyon başına tek all_status)
+
+Kullanım:
+    context = EvaluationContext()
+    context.prefetch(automations)
+    for automation in automations:
+        should_trigger, reason = get_rule_cache().get(automation).evaluate(context, automation)
+"""
+from __future__ import annotations
+
+import logging
+import operator
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from app.models import Automation, MarketPrice
+from app.services.latest_values import get_latest_value_store
+from app.services.shelly_service import get_shelly_service
+from app.services.shelly_status import get_shelly_status_cache
+from app.services.telemetry_store import get_telemetry_store, normalize_key
+
+logger = logging.getLogger(__name__)
+
+ALL_DAYS = (0, 1, 2, 3, 4, 5, 6)
+
+COMPARISONS: Dict[str, Callable[[float, float], bool]] = {
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '==': operator.eq,
+}
+
+# Değerlendirme sonucu: (koşul sağlandı mı, açıklama)
+Result = Tuple[bool, str]
+
+_UNSET = object()
+
+
+def compare_values(op: str, value: float, threshold: float) -> bool:
+    """Kural operatörü ile karşılaştır (bilinmeyen operatör False)."""
+    compare_func = COMPARISONS.get(op)
+    return bool(compare_func and compare_func(value, threshold))
+
+
+def _linked_device(automation: Automation):
+    asset = automation.asset
+    return asset.device if asset else None
+
+
+# ==========================================
+# Evaluation Context
+# ==========================================
+
+class EvaluationContext:
+    """
+    Tek bir değerlendirme turu (tick) için paylaşılan veriler.
+
+    prefetch() çağrılmazsa değerler ilk ihtiyaç anında tek tek okunur
+    (tekil otomasyon çalıştırma yolu) ve tick boyunca tekrar kullanılır.
+    """
+
+    def __init__(self, now: Optional[datetime] = None):
+        self.now = now or datetime.now(timezone.utc)
+        self.current_time = self.now.strftime('%H:%M')
+        self.current_day = self.now.weekday()
+        self.local_day = datetime.now().weekday()  # day_of_week koşulu sunucu yerel saatini kullanır
+
+        self._price: Any = _UNSET
+        self._sensors: Dict[Tuple[UUID, str], Optional[float]] = {}
+        self._states: Dict[UUID, Tuple[Optional[str], Optional[str]]] = {}  # device_id -> (state, error)
+
+    @property
+    def price(self) -> Optional[float]:
+        """Son piyasa fiyatı (TL/kWh) veya None."""
+        if self._price is _UNSET:
+            latest = MarketPrice.query.order_by(MarketPrice.time.desc()).first()
+            self._price = latest.price if latest else None
+        return self._price
+
+    def prefetch(self, automations: Sequence[Automation]) -> None:
+        """Tick'teki tüm otomasyonların ihtiyaç duyduğu sensör değerlerini ve cihaz durumlarını toplu oku."""
+        sensor_devices: Dict[str, Dict[UUID, UUID]] = {}
+        state_devices: Dict[UUID, Dict[UUID, Any]] = {}
+        cache = get_rule_cache()
+
+        for automation in automations:
+            rule = cache.get(automation)
+            if not (rule.sensor_keys or rule.needs_device_state):
+                continue
+            device = _linked_device(automation)
+            if device is None:
+                continue
+            for key in rule.sensor_keys:
+                sensor_devices.setdefault(key, {})[device.id] = device.organization_id
+            if rule.needs_device_state and device.brand == 'shelly':
+                state_devices.setdefault(device.organization_id, {})[device.id] = device
+
+        for key, devices in sensor_devices.items():
+            self._prefetch_sensor(key, devices)
+        for organization_id, devices in state_devices.items():
+            self._prefetch_states(organization_id, devices)
+
+    def sensor_value(self, device, key: str) -> Optional[float]:
+        """Cihazın sensör key'i için son değeri."""
+        key = normalize_key(key)
+        cache_key = (device.id, key)
+        if cache_key not in self._sensors:
+            latest = get_latest_value_store().get_latest(device, key)
+            if latest:
+                self._sensors[cache_key] = latest[1]
+            else:
+                # LKV'de olmayan (kanonik dışı) key'ler için telemetri store'u
+                point = get_telemetry_store().latest_value(device.id, key)
+                self._sensors[cache_key] = point[1] if point else None
+        return self._sensors[cache_key]
+
+    def device_state(self, device) -> Tuple[Optional[str], Optional[str]]:
+        """Shelly cihazının anlık durumu: ('on' | 'off' | None, hata mesajı)."""
+        if device.id not in self._states:
+            try:
+                snapshot = get_shelly_status_cache().get(device)
+                if snapshot is not None:
+                    self._states[device.id] = ('on' if snapshot['output'] else 'off', None)
+                else:
+                    # Snapshot'ta olmayan cihaz için tekil sorgu
+                    service = get_shelly_service(str(device.organization_id))
+                    if service is None:
+                        self._states[device.id] = (None, None)
+                    else:
+                        status = service.get_device_status(device)
+                        self._states[device.id] = ('on' if status.get('output', False) else 'off', None)
+            except Exception as e:
+                self._states[device.id] = (None, str(e))
+        return self._states[device.id]
+
+    def _prefetch_sensor(self, key: str, devices: Dict[UUID, UUID]) -> None:
+        key = normalize_key(key)
+        latest = get_latest_value_store().get_latest_many(list(devices.items()), key)
+        missing = [device_id for device_id in devices if device_id not in latest]
+        points = {}
+        if missing:
+            try:
+                points = get_telemetry_store().latest_points(key, device_ids=missing)
+            except Exception as e:
+                logger.warning(f"[AutomationRules] Sensör değerleri okunamadı ({key}): {e}")
+        for device_id in devices:
+            value = latest.get(device_id) or points.get(device_id)
+            self._sensors[(device_id, key)] = value[1] if value else None
+
+    def _prefetch_states(self, organization_id: UUID, devices: Dict[UUID, Any]) -> None:
+        try:
+            snapshots, polled_at = get_shelly_status_cache().get_many(organization_id)
+        except Exception as e:
+            self._states.update({device_id: (None, str(e)) for device_id in devices})
+            return
+        if polled_at is None:
+            # Shelly entegrasyonu yok
+            self._states.update({device_id: (None, None) for device_id in devices})
+            return
+        for device_id, device in devices.items():
+            snapshot = snapshots.get(device.external_id)
+            if snapshot is None:
+                continue  # Listede yoksa tekil sorguya düşer
+            self._states[device_id] = ('on' if snapshot['output'] else 'off', None)
+
+
+# ==========================================
+# Predicates
+# ==========================================
+
+class PriceTrigger:
+    """Fiyat eşiği kontrolü."""
+
+    __slots__ = ('op', 'threshold')
+
+    def __init__(self, spec: dict):
+        self.op = spec.get('operator', '<')
+        self.threshold = spec.get('value', 0)
+
+    def __call__(self, context: EvaluationContext, automation: Automation) -> Result:
+        price = context.price
+        if price is None:
+            return False, "No price data available"
+        if compare_values(self.op, price, self.threshold):
+            return True, f"Price {price:.2f} TL/kWh {self.op} {self.threshold}"
+        return False, f"Price {price:.2f} TL/kWh does not meet {self.op} {self.threshold}"
+
+
+class TimeRange:
+    """Zaman aralığı kontrolü (UTC)."""
+
+    __slots__ = ('start', 'end', 'days')
+
+    def __init__(self, spec: dict):
+        self.start = spec.get('start', '00:00')
+        self.end = spec.get('end', '23:59')
+        self.days = frozenset(spec.get('days', ALL_DAYS))
+
+    def __call__(self, context: EvaluationContext, automation: Automation) -> Result:
+        current_time = context.current_time
+        if context.current_day not in self.days:
+            return False, f"Today ({context.current_day}) not in scheduled days"
+
+        if self.start <= self.end:
+            if self.start <= current_time <= self.end:
+                return True, f"Time {current_time} in range {self.start}-{self.end}"
+        elif current_time >= self.start or current_time <= self.end:
+            # Gece yarısını geçen aralık (örn: 22:00 - 06:00)
+            return True, f"Time {current_time} in overnight range {self.start}-{self.end}"
+
+        return False, f"Time {current_time} outside range {self.start}-{self.end}"
+
+
+class DayOfWeek:
+    """Gün koşulu kontrolü."""
+
+    __slots__ = ('days',)
+
+    def __init__(self, spec: dict):
+        self.days = frozenset(spec.get('days', ALL_DAYS))
+
+    def __call__(self, context: EvaluationContext, automation: Automation) -> Result:
+        if context.local_day in self.days:
+            return True, f"Day {context.local_day} is in allowed days"
+        return False, f"Day {context.local_day} not in allowed days"
+
+
+class SensorTrigger:
+    """Sensör değeri kontrolü."""
+
+    __slots__ = ('key', 'op', 'threshold')
+
+    def __init__(self, spec: dict):
+        self.key = spec.get('key', 'power')
+        self.op = spec.get('operator', '>')
+        self.threshold = spec.get('value', 0)
+
+    def __call__(self, context: EvaluationContext, automation: Automation) -> Result:
+        device = _linked_device(automation)
+        if device is None:
+            return False, "No device linked to asset"
+
+        value = context.sensor_value(device, self.key)
+        if value is None:
+            return False, f"No telemetry data for {self.key}"
+        if compare_values(self.op, value, self.threshold):
+            return True, f"Sensor {self.key}={value} {self.op} {self.threshold}"
+        return False, f"Sensor {self.key}={value} does not meet {self.op} {self.threshold}"
+
+
+class DeviceState:
+    """Cihaz durumu kontrolü ('on', 'off', 'online')."""
+
+    __slots__ = ('expected',)
+
+    def __init__(self, spec: dict):
+        self.expected = spec.get('state')
+
+    def __call__(self, context: EvaluationContext, automation: Automation) -> Result:
+        device = _linked_device(automation)
+        if device is None:
+            return False, "No device linked"
+
+        if self.expected == 'online':
+            if device.is_online:
+                return True, "Device is online"
+            return False, "Device is offline"
+
+        # Shelly cihazları için gerçek durumu kontrol et
+        if device.brand == 'shelly':
+            current_state, error = context.device_state(device)
+            if error:
+                return False, f"Could not get device status: {error}"
+            if current_state is not None:
+                if current_state == self.expected:
+                    return True, f"Device is {current_state}"
+                return False, f"Device is {current_state}, expected {self.expected}"
+
+        # Diğer markalar için veritabanındaki son durumu kullan
+        return True, "Device state check based on last known state"
+
+
+class Constant:
+    """Sabit sonuç (always trigger, bilinmeyen tipler)."""
+
+    __slots__ = ('result',)
+
+    def __init__(self, ok: bool, reason: str):
+        self.result = (ok, reason)
+
+    def __call__(self, context: EvaluationContext, automation: Automation) -> Result:
+        return self.result
+
+
+TRIGGERS = {
+    'price': PriceTrigger,
+    'time_range': TimeRange,
+    'sensor': SensorTrigger,
+}
+
+CONDITIONS = {
+    'time_range': TimeRange,
+    'day_of_week': DayOfWeek,
+    'device_state': DeviceState,
+}
+
+
+# ==========================================
+# Compiler
+# ==========================================
+
+class CompiledRule:
+    """Derlenmiş otomasyon kuralı: önce koşullar, sonra ana tetikleyici."""
+
+    __slots__ = ('conditions', 'trigger', 'sensor_keys', 'needs_device_state')
+
+    def __init__(self, conditions: List[Callable], trigger: Callable):
+        self.conditions = conditions
+        self.trigger = trigger
+        self.sensor_keys = tuple(
+            normalize_key(p.key) for p in [trigger, *conditions] if isinstance(p, SensorTrigger)
+        )
+        self.needs_device_state = any(
+            isinstance(p, DeviceState) and p.expected != 'online' for p in conditions
+        )
+
+    def evaluate(self, context: EvaluationContext, automation: Automation) -> Result:
+        for condition in self.conditions:
+            condition_met, reason = condition(context, automation)
+            if not condition_met:
+                return False, f"Condition not met: {reason}"
+        return self.trigger(context, automation)
+
+
+def compile_rules(rules: Optional[dict]) -> CompiledRule:
+    """`rules` JSONB'sini predicate nesnelerine derle."""
+    rules = rules or {}
+    trigger = rules.get('trigger', {})
+    trigger_type = trigger.get('type')
+
+    conditions = []
+    for condition in rules.get('conditions', []):
+        predicate = CONDITIONS.get(condition.get('type'))
+        if predicate is not None:
+            conditions.append(predicate(condition))
+        # Bilinmeyen koşul tipleri yok sayılır
+
+    if trigger_type in TRIGGERS:
+        compiled_trigger = TRIGGERS[trigger_type](trigger)
+    elif trigger_type == 'always':
+        compiled_trigger = Constant(True, "Always trigger")
+    else:
+        compiled_trigger = Constant(False, f"Unknown trigger type: {trigger_type}")
+
+    return CompiledRule(conditions, compiled_trigger)
+
+
+class RuleCache:
+    """
+    automation.id -> CompiledRule cache'i.
+
+    Kayıt automation.updated_at ile eşleşmiyorsa (kural güncellendi) yeniden derlenir.
+    """
+
+    def __init__(self):
+        self._rules: Dict[UUID, Tuple[Optional[datetime], CompiledRule]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, automation: Automation) -> CompiledRule:
+        if automation.id is None:
+            return compile_rules(automation.rules)
+
+        cached = self._rules.get(automation.id)
+        if cached is not None and cached[0] == automation.updated_at:
+            return cached[1]
+
+        compiled = compile_rules(automation.rules)
+        with self._lock:
+            self._rules[automation.id] = (automation.updated_at, compiled)
+        return compiled
+
+    def invalidate(self, automation_id: Any) -> None:
+        """Güncellenen/silinen otomasyonun derlenmiş kuralını at."""
+        if automation_id is None:
+            return
+        automation_id = automation_id if isinstance(automation_id, UUID) else UUID(str(automation_id))
+        with self._lock:
+            self._rules.pop(automation_id, None)
+
+    def prune(self, active_ids: Iterable[UUID]) -> None:
+        """Artık aktif olmayan otomasyonların kayıtlarını temizle."""
+        active = set(active_ids)
+        with self._lock:
+            for automation_id in [a for a in self._rules if a not in active]:
+                del self._rules[automation_id]
+
+
+# Singleton instance
+_rule_cache: Optional[RuleCache] = None
+
+
+def get_rule_cache() -> RuleCache:
+    """Rule cache singleton'ı döndür."""
+    global _rule_cache
+    if _rule_cache is None:
+        _rule_cache = RuleCache()
+    return _rule_cache
@@ -0,0 +1,298 @@
+"""
+Automation Triggers - Olay bazlı otomasyon tetikleme.
+
+Otomasyonlar dakikalık polling yerine girdileri değiştiğinde değerlendirilir:
+
+- Sensör okuması: (device_id, key) -> o sensöre bağlı otomasyonlar
+  (ingest yolları publish_ingested üzerinden bildirir; sadece eşik geçişlerinde tetiklenir)
+- Fiyat değişimi: fetch_epias_prices yeni fiyatları kaydettiğinde price trigger'ları
+- Zaman sınırı: time_range başlangıç/bitiş dakikası ve gün değişimi (days / day_of_week)
+
+Etkilenen otomasyonlar evaluate_automations Celery task'ına gönderilir.
+check_automations beat job'ı güvenlik ağı olarak her dakika çalışmaya devam eder.
+
+Sensör trigger'larının son karşılaştırma sonucu Redis'te (otomasyon başına) tutulur;
+böylece aynı cihazın okumaları farklı process'lere düştüğünde de eşik geçişi bir kez
+algılanır. Redis yoksa process içi sonuçlarla devam edilir.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import selectinload
+
+from app.models import Automation, SmartAsset
+from app.services.automation_rules import (
+    ALL_DAYS, DayOfWeek, PriceTrigger, SensorTrigger, TimeRange, compare_values, get_rule_cache,
+)
+from app.services.telemetry_store import TelemetryRow, normalize_key
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+OUTCOMES_KEY = "awaxen:automation:sensor_outcomes"
+OUTCOMES_TTL_SECONDS = 7 * 24 * 3600
+REDIS_RETRY_SECONDS = 30  # Redis bağlantı hatasından sonra tekrar deneme aralığı
+AUTOMATION_INDEX_TTL_SECONDS = 60  # İndeksin DB'den yeniden kurulma aralığı (diğer process'lerdeki değişiklikler için)
+LOCAL_DAY_BOUNDARY = "00:00"
+
+# ARGV[1] = TTL, ardından (automation_id, outcome) çiftleri (zaman sırasıyla).
+# Her çift için önceki sonuç okunup yenisi yazılır; eşik geçişi olan otomasyonlar döner.
+_SWAP_OUTCOMES = """
+local fired = {}
+for i = 2, #ARGV, 2 do
+    local previous = redis.call('HGET', KEYS[1], ARGV[i])
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    if previous ~= ARGV[i + 1] and (previous or ARGV[i + 1] == '1') then
+        table.insert(fired, ARGV[i])
+    end
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return fired
+"""
+
+
+class AutomationTriggerIndex:
+    """
+    Girdi -> otomasyon indeksi.
+
+    Kullanım:
+        index = get_automation_trigger_index()
+        index.on_readings([(ts, device.id, "power", 1500.0)])
+        index.on_price_changed()
+        index.on_time_boundary(datetime.now(timezone.utc))
+    """
+
+    def __init__(self, ttl: float = AUTOMATION_INDEX_TTL_SECONDS, redis_url: Optional[str] = REDIS_URL):
+        self.ttl = ttl
+        self.redis_url = redis_url
+
+        self._sensors: Dict[Tuple[UUID, str], List[Tuple[UUID, SensorTrigger]]] = {}
+        self._price: Set[UUID] = set()
+        self._time: Dict[str, Set[UUID]] = {}  # UTC "HH:MM" -> otomasyonlar
+        self._daily: Set[UUID] = set()  # Yerel gün değişiminde değerlendirilecekler
+        self._outcomes: Dict[UUID, bool] = {}  # Redis yokken sensör trigger'ının son sonucu
+
+        self._built_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+        self._redis = None
+        self._script = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Events
+    # ------------------------------------------
+
+    def on_readings(self, rows: Iterable[TelemetryRow]) -> int:
+        """
+        Yeni sensör okumalarını işle; eşiği geçen sensör trigger'larını tetikle.
+
+        Returns:
+            Değerlendirmeye gönderilen otomasyon sayısı
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        self._ensure_built()
+
+        outcomes: List[Tuple[UUID, bool]] = []
+        with self._lock:
+            if not self._sensors:
+                return 0
+            for _, device_id, key, value in sorted(rows, key=lambda row: row[0]):
+                if value is None:
+                    continue
+                for automation_id, trigger in self._sensors.get((device_id, normalize_key(key)), ()):
+                    outcomes.append((automation_id, compare_values(trigger.op, value, trigger.threshold)))
+
+        return self._dispatch(self._crossings(outcomes), "sensor")
+
+    def on_price_changed(self) -> int:
+        """Piyasa fiyatları güncellendiğinde price trigger'lı otomasyonları değerlendir."""
+        self._ensure_built()
+        with self._lock:
+            affected = set(self._price)
+        return self._dispatch(affected, "price")
+
+    def on_time_boundary(self, now: Optional[datetime] = None) -> int:
+        """Bu dakikada zaman aralığı başlayan/biten veya gün değişen otomasyonları değerlendir."""
+        now = now or datetime.now(timezone.utc)
+        self._ensure_built()
+        with self._lock:
+            affected = set(self._time.get(now.strftime('%H:%M'), ()))
+            if now.astimezone().strftime('%H:%M') == LOCAL_DAY_BOUNDARY:
+                affected |= self._daily
+        return self._dispatch(affected, "time")
+
+    def invalidate(self) -> None:
+        """Otomasyon oluşturuldu/güncellendi/silindi: indeks bir sonraki olayda yeniden kurulur."""
+        with self._lock:
+            self._built_at = None
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _crossings(self, outcomes: List[Tuple[UUID, bool]]) -> Set[UUID]:
+        """
+        Sonuçları sırayla kaydet; eşiği geçen otomasyonları döndür
+        (ilk okumada yalnızca koşul sağlanıyorsa).
+        """
+        if not outcomes:
+            return set()
+
+        client = self._client()
+        if client is not None:
+            args: List[str] = [str(OUTCOMES_TTL_SECONDS)]
+            for automation_id, outcome in outcomes:
+                args += [str(automation_id), '1' if outcome else '0']
+            try:
+                fired = self._script(keys=[OUTCOMES_KEY], args=args, client=client)
+                return {UUID(automation_id) for automation_id in fired}
+            except Exception as e:
+                self._redis_error(e)
+
+        affected: Set[UUID] = set()
+        with self._lock:
+            for automation_id, outcome in outcomes:
+                previous = self._outcomes.get(automation_id)
+                self._outcomes[automation_id] = outcome
+                if outcome != previous and (previous is not None or outcome):
+                    affected.add(automation_id)
+        return affected
+
+    def _ensure_built(self) -> None:
+        with self._lock:
+            if self._built_at is not None and time.monotonic() - self._built_at < self.ttl:
+                return
+            # Diğer thread'ler kurulum sırasında eski indeksi kullanır
+            self._built_at = time.monotonic()
+
+        try:
+            self._build()
+        except Exception as e:
+            logger.warning(f"[AutomationTriggers] İndeks kurulamadı: {e}")
+            with self._lock:
+                self._built_at = None
+
+    def _build(self) -> None:
+        automations = Automation.query.filter_by(is_active=True).options(
+            selectinload(Automation.asset).selectinload(SmartAsset.device)
+        ).all()
+        cache = get_rule_cache()
+
+        sensors: Dict[Tuple[UUID, str], List[Tuple[UUID, SensorTrigger]]] = {}
+        price: Set[UUID] = set()
+        boundaries: Dict[str, Set[UUID]] = {}
+        daily: Set[UUID] = set()
+
+        for automation in automations:
+            rule = cache.get(automation)
+            for predicate in (rule.trigger, *rule.conditions):
+                if isinstance(predicate, SensorTrigger):
+                    device = automation.asset.device if automation.asset else None
+                    if device is not None:
+                        sensors.setdefault((device.id, normalize_key(predicate.key)), []).append(
+                            (automation.id, predicate)
+                        )
+                elif isinstance(predicate, PriceTrigger):
+                    price.add(automation.id)
+                elif isinstance(predicate, TimeRange):
+                    boundaries.setdefault(predicate.start, set()).add(automation.id)
+                    boundaries.setdefault(_minute_after(predicate.end), set()).add(automation.id)
+                    if predicate.days != frozenset(ALL_DAYS):
+                        boundaries.setdefault("00:00", set()).add(automation.id)  # UTC gün değişimi
+                elif isinstance(predicate, DayOfWeek):
+                    daily.add(automation.id)
+
+        with self._lock:
+            self._sensors = sensors
+            self._price = price
+            self._time = boundaries
+            self._daily = daily
+            active = {automation_id for entries in sensors.values() for automation_id, _ in entries}
+            self._outcomes = {k: v for k, v in self._outcomes.items() if k in active}
+        self._prune_outcomes(active)
+        logger.debug(
+            f"[AutomationTriggers] İndeks kuruldu: {len(automations)} otomasyon, "
+            f"{len(sensors)} sensör, {len(price)} fiyat"
+        )
+
+    def _prune_outcomes(self, active: Set[UUID]) -> None:
+        """Silinmiş/pasif otomasyonların Redis'teki son sonuçlarını temizle."""
+        client = self._client()
+        if client is None:
+            return
+        try:
+            stale = set(client.hkeys(OUTCOMES_KEY)) - {str(automation_id) for automation_id in active}
+            if stale:
+                client.hdel(OUTCOMES_KEY, *stale)
+        except Exception as e:
+            self._redis_error(e)
+
+    def _client(self):
+        """Redis client (hata sonrası REDIS_RETRY_SECONDS boyunca denenmez)."""
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._script = client.register_script(_SWAP_OUTCOMES)
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[AutomationTriggers] Redis kullanılamıyor, process içi sonuçlarla devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+    @staticmethod
+    def _dispatch(automation_ids: Set[UUID], source: str) -> int:
+        if not automation_ids:
+            return 0
+        try:
+            from app.tasks.automation_tasks import evaluate_automations
+            evaluate_automations.delay([str(a) for a in automation_ids], source)
+        except Exception as e:
+            logger.warning(f"[AutomationTriggers] Değerlendirme kuyruğa alınamadı ({source}): {e}")
+            return 0
+        return len(automation_ids)
+
+
+def _minute_after(hhmm: str) -> str:
+    """Aralık bitişi dahil olduğu için çıkış sınırı bir sonraki dakikadır ('23:59' -> '00:00')."""
+    try:
+        hour, minute = (int(part) for part in hhmm.split(':'))
+    except ValueError:
+        return hhmm
+    total = (hour * 60 + minute + 1) % (24 * 60)
+    return f"{total // 60:02d}:{total % 60:02d}"
+
+
+# Singleton instance
+_trigger_index: Optional[AutomationTriggerIndex] = None
+
+
+def get_automation_trigger_index() -> AutomationTriggerIndex:
+    """Automation trigger index singleton'ı döndür."""
+    global _trigger_index
+    if _trigger_index is None:
+        _trigger_index = AutomationTriggerIndex()
+    return _trigger_index
@@ -0,0 +1,385 @@
+"""
+Dashboard Stats - /dashboard/statistics için günlük özet (daily facts) ve sonuç cache'i.
+
+get_dashboard_statistics her istekte telemetri, energy_savings ve automation_logs
+üzerinde GROUP BY sorguları çalıştırmak yerine:
+
+- Kapanmış günleri (UTC, bugünden önce) org_daily_stats tablosundan okur; eksik
+  günler tek seferde (sorgu başına tek GROUP BY) hesaplanır. GET isteği yazmaz:
+  eksik günler refresh_daily_stats task'ına gönderilir ve orada kaydedilir
+- Sadece açık "bugün" dilimi canlı hesaplanır ve kapanmış günlerle birleştirilir;
+  ay / yıl görünümleri günlük satırların toplamıdır
+- Hesaplanan bölümler (energy, savings, devices, automations, costs) organizasyon
+  başına Redis hash'inde (awaxen:stats:<org_id>) gün aralığıyla cache'lenir:
+  bugünü içeren aralıklar STATS_OPEN_TTL_SECONDS, kapanmış aralıklar
+  STATS_CLOSED_TTL_SECONDS boyunca
+- rollup_daily_stats beat job'ı her gece son FACTS_REFRESH_DAYS günü yeniden
+  hesaplar (gece yarısından sonra gelen geç telemetri / tasarruf kayıtları)
+
+Redis yoksa sonuç cache'i process içinde tutulur.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import AutomationLog, EnergySavings, Organization, OrgDailyStats
+from app.services.telemetry_store import get_telemetry_store
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+STATS_KEY_PREFIX = "awaxen:stats:"
+STATS_OPEN_TTL_SECONDS = 60  # Bugünü içeren aralıklar (canlı dilim)
+STATS_CLOSED_TTL_SECONDS = 900  # Sadece kapanmış günler (cihaz sayıları anlık durum)
+STATS_REDIS_TTL_SECONDS = 24 * 3600
+FACTS_REFRESH_DAYS = 2
+REFRESH_PENDING_TTL_SECONDS = 600  # Kuyruktaki refresh task'ı için aynı aralığın tekrar kuyruğa alınmadığı süre
+REDIS_RETRY_SECONDS = 30
+
+Facts = Dict[str, Any]
+
+FACT_FIELDS = (
+    "energy_sum", "energy_max", "energy_count",
+    "savings_count", "energy_saved_kwh", "money_saved", "off_duration_minutes",
+    "automation_triggers", "automation_success", "automation_failed",
+)
+
+
+def day_range(start: datetime, end: datetime) -> Tuple[date, date]:
+    """İstek aralığının kapsadığı ilk ve son gün (gece yarısında biten aralık o günü içermez)."""
+    first = start.date()
+    last = end.date() if end.time() != datetime.min.time() else (end - timedelta(microseconds=1)).date()
+    return first, max(first, last)
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def _days(first: date, last: date) -> List[date]:
+    return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def _as_uuid(value: Any) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+
+def _empty_facts(day: date) -> Facts:
+    facts: Facts = {field: 0 for field in FACT_FIELDS}
+    facts.update({"date": day.isoformat(), "energy_sum": 0.0, "energy_max": 0.0,
+                  "energy_saved_kwh": 0.0, "money_saved": 0.0, "savings_by_source": {}})
+    return facts
+
+
+def _pending_key(org_id: Any, first: date, last: date) -> str:
+    return f"{STATS_KEY_PREFIX}refresh:{org_id}:{first.isoformat()}:{last.isoformat()}"
+
+
+def _row_facts(row: OrgDailyStats) -> Facts:
+    facts = {field: getattr(row, field) or 0 for field in FACT_FIELDS}
+    facts["date"] = row.date.isoformat()
+    facts["savings_by_source"] = row.savings_by_source or {}
+    return facts
+
+
+class DailyStatsStore:
+    """
+    Organizasyon günlük özetleri ve istatistik sonuç cache'i.
+
+    Kullanım:
+        stats = get_daily_stats_store()
+        first, last = day_range(start_date, end_date)
+        sections = stats.get_cached(org_id, first, last)
+        if sections is None:
+            facts = stats.facts(org_id, first, last)   # [{date, energy_sum, ...}, ...]
+            ...
+            stats.set_cached(org_id, first, last, sections)
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL):
+        self.redis_url = redis_url
+
+        # Redis yoksa process içi cache: org_id -> {field: (expires_at, sections)}
+        self._local: Dict[str, Dict[str, Tuple[float, Dict[str, Any]]]] = {}
+        # Redis yoksa kuyruktaki refresh'ler: pending key -> expires_at
+        self._pending: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Günlük özetler
+    # ------------------------------------------
+
+    def facts(self, org_id: Any, first: date, last: date) -> List[Facts]:
+        """Aralıktaki her gün için özet; kapanmış günler tablodan, bugün canlı."""
+        today = _today()
+        closed_last = min(last, today - timedelta(days=1))
+        by_day: Dict[date, Facts] = {}
+
+        if first <= closed_last:
+            rows = OrgDailyStats.query.filter(
+                OrgDailyStats.organization_id == _as_uuid(org_id),
+                OrgDailyStats.date >= first,
+                OrgDailyStats.date <= closed_last,
+            ).all()
+            by_day = {row.date: _row_facts(row) for row in rows}
+            missing = [day for day in _days(first, closed_last) if day not in by_day]
+            if missing:
+                computed = self.compute(org_id, missing[0], missing[-1])
+                by_day.update({day: computed[day] for day in missing})
+                self._schedule_refresh(org_id, missing[0], missing[-1])
+
+        if first <= today <= last:
+            by_day[today] = self.compute(org_id, today, today)[today]
+        return [by_day[day] for day in sorted(by_day)]
+
+    def compute(self, org_id: Any, first: date, last: date) -> Dict[date, Facts]:
+        """Gün aralığının özetlerini SQL'den hesapla (kaynak başına tek GROUP BY)."""
+        org_uuid = _as_uuid(org_id)
+        start, end = _day_start(first), _day_start(last + timedelta(days=1))
+        result = {day: _empty_facts(day) for day in _days(first, last)}
+        by_iso = {facts["date"]: facts for facts in result.values()}
+
+        energy = get_telemetry_store().daily_summaries("energy", start, end, organization_id=org_uuid)
+        for day, summary in energy.items():
+            facts = by_iso.get(day)
+            if facts is not None:
+                facts.update(energy_sum=summary["sum"], energy_max=summary["max"], energy_count=summary["count"])
+
+        savings = db.session.query(
+            EnergySavings.date,
+            EnergySavings.source_type,
+            func.count(EnergySavings.id),
+            func.sum(EnergySavings.energy_saved_kwh),
+            func.sum(EnergySavings.money_saved),
+            func.sum(EnergySavings.off_duration_minutes),
+        ).filter(
+            EnergySavings.organization_id == org_uuid,
+            EnergySavings.date >= first,
+            EnergySavings.date <= last,
+        ).group_by(EnergySavings.date, EnergySavings.source_type).all()
+        for day, source, count, kwh, money, minutes in savings:
+            facts = by_iso.get(str(day))
+            if facts is None:
+                continue
+            kwh, money = float(kwh or 0), float(money or 0)
+            facts["savings_count"] += int(count or 0)
+            facts["energy_saved_kwh"] += kwh
+            facts["money_saved"] += money
+            facts["off_duration_minutes"] += int(minutes or 0)
+            facts["savings_by_source"][source] = [kwh, money]
+
+        day_col = func.date(AutomationLog.triggered_at)
+        triggers = db.session.query(day_col, AutomationLog.status, func.count(AutomationLog.id)).filter(
+            AutomationLog.organization_id == org_uuid,
+            AutomationLog.triggered_at >= start,
+            AutomationLog.triggered_at < end,
+        ).group_by(day_col, AutomationLog.status).all()
+        for day, status, count in triggers:
+            facts = by_iso.get(str(day))
+            if facts is None:
+                continue
+            facts["automation_triggers"] += count
+            if status == "success":
+                facts["automation_success"] += count
+            elif status == "failed":
+                facts["automation_failed"] += count
+
+        return result
+
+    def rollup(self, days: int = FACTS_REFRESH_DAYS, org_ids: Optional[Sequence[Any]] = None) -> int:
+        """Son `days` kapanmış günü yeniden hesapla ve kaydet (beat job); işlenen organizasyon sayısı."""
+        last = _today() - timedelta(days=1)
+        first = last - timedelta(days=max(1, days) - 1)
+        if org_ids is None:
+            org_ids = [row.id for row in Organization.query.with_entities(Organization.id).all()]
+        return self.refresh(org_ids, first, last)
+
+    def refresh(self, org_ids: Sequence[Any], first: date, last: date) -> int:
+        """Kaynak veri sonradan değişen kapanmış günleri yeniden hesapla; işlenen organizasyon sayısı."""
+        last = min(last, _today() - timedelta(days=1))
+        for org_id in org_ids:
+            if first <= last:
+                self._save(org_id, self.compute(org_id, first, last))
+            self.invalidate(org_id)
+        return len(org_ids)
+
+    # ------------------------------------------
+    # Sonuç cache'i
+    # ------------------------------------------
+
+    def get_cached(self, org_id: Any, first: date, last: date) -> Optional[Dict[str, Any]]:
+        """Cache'lenmiş istatistik bölümleri (yoksa / süresi dolduysa None)."""
+        org_key, field = str(org_id), f"{first.isoformat()}|{last.isoformat()}"
+        client = self._client()
+        if client is not None:
+            try:
+                raw = client.hget(f"{STATS_KEY_PREFIX}{org_key}", field)
+                if raw is None:
+                    return None
+                payload = json.loads(raw)
+                return payload["sections"] if payload["expires_at"] > time.time() else None
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            entry = self._local.get(org_key, {}).get(field)
+        return entry[1] if entry is not None and entry[0] > time.time() else None
+
+    def set_cached(self, org_id: Any, first: date, last: date, sections: Dict[str, Any]) -> None:
+        """İstatistik bölümlerini cache'le (bugünü içeren aralıklar daha kısa süre)."""
+        org_key, field = str(org_id), f"{first.isoformat()}|{last.isoformat()}"
+        ttl = STATS_OPEN_TTL_SECONDS if last >= _today() else STATS_CLOSED_TTL_SECONDS
+        expires_at = time.time() + ttl
+        client = self._client()
+        if client is not None:
+            try:
+                key = f"{STATS_KEY_PREFIX}{org_key}"
+                pipe = client.pipeline(transaction=False)
+                pipe.hset(key, field, json.dumps({"expires_at": expires_at, "sections": sections}))
+                pipe.expire(key, STATS_REDIS_TTL_SECONDS)
+                pipe.execute()
+                return
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            entries = self._local.setdefault(org_key, {})
+            now = time.time()
+            for stale in [f for f, (exp, _) in entries.items() if exp <= now]:
+                del entries[stale]
+            entries[field] = (expires_at, sections)
+
+    def invalidate(self, org_id: Any) -> None:
+        """Organizasyonun tüm cache'lenmiş istatistiklerini düşür."""
+        client = self._client()
+        if client is not None:
+            try:
+                client.delete(f"{STATS_KEY_PREFIX}{org_id}")
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            self._local.pop(str(org_id), None)
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def release_refresh(self, org_id: Any, first: date, last: date) -> None:
+        """Refresh task'ı bitince aralığın pending işaretini kaldır."""
+        key = _pending_key(org_id, first, last)
+        with self._lock:
+            self._pending.pop(key, None)
+        client = self._client()
+        if client is None:
+            return
+        try:
+            client.delete(key)
+        except Exception as e:
+            self._redis_error(e)
+
+    def _schedule_refresh(self, org_id: Any, first: date, last: date) -> None:
+        """
+        Eksik günlerin kaydını refresh_daily_stats task'ına bırak (okuma yolu commit etmez).
+
+        Aralık başına tek task kuyruğa alınır: pending işareti Redis'te SET NX EX ile
+        (Redis yoksa process içinde) tutulur, task bitince release_refresh() ile silinir.
+        """
+        if not self._claim_refresh(org_id, first, last):
+            return
+        try:
+            from app.tasks.monitoring_tasks import refresh_daily_stats
+            refresh_daily_stats.delay(str(org_id), first.isoformat(), last.isoformat())
+        except Exception as e:
+            logger.warning(f"[DashboardStats] Günlük özet kaydı kuyruğa alınamadı ({org_id}): {e}")
+            self.release_refresh(org_id, first, last)
+
+    def _claim_refresh(self, org_id: Any, first: date, last: date) -> bool:
+        key = _pending_key(org_id, first, last)
+        client = self._client()
+        if client is not None:
+            try:
+                return bool(client.set(key, "1", nx=True, ex=REFRESH_PENDING_TTL_SECONDS))
+            except Exception as e:
+                self._redis_error(e)
+        now = time.monotonic()
+        with self._lock:
+            if self._pending.get(key, 0.0) > now:
+                return False
+            self._pending = {k: expires for k, expires in self._pending.items() if expires > now}
+            self._pending[key] = now + REFRESH_PENDING_TTL_SECONDS
+        return True
+
+    def _save(self, org_id: Any, facts_by_day: Dict[date, Facts]) -> None:
+        if not facts_by_day:
+            return
+        org_uuid = _as_uuid(org_id)
+        try:
+            with db.session.begin_nested():
+                OrgDailyStats.query.filter(
+                    OrgDailyStats.organization_id == org_uuid,
+                    OrgDailyStats.date.in_(list(facts_by_day)),
+                ).delete(synchronize_session=False)
+                db.session.add_all([
+                    OrgDailyStats(
+                        organization_id=org_uuid,
+                        date=day,
+                        savings_by_source=facts["savings_by_source"],
+                        **{field: facts[field] for field in FACT_FIELDS},
+                    )
+                    for day, facts in facts_by_day.items()
+                ])
+            db.session.commit()
+        except IntegrityError as e:
+            # Eşzamanlı bir task aynı günleri yazdı (savepoint geri alındı)
+            logger.debug(f"[DashboardStats] Günlük özetler başka bir task'ta yazıldı ({org_id}): {e}")
+
+    def _client(self):
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[DashboardStats] Redis kullanılamıyor, bellek içi cache ile devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+# Singleton instance
+_daily_stats_store: Optional[DailyStatsStore] = None
+
+
+def get_daily_stats_store() -> DailyStatsStore:
+    """Günlük istatistik store singleton'ı döndür."""
+    global _daily_stats_store
+    if _daily_stats_store is None:
+        _daily_stats_store = DailyStatsStore()
+    return _daily_stats_store
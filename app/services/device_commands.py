@@ -0,0 +1,279 @@
+"""
+Device Commands - Cihaz komutlarını eşzamanlı gönderen dispatcher.
+
+Otomasyon aksiyonları ve bulk action'lar Shelly Cloud çağrılarını sırayla
+(30 sn timeout ile) yapmak yerine buradan paralel gönderir:
+
+- Ortak thread pool (DEVICE_COMMAND_WORKERS)
+- Entegrasyon başına eşzamanlılık sınırı (Shelly Cloud rate limit'i için)
+- Komut başına deadline (HTTP timeout'u kalan süreyle sınırlanır)
+- Geçici hatalarda (timeout, bağlantı, 429/5xx) jitter'lı exponential backoff ile retry;
+  idempotent olmayan toggle sadece istek cihaza ulaşmadıysa (bağlantı kurulamadı, 429) tekrarlanır
+- Relay + dimmer çiftinde yalnızca başarısız adım tekrarlanır
+- Sonuçlar istek sırasıyla tek listede döner
+
+Worker thread'leri DB'ye dokunmaz; ORM güncellemeleri (last_seen vb.)
+çağıran tarafta yapılır.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import requests
+from flask import current_app, has_app_context
+from urllib3.exceptions import NewConnectionError
+
+from app.services.http_client import CircuitOpenError
+from app.services.shelly_service import ShellyService, get_shelly_service
+
+logger = logging.getLogger(__name__)
+
+# Varsayılan ayarlar (config ile override edilir)
+DEFAULT_WORKERS = 32
+DEFAULT_PER_INTEGRATION = 8  # Aynı Shelly hesabına eşzamanlı istek sayısı
+DEFAULT_DEADLINE_SECONDS = 10.0
+DEFAULT_RETRIES = 2
+RETRY_BASE_DELAY_SECONDS = 0.25
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+NOT_PROCESSED_STATUS_CODES = {429}  # İstek reddedildi; cihaza uygulanmadığı kesin
+
+ACTIONS = ("on", "off", "toggle", "set_power")
+NON_IDEMPOTENT_ACTIONS = ("toggle",)
+DIMMABLE_TYPES = ("dimmer", "rgbw")
+
+
+class DeviceCommand:
+    """Tek cihaz komutu (ORM nesnesinden bağımsız anlık görüntü)."""
+
+    __slots__ = ("device_id", "name", "brand", "device_type", "external_id", "organization_id", "action", "value")
+
+    def __init__(self, device, action: str, value: Optional[int] = None):
+        if action not in ACTIONS:
+            raise ValueError(f"Invalid action: {action}")
+        self.device_id = device.id
+        self.name = device.name
+        self.brand = device.brand
+        self.device_type = device.device_type
+        self.external_id = device.external_id
+        self.organization_id = device.organization_id
+        self.action = action
+        self.value = value
+
+
+class CommandResult:
+    """Komut sonucu."""
+
+    __slots__ = ("command", "success", "message", "attempts", "elapsed_ms")
+
+    def __init__(self, command: DeviceCommand, success: bool, message: str = "OK", attempts: int = 0, elapsed_ms: float = 0.0):
+        self.command = command
+        self.success = success
+        self.message = message
+        self.attempts = attempts
+        self.elapsed_ms = elapsed_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "device_id": str(self.command.device_id),
+            "name": self.command.name,
+            "success": self.success,
+            "message": self.message,
+            "attempts": self.attempts,
+            "elapsed_ms": round(self.elapsed_ms, 1),
+        }
+
+
+class DeviceCommandDispatcher:
+    """
+    Thread-safe eşzamanlı komut dispatcher'ı.
+
+    Kullanım:
+        dispatcher = get_command_dispatcher()
+        results = dispatcher.dispatch([DeviceCommand(device, "off") for device in devices])
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        per_integration: int = DEFAULT_PER_INTEGRATION,
+        deadline: float = DEFAULT_DEADLINE_SECONDS,
+        retries: int = DEFAULT_RETRIES,
+    ):
+        self.workers = max(1, workers)
+        self.per_integration = max(1, per_integration)
+        self.deadline = deadline
+        self.retries = max(0, retries)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="device-command")
+        self._limits: Dict[Any, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, commands: Sequence[DeviceCommand], deadline: Optional[float] = None) -> List[CommandResult]:
+        """
+        Komutları paralel gönder ve sonuçları topla.
+
+        Args:
+            commands: Gönderilecek komutlar
+            deadline: Komut başına süre sınırı (sn); None ise varsayılan
+
+        Returns:
+            Komutlarla aynı sırada CommandResult listesi
+        """
+        if not commands:
+            return []
+        deadline = deadline or self.deadline
+
+        # Entegrasyonlar çağıran thread'de (DB erişimi) organizasyon başına bir kez çözülür
+        services: Dict[Any, Optional[ShellyService]] = {}
+        for command in commands:
+            if command.brand == "shelly" and command.organization_id not in services:
+                services[command.organization_id] = get_shelly_service(str(command.organization_id))
+
+        results: List[Optional[CommandResult]] = [None] * len(commands)
+        futures = {}
+        for i, command in enumerate(commands):
+            if command.action == "set_power" and (command.brand != "shelly" or command.device_type not in DIMMABLE_TYPES):
+                results[i] = CommandResult(
+                    command, False, f"Power control not supported for {command.brand}/{command.device_type}"
+                )
+                continue
+            if command.brand != "shelly":
+                # Diğer markalar için placeholder (gelecekte Tapo, Tuya vb. eklenecek)
+                results[i] = CommandResult(command, True, f"{command.brand or 'device'} control not implemented, skipping")
+                continue
+            service = services.get(command.organization_id)
+            if service is None:
+                results[i] = CommandResult(command, False, "Shelly integration not configured")
+                continue
+            futures[self._executor.submit(self._run, service, command, deadline)] = i
+
+        # Toplam bekleme sınırı: pool ve entegrasyon limitleri nedeniyle sıralı çalışacak dalga sayısı
+        per_org: Dict[Any, int] = {}
+        for i in futures.values():
+            per_org[commands[i].organization_id] = per_org.get(commands[i].organization_id, 0) + 1
+        waves = max(
+            [-(-len(futures) // self.workers)] + [-(-n // self.per_integration) for n in per_org.values()]
+        )
+        done, pending = wait(futures, timeout=deadline * max(1, waves) + 1.0)
+        for future in done:
+            results[futures[future]] = future.result()
+        for future in pending:
+            command = commands[futures[future]]
+            if future.cancel():
+                results[futures[future]] = CommandResult(command, False, "Deadline exceeded before sending")
+            else:
+                # Çalışan future iptal edilemez; komut cihaza ulaşmış olabilir
+                results[futures[future]] = CommandResult(command, False, "Result unknown: command still in flight")
+
+        failed = sum(1 for r in results if not r.success)
+        logger.info(f"[DeviceCommands] {len(commands)} komut gönderildi, {failed} başarısız")
+        return results
+
+    def _run(self, service: ShellyService, command: DeviceCommand, deadline: float) -> CommandResult:
+        attempts = 0
+
+        # Entegrasyon organizasyon başına tek (get_shelly_service); ORM nesnesine thread'den dokunulmaz
+        with self._limit(command.organization_id):
+            # Deadline entegrasyon slotu alındıktan sonra başlar
+            started = time.monotonic()
+            expires_at = started + deadline
+            steps = self._steps(service, command, retry=not self.retries)
+            while True:
+                attempts += 1
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    return CommandResult(command, False, "Deadline exceeded", attempts - 1, (time.monotonic() - started) * 1000)
+                try:
+                    # Tamamlanan adımlar (ör. relay) retry'da tekrar gönderilmez
+                    while steps:
+                        steps[0](min(service.TIMEOUT, remaining))
+                        steps.pop(0)
+                    return CommandResult(command, True, "OK", attempts, (time.monotonic() - started) * 1000)
+                except Exception as e:
+                    if attempts > self.retries or not _is_retryable(e, command.action):
+                        logger.warning(f"[DeviceCommands] {command.name} ({command.action}) başarısız: {e}")
+                        return CommandResult(command, False, str(e), attempts, (time.monotonic() - started) * 1000)
+                    # Full jitter: 0..base*2^n (kalan süreyi aşmadan)
+                    delay = random.uniform(0, RETRY_BASE_DELAY_SECONDS * (2 ** (attempts - 1)))
+                    time.sleep(min(delay, max(0.0, expires_at - time.monotonic())))
+
+    @staticmethod
+    def _steps(service: ShellyService, command: DeviceCommand, retry: bool) -> List[Callable[[float], None]]:
+        """
+        Komutun sırayla gönderilecek istekleri (her biri timeout alır).
+
+        Dispatcher retry yapıyorsa HTTP client retry'ı kapatılır (retry=False);
+        aksi halde denemeler çarpılır ve deadline aşılır.
+        """
+        external_id = command.external_id
+
+        def missing(timeout: float) -> None:
+            raise ValueError("Device has no external_id")
+
+        if not external_id:
+            return [missing]
+        if command.action == "set_power":
+            return [lambda timeout: service.light_control(external_id, int(command.value or 0), timeout=timeout, retry=retry)]
+        steps = [lambda timeout: service.relay_control(external_id, command.action, timeout=timeout, retry=retry)]
+        if command.value is not None and command.device_type in DIMMABLE_TYPES:
+            steps.append(lambda timeout: service.light_control(external_id, int(command.value), timeout=timeout, retry=retry))
+        return steps
+
+    def _limit(self, integration_id: Any) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._limits.get(integration_id)
+            if semaphore is None:
+                semaphore = self._limits[integration_id] = threading.BoundedSemaphore(self.per_integration)
+            return semaphore
+
+
+def _is_retryable(error: Exception, action: str) -> bool:
+    """
+    Geçici hata mı? (timeout, bağlantı hatası, 429/5xx)
+
+    Idempotent olmayan aksiyonlarda (toggle) sadece isteğin cihaza ulaşmadığı
+    kesin olan hatalar tekrarlanır; read timeout / 5xx sonrası toggle tekrar
+    gönderilirse cihaz eski durumuna dönebilir.
+    """
+    if action in NON_IDEMPOTENT_ACTIONS:
+        return _not_sent(error)
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def _not_sent(error: Exception) -> bool:
+    """İstek karşı tarafa hiç ulaşmadı mı? (bağlantı kurulamadı, circuit açık, 429)"""
+    if isinstance(error, (requests.ConnectTimeout, CircuitOpenError)):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in NOT_PROCESSED_STATUS_CODES
+    return False
+
+
+# Singleton instance
+_command_dispatcher: Optional[DeviceCommandDispatcher] = None
+
+
+def get_command_dispatcher() -> DeviceCommandDispatcher:
+    """Command dispatcher singleton'ı döndür (ayarlar app config'inden)."""
+    global _command_dispatcher
+    if _command_dispatcher is None:
+        config = current_app.config if has_app_context() else {}
+        _command_dispatcher = DeviceCommandDispatcher(
+            workers=config.get("DEVICE_COMMAND_WORKERS", DEFAULT_WORKERS),
+            per_integration=config.get("DEVICE_COMMAND_PER_INTEGRATION", DEFAULT_PER_INTEGRATION),
+            deadline=config.get("DEVICE_COMMAND_DEADLINE_SECONDS", DEFAULT_DEADLINE_SECONDS),
+            retries=config.get("DEVICE_COMMAND_RETRIES", DEFAULT_RETRIES),
+        )
+    return _command_dispatcher
@@ -0,0 +1,400 @@
+"""
+Device Resolver - Ingest hot path'leri için cihaz kimlik cache'i.
+
+MQTT, HTTP ingest ve Home Assistant webhook'ları her okumada cihazı
+external_id / UUID / HA entity_id ile çözümler. Bu servis sonuçları
+process içinde tutar:
+- Pozitif sonuçlar DEVICE_RESOLVER_TTL süresince cache'lenir
+- Bilinmeyen ID'ler DEVICE_RESOLVER_NEGATIVE_TTL süresince cache'lenir (negative caching)
+- Cihaz oluşturma/güncelleme/silme sonrası invalidate_device() çağrılır
+
+Invalidation'lar Redis'e (sayaç + sorted set) yazılır; her process
+(ayrı mqtt_ingest container'ı dahil) en fazla DEVICE_RESOLVER_SYNC_SECONDS
+aralıkla yeni kayıtları okuyup kendi cache'ini temizler. Silinen veya
+başka organizasyona taşınan cihaz eski organizasyona çözümlenmeye devam etmez.
+
+Steady state'te cihaz çözümleme için SQL çalışmaz.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Set, Tuple
+from uuid import UUID
+
+from app.extensions import db
+from app.models import SmartDevice
+
+logger = logging.getLogger(__name__)
+
+# Cache ayarları
+RESOLVER_TTL_SECONDS = int(os.getenv("DEVICE_RESOLVER_TTL", "300"))
+RESOLVER_NEGATIVE_TTL_SECONDS = int(os.getenv("DEVICE_RESOLVER_NEGATIVE_TTL", "30"))
+RESOLVER_MAX_ENTRIES = int(os.getenv("DEVICE_RESOLVER_MAX_ENTRIES", "200000"))
+RESOLVER_SYNC_SECONDS = float(os.getenv("DEVICE_RESOLVER_SYNC_SECONDS", "1"))
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+REDIS_RETRY_SECONDS = 30  # Redis bağlantı hatasından sonra tekrar deneme aralığı
+INVALIDATION_GENERATION_KEY = "awaxen:device_resolver:generation"
+INVALIDATION_LOG_KEY = "awaxen:device_resolver:invalidations"
+INVALIDATION_FLOOR_KEY = "awaxen:device_resolver:floor"
+INVALIDATION_LOG_SIZE = 5000  # Saklanan son invalidation sayısı
+
+# ARGV[1] = device_id, ARGV[2] = log boyutu.
+# Sayaç artırılır, cihaz yeni generation ile log'a yazılır; log kırpılırsa
+# kırpılan en yüksek generation floor'a yazılır (geride kalan process tüm cache'i temizler).
+_PUBLISH_INVALIDATION = """
+local generation = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], generation, ARGV[1])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[2])
+if excess > 0 then
+    local trimmed = redis.call('ZRANGE', KEYS[2], 0, excess - 1, 'WITHSCORES')
+    redis.call('SET', KEYS[3], trimmed[#trimmed])
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+return generation
+"""
+
+# ARGV[1] = process'in gördüğü son generation.
+# Dönüş: {generation, kaçırıldı mı (1/0), device_id...}
+_READ_INVALIDATIONS = """
+local generation = tonumber(redis.call('GET', KEYS[1]) or '0')
+local since = tonumber(ARGV[1])
+if generation <= since then
+    return {generation, 0}
+end
+if tonumber(redis.call('GET', KEYS[3]) or '0') > since then
+    return {generation, 1}
+end
+local result = {generation, 0}
+for _, device_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. since, '+inf')) do
+    table.insert(result, device_id)
+end
+return result
+"""
+
+
+class DeviceRef(NamedTuple):
+    """Ingest için gereken cihaz kimlik bilgisi (ORM objesi değil)."""
+    id: UUID
+    organization_id: Optional[UUID]
+    name: Optional[str]
+    external_id: Optional[str]
+    is_online: bool = False
+
+
+_COLUMNS = (
+    SmartDevice.id,
+    SmartDevice.organization_id,
+    SmartDevice.name,
+    SmartDevice.external_id,
+    SmartDevice.is_online,
+)
+
+
+def _to_ref(row) -> Optional[DeviceRef]:
+    if row is None:
+        return None
+    return DeviceRef(row.id, row.organization_id, row.name, row.external_id, bool(row.is_online))
+
+
+def _query():
+    return db.session.query(*_COLUMNS)
+
+
+def _parse_uuid(value: Any) -> Optional[UUID]:
+    if isinstance(value, UUID):
+        return value
+    try:
+        return UUID(str(value))
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+class DeviceResolver:
+    """
+    Thread-safe, TTL'li cihaz kimlik cache'i.
+
+    Kullanım:
+        resolver = get_device_resolver()
+        ref = resolver.resolve("shellyplug-s-1234")
+        if ref:
+            writer.submit(ref.id, ...)
+    """
+
+    def __init__(
+        self,
+        ttl: int = RESOLVER_TTL_SECONDS,
+        negative_ttl: int = RESOLVER_NEGATIVE_TTL_SECONDS,
+        max_entries: int = RESOLVER_MAX_ENTRIES,
+        sync_interval: float = RESOLVER_SYNC_SECONDS,
+        redis_url: Optional[str] = REDIS_URL,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval
+        self.redis_url = redis_url
+
+        # key -> (DeviceRef | None, expires_at)
+        self._entries: "OrderedDict[Hashable, Tuple[Optional[DeviceRef], float]]" = OrderedDict()
+        # device_id -> cache key'leri (invalidation için)
+        self._keys_by_device: Dict[UUID, Set[Hashable]] = {}
+        # Her cihaz değişikliğinde silinen key'ler: negatif sonuçlar ve HA/LIKE benzerlik sonuçları
+        self._volatile_keys: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "negative_hits": 0, "invalidations": 0}
+
+        self._generation: Optional[int] = None  # Redis'ten okunan son invalidation generation'ı
+        self._synced_at = 0.0
+        self._sync_lock = threading.Lock()
+        self._redis = None
+        self._publish_script = None
+        self._read_script = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Public API
+    # ------------------------------------------
+
+    def resolve(self, identifier: Any) -> Optional[DeviceRef]:
+        """UUID veya external_id ile cihaz çözümle."""
+        if identifier in (None, ""):
+            return None
+
+        device_uuid = _parse_uuid(identifier)
+        if device_uuid is not None:
+            ref = self._cached(("id", device_uuid), lambda: _to_ref(
+                _query().filter(SmartDevice.id == device_uuid).first()
+            ))
+            if ref:
+                return ref
+
+        external_id = str(identifier)
+        return self._cached(("ext", external_id), lambda: _to_ref(
+            _query().filter(SmartDevice.external_id == external_id).first()
+        ))
+
+    def resolve_ha_entity(self, entity_id: str, device_name: str) -> Optional[DeviceRef]:
+        """
+        Home Assistant entity_id veya device_name ile cihaz bul.
+
+        Sıra: tam external_id -> entity'nin kısa adı -> device_name ->
+        external_id benzerliği -> isim benzerliği. Sonuç (bulunamadı dahil)
+        cache'lenir; LIKE taramaları sadece cache miss'te çalışır.
+        """
+        return self._cached(("ha", entity_id, device_name), lambda: self._load_ha_entity(entity_id, device_name))
+
+    def resolve_by_name(self, fragment: str) -> Optional[DeviceRef]:
+        """external_id içinde geçen isim parçasıyla cihaz bul (HA telemetri webhook'u)."""
+        if not fragment:
+            return None
+        return self._cached(("like", fragment), lambda: _to_ref(
+            _query().filter(SmartDevice.external_id.ilike(f"%{fragment}%")).first()
+        ))
+
+    def mark_online(self, device_id: UUID) -> None:
+        """
+        Cache'teki cihazı online işaretle.
+
+        Cache'teki is_online başka process'lerin / watchdog'un değişikliklerini görmez;
+        device_online kararı için kullanılmaz, DB UPDATE'inin sonucu (RETURNING) esas alınır.
+        """
+        with self._lock:
+            for key in self._keys_by_device.get(device_id, ()):
+                entry = self._entries.get(key)
+                if entry and entry[0] is not None and not entry[0].is_online:
+                    self._entries[key] = (entry[0]._replace(is_online=True), entry[1])
+
+    def invalidate_device(self, device: Any) -> None:
+        """
+        Cihaz değiştiğinde cache'i temizle.
+
+        Cihaza ait tüm key'ler, negatif sonuçlar ve benzerlik tabanlı
+        (HA/LIKE) sonuçlar silinir; yeni/yeniden adlandırılmış cihaz
+        bir sonraki okumada tekrar çözümlenir. Invalidation Redis'e yazılır,
+        diğer process'ler bir sonraki senkronizasyonda aynı key'leri siler.
+        """
+        device_id = getattr(device, "id", device)
+        self._invalidate_local(device_id)
+        self._publish(device_id)
+
+    def clear(self) -> None:
+        """Tüm cache'i temizle."""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_device.clear()
+            self._volatile_keys.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _cached(self, key: Hashable, loader: Callable[[], Optional[DeviceRef]]) -> Optional[DeviceRef]:
+        now = time.monotonic()
+        if now - self._synced_at >= self.sync_interval:
+            self._sync(now)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(key)
+                if entry[0] is None:
+                    self._stats["negative_hits"] += 1
+                else:
+                    self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+
+        ref = loader()
+
+        with self._lock:
+            ttl = self.ttl if ref is not None else self.negative_ttl
+            self._drop(key)
+            self._entries[key] = (ref, now + ttl)
+            if ref is not None:
+                self._keys_by_device.setdefault(ref.id, set()).add(key)
+            if ref is None or key[0] in ("ha", "like"):
+                self._volatile_keys.add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+        return ref
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        self._volatile_keys.discard(key)
+        if entry and entry[0] is not None:
+            keys = self._keys_by_device.get(entry[0].id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    self._keys_by_device.pop(entry[0].id, None)
+
+    def _invalidate_local(self, device_id: Any) -> None:
+        with self._lock:
+            keys = self._keys_by_device.pop(device_id, set()) | self._volatile_keys
+            for key in keys:
+                self._drop(key)
+            self._stats["invalidations"] += 1
+
+    def _publish(self, device_id: Any) -> None:
+        """Invalidation'ı diğer process'lere duyur."""
+        client = self._client()
+        if client is None:
+            return
+        try:
+            self._publish_script(
+                keys=[INVALIDATION_GENERATION_KEY, INVALIDATION_LOG_KEY, INVALIDATION_FLOOR_KEY],
+                args=[str(device_id), str(INVALIDATION_LOG_SIZE)],
+            )
+        except Exception as e:
+            self._redis_error(e)
+
+    def _sync(self, now: float) -> None:
+        """
+        Diğer process'lerin invalidation'larını uygula (en fazla sync_interval'da bir).
+
+        İlk senkronizasyonda, log kırpılıp kayıt kaçırıldığında veya Redis
+        kesintisinden sonra neyin değiştiği bilinmediğinden tüm cache temizlenir.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._synced_at = now
+            client = self._client()
+            if client is None:
+                return
+            try:
+                result = self._read_script(
+                    keys=[INVALIDATION_GENERATION_KEY, INVALIDATION_LOG_KEY, INVALIDATION_FLOOR_KEY],
+                    args=[str(self._generation if self._generation is not None else -1)],
+                )
+            except Exception as e:
+                self._redis_error(e)
+                return
+
+            generation, missed, device_ids = int(result[0]), int(result[1]), result[2:]
+            if self._generation is None or missed or generation < self._generation:
+                if self._generation is not None:
+                    logger.info("[DeviceResolver] Invalidation kayıtları kaçırıldı, cache temizleniyor")
+                self.clear()
+            else:
+                for device_id in device_ids:
+                    parsed = _parse_uuid(device_id)
+                    self._invalidate_local(parsed if parsed is not None else device_id)
+            self._generation = generation
+        finally:
+            self._sync_lock.release()
+
+    def _client(self):
+        """Redis client (hata sonrası REDIS_RETRY_SECONDS boyunca denenmez)."""
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._publish_script = client.register_script(_PUBLISH_INVALIDATION)
+            self._read_script = client.register_script(_READ_INVALIDATIONS)
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(
+                f"[DeviceResolver] Redis kullanılamıyor, diğer process'lerin invalidation'ları "
+                f"TTL ile sınırlı gecikmeyle görülecek: {error}"
+            )
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+        # Kesinti sırasında kaçırılan invalidation'lar bilinmiyor; yeniden bağlanınca cache sıfırlanır
+        self._generation = None
+
+    @staticmethod
+    def _load_ha_entity(entity_id: str, device_name: str) -> Optional[DeviceRef]:
+        # 1. Tam external_id eşleşmesi (switch.tapo_priz_103)
+        # 2. Entity ID'nin son kısmı (tapo_priz_103)
+        # 3. Device name
+        short_id = entity_id.split('.')[-1] if '.' in entity_id else entity_id
+        for candidate in dict.fromkeys(c for c in (entity_id, short_id, device_name) if c):
+            row = _query().filter(SmartDevice.external_id == candidate).first()
+            if row:
+                return _to_ref(row)
+
+        if not device_name:
+            return None
+
+        # 4. İsim benzerliği ile ara (LIKE query)
+        row = _query().filter(SmartDevice.external_id.ilike(f"%{device_name}%")).first()
+        if row:
+            return _to_ref(row)
+
+        # 5. Name alanında ara
+        return _to_ref(_query().filter(SmartDevice.name.ilike(f"%{device_name}%")).first())
+
+
+# Singleton instance
+_device_resolver: Optional[DeviceResolver] = None
+
+
+def get_device_resolver() -> DeviceResolver:
+    """Device resolver singleton'ı döndür."""
+    global _device_resolver
+    if _device_resolver is None:
+        _device_resolver = DeviceResolver()
+    return _device_resolver
@@ -5,6 +5,9 @@ from uuid import UUID
 
 from app.extensions import db
 from app.models import SmartDevice
+from app.services.device_resolver import get_device_resolver
+from app.services.anomaly_stats import get_hourly_stats_store
+from app.services.latest_values import get_latest_value_store
 
 
 def get_device_for_org(device_id: UUID, organization_id: UUID) -> Optional[SmartDevice]:
@@ -36,6 +39,7 @@ def create_device_logic(organization_id: UUID, data: Dict[str, Any]) -> SmartDev
     )
     db.session.add(device)
     db.session.commit()
+    get_device_resolver().invalidate_device(device)
     return device
 
 
@@ -70,6 +74,7 @@ def update_device_logic(organization_id: UUID, device_id: UUID, data: Dict[str,
             device.last_seen = datetime.utcnow()
 
     db.session.commit()
+    get_device_resolver().invalidate_device(device)
     return device
 
 
@@ -81,3 +86,6 @@ def delete_device_logic(organization_id: UUID, device_id: UUID) -> None:
 
     device.is_active = False
     db.session.commit()
+    get_device_resolver().invalidate_device(device)
+    get_latest_value_store().forget_device(device.id)
+    get_hourly_stats_store().forget(device.id)
@@ -20,6 +20,8 @@ import requests
 from datetime import datetime, timedelta, time
 from typing import Optional, List, Dict, Any
 
+from app.services.http_client import get_http_client
+
 # Redis cache için (opsiyonel)
 try:
     import redis
@@ -82,7 +84,7 @@ class EpiasService:
             return None
         
         try:
-            response = requests.post(
+            response = get_http_client().post(
                 self.AUTH_URL,
                 headers={
                     "Content-Type": "application/x-www-form-urlencoded",
@@ -189,7 +191,7 @@ class EpiasService:
         date_str = date_obj.strftime("%Y-%m-%d")
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=20)
+            response = get_http_client().post(url, json=payload, headers=headers, timeout=20)
             response.raise_for_status()
             
             data = response.json()
@@ -224,7 +226,7 @@ class EpiasService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=self.HEADERS, timeout=20)
+            response = get_http_client().post(url, json=payload, headers=self.HEADERS, timeout=20)
             response.raise_for_status()
             
             data = response.json()
@@ -323,7 +325,7 @@ class EpiasService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=15)
+            response = get_http_client().post(url, json=payload, headers=headers, timeout=15)
             response.raise_for_status()
             return response.json().get("items", [])
             
@@ -354,7 +356,7 @@ class EpiasService:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=15)
+            response = get_http_client().post(url, json=payload, headers=headers, timeout=15)
             response.raise_for_status()
             
             data = response.json()
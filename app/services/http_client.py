@@ -0,0 +1,299 @@
+"""
+HTTP Client - Dış entegrasyonlar için ortak, bağlantı havuzlu HTTP istemcisi.
+
+Shelly Cloud, EPİAŞ, OpenWeather ve Telegram çağrıları her istekte yeni
+TCP+TLS bağlantısı açmak yerine buradan yapılır:
+
+- Host başına requests.Session + ayarlı HTTPAdapter (keep-alive, pool_maxsize)
+- Retry/backoff: bağlantı hatalarında her metot, 502/503/504'te sadece idempotent metotlar
+  (kendi retry'ını yapan çağıranlar retry=False ile adapter retry'ını kapatır)
+- Host başına circuit breaker (art arda hatalarda host'a istek kısa süre kesilir)
+- Host başına latency / hata metrikleri (/meta/http)
+
+Hatalar requests exception'ları olarak yükselir; mevcut
+`except requests.RequestException` blokları aynen çalışır.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Varsayılan ayarlar (config ile override edilir)
+DEFAULT_POOL_MAXSIZE = 32  # Host başına açık tutulan bağlantı (device command worker sayısı kadar)
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.3
+DEFAULT_TIMEOUT_SECONDS = 15.0
+DEFAULT_CIRCUIT_FAILURES = 5
+DEFAULT_CIRCUIT_RESET_SECONDS = 30.0
+
+RETRY_STATUS_CODES = (502, 503, 504)
+CIRCUIT_STATUS_CODES = {500, 502, 503, 504}
+LATENCY_WINDOW = 512  # Percentile hesabı için host başına tutulan son ölçüm sayısı
+USER_AGENT = "awaxen-backend"
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Host'un circuit breaker'ı açık; istek gönderilmedi."""
+
+
+class CircuitBreaker:
+    """
+    Basit closed -> open -> half_open circuit breaker.
+
+    `failure_threshold` art arda hatadan sonra açılır, `reset_timeout` sonra
+    tek bir deneme isteğine izin verir; başarılıysa kapanır.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = DEFAULT_CIRCUIT_FAILURES, reset_timeout: float = DEFAULT_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        """Sonucu kaydedilmeden biten deneme isteğinin slotunu bırak."""
+        with self._lock:
+            self._probing = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """Hatayı kaydet; circuit bu hatayla açıldıysa True döner."""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class HostMetrics:
+    """Host başına istek sayacı ve latency penceresi."""
+
+    __slots__ = ("requests", "errors", "rejected", "total_ms", "max_ms", "last_status", "latencies")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_status: Optional[int] = None
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, elapsed_ms: float, status: Optional[int], error: bool) -> None:
+        self.requests += 1
+        self.errors += int(error)
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.last_status = status
+        self.latencies.append(elapsed_ms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        window = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not window:
+                return None
+            return round(window[min(len(window) - 1, int(p * len(window)))], 1)
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else None,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(self.max_ms, 1),
+            "last_status": self.last_status,
+        }
+
+
+class HttpClient:
+    """
+    Thread-safe, host başına havuzlu HTTP istemcisi.
+
+    Kullanım:
+        client = get_http_client()
+        response = client.post(url, data=payload, timeout=10)
+        response.raise_for_status()
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        retries: int = DEFAULT_RETRIES,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        circuit_failures: int = DEFAULT_CIRCUIT_FAILURES,
+        circuit_reset: float = DEFAULT_CIRCUIT_RESET_SECONDS,
+    ):
+        self.pool_maxsize = max(1, pool_maxsize)
+        self.retries = max(0, retries)
+        self.backoff_factor = backoff_factor
+        self.circuit_failures = circuit_failures
+        self.circuit_reset = circuit_reset
+
+        self._sessions: Dict[Tuple[str, bool], requests.Session] = {}
+        self._circuits: Dict[str, CircuitBreaker] = {}
+        self._metrics: Dict[str, HostMetrics] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, retry: bool = True, **kwargs) -> requests.Response:
+        """
+        İsteği host'un havuzlu session'ı üzerinden gönder.
+
+        Args:
+            retry: False ise adapter retry'ı yapılmaz (çağıran kendi retry'ını yapıyorsa;
+                   aksi halde denemeler çarpılır ve deadline aşılır)
+
+        Raises:
+            CircuitOpenError: Host'un circuit'i açık
+            requests.RequestException: Bağlantı / timeout hataları
+        """
+        host = urlsplit(url).netloc.lower()
+        session, circuit, metrics = self._host(host, retry)
+
+        if not circuit.allow():
+            with self._lock:
+                metrics.rejected += 1
+            raise CircuitOpenError(f"Circuit open for {host}")
+
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT_SECONDS)
+        started = time.monotonic()
+        recorded = False
+        try:
+            response = session.request(method, url, **kwargs)
+            failed = response.status_code in CIRCUIT_STATUS_CODES
+            recorded = True
+            self._record(host, circuit, metrics, (time.monotonic() - started) * 1000, response.status_code, failed)
+            return response
+        except requests.RequestException:
+            recorded = True
+            self._record(host, circuit, metrics, (time.monotonic() - started) * 1000, None, True)
+            raise
+        finally:
+            # Beklenmeyen hatada half-open deneme slotu açık kalmasın
+            if not recorded:
+                circuit.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Host başına latency, hata ve circuit durumu."""
+        with self._lock:
+            return {
+                host: {**metrics.to_dict(), "circuit": self._circuits[host].state}
+                for host, metrics in self._metrics.items()
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _host(self, host: str, retry: bool = True):
+        with self._lock:
+            session = self._sessions.get((host, retry))
+            if session is None:
+                session = self._sessions[(host, retry)] = self._build_session(retry)
+                self._circuits.setdefault(host, CircuitBreaker(self.circuit_failures, self.circuit_reset))
+                self._metrics.setdefault(host, HostMetrics())
+            return session, self._circuits[host], self._metrics[host]
+
+    def _build_session(self, retry: bool = True) -> requests.Session:
+        # connect retry'ları istek gönderilmeden olduğu için POST'ta da güvenli;
+        # read/status retry'ları sadece idempotent metotlarda (Retry.DEFAULT_ALLOWED_METHODS)
+        retries = self.retries if retry else 0
+        max_retries = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=max_retries)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def _record(
+        self, host: str, circuit: CircuitBreaker, metrics: HostMetrics,
+        elapsed_ms: float, status: Optional[int], failed: bool,
+    ) -> None:
+        with self._lock:
+            metrics.observe(elapsed_ms, status, failed)
+        if not failed:
+            circuit.record_success()
+        elif circuit.record_failure():
+            logger.warning(f"[HttpClient] {host} için circuit açıldı ({circuit.failures} art arda hata)")
+
+
+# Singleton instance
+_http_client: Optional[HttpClient] = None
+
+
+def get_http_client() -> HttpClient:
+    """HTTP client singleton'ı döndür (ayarlar app config'inden)."""
+    global _http_client
+    if _http_client is None:
+        config = current_app.config if has_app_context() else {}
+        _http_client = HttpClient(
+            pool_maxsize=config.get("HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE),
+            retries=config.get("HTTP_RETRIES", DEFAULT_RETRIES),
+            backoff_factor=config.get("HTTP_BACKOFF_FACTOR", DEFAULT_BACKOFF_FACTOR),
+            circuit_failures=config.get("HTTP_CIRCUIT_FAILURES", DEFAULT_CIRCUIT_FAILURES),
+            circuit_reset=config.get("HTTP_CIRCUIT_RESET_SECONDS", DEFAULT_CIRCUIT_RESET_SECONDS),
+        )
+    return _http_client
@@ -0,0 +1,411 @@
+"""
+Latest Value Store - Cihazların son bilinen telemetri değerleri (last-known-value).
+
+"Cihazın son okuması" soran okuyucular (dashboard anlık güç, /telemetry/latest,
+anomaly taraması, sensör tetikleyicileri, Telegram cihaz detayı) hypertable
+üzerinde index taraması yapmak yerine buradan O(1) okur.
+
+Yapı:
+- Redis: organizasyon başına hash  awaxen:lkv:<org_id>  alan "<device_id>:<key>" -> "<epoch>|<value>"
+- Process içi mirror: aynı veri, Redis yoksa veya kısa süre önce okunduysa kullanılır
+
+Tüm ingest yolları (MQTT writer, HTTP ingest, HA webhook'ları) commit sonrası
+record() çağırır. Eski zamanlı okumalar yenilerinin üzerine yazılmaz.
+Cold start'ta (Redis ve mirror boş) son LKV_LOAD_LOOKBACK_DAYS günün değerleri
+telemetri store'undan yüklenir. Değerler her yerde (time, value) sırasıyla tutulur.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from app.services.device_resolver import get_device_resolver
+from app.services.telemetry_store import METRIC_KEYS, TelemetryRow, get_telemetry_store, normalize_key
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+LKV_KEY_PREFIX = "awaxen:lkv:"
+LKV_REDIS_TTL_SECONDS = 7 * 24 * 3600  # Hiç veri gelmeyen organizasyonun hash'i 7 gün sonra silinir
+LKV_LOCAL_TTL_SECONDS = float(os.getenv("LKV_LOCAL_TTL", "5"))  # Mirror'ın Redis'e tekrar sormadan geçerli sayıldığı süre
+LKV_LOAD_CHUNK_SIZE = 5000  # Toplu cold start yüklemesinde tek sorgudaki cihaz sayısı
+LKV_LOAD_LOOKBACK_DAYS = int(os.getenv("LKV_LOAD_LOOKBACK_DAYS", "7"))  # Cold start'ta taranan süre (hypertable'ın tamamı değil)
+REDIS_RETRY_SECONDS = 30  # Redis bağlantı hatasından sonra tekrar deneme aralığı
+
+# Sadece daha yeni zamanlı değerleri yazan compare-and-set (process'ler arası sıralama).
+# ARGV[1] = hash TTL'i (saniye), ardından alan / "<epoch>|<value>" çiftleri
+_HSET_IF_NEWER = """
+for i = 2, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    local incoming = tonumber(string.match(ARGV[i + 1], '^[^|]+'))
+    if (not current) or tonumber(string.match(current, '^[^|]+')) <= incoming then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+"""
+
+# Değer: (time, value) - TelemetryStore.latest_value / latest_points ile aynı sıra
+LatestValue = Tuple[datetime, float]
+
+
+def _org_key(org_id: Any) -> str:
+    return f"{LKV_KEY_PREFIX}{org_id}"
+
+
+def _decode(raw: str) -> Optional[LatestValue]:
+    try:
+        ts, value = raw.split("|", 1)
+        return datetime.fromtimestamp(float(ts), tz=timezone.utc), float(value)
+    except (ValueError, AttributeError):
+        return None
+
+
+class LatestValueStore:
+    """
+    Thread-safe last-known-value store.
+
+    Kullanım:
+        lkv = get_latest_value_store()
+        lkv.record([(ts, device.id, "power", 45.5)])
+        ts, value = lkv.get_latest(device, "power")
+        snapshot = lkv.get_org_snapshot(org_id)  # {device_id: {key: (time, value)}}
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, local_ttl: float = LKV_LOCAL_TTL_SECONDS):
+        self.redis_url = redis_url
+        self.local_ttl = local_ttl
+
+        # org_id -> device_id -> key -> (time, value)
+        self._values: Dict[UUID, Dict[UUID, Dict[str, LatestValue]]] = {}
+        self._org_by_device: Dict[UUID, UUID] = {}
+        self._synced_at: Dict[UUID, float] = {}  # org_id -> son Redis/DB senkronizasyonu
+        self._lock = threading.Lock()
+
+        self._redis = None
+        self._script = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Write API
+    # ------------------------------------------
+
+    def record(self, rows: Iterable[TelemetryRow]) -> int:
+        """
+        Ingest edilen okumaları kaydet (commit sonrası çağrılır).
+
+        Args:
+            rows: (time, device_id, key, value) tuple'ları
+
+        Returns:
+            Güncellenen (device, key) sayısı
+        """
+        rows = [row for row in rows if row[3] is not None]
+        orgs = {device_id: self._org_for(device_id) for device_id in {row[1] for row in rows}}
+
+        updates: Dict[UUID, Dict[UUID, Dict[str, LatestValue]]] = {}
+        with self._lock:
+            for ts, device_id, key, value in rows:
+                org_id = orgs.get(device_id)
+                if org_id is None:
+                    continue
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                key = normalize_key(key)
+                device_values = self._values.setdefault(org_id, {}).setdefault(device_id, {})
+                current = device_values.get(key)
+                if current is not None and current[0] > ts:
+                    continue
+                device_values[key] = (ts, float(value))
+                updates.setdefault(org_id, {}).setdefault(device_id, {})[key] = device_values[key]
+
+        if updates:
+            self._publish(updates)
+        return sum(len(keys) for devices in updates.values() for keys in devices.values())
+
+    def forget_device(self, device_id: UUID) -> None:
+        """Silinen cihazın değerlerini kaldır."""
+        with self._lock:
+            org_id = self._org_by_device.pop(device_id, None)
+            keys = []
+            if org_id is not None:
+                keys = list(self._values.get(org_id, {}).pop(device_id, {}).keys())
+        client = self._client()
+        if client is not None and org_id is not None and keys:
+            try:
+                client.hdel(_org_key(org_id), *(f"{device_id}:{key}" for key in keys))
+            except Exception as e:
+                self._redis_error(e)
+
+    def clear(self) -> None:
+        """Process içi mirror'ı temizle (Redis'e dokunmaz)."""
+        with self._lock:
+            self._values.clear()
+            self._org_by_device.clear()
+            self._synced_at.clear()
+
+    # ------------------------------------------
+    # Read API
+    # ------------------------------------------
+
+    def get_latest(self, device: Any, key: str) -> Optional[LatestValue]:
+        """
+        Cihazın bir metrik için son değeri.
+
+        Args:
+            device: SmartDevice / DeviceRef veya device UUID
+
+        Returns:
+            (time, value) veya None
+        """
+        return self.get_device_snapshot(device).get(normalize_key(key))
+
+    def get_device_snapshot(self, device: Any) -> Dict[str, LatestValue]:
+        """Cihazın tüm metrikleri: {key: (time, value)}."""
+        device_id = getattr(device, "id", device)
+        org_id = getattr(device, "organization_id", None) or self._org_for(device_id)
+        if org_id is None:
+            return {}
+        org_id = self._sync(org_id)
+        with self._lock:
+            return dict(self._values.get(org_id, {}).get(device_id, {}))
+
+    def get_org_snapshot(self, org_id: UUID) -> Dict[UUID, Dict[str, LatestValue]]:
+        """Organizasyondaki tüm cihazların son değerleri: {device_id: {key: (time, value)}}."""
+        org_id = self._sync(org_id)
+        with self._lock:
+            return {device_id: dict(values) for device_id, values in self._values.get(org_id, {}).items()}
+
+    def get_latest_many(self, devices: Sequence[Tuple[UUID, UUID]], key: str) -> Dict[UUID, LatestValue]:
+        """
+        Birden fazla cihazın tek metrik için son değeri (toplu taramalar için).
+
+        Args:
+            devices: (device_id, organization_id) çiftleri
+
+        Returns:
+            {device_id: (time, value)} - değeri olmayan cihazlar dahil edilmez
+
+        Organizasyonlar tek Redis pipeline'ı ile senkronize edilir; hiç veri
+        bulunamayan cihazlar (cold start) chunk başına tek sorgu ile store'dan okunur.
+        """
+        key = normalize_key(key)
+        org_ids = {org_id for _, org_id in devices}
+        cold_orgs = self._sync_many(org_ids)
+
+        result: Dict[UUID, LatestValue] = {}
+        missing = []
+        with self._lock:
+            for device_id, org_id in devices:
+                latest = self._values.get(org_id, {}).get(device_id, {}).get(key)
+                if latest is not None:
+                    result[device_id] = latest
+                elif org_id in cold_orgs:
+                    missing.append((device_id, org_id))
+
+        if missing:
+            loaded = self._load_key_from_store(key, missing)
+            if loaded:
+                self._publish(loaded)
+                with self._lock:
+                    for org_id, values in loaded.items():
+                        self._merge(org_id, values)
+                        result.update((device_id, device_values[key]) for device_id, device_values in values.items())
+        return result
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _org_for(self, device_id: UUID) -> Optional[UUID]:
+        """Cihazın organizasyonu (DeviceResolver cache'i üzerinden)."""
+        org_id = self._org_by_device.get(device_id)
+        if org_id is None:
+            ref = get_device_resolver().resolve(device_id)
+            if ref is not None and ref.organization_id is not None:
+                org_id = ref.organization_id
+                with self._lock:
+                    self._org_by_device[device_id] = org_id
+        return org_id
+
+    def _sync(self, org_id: Any) -> UUID:
+        """
+        Mirror'ı Redis ile senkronize et (LKV_LOCAL_TTL içinde tekrar sorulmaz).
+
+        Redis yoksa mirror yetkilidir; process org'u ilk kez görüyorsa
+        değerler telemetri store'undan yüklenir.
+        """
+        org_id = org_id if isinstance(org_id, UUID) else UUID(str(org_id))
+        for cold_org in self._sync_many([org_id]):
+            # Cold start (Redis boş/yok ve bu process org'u hiç görmedi): DB'den yükle
+            values = self._load_from_store(cold_org)
+            if values:
+                self._publish({cold_org: values})
+                with self._lock:
+                    self._merge(cold_org, values)
+        return org_id
+
+    def _sync_many(self, org_ids: Iterable[UUID]) -> Set[UUID]:
+        """
+        Süresi geçmiş organizasyonları tek Redis pipeline'ı ile senkronize et.
+
+        Returns:
+            Cold organizasyonlar (Redis'te veri yok ve process org'u hiç görmedi)
+        """
+        now = time.monotonic()
+        stale: Dict[UUID, Optional[float]] = {}
+        with self._lock:
+            for org_id in org_ids:
+                synced_at = self._synced_at.get(org_id)
+                if synced_at is None or now - synced_at >= self.local_ttl:
+                    stale[org_id] = synced_at
+        if not stale:
+            return set()
+
+        loaded = self._load_from_redis(list(stale))
+        with self._lock:
+            for org_id, values in loaded.items():
+                if values:
+                    self._merge(org_id, values)
+            for org_id in stale:
+                self._synced_at[org_id] = now
+        return {org_id for org_id, synced_at in stale.items() if synced_at is None and not loaded.get(org_id)}
+
+    def _merge(self, org_id: UUID, values: Dict[UUID, Dict[str, LatestValue]]) -> None:
+        org_values = self._values.setdefault(org_id, {})
+        for device_id, device_values in values.items():
+            self._org_by_device[device_id] = org_id
+            target = org_values.setdefault(device_id, {})
+            for key, latest in device_values.items():
+                current = target.get(key)
+                if current is None or current[0] <= latest[0]:
+                    target[key] = latest
+
+    def _publish(self, updates: Dict[UUID, Dict[UUID, Dict[str, LatestValue]]]) -> None:
+        """Değerleri Redis hash'lerine yaz (organizasyon başına tek script çağrısı, tek round-trip)."""
+        client = self._client()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for org_id, devices in updates.items():
+                args = [LKV_REDIS_TTL_SECONDS]
+                for device_id, values in devices.items():
+                    for key, (ts, value) in values.items():
+                        args.extend((f"{device_id}:{key}", f"{ts.timestamp()}|{value!r}"))
+                self._script(keys=[_org_key(org_id)], args=args, client=pipe)
+            pipe.execute()
+        except Exception as e:
+            self._redis_error(e)
+
+    def _load_from_redis(self, org_ids: Sequence[UUID]) -> Dict[UUID, Dict[UUID, Dict[str, LatestValue]]]:
+        """Organizasyon hash'lerini tek pipeline ile oku: {org_id: {device_id: {key: (time, value)}}}."""
+        client = self._client()
+        if client is None:
+            return {}
+        try:
+            pipe = client.pipeline(transaction=False)
+            for org_id in org_ids:
+                pipe.hgetall(_org_key(org_id))
+            results = pipe.execute()
+        except Exception as e:
+            self._redis_error(e)
+            return {}
+
+        loaded: Dict[UUID, Dict[UUID, Dict[str, LatestValue]]] = {}
+        for org_id, raw in zip(org_ids, results):
+            values = loaded.setdefault(org_id, {})
+            for field, encoded in raw.items():
+                device_part, _, key = field.partition(":")
+                latest = _decode(encoded)
+                if not key or latest is None:
+                    continue
+                try:
+                    device_id = UUID(device_part)
+                except ValueError:
+                    continue
+                values.setdefault(device_id, {})[key] = latest
+        return loaded
+
+    @staticmethod
+    def _load_from_store(org_id: UUID) -> Dict[UUID, Dict[str, LatestValue]]:
+        """Cold start: kanonik metriklerin son LKV_LOAD_LOOKBACK_DAYS gündeki son değerlerini oku."""
+        store = get_telemetry_store()
+        since = datetime.now(timezone.utc) - timedelta(days=LKV_LOAD_LOOKBACK_DAYS)
+        values: Dict[UUID, Dict[str, LatestValue]] = {}
+        try:
+            for key in METRIC_KEYS:
+                for device_id, (ts, value) in store.latest_points(key, organization_id=org_id, since=since).items():
+                    if ts.tzinfo is None:
+                        ts = ts.replace(tzinfo=timezone.utc)
+                    values.setdefault(device_id, {})[key] = (ts, value)
+        except Exception as e:
+            logger.warning(f"[LKV] Store'dan yüklenemedi (org={org_id}): {e}")
+        return values
+
+    @staticmethod
+    def _load_key_from_store(
+        key: str,
+        devices: Sequence[Tuple[UUID, UUID]],
+    ) -> Dict[UUID, Dict[UUID, Dict[str, LatestValue]]]:
+        """Cold start (toplu): tek metriğin son değerleri, chunk başına tek sorgu."""
+        org_by_device = dict(devices)
+        device_ids = list(org_by_device)
+        store = get_telemetry_store()
+        since = datetime.now(timezone.utc) - timedelta(days=LKV_LOAD_LOOKBACK_DAYS)
+        values: Dict[UUID, Dict[UUID, Dict[str, LatestValue]]] = {}
+        for offset in range(0, len(device_ids), LKV_LOAD_CHUNK_SIZE):
+            chunk = device_ids[offset:offset + LKV_LOAD_CHUNK_SIZE]
+            try:
+                points = store.latest_points(key, device_ids=chunk, since=since)
+            except Exception as e:
+                logger.warning(f"[LKV] Store'dan yüklenemedi ({len(chunk)} cihaz): {e}")
+                continue
+            for device_id, (ts, value) in points.items():
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                values.setdefault(org_by_device[device_id], {})[device_id] = {key: (ts, value)}
+        return values
+
+    def _client(self):
+        """Redis client (hata sonrası REDIS_RETRY_SECONDS boyunca denenmez)."""
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._script = client.register_script(_HSET_IF_NEWER)
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[LKV] Redis kullanılamıyor, process içi mirror ile devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+# Singleton instance
+_latest_value_store: Optional[LatestValueStore] = None
+
+
+def get_latest_value_store() -> LatestValueStore:
+    """Latest value store singleton'ı döndür."""
+    global _latest_value_store
+    if _latest_value_store is None:
+        _latest_value_store = LatestValueStore()
+    return _latest_value_store
@@ -0,0 +1,313 @@
+"""
+Leaderboard - Organizasyon cüzdan sıralaması (Redis sorted set).
+
+Dashboard rank'i ve /wallet/leaderboard her istekte cüzdanlar üzerinde
+COUNT / ORDER BY çalıştırmak yerine buradan okur:
+
+- Organizasyon başına sorted set (awaxen:leaderboard:<org_id>): member=user_id, score=bakiye
+- Cüzdan bakiyesi / durumu değiştiğinde (ödül endpoint'i dahil tüm WalletTransaction
+  yazımları) commit sonrası mutlak skor ZADD ile yazılır; rollback olan işlem
+  sıralamaya girmez. Kullanıcı organizasyon değiştirirse eski set'ten çıkar
+- Sıra O(log n): bakiyesi daha yüksek kullanıcı sayısı + 1 (eşit bakiyeler aynı sırayı paylaşır)
+- Top-N sayfalı ZREVRANGE ile okunur
+- reconcile_leaderboards beat job'ı setleri wallets tablosundan yeniden kurar;
+  hiç kurulmamış organizasyon ilk okumada senkron kurulur
+
+Redis yoksa aynı yapı process içinde tutulur.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import User, Wallet
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+LEADERBOARD_KEY_PREFIX = "awaxen:leaderboard:"
+LEADERBOARD_BUILT_KEY = "awaxen:leaderboard:built"  # org_id -> son yeniden kurulum zamanı
+LEADERBOARD_RECONCILE_SECONDS = 900
+REDIS_RETRY_SECONDS = 30
+
+# (org_id, user_id, bakiye) — bakiye None ise kullanıcı sıralamadan çıkar
+Entry = Tuple[str, str, Optional[float]]
+SESSION_ENTRIES_KEY = "leaderboard_entries"
+
+
+def _as_uuid(value: Any) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+
+class LeaderboardStore:
+    """
+    Organizasyon başına cüzdan sıralaması.
+
+    Kullanım:
+        board = get_leaderboard_store()
+        board.rank(org_id, user_id)              # 1-indexed; cüzdan yoksa None
+        board.top(org_id, offset=0, limit=10)    # [(user_id, bakiye), ...]
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL):
+        self.redis_url = redis_url
+
+        # Redis yoksa process içi sıralama: org_id -> {user_id: bakiye}
+        self._local: Dict[str, Dict[str, float]] = {}
+        self._local_built: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Okuma
+    # ------------------------------------------
+
+    def rank(self, org_id: Any, user_id: Any) -> Optional[int]:
+        """Kullanıcının organizasyon içindeki sırası (bakiyesi daha yüksek olanlar + 1)."""
+        org_key, member = str(org_id), str(user_id)
+        self._ensure_built(org_id)
+        client = self._client()
+        if client is not None:
+            try:
+                score = client.zscore(f"{LEADERBOARD_KEY_PREFIX}{org_key}", member)
+                if score is None:
+                    return None
+                return client.zcount(f"{LEADERBOARD_KEY_PREFIX}{org_key}", f"({score}", "+inf") + 1
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            scores = self._local.get(org_key, {})
+            if member not in scores:
+                return None
+            return sum(1 for balance in scores.values() if balance > scores[member]) + 1
+
+    def top(self, org_id: Any, offset: int = 0, limit: int = 10) -> List[Tuple[str, float]]:
+        """Bakiyeye göre azalan sırada [(user_id, bakiye), ...] sayfası."""
+        org_key = str(org_id)
+        offset, limit = max(0, offset), max(0, limit)
+        if not limit:
+            return []
+        self._ensure_built(org_id)
+        client = self._client()
+        if client is not None:
+            try:
+                rows = client.zrevrange(f"{LEADERBOARD_KEY_PREFIX}{org_key}", offset, offset + limit - 1, withscores=True)
+                return [(member, float(score)) for member, score in rows]
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            scores = self._local.get(org_key, {})
+            ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ordered[offset:offset + limit]
+
+    def size(self, org_id: Any) -> int:
+        """Sıralamadaki kullanıcı sayısı."""
+        self._ensure_built(org_id)
+        client = self._client()
+        if client is not None:
+            try:
+                return int(client.zcard(f"{LEADERBOARD_KEY_PREFIX}{org_id}"))
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            return len(self._local.get(str(org_id), {}))
+
+    # ------------------------------------------
+    # Yazma
+    # ------------------------------------------
+
+    def apply(self, entries: Iterable[Entry]) -> None:
+        """Commit edilen cüzdan değişikliklerini uygula (mutlak skor; tekrar uygulanabilir)."""
+        entries = list(entries)
+        if not entries:
+            return
+        client = self._client()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=True)
+                for org_key, member, balance in entries:
+                    key = f"{LEADERBOARD_KEY_PREFIX}{org_key}"
+                    if balance is None:
+                        pipe.zrem(key, member)
+                    else:
+                        pipe.zadd(key, {member: balance})
+                pipe.execute()
+                return
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            for org_key, member, balance in entries:
+                scores = self._local.setdefault(org_key, {})
+                if balance is None:
+                    scores.pop(member, None)
+                else:
+                    scores[member] = balance
+
+    def reconcile(self, org_ids: Optional[Sequence[Any]] = None) -> int:
+        """Sıralamaları wallets tablosundan yeniden kur; işlenen organizasyon sayısı."""
+        query = db.session.query(User.organization_id, Wallet.user_id, Wallet.balance).join(
+            User, Wallet.user_id == User.id
+        ).filter(Wallet.is_active.is_(True), User.organization_id.isnot(None))
+        if org_ids is not None:
+            query = query.filter(User.organization_id.in_([_as_uuid(org_id) for org_id in org_ids]))
+
+        boards: Dict[str, Dict[str, float]] = {str(org_id): {} for org_id in org_ids or []}
+        for org_id, user_id, balance in query.all():
+            boards.setdefault(str(org_id), {})[str(user_id)] = float(balance or 0)
+
+        now = time.time()
+        client = self._client()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=True)
+                for org_key, scores in boards.items():
+                    key = f"{LEADERBOARD_KEY_PREFIX}{org_key}"
+                    pipe.delete(key)
+                    if scores:
+                        pipe.zadd(key, scores)
+                    pipe.hset(LEADERBOARD_BUILT_KEY, org_key, now)
+                pipe.execute()
+                return len(boards)
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            for org_key, scores in boards.items():
+                self._local[org_key] = scores
+                self._local_built[org_key] = now
+        return len(boards)
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _ensure_built(self, org_id: Any) -> None:
+        """Sıralama bu organizasyon için hiç kurulmadıysa (cold start) SQL'den kur."""
+        org_key = str(org_id)
+        client = self._client()
+        if client is not None:
+            try:
+                if client.hexists(LEADERBOARD_BUILT_KEY, org_key):
+                    return
+            except Exception as e:
+                self._redis_error(e)
+        else:
+            with self._lock:
+                if org_key in self._local_built:
+                    return
+        self.reconcile([org_id])
+
+    def _client(self):
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[Leaderboard] Redis kullanılamıyor, bellek içi sıralama ile devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+# ==========================================
+# ORM Event'leri - commit sonrası sıralama güncellemesi
+# ==========================================
+
+def _collect_entries(session: Session, flush_context: Any) -> None:
+    wallets: Dict[str, Wallet] = {}
+    moved: Dict[str, Any] = {}  # user_id -> eski organization_id
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Wallet) and obj.user_id is not None:
+            inspected = db.inspect(obj)
+            if obj in session.new or any(
+                inspected.attrs[attr].history.has_changes() for attr in ("balance", "is_active", "user_id")
+            ):
+                wallets[str(obj.user_id)] = obj
+        elif isinstance(obj, User) and obj in session.dirty:
+            history = db.inspect(obj).attrs["organization_id"].history
+            if history.has_changes() and history.deleted and history.deleted[0] is not None:
+                moved[str(obj.id)] = history.deleted[0]
+    for obj in session.deleted:
+        if isinstance(obj, Wallet) and obj.user_id is not None:
+            wallets[str(obj.user_id)] = obj
+
+    user_ids = set(wallets) | set(moved)
+    if not user_ids:
+        return
+
+    # Kullanıcıların güncel organizasyonu (ve taşınanların bakiyesi) tek sorguda
+    rows = session.execute(
+        select(User.id, User.organization_id, Wallet.balance, Wallet.is_active)
+        .outerjoin(Wallet, Wallet.user_id == User.id)
+        .where(User.id.in_([_as_uuid(user_id) for user_id in user_ids]))
+    ).all()
+
+    entries: List[Entry] = session.info.setdefault(SESSION_ENTRIES_KEY, [])
+    for user_id, org_id, balance, is_active in rows:
+        member = str(user_id)
+        if member in moved:
+            entries.append((str(moved[member]), member, None))
+        if org_id is None:
+            continue
+        wallet = wallets.get(member)
+        if wallet is not None:
+            removed = wallet in session.deleted or not wallet.is_active
+            entries.append((str(org_id), member, None if removed else float(wallet.balance or 0)))
+        elif balance is not None:
+            entries.append((str(org_id), member, float(balance) if is_active else None))
+
+
+def _apply_entries(session: Session) -> None:
+    entries = session.info.pop(SESSION_ENTRIES_KEY, None)
+    if not entries:
+        return
+    try:
+        get_leaderboard_store().apply(entries)
+    except Exception as e:
+        logger.warning(f"[Leaderboard] Sıralama güncellenemedi: {e}")
+
+
+def _drop_entries(session: Session, *args: Any) -> None:
+    session.info.pop(SESSION_ENTRIES_KEY, None)
+
+
+def register_leaderboard_listeners() -> None:
+    """Cüzdan / kullanıcı organizasyon commit'lerini sıralamaya bağla (idempotent)."""
+    if event.contains(Session, "after_flush", _collect_entries):
+        return
+    event.listen(Session, "after_flush", _collect_entries)
+    event.listen(Session, "after_commit", _apply_entries)
+    event.listen(Session, "after_rollback", _drop_entries)
+
+
+# Singleton instance
+_leaderboard_store: Optional[LeaderboardStore] = None
+
+
+def get_leaderboard_store() -> LeaderboardStore:
+    """Leaderboard store singleton'ı döndür."""
+    global _leaderboard_store
+    if _leaderboard_store is None:
+        _leaderboard_store = LeaderboardStore()
+    return _leaderboard_store
@@ -2,6 +2,8 @@
 import requests
 from flask import current_app
 
+from app.services.http_client import get_http_client
+
 
 def send_telegram_notification(user, message: str) -> bool:
     """
@@ -31,7 +33,7 @@ def send_telegram_notification(user, message: str) -> bool:
     }
 
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = get_http_client().post(url, json=payload, timeout=10)
         response.raise_for_status()
         return True
     except requests.RequestException as exc:
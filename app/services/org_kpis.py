@@ -0,0 +1,512 @@
+"""
+Org KPIs - Dashboard özeti için organizasyon KPI snapshot'ı.
+
+get_dashboard_summary her sayfa yüklemesinde ayrı sorgular (cihaz sayımları,
+günlük tüketim, piyasa, cüzdan, alarm) yapmak yerine buradan tek okuma yapar:
+
+- Redis'te organizasyon başına hash (awaxen:kpi:org:<org_id>) + çevrimiçi cihaz set'i;
+  piyasa ve kullanıcı cüzdan özetleri kısa TTL'li JSON anahtarları. Okuma tek pipeline.
+- Artımlı güncellenir: telemetri ingest'i (publish_ingested -> observe_rows) ve ORM
+  commit'leri (cihaz ekleme/silme/online durumu, bildirim okunma, cüzdan değişiklikleri)
+- reconcile_org_kpis beat job'ı KPI_RECONCILE_SECONDS'ta bir SQL'den yeniden hesaplar;
+  bulk update, rollback ve kaybolan event'lerden kaynaklı kaymalar böyle düzelir
+- Snapshot reconciled_at + KPI_STALE_SECONDS'ı geçtiyse "stale": true döner;
+  hiç yoksa (cold start) organizasyon senkron hesaplanır
+
+Redis yoksa aynı yapı process içinde tutulur.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import MarketPrice, Notification, SmartDevice, Wallet, WalletTransaction
+from app.services.device_resolver import get_device_resolver
+from app.services.telemetry_store import get_telemetry_store, normalize_key
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+KPI_KEY_PREFIX = "awaxen:kpi:org:"
+KPI_ONLINE_PREFIX = "awaxen:kpi:online:"
+KPI_WALLET_PREFIX = "awaxen:kpi:wallet:"
+KPI_MARKET_KEY = "awaxen:kpi:market"
+KPI_STALE_SECONDS = 600  # Bu süre reconcile edilmemiş snapshot "stale" işaretlenir
+KPI_RECONCILE_SECONDS = 300
+KPI_MARKET_TTL_SECONDS = 300  # Piyasa fiyatları saatlik; özet 5 dk'da bir yeniden hesaplanır
+KPI_WALLET_TTL_SECONDS = 300
+KPI_REDIS_TTL_SECONDS = 2 * 24 * 3600
+REDIS_RETRY_SECONDS = 30
+
+CHEAP_PRICE_THRESHOLD = 2.0  # TL
+EXPENSIVE_PRICE_THRESHOLD = 3.5  # TL
+
+ENERGY_KEY = normalize_key("energy")
+
+# ORM commit'lerinden biriken KPI event'leri: ("device", org, device_id, +1/-1, online)
+# ("online", org, device_id, bool), ("alerts", org, delta), ("wallet", user_id)
+KpiEvent = Tuple[Any, ...]
+SESSION_EVENTS_KEY = "org_kpi_events"
+
+
+def _day(ts: Optional[datetime] = None) -> str:
+    return (ts or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+
+
+def _iso(epoch: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat() if epoch else None
+
+
+def _as_uuid(value: Any) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+
+class OrgKpiStore:
+    """
+    Organizasyon KPI snapshot'ı.
+
+    Kullanım:
+        store = get_org_kpi_store()
+        summary = store.summary(org_id, user_id)   # Tek Redis round-trip
+        store.reconcile()                          # Beat job: SQL ile düzelt
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, stale_after: float = KPI_STALE_SECONDS):
+        self.redis_url = redis_url
+        self.stale_after = stale_after
+
+        # Redis yoksa process içi snapshot
+        self._local_orgs: Dict[str, Dict[str, Any]] = {}
+        self._local_online: Dict[str, Set[str]] = {}
+        self._local_json: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_failed_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Okuma
+    # ------------------------------------------
+
+    def summary(self, org_id: Any, user_id: Any = None) -> Dict[str, Any]:
+        """Dashboard KPI'ları, piyasa ve (verildiyse) kullanıcı cüzdan özeti."""
+        org_key = str(org_id)
+        org, online, market, wallet = self._read(org_key, user_id)
+        if not org.get("reconciled_at"):
+            self.reconcile([org_id])
+            org, online, market, wallet = self._read(org_key, user_id)
+        if market is None:
+            market = self.refresh_market()
+        if user_id is not None and wallet is None:
+            wallet = self.refresh_wallet(user_id)
+
+        reconciled_at = float(org.get("reconciled_at") or 0)
+        stale_after = reconciled_at + self.stale_after
+        total = int(org.get("devices_total") or 0)
+        return {
+            "devices_total": total,
+            "devices_online": min(online, total),
+            "alerts_unread": max(0, int(org.get("alerts_unread") or 0)),
+            "energy_today_kwh": float(org.get(f"energy:{_day()}") or 0),
+            "market": market,
+            "wallet": wallet,
+            "reconciled_at": _iso(reconciled_at),
+            "stale_after": _iso(stale_after),
+            "stale": time.time() > stale_after,
+        }
+
+    # ------------------------------------------
+    # Artımlı güncelleme
+    # ------------------------------------------
+
+    def observe_rows(self, rows: Sequence[Tuple[datetime, UUID, str, float]]) -> None:
+        """Commit edilen telemetri: okuma gelen cihaz online, bugünkü enerji toplamı artar."""
+        resolver = get_device_resolver()
+        online: Dict[str, Set[str]] = {}
+        energy: Dict[Tuple[str, str], float] = {}
+        for ts, device_id, key, value in rows:
+            ref = resolver.resolve(device_id)
+            if ref is None or ref.organization_id is None:
+                continue
+            org_key = str(ref.organization_id)
+            online.setdefault(org_key, set()).add(str(device_id))
+            if value is not None and normalize_key(key) == ENERGY_KEY:
+                field = f"energy:{_day(ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc))}"
+                energy[(org_key, field)] = energy.get((org_key, field), 0.0) + float(value)
+
+        client = self._client()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for org_key, device_ids in online.items():
+                    pipe.sadd(f"{KPI_ONLINE_PREFIX}{org_key}", *device_ids)
+                for (org_key, field), amount in energy.items():
+                    pipe.hincrbyfloat(f"{KPI_KEY_PREFIX}{org_key}", field, amount)
+                pipe.execute()
+                return
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            for org_key, device_ids in online.items():
+                self._local_online.setdefault(org_key, set()).update(device_ids)
+            for (org_key, field), amount in energy.items():
+                org = self._local_orgs.setdefault(org_key, {})
+                org[field] = org.get(field, 0.0) + amount
+
+    def apply(self, events: Iterable[KpiEvent]) -> None:
+        """ORM commit'inden gelen KPI event'lerini uygula."""
+        events = list(events)
+        if not events:
+            return
+        client = self._client()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for kind, *args in events:
+                    if kind == "device":
+                        org_key, device_id, delta, is_online = args
+                        pipe.hincrby(f"{KPI_KEY_PREFIX}{org_key}", "devices_total", delta)
+                        if delta > 0 and is_online:
+                            pipe.sadd(f"{KPI_ONLINE_PREFIX}{org_key}", device_id)
+                        elif delta < 0:
+                            pipe.srem(f"{KPI_ONLINE_PREFIX}{org_key}", device_id)
+                    elif kind == "online":
+                        org_key, device_id, is_online = args
+                        (pipe.sadd if is_online else pipe.srem)(f"{KPI_ONLINE_PREFIX}{org_key}", device_id)
+                    elif kind == "alerts":
+                        org_key, delta = args
+                        pipe.hincrby(f"{KPI_KEY_PREFIX}{org_key}", "alerts_unread", delta)
+                    elif kind == "wallet":
+                        pipe.delete(f"{KPI_WALLET_PREFIX}{args[0]}")
+                pipe.execute()
+                return
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            for kind, *args in events:
+                if kind == "device":
+                    org_key, device_id, delta, is_online = args
+                    org = self._local_orgs.setdefault(org_key, {})
+                    org["devices_total"] = int(org.get("devices_total") or 0) + delta
+                    online = self._local_online.setdefault(org_key, set())
+                    if delta > 0 and is_online:
+                        online.add(device_id)
+                    elif delta < 0:
+                        online.discard(device_id)
+                elif kind == "online":
+                    org_key, device_id, is_online = args
+                    online = self._local_online.setdefault(org_key, set())
+                    if is_online:
+                        online.add(device_id)
+                    else:
+                        online.discard(device_id)
+                elif kind == "alerts":
+                    org_key, delta = args
+                    org = self._local_orgs.setdefault(org_key, {})
+                    org["alerts_unread"] = int(org.get("alerts_unread") or 0) + delta
+                elif kind == "wallet":
+                    self._local_json.pop(f"{KPI_WALLET_PREFIX}{args[0]}", None)
+
+    # ------------------------------------------
+    # SQL ile yeniden hesaplama
+    # ------------------------------------------
+
+    def reconcile(self, org_ids: Optional[Sequence[Any]] = None) -> int:
+        """
+        KPI'ları SQL'den yeniden hesapla (org_ids None ise cihazı/bildirimi olan tüm organizasyonlar).
+
+        Returns:
+            Güncellenen organizasyon sayısı
+        """
+        uuids = [_as_uuid(org_id) for org_id in org_ids] if org_ids else None
+
+        def scoped(query, column):
+            return query.filter(column.in_(uuids)) if uuids else query
+
+        totals = dict(scoped(
+            db.session.query(SmartDevice.organization_id, func.count(SmartDevice.id)),
+            SmartDevice.organization_id,
+        ).group_by(SmartDevice.organization_id).all())
+        online_rows = scoped(
+            db.session.query(SmartDevice.organization_id, SmartDevice.id).filter(SmartDevice.is_online.is_(True)),
+            SmartDevice.organization_id,
+        ).all()
+        alerts = dict(scoped(
+            db.session.query(Notification.organization_id, func.count(Notification.id)).filter(Notification.is_read.is_(False)),
+            Notification.organization_id,
+        ).group_by(Notification.organization_id).all())
+
+        online: Dict[Any, Set[str]] = {}
+        for org_id, device_id in online_rows:
+            online.setdefault(org_id, set()).add(str(device_id))
+
+        now = datetime.now(timezone.utc)
+        day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        reconciled_at = time.time()
+        store = get_telemetry_store()
+        snapshots: Dict[str, Tuple[Dict[str, Any], Set[str]]] = {}
+        for org_id in set(uuids or []) | set(totals) | set(alerts):
+            if org_id is None:
+                continue
+            snapshots[str(org_id)] = ({
+                "devices_total": int(totals.get(org_id, 0)),
+                "alerts_unread": int(alerts.get(org_id, 0)),
+                f"energy:{_day(now)}": float(store.sum_values("energy", day_start, organization_id=org_id) or 0),
+                "reconciled_at": reconciled_at,
+            }, online.get(org_id, set()))
+
+        self._write_snapshots(snapshots)
+        return len(snapshots)
+
+    def refresh_market(self) -> Dict[str, Any]:
+        """Piyasa özetini hesapla ve cache'le (tüm organizasyonlar için ortak)."""
+        now = datetime.utcnow()
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        avg = db.session.query(func.avg(MarketPrice.price)).filter(MarketPrice.time >= day_start).scalar()
+        latest = MarketPrice.query.filter(MarketPrice.time <= now).order_by(MarketPrice.time.desc()).first()
+        current_price = float(latest.price) if latest else 0.0
+
+        if current_price < CHEAP_PRICE_THRESHOLD:
+            status = "cheap"
+        elif current_price > EXPENSIVE_PRICE_THRESHOLD:
+            status = "expensive"
+        else:
+            status = "normal"
+
+        # Gelecek ucuz saati bul
+        next_slot = "Şu an!"
+        if status == "expensive":
+            future = MarketPrice.query.filter(
+                MarketPrice.time > now,
+                MarketPrice.price < CHEAP_PRICE_THRESHOLD,
+            ).order_by(MarketPrice.time.asc()).first()
+            if future:
+                next_slot = future.time.strftime("%H:%00")
+
+        market = {
+            "current_price": current_price,
+            "status": status,
+            "next_cheap_slot": next_slot,
+            "currency": "TL/MWh",
+            "average_price_today": float(avg or 0),
+        }
+        self._write_json(KPI_MARKET_KEY, market, KPI_MARKET_TTL_SECONDS)
+        return market
+
+    def refresh_wallet(self, user_id: Any) -> Dict[str, Any]:
+        """Kullanıcının cüzdan özetini hesapla ve cache'le (sıralama hariç)."""
+        wallet = Wallet.query.filter_by(user_id=_as_uuid(user_id)).first()
+        if not wallet:
+            summary = {"wallet_id": None, "balance": 0, "todays_earnings": 0, "level": 1}
+        else:
+            day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+            today_earn = db.session.query(func.sum(WalletTransaction.amount)).filter(
+                WalletTransaction.wallet_id == wallet.id,
+                WalletTransaction.created_at >= day_start,
+                WalletTransaction.amount > 0,
+            ).scalar() or 0.0
+            summary = {
+                "wallet_id": str(wallet.id),
+                "balance": float(wallet.balance),
+                "todays_earnings": float(today_earn),
+                "level": wallet.level,
+            }
+        self._write_json(f"{KPI_WALLET_PREFIX}{user_id}", summary, KPI_WALLET_TTL_SECONDS)
+        return summary
+
+    def invalidate_market(self) -> None:
+        """Yeni fiyatlar kaydedildiğinde piyasa özetini düşür."""
+        client = self._client()
+        if client is not None:
+            try:
+                client.delete(KPI_MARKET_KEY)
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            self._local_json.pop(KPI_MARKET_KEY, None)
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _read(self, org_key: str, user_id: Any):
+        client = self._client()
+        wallet_key = f"{KPI_WALLET_PREFIX}{user_id}"
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hgetall(f"{KPI_KEY_PREFIX}{org_key}")
+                pipe.scard(f"{KPI_ONLINE_PREFIX}{org_key}")
+                pipe.get(KPI_MARKET_KEY)
+                pipe.get(wallet_key)
+                org, online, market, wallet = pipe.execute()
+                return (
+                    org,
+                    int(online or 0),
+                    json.loads(market) if market else None,
+                    json.loads(wallet) if wallet and user_id is not None else None,
+                )
+            except Exception as e:
+                self._redis_error(e)
+        now = time.monotonic()
+        with self._lock:
+            market = self._local_json.get(KPI_MARKET_KEY)
+            wallet = self._local_json.get(wallet_key) if user_id is not None else None
+            return (
+                dict(self._local_orgs.get(org_key, {})),
+                len(self._local_online.get(org_key, ())),
+                market[1] if market and market[0] > now else None,
+                wallet[1] if wallet and wallet[0] > now else None,
+            )
+
+    def _write_snapshots(self, snapshots: Dict[str, Tuple[Dict[str, Any], Set[str]]]) -> None:
+        with self._lock:
+            for org_key, (fields, online) in snapshots.items():
+                self._local_orgs[org_key] = dict(fields)
+                self._local_online[org_key] = set(online)
+        client = self._client()
+        if client is None or not snapshots:
+            return
+        try:
+            pipe = client.pipeline(transaction=True)
+            for org_key, (fields, online) in snapshots.items():
+                org_hash, online_set = f"{KPI_KEY_PREFIX}{org_key}", f"{KPI_ONLINE_PREFIX}{org_key}"
+                pipe.delete(org_hash, online_set)
+                pipe.hset(org_hash, mapping=fields)
+                if online:
+                    pipe.sadd(online_set, *online)
+                pipe.expire(org_hash, KPI_REDIS_TTL_SECONDS)
+                pipe.expire(online_set, KPI_REDIS_TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            self._redis_error(e)
+
+    def _write_json(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        with self._lock:
+            self._local_json[key] = (time.monotonic() + ttl, value)
+        client = self._client()
+        if client is None:
+            return
+        try:
+            client.set(key, json.dumps(value), ex=int(ttl))
+        except Exception as e:
+            self._redis_error(e)
+
+    def _client(self):
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[OrgKpis] Redis kullanılamıyor, bellek içi snapshot ile devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+# ==========================================
+# ORM Event'leri - commit sonrası artımlı güncelleme
+# ==========================================
+
+def _changed(obj: Any, attr: str) -> Optional[Tuple[Any, Any]]:
+    """Flush'ta değişen attribute'un (eski, yeni) değeri; değişmediyse None."""
+    history = db.inspect(obj).attrs[attr].history
+    if not history.has_changes():
+        return None
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    return old, new
+
+
+def _collect_events(session: Session, flush_context: Any) -> None:
+    events: List[KpiEvent] = session.info.setdefault(SESSION_EVENTS_KEY, [])
+    for obj in session.new:
+        if isinstance(obj, SmartDevice) and obj.organization_id:
+            events.append(("device", str(obj.organization_id), str(obj.id), 1, bool(obj.is_online)))
+        elif isinstance(obj, Notification) and obj.organization_id and not obj.is_read:
+            events.append(("alerts", str(obj.organization_id), 1))
+        elif isinstance(obj, Wallet):
+            events.append(("wallet", str(obj.user_id)))
+    for obj in session.dirty:
+        if isinstance(obj, SmartDevice) and obj.organization_id:
+            change = _changed(obj, "is_online")
+            if change is not None and bool(change[0]) != bool(change[1]):
+                events.append(("online", str(obj.organization_id), str(obj.id), bool(change[1])))
+        elif isinstance(obj, Notification) and obj.organization_id:
+            change = _changed(obj, "is_read")
+            if change is not None and bool(change[0]) != bool(change[1]):
+                events.append(("alerts", str(obj.organization_id), -1 if change[1] else 1))
+        elif isinstance(obj, Wallet) and (_changed(obj, "balance") or _changed(obj, "level")):
+            events.append(("wallet", str(obj.user_id)))
+    for obj in session.deleted:
+        if isinstance(obj, SmartDevice) and obj.organization_id:
+            events.append(("device", str(obj.organization_id), str(obj.id), -1, False))
+        elif isinstance(obj, Notification) and obj.organization_id and not obj.is_read:
+            events.append(("alerts", str(obj.organization_id), -1))
+
+
+def record_new_alerts(session: Session, counts: Dict[Any, int]) -> None:
+    """
+    Core INSERT ile (ORM dışında) eklenen okunmamış bildirimleri KPI event'i olarak kaydet.
+
+    Event'ler ORM event'leri gibi session commit'inde uygulanır, rollback'te atılır.
+    """
+    events: List[KpiEvent] = session.info.setdefault(SESSION_EVENTS_KEY, [])
+    events.extend(("alerts", str(org_id), count) for org_id, count in counts.items() if count)
+
+
+def _apply_events(session: Session) -> None:
+    events = session.info.pop(SESSION_EVENTS_KEY, None)
+    if not events:
+        return
+    try:
+        get_org_kpi_store().apply(events)
+    except Exception as e:
+        logger.warning(f"[OrgKpis] KPI event'leri uygulanamadı: {e}")
+
+
+def _drop_events(session: Session, *args: Any) -> None:
+    session.info.pop(SESSION_EVENTS_KEY, None)
+
+
+def register_kpi_listeners() -> None:
+    """Cihaz / bildirim / cüzdan commit'lerini KPI snapshot'ına bağla (idempotent)."""
+    if event.contains(Session, "after_flush", _collect_events):
+        return
+    event.listen(Session, "after_flush", _collect_events)
+    event.listen(Session, "after_commit", _apply_events)
+    event.listen(Session, "after_rollback", _drop_events)
+
+
+# Singleton instance
+_org_kpi_store: Optional[OrgKpiStore] = None
+
+
+def get_org_kpi_store() -> OrgKpiStore:
+    """Org KPI store singleton'ı döndür."""
+    global _org_kpi_store
+    if _org_kpi_store is None:
+        _org_kpi_store = OrgKpiStore()
+    return _org_kpi_store
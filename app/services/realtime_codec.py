@@ -0,0 +1,494 @@
+"""
+Realtime Codec - Socket.IO için kompakt (delta) telemetri formatı.
+
+Dashboard client'ları `subscribe_telemetry` ile format seçer:
+
+- json:    telemetry_batch (tam alan adları, ISO timestamp) - varsayılan
+- compact: telemetry_delta (JSON) - cihaz sözlüğü bir kez, sonra sayısal indeks + değişen alanlar
+- msgpack: telemetry_delta (MessagePack binary frame; msgpack kuruluysa)
+
+Cihaz sözlüğü organizasyon başınadır ve DB'den deterministik üretilir
+(created_at, id sırası); bu sayede her backend instance'ı aynı indeksleri
+kullanır. Sözlük (cihaz, ad, tip) değişince `v` (versiyon) değişir, client
+sözlüğü yeniden ister.
+
+Delta'ların baseline'ı (client'a son gönderilen alan değerleri) Redis'te
+organizasyon başına tutulur; birden fazla emitter (API instance'ları, MQTT
+ingest) aynı room'a yazdığında da her delta client'ın gördüğü duruma göredir.
+Redis yoksa baseline process içinde tutulur.
+
+compact/msgpack'e abone olan bağlantılar (sid) organizasyon başına Redis'te
+kiralık (lease) kayıt olarak tutulur; emitter abonesi olmayan organizasyonlar
+için delta hesaplamaz.
+
+Delta payload:
+    {"v": "3f2a9c1b", "t": 1718000000000, "k": 1, "d": [[idx, dt_ms, {"p": 1200.5}], ...]}
+
+- t: batch zamanı (epoch ms), dt_ms: t - cihazın son güncelleme zamanı
+- k: keyframe (bu emitter'ın bildiği tüm cihazların tam durumu; geç katılanlar için)
+- Alan kodları sözlükteki `fields` tablosundan çözülür
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.extensions import socketio
+from app.models import SmartDevice
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+BASELINE_KEY_PREFIX = "awaxen:realtime:baseline:"
+BASELINE_TTL_SECONDS = 3600
+SUBSCRIBERS_KEY_PREFIX = "awaxen:realtime:compact_subscribers:"
+SUBSCRIBER_LEASE_SECONDS = 120  # Abone process'i kaydı bu sürenin üçte birinde bir yeniler
+REDIS_RETRY_SECONDS = 30  # Redis bağlantı hatasından sonra tekrar deneme aralığı
+
+FORMATS = ("json", "compact", "msgpack")
+DICTIONARY_TTL_SECONDS = 60
+KEYFRAME_INTERVAL_SECONDS = 30
+VALUE_PRECISION = 3
+
+# Sık kullanılan alanlar için kısa kodlar (sözlükle birlikte client'a gönderilir)
+FIELD_CODES = {
+    "power_w": "p",
+    "power": "pw",
+    "voltage": "v",
+    "current": "c",
+    "energy_total_kwh": "e",
+    "energy": "en",
+    "temperature": "t",
+    "humidity": "h",
+    "value": "x",
+    "is_on": "o",
+    "state": "s",
+    "is_online": "n",
+    "last_seen": "ls",
+}
+# Sözlükte zaten olan / her mesajda tekrar eden statik alanlar delta'ya girmez
+STATIC_FIELDS = frozenset({
+    "external_id", "device_id", "device_uuid", "device_name", "name",
+    "domain", "attribute", "ha_entity_id", "time", "timestamp", "event",
+})
+
+# ARGV[1] = TTL, ardından "<device_id>|<kod>" / JSON değer çiftleri.
+# Baseline'dan farklı olan alanlar yazılır ve adları döner.
+_MERGE_BASELINE = """
+local changed = {}
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+        table.insert(changed, ARGV[i])
+    end
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return changed
+"""
+
+
+class DeviceDictionary:
+    """Organizasyonun cihaz -> indeks sözlüğü."""
+
+    __slots__ = ("version", "index", "devices")
+
+    def __init__(self, devices: List[Tuple[str, str, Optional[str], Optional[str]]]):
+        self.devices = devices
+        self.index = {device[0]: i for i, device in enumerate(devices)}
+        # Ad / tip değişikliği de client'ın sözlüğü yeniden istemesini gerektirir
+        self.version = hashlib.sha1(json.dumps(devices).encode()).hexdigest()[:8]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "v": self.version,
+            "devices": [list(device) for device in self.devices],
+            "fields": {code: name for name, code in FIELD_CODES.items()},
+        }
+
+
+class DeviceDictionaryRegistry:
+    """Organizasyon başına TTL'li sözlük cache'i."""
+
+    def __init__(self, ttl: float = DICTIONARY_TTL_SECONDS):
+        self.ttl = ttl
+        self._dictionaries: Dict[str, Tuple[DeviceDictionary, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, org_id: Any, refresh: bool = False) -> DeviceDictionary:
+        key = str(org_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._dictionaries.get(key)
+            if entry is not None and not refresh and entry[1] > now:
+                return entry[0]
+
+        # Silinen (soft delete) cihazlar da dahil: indeksler kaymasın
+        rows = SmartDevice.query.with_entities(
+            SmartDevice.id, SmartDevice.name, SmartDevice.external_id, SmartDevice.device_type
+        ).filter(
+            SmartDevice.organization_id == _as_uuid(org_id)
+        ).order_by(SmartDevice.created_at, SmartDevice.id).all()
+        dictionary = DeviceDictionary([
+            (str(row.id), row.name, row.external_id, row.device_type) for row in rows
+        ])
+
+        with self._lock:
+            self._dictionaries[key] = (dictionary, now + self.ttl)
+        return dictionary
+
+    def invalidate(self, org_id: Any = None) -> None:
+        with self._lock:
+            if org_id is None:
+                self._dictionaries.clear()
+            else:
+                self._dictionaries.pop(str(org_id), None)
+
+
+class CompactEncoder:
+    """
+    telemetry_batch girdilerini organizasyon başına delta payload'ına çevirir.
+
+    Son gönderilen durum (baseline) Redis'te paylaşılır (yoksa bu process'te
+    tutulur); değişmeyen alanlar gönderilmez. KEYFRAME_INTERVAL_SECONDS'ta bir
+    paylaşılan baseline'dan tam durum gönderilir.
+    """
+
+    def __init__(
+        self,
+        registry: DeviceDictionaryRegistry,
+        keyframe_interval: float = KEYFRAME_INTERVAL_SECONDS,
+        redis_url: Optional[str] = REDIS_URL,
+    ):
+        self.registry = registry
+        self.keyframe_interval = keyframe_interval
+        self.redis_url = redis_url
+        self._state: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._keyframe_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self._redis = None
+        self._script = None
+        self._redis_failed_at: Optional[float] = None
+
+    def encode(self, org_id: Any, entries: List[Dict[str, Any]], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Delta payload'ı (gönderilecek değişiklik yoksa None)."""
+        now = time.time() if now is None else now
+        now_ms = int(now * 1000)
+        key = str(org_id)
+
+        dictionary = self.registry.get(org_id)
+        if any(entry["device_id"] not in dictionary.index for entry in entries):
+            dictionary = self.registry.get(org_id, refresh=True)  # Yeni cihaz
+
+        rows = []  # (idx, device_id, dt_ms, alanlar)
+        for entry in entries:
+            idx = dictionary.index.get(entry["device_id"])
+            if idx is None:
+                continue
+            fields = encode_fields({**entry.get("data", {}), **entry.get("status", {})})
+            rows.append((idx, entry["device_id"], max(0, now_ms - _epoch_ms(entry.get("timestamp"), now_ms)), fields))
+
+        with self._lock:
+            keyframe = now - self._keyframe_at.get(key, 0.0) >= self.keyframe_interval
+            if keyframe:
+                self._keyframe_at[key] = now
+
+        deltas = self._merge_shared(key, rows, keyframe, dictionary)
+        if deltas is None:
+            deltas = self._merge_local(key, rows, keyframe)
+        if not deltas:
+            return None
+
+        payload = {"v": dictionary.version, "t": now_ms, "d": deltas}
+        if keyframe:
+            payload["k"] = 1
+        return payload
+
+    def _merge_shared(
+        self, key: str, rows: List[Tuple[int, str, int, Dict[str, Any]]], keyframe: bool, dictionary: DeviceDictionary,
+    ) -> Optional[List[List[Any]]]:
+        """Redis baseline'ına göre delta'lar (keyframe'de tüm baseline); Redis yoksa None."""
+        client = self._client()
+        if client is None:
+            return None
+        redis_key = BASELINE_KEY_PREFIX + key
+        args: List[str] = [str(BASELINE_TTL_SECONDS)]
+        for _, device_id, _, fields in rows:
+            for code, value in fields.items():
+                args += [f"{device_id}|{code}", json.dumps(value)]
+        try:
+            changed = set(self._script(keys=[redis_key], args=args, client=client)) if len(args) > 1 else set()
+            stored = client.hgetall(redis_key) if keyframe else {}
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+        if keyframe:
+            state: Dict[int, Dict[str, Any]] = {}
+            for field, raw in stored.items():
+                device_id, _, code = field.partition("|")
+                idx = dictionary.index.get(device_id)
+                if idx is not None:
+                    state.setdefault(idx, {})[code] = json.loads(raw)
+            return [[idx, 0, fields] for idx, fields in sorted(state.items())]
+
+        deltas = []
+        for idx, device_id, dt_ms, fields in rows:
+            delta = {code: value for code, value in fields.items() if f"{device_id}|{code}" in changed}
+            if delta:
+                deltas.append([idx, dt_ms, delta])
+        return deltas
+
+    def _merge_local(self, key: str, rows: List[Tuple[int, str, int, Dict[str, Any]]], keyframe: bool) -> List[List[Any]]:
+        """Process içi baseline'a göre delta'lar (Redis yokken)."""
+        with self._lock:
+            state = self._state.setdefault(key, {})
+            deltas = []
+            for idx, _, dt_ms, fields in rows:
+                last = state.setdefault(idx, {})
+                changed = {code: value for code, value in fields.items() if last.get(code) != value}
+                last.update(fields)
+                if changed and not keyframe:
+                    deltas.append([idx, dt_ms, changed])
+            if keyframe:
+                deltas = [[idx, 0, dict(fields)] for idx, fields in state.items() if fields]
+        return deltas
+
+    def _client(self):
+        """Redis client (hata sonrası REDIS_RETRY_SECONDS boyunca denenmez)."""
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._script = client.register_script(_MERGE_BASELINE)
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[RealtimeCodec] Redis kullanılamıyor, process içi baseline ile devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+    def reset(self, org_id: Any = None) -> None:
+        with self._lock:
+            if org_id is None:
+                self._state.clear()
+                self._keyframe_at.clear()
+            else:
+                self._state.pop(str(org_id), None)
+                self._keyframe_at.pop(str(org_id), None)
+
+
+class CompactSubscribers:
+    """
+    compact/msgpack telemetri aboneleri (organizasyon başına sid'ler).
+
+    Bağlantıyı tutan process sid'i Redis sorted set'ine (skor = lease bitişi)
+    yazar ve kendi sid'lerinin lease'ini arka plan döngüsüyle yeniler; çöken
+    process'in kayıtları lease bitince sayılmaz. Emitter (ayrı mqtt_ingest
+    container'ı dahil) active() ile delta hesaplanacak organizasyonları seçer.
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, lease: float = SUBSCRIBER_LEASE_SECONDS):
+        self.redis_url = redis_url
+        self.lease = lease
+        self._sids: Dict[str, str] = {}  # Bu process'teki abone sid -> org_id
+        self._running = False
+        self._lock = threading.Lock()
+
+        self._redis = None
+        self._redis_failed_at: Optional[float] = None
+
+    def add(self, org_id: Any, sid: str) -> None:
+        """Bağlantıyı organizasyonun compact abonesi olarak kaydet."""
+        org_key = str(org_id)
+        with self._lock:
+            previous = self._sids.get(sid)
+            self._sids[sid] = org_key
+            start = not self._running
+            self._running = True
+        if previous is not None and previous != org_key:
+            self._write({previous: [sid]}, remove=True)
+        self._write({org_key: [sid]})
+        if start:
+            socketio.start_background_task(self._run)
+
+    def remove(self, sid: str) -> None:
+        """Bağlantının compact aboneliğini bırak (json'a geçiş, disconnect, org değişimi)."""
+        with self._lock:
+            org_key = self._sids.pop(sid, None)
+        if org_key is not None:
+            self._write({org_key: [sid]}, remove=True)
+
+    def active(self, org_ids: Iterable[Any]) -> Set[str]:
+        """
+        compact/msgpack abonesi olan organizasyonlar.
+
+        Redis ayarlı ama erişilemiyorsa (diğer process'lerin aboneleri bilinemez)
+        tüm organizasyonlar aktif sayılır.
+        """
+        org_keys = [str(org_id) for org_id in org_ids]
+        with self._lock:
+            local = set(self._sids.values())
+        if not self.redis_url:
+            return {org_key for org_key in org_keys if org_key in local}
+        client = self._client()
+        if client is None:
+            return set(org_keys)
+        try:
+            pipe = client.pipeline(transaction=False)
+            now = time.time()
+            for org_key in org_keys:
+                pipe.zcount(SUBSCRIBERS_KEY_PREFIX + org_key, now, "+inf")
+            counts = pipe.execute()
+        except Exception as e:
+            self._redis_error(e)
+            return set(org_keys)
+        return {org_key for org_key, count in zip(org_keys, counts) if count or org_key in local}
+
+    def renew(self) -> None:
+        """Bu process'teki abonelerin lease'ini yenile, süresi dolan kayıtları temizle."""
+        by_org: Dict[str, List[str]] = {}
+        with self._lock:
+            for sid, org_key in self._sids.items():
+                by_org.setdefault(org_key, []).append(sid)
+        if by_org:
+            self._write(by_org)
+
+    def _write(self, by_org: Dict[str, List[str]], remove: bool = False) -> None:
+        client = self._client()
+        if client is None:
+            return
+        now = time.time()
+        try:
+            pipe = client.pipeline(transaction=False)
+            for org_key, sids in by_org.items():
+                key = SUBSCRIBERS_KEY_PREFIX + org_key
+                if remove:
+                    pipe.zrem(key, *sids)
+                    continue
+                pipe.zadd(key, {sid: now + self.lease for sid in sids})
+                pipe.zremrangebyscore(key, "-inf", now)
+                pipe.expire(key, int(self.lease * 2))
+            pipe.execute()
+        except Exception as e:
+            self._redis_error(e)
+
+    def _run(self) -> None:
+        while True:
+            socketio.sleep(self.lease / 3)
+            try:
+                self.renew()
+            except Exception:
+                logger.exception("[RealtimeCodec] Abone lease'leri yenilenemedi")
+
+    def _client(self):
+        """Redis client (hata sonrası REDIS_RETRY_SECONDS boyunca denenmez)."""
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[RealtimeCodec] Redis kullanılamıyor, compact delta'lar tüm organizasyonlar için hesaplanacak: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+def encode_fields(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Alan adlarını kodla, statik alanları at, float'ları yuvarla."""
+    fields = {}
+    for name, value in values.items():
+        if name in STATIC_FIELDS or isinstance(value, (dict, list)):
+            continue
+        if isinstance(value, float):
+            value = round(value, VALUE_PRECISION)
+        fields[FIELD_CODES.get(name, name)] = value
+    return fields
+
+
+def pack(payload: Dict[str, Any]) -> Optional[bytes]:
+    """MessagePack binary frame (msgpack kurulu değilse None)."""
+    if not MSGPACK_AVAILABLE:
+        return None
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def _epoch_ms(timestamp: Optional[str], default: int) -> int:
+    if not timestamp:
+        return default
+    try:
+        return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+    except ValueError:
+        return default
+
+
+def _as_uuid(value: Any) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+
+# Singleton instances
+_dictionary_registry: Optional[DeviceDictionaryRegistry] = None
+_compact_encoder: Optional[CompactEncoder] = None
+_compact_subscribers: Optional[CompactSubscribers] = None
+
+
+def get_device_dictionary_registry() -> DeviceDictionaryRegistry:
+    """Cihaz sözlüğü registry singleton'ı döndür."""
+    global _dictionary_registry
+    if _dictionary_registry is None:
+        _dictionary_registry = DeviceDictionaryRegistry()
+    return _dictionary_registry
+
+
+def get_compact_encoder() -> CompactEncoder:
+    """Compact encoder singleton'ı döndür."""
+    global _compact_encoder
+    if _compact_encoder is None:
+        _compact_encoder = CompactEncoder(get_device_dictionary_registry())
+    return _compact_encoder
+
+
+def get_compact_subscribers() -> CompactSubscribers:
+    """Compact abone kaydı singleton'ı döndür."""
+    global _compact_subscribers
+    if _compact_subscribers is None:
+        _compact_subscribers = CompactSubscribers()
+    return _compact_subscribers
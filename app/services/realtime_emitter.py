@@ -0,0 +1,240 @@
+"""
+Realtime Emitter - Socket.IO telemetri yayınlarını birleştiren (coalescing) emitter.
+
+MQTT/HTTP ingest her mesajda ayrı telemetry / device_status / global
+device_update emit'i yapmak yerine güncellemeleri buraya bırakır:
+
+- Organizasyon room'u başına cihaz -> son değerler (alan bazında birleştirilir)
+- REALTIME_EMIT_RATE_HZ hızında (varsayılan 2 Hz) format başına tek event:
+  telemetry_batch (json) ve telemetry_delta (compact / msgpack, bkz. realtime_codec)
+- Global broadcast yok; sadece organizasyonun telemetry room'larına gider
+- Delta'lar sadece compact/msgpack abonesi olan organizasyonlar için hesaplanır
+- Bekleyen cihaz sayısı REALTIME_EMIT_MAX_PENDING ile sınırlı (aşımda yeni cihazlar düşer)
+- Kuyruk derinliği ve birleştirme metrikleri /meta/realtime'dan okunur
+
+Flush döngüsü Socket.IO arka plan task'ı olarak (gevent altında greenlet) ilk
+güncellemede başlar.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from flask import current_app, has_app_context
+
+from app.extensions import socketio
+from app.realtime import emit_telemetry_frame
+from app.services.realtime_codec import get_compact_encoder, get_compact_subscribers, pack
+
+logger = logging.getLogger(__name__)
+
+# Varsayılan ayarlar (config ile override edilir)
+DEFAULT_RATE_HZ = 2.0
+DEFAULT_MAX_PENDING = 50000
+BATCH_EVENT = "telemetry_batch"
+DELTA_EVENT = "telemetry_delta"
+
+
+class TelemetryEmitter:
+    """
+    Thread-safe, room başına birleştiren telemetri emitter'ı.
+
+    Kullanım:
+        emitter = get_telemetry_emitter()
+        emitter.update(org_id, device_id, data={"power_w": 1200})
+        emitter.update(org_id, device_id, status={"is_on": True})
+    """
+
+    def __init__(
+        self,
+        app=None,
+        rate_hz: float = DEFAULT_RATE_HZ,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        compact: bool = True,
+        autostart: bool = True,
+    ):
+        self.app = app  # Compact format cihaz sözlüğü için (flush app context dışında çalışır)
+        self.interval = 1.0 / max(0.1, rate_hz)
+        self.max_pending = max(1, max_pending)
+        self.compact = compact
+        self.autostart = autostart
+
+        # org_id -> device_id -> {"data": {...}, "status": {...}, "timestamp": iso}
+        self._pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._pending_count = 0
+        self._running = False
+        self._lock = threading.Lock()
+        self._stats = {
+            "updates": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "events_emitted": 0,
+            "devices_emitted": 0,
+            "delta_events_emitted": 0,
+            "delta_orgs_skipped": 0,
+            "delta_bytes": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def update(
+        self,
+        org_id: Any,
+        device_id: Any,
+        data: Optional[Dict[str, Any]] = None,
+        status: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """
+        Cihaz güncellemesini bir sonraki batch'e ekle.
+
+        Aynı flush aralığındaki güncellemeler alan bazında birleşir (son değer kazanır).
+
+        Returns:
+            Kuyruğa alındıysa True (kapasite dolu ve cihaz yeni ise False)
+        """
+        if org_id in (None, "") or device_id in (None, ""):
+            return False
+        org_key, device_key = str(org_id), str(device_id)
+
+        with self._lock:
+            self._stats["updates"] += 1
+            entry = self._pending.get(org_key, {}).get(device_key)
+            if entry is None:
+                if self._pending_count >= self.max_pending:
+                    self._stats["dropped"] += 1
+                    return False
+                entry = self._pending.setdefault(org_key, {})[device_key] = {"device_id": device_key}
+                self._pending_count += 1
+            else:
+                self._stats["coalesced"] += 1
+            if data:
+                entry.setdefault("data", {}).update(data)
+            if status:
+                entry.setdefault("status", {}).update(status)
+            entry["timestamp"] = datetime.now(timezone.utc).isoformat()
+
+        if self.autostart:
+            self.start()
+        return True
+
+    def flush(self) -> int:
+        """Bekleyen güncellemeleri room başına tek event olarak gönder; gönderilen event sayısı."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_count = 0
+        if not pending:
+            return 0
+
+        started = time.monotonic()
+        events = devices = deltas = delta_bytes = 0
+        compact_orgs = self._compact_orgs(pending) if self.compact else set()
+        for org_id, entries in pending.items():
+            batch = list(entries.values())
+            try:
+                emit_telemetry_frame(BATCH_EVENT, {
+                    "devices": batch,
+                    "count": len(batch),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                }, org_id)
+                events += 1
+                devices += len(batch)
+            except Exception as e:
+                logger.warning(f"[RealtimeEmitter] {org_id} batch'i gönderilemedi: {e}")
+            if org_id in compact_orgs:
+                sent, size = self._emit_delta(org_id, batch)
+                deltas += sent
+                delta_bytes += size
+
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["events_emitted"] += events
+            self._stats["devices_emitted"] += devices
+            self._stats["delta_events_emitted"] += deltas
+            if self.compact:
+                self._stats["delta_orgs_skipped"] += len(pending) - len(compact_orgs)
+            self._stats["delta_bytes"] += delta_bytes
+            self._stats["last_flush_ms"] = round((time.monotonic() - started) * 1000, 2)
+        return events
+
+    @staticmethod
+    def _compact_orgs(org_ids: Iterable[str]) -> Set[str]:
+        """Delta gönderilecek organizasyonlar (abone sorgusu başarısızsa hepsi)."""
+        try:
+            return get_compact_subscribers().active(org_ids)
+        except Exception as e:
+            logger.warning(f"[RealtimeEmitter] Compact aboneleri okunamadı: {e}")
+            return set(org_ids)
+
+    def _emit_delta(self, org_id: str, batch: List[Dict[str, Any]]):
+        """Compact (JSON) ve msgpack delta frame'lerini gönder; (event sayısı, msgpack byte)."""
+        try:
+            with self.app.app_context() if self.app is not None else nullcontext():
+                payload = get_compact_encoder().encode(org_id, batch)
+            if payload is None:
+                return 0, 0
+            emit_telemetry_frame(DELTA_EVENT, payload, org_id, "compact")
+            packed = pack(payload)
+            if packed is not None:
+                emit_telemetry_frame(DELTA_EVENT, packed, org_id, "msgpack")
+                return 2, len(packed)
+            return 1, 0
+        except Exception as e:
+            logger.warning(f"[RealtimeEmitter] {org_id} delta'sı gönderilemedi: {e}")
+            return 0, 0
+
+    def start(self) -> None:
+        """Flush döngüsünü başlat (idempotent)."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        socketio.start_background_task(self._run)
+
+    def stop(self) -> None:
+        """Döngüyü durdur ve bekleyenleri gönder."""
+        with self._lock:
+            self._running = False
+        self.flush()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Kuyruk derinliği ve birleştirme metrikleri."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "pending_devices": self._pending_count,
+                "pending_rooms": len(self._pending),
+                "max_pending": self.max_pending,
+                "rate_hz": round(1.0 / self.interval, 2),
+                "running": self._running,
+            })
+        return stats
+
+    def _run(self) -> None:
+        while self._running:
+            socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("[RealtimeEmitter] Flush hatası")
+
+
+# Singleton instance
+_telemetry_emitter: Optional[TelemetryEmitter] = None
+
+
+def get_telemetry_emitter() -> TelemetryEmitter:
+    """Telemetry emitter singleton'ı döndür (ayarlar app config'inden)."""
+    global _telemetry_emitter
+    if _telemetry_emitter is None:
+        config = current_app.config if has_app_context() else {}
+        _telemetry_emitter = TelemetryEmitter(
+            app=current_app._get_current_object() if has_app_context() else None,
+            rate_hz=config.get("REALTIME_EMIT_RATE_HZ", DEFAULT_RATE_HZ),
+            max_pending=config.get("REALTIME_EMIT_MAX_PENDING", DEFAULT_MAX_PENDING),
+            compact=config.get("REALTIME_COMPACT_ENABLED", True),
+        )
+    return _telemetry_emitter
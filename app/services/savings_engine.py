@@ -0,0 +1,382 @@
+"""
+Savings Engine - DeviceStateLog aralıklarından toplu tasarruf hesabı.
+
+SavingsService.record_device_state_change artık yalnızca durum log'u yazar; tasarruf
+bu motor tarafından periyodik olarak, çok sayıda cihaz için birlikte hesaplanır:
+
+- Watermark ile kesim zamanı (now - COMMIT_LAG_SECONDS) arasında log'u olan cihazlar bulunur;
+  her log bir kez işlenir, watermark kesim zamanına ilerler
+- Cihaz başına etkilenen ilk gün: yeni kapanan aralık tasarruf ediyorsa (off / dimmed)
+  açılış log'unun günü, aksi halde ilk yeni log'un günü
+- Bu cihazların log'ları kendi başlangıç günlerinden itibaren (o andaki durumla birlikte) okunur
+- Aralıklar NumPy ile kurulur: off = tam güç, dimmed = (100 - power_level)% güç tasarrufu, on = yok
+- Aralıklar saat sınırlarında bölünür ve saatlik MarketPrice ile fiyatlanır; fiyatı olmayan
+  saatler (ve TRY dışı para birimli organizasyonlar) sabit electricity_price_kwh ile
+- Sonuç (cihaz, gün, kaynak) başına toplanır; etkilenen günlerin energy_savings satırları
+  silinip toplu yazılır. Aynı aralık tekrar işlense de sonuç değişmez (idempotent)
+
+Yalnızca kapanmış aralıklar (ardından yeni bir durum log'u gelmiş) hesaplanır; günü aşan
+aralıklar gün sınırında bölünür. Watermark Redis'te tutulur; Redis yoksa process içinde.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from sqlalchemy import and_, func, insert
+
+from app.extensions import db
+from app.models import MarketPrice, Organization, SmartAsset, SmartDevice
+from app.models.savings import DeviceStateLog, EnergySavings
+from app.services.dashboard_stats import get_daily_stats_store
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+SAVINGS_WATERMARK_KEY = "awaxen:savings:watermark"
+COMMIT_LAG_SECONDS = 300  # Bundan yeni log'lar henüz commit edilmemiş olabilir; sonraki çalıştırmaya kalır
+INITIAL_LOOKBACK_HOURS = 48  # Watermark yoksa geriye bakılan süre
+REDIS_RETRY_SECONDS = 30
+
+DEFAULT_PRICE_KWH = 2.5
+MARKET_CURRENCY = "TRY"
+SAVING_STATES = ("off", "dimmed")
+
+# (device_id, timestamp, state, power_level, triggered_by, automation_id)
+LogRow = Tuple[Any, datetime, str, Optional[int], Optional[str], Any]
+# device_id -> (organization_id, güç W); organization_id -> (sabit fiyat, para birimi)
+DeviceInfo = Dict[str, Tuple[Any, int]]
+OrgInfo = Dict[str, Tuple[float, str]]
+
+
+def _epoch(ts: datetime) -> float:
+    return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _day_start(ts: datetime) -> datetime:
+    ts = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def savings_rows(
+    logs: Sequence[LogRow],
+    devices: DeviceInfo,
+    orgs: OrgInfo,
+    prices: Dict[int, float],
+    start: Union[datetime, Dict[str, datetime]],
+) -> List[Dict[str, Any]]:
+    """
+    Cihaz + zamana göre sıralı log'lardan energy_savings satırları (start'tan itibaren).
+
+    start: tüm cihazlar için tek başlangıç veya cihaz (str id) başına başlangıç
+    prices: saat başı epoch saati (unix saniye // 3600) -> TL/kWh
+    """
+    if len(logs) < 2:
+        return []
+
+    device_keys = [str(row[0]) for row in logs]
+    codes: Dict[str, int] = {}
+    dev = np.fromiter((codes.setdefault(key, len(codes)) for key in device_keys), dtype=np.int64, count=len(logs))
+    device_list = list(codes)
+    ts = np.fromiter((_epoch(row[1]) for row in logs), dtype=np.float64, count=len(logs))
+    states = np.array([row[2] for row in logs])
+    levels = np.fromiter((row[3] if row[3] is not None else 100 for row in logs), dtype=np.float64, count=len(logs))
+    source_codes: Dict[str, int] = {}
+    src = np.fromiter(
+        (source_codes.setdefault(row[4] or "manual", len(source_codes)) for row in logs), dtype=np.int64, count=len(logs)
+    )
+    source_list = list(source_codes)
+
+    # Cihaz başına güç, sabit fiyat ve piyasa fiyatı kullanılabilirliği
+    info = [devices.get(key, (None, 0)) for key in device_list]
+    power_kw = np.array([power / 1000.0 for _, power in info], dtype=np.float64)
+    org_info = [orgs.get(str(org_id), (DEFAULT_PRICE_KWH, MARKET_CURRENCY)) for org_id, _ in info]
+    flat_price = np.array([price for price, _ in org_info], dtype=np.float64)
+    market_ok = np.array([currency == MARKET_CURRENCY for _, currency in org_info], dtype=bool)
+    starts = start if isinstance(start, dict) else {}
+    device_start = np.array(
+        [_epoch(starts.get(key, start)) if starts else _epoch(start) for key in device_list], dtype=np.float64
+    )
+
+    # Her log bir sonraki log'a kadar süren bir aralık açar (aynı cihaz içinde)
+    reduction = np.where(
+        states == "off", 1.0, np.where(states == "dimmed", (100.0 - np.clip(levels, 0, 100)) / 100.0, 0.0)
+    )
+    begin = np.maximum(ts[:-1], device_start[dev[:-1]])
+    end = ts[1:]
+    valid = (dev[:-1] == dev[1:]) & (reduction[:-1] > 0) & (end > begin) & (power_kw[dev[:-1]] > 0)
+    idx = np.flatnonzero(valid)
+    if not idx.size:
+        return []
+    begin, end = begin[idx], end[idx]
+
+    # Aralıkları saat sınırlarında parçala
+    first_hour = np.floor(begin / 3600).astype(np.int64)
+    counts = np.ceil(end / 3600).astype(np.int64) - first_hour
+    seg = np.repeat(np.arange(idx.size), counts)
+    hour = first_hour[seg] + (np.arange(seg.size) - np.repeat(np.cumsum(counts) - counts, counts))
+    seconds = np.minimum(end[seg], (hour + 1) * 3600.0) - np.maximum(begin[seg], hour * 3600.0)
+    log_idx = idx[seg]
+    seg_dev = dev[log_idx]
+
+    # Saatlik piyasa fiyatı; yoksa organizasyonun sabit fiyatı
+    price_hours = np.fromiter(sorted(prices), dtype=np.int64, count=len(prices))
+    price_values = np.array([prices[h] for h in price_hours.tolist()], dtype=np.float64)
+    if price_hours.size:
+        pos = np.minimum(np.searchsorted(price_hours, hour), price_hours.size - 1)
+        market = (price_hours[pos] == hour) & market_ok[seg_dev]
+        price = np.where(market, price_values[pos], flat_price[seg_dev])
+    else:
+        market = np.zeros(seg.size, dtype=bool)
+        price = flat_price[seg_dev]
+
+    weight = reduction[log_idx] * seconds
+    kwh = power_kw[seg_dev] * weight / 3600.0
+    money = kwh * price
+
+    # (cihaz, gün, kaynak) başına topla
+    day = hour // 24
+    day_min = int(day.min())
+    n_days = int(day.max()) - day_min + 1
+    key = (seg_dev * n_days + (day - day_min)) * len(source_list) + src[log_idx]
+    groups, inverse = np.unique(key, return_inverse=True)
+    totals_kwh = np.bincount(inverse, weights=kwh)
+    totals_money = np.bincount(inverse, weights=money)
+    totals_minutes = np.bincount(inverse, weights=weight / 60.0)
+    market_minutes = np.bincount(inverse, weights=np.where(market, seconds / 60.0, 0.0))
+    last = np.full(groups.size, -1, dtype=np.int64)
+    np.maximum.at(last, inverse, np.arange(seg.size))  # Grubun en son parçası (otomasyon bilgisi için)
+
+    rows = []
+    epoch_day = date(1970, 1, 1)
+    for group in range(groups.size):
+        segment = int(last[group])
+        device_key = device_list[int(seg_dev[segment])]
+        org_id, power_watt = devices[device_key]
+        log = logs[int(log_idx[segment])]
+        rows.append({
+            "organization_id": org_id,
+            "device_id": log[0],
+            "automation_id": log[5],
+            "date": epoch_day + timedelta(days=int(day[segment])),
+            "off_duration_minutes": int(round(totals_minutes[group])),
+            "power_rating_watt": power_watt,
+            "energy_saved_kwh": Decimal(str(round(float(totals_kwh[group]), 4))),
+            "money_saved": Decimal(str(round(float(totals_money[group]), 2))),
+            "currency": org_info[int(seg_dev[segment])][1],
+            "source_type": source_list[int(src[log_idx[segment]])],
+            "details": {"engine": "intervals", "market_priced_minutes": int(round(market_minutes[group]))},
+        })
+    return rows
+
+
+def _group_by_day(starts: Dict[Any, datetime]) -> Dict[date, List[Any]]:
+    """{anahtar: başlangıç} -> {başlangıç günü: [anahtarlar]} (gün başına tek sorgu için)."""
+    groups: Dict[date, List[Any]] = {}
+    for key, ts in starts.items():
+        groups.setdefault(ts.date(), []).append(key)
+    return groups
+
+
+class SavingsEngine:
+    """
+    Watermark'tan itibaren artımlı toplu tasarruf hesabı.
+
+    Kullanım:
+        get_savings_engine().run()    # {"devices": ..., "rows": ...}
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL):
+        self.redis_url = redis_url
+
+        self._local_watermark: Optional[float] = None
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_failed_at: Optional[float] = None
+
+    def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Watermark'tan sonra durum değiştiren cihazların etkilenen günlerini yeniden hesapla."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=COMMIT_LAG_SECONDS)
+        since = self.watermark() or now - timedelta(hours=INITIAL_LOOKBACK_HOURS)
+        if cutoff <= since:
+            return {"devices": 0, "rows": 0}
+
+        changed = dict(db.session.query(DeviceStateLog.device_id, func.min(DeviceStateLog.timestamp)).filter(
+            DeviceStateLog.timestamp > since, DeviceStateLog.timestamp <= cutoff
+        ).group_by(DeviceStateLog.device_id).all())
+        if not changed:
+            self.set_watermark(_epoch(cutoff))
+            return {"devices": 0, "rows": 0}
+        device_ids = list(changed)
+
+        starts = self._starts(changed, since)
+        logs = self._load_logs(starts, cutoff)
+        devices, orgs = self._load_devices(device_ids)
+        first = min(starts.values())
+        prices = self._load_prices(first, logs[-1][1] if logs else cutoff)
+        rows = savings_rows(logs, devices, orgs, prices, {str(device_id): ts for device_id, ts in starts.items()})
+
+        for day, ids in _group_by_day(starts).items():
+            EnergySavings.query.filter(
+                EnergySavings.device_id.in_(ids), EnergySavings.date >= day
+            ).delete(synchronize_session=False)
+        if rows:
+            db.session.execute(insert(EnergySavings), rows)
+        db.session.commit()
+
+        # Organizasyon başına etkilenen ilk günden itibaren günlük özetler
+        org_starts: Dict[Any, datetime] = {}
+        for device_id, ts in starts.items():
+            org_id = devices.get(str(device_id), (None, 0))[0]
+            if org_id is not None:
+                org_starts[org_id] = min(ts, org_starts.get(org_id, ts))
+        for day, org_ids in _group_by_day(org_starts).items():
+            get_daily_stats_store().refresh(org_ids, day, now.date())
+
+        self.set_watermark(_epoch(cutoff))
+        return {"devices": len(device_ids), "rows": len(rows)}
+
+    def watermark(self) -> Optional[datetime]:
+        """Son işlenen log zamanı (hiç çalışmadıysa None)."""
+        value = None
+        client = self._client()
+        if client is not None:
+            try:
+                value = client.get(SAVINGS_WATERMARK_KEY)
+            except Exception as e:
+                self._redis_error(e)
+                client = None
+        if client is None:
+            with self._lock:
+                value = self._local_watermark
+        return datetime.fromtimestamp(float(value), tz=timezone.utc) if value is not None else None
+
+    def set_watermark(self, epoch: float) -> None:
+        client = self._client()
+        if client is not None:
+            try:
+                client.set(SAVINGS_WATERMARK_KEY, epoch)
+                return
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            self._local_watermark = epoch
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _starts(self, changed: Dict[Any, datetime], since: datetime) -> Dict[Any, datetime]:
+        """
+        Cihaz başına yeniden hesaplanacak ilk gün.
+
+        Yeni kapanan aralık watermark'taki (açılış) durumla başlar; yalnızca bu durum
+        tasarruf ediyorsa (off / dimmed) başlangıç açılış log'unun gününe çekilir.
+        Aylardır açık kalan cihazın yeni log'u eski günleri yeniden hesaplatmaz.
+        """
+        latest = db.session.query(
+            DeviceStateLog.device_id.label("device_id"), func.max(DeviceStateLog.timestamp).label("timestamp")
+        ).filter(
+            DeviceStateLog.device_id.in_(list(changed)), DeviceStateLog.timestamp <= since
+        ).group_by(DeviceStateLog.device_id).subquery()
+        opened = {
+            device_id: timestamp
+            for device_id, timestamp, state in db.session.query(
+                DeviceStateLog.device_id, DeviceStateLog.timestamp, DeviceStateLog.state
+            ).join(latest, and_(
+                DeviceStateLog.device_id == latest.c.device_id, DeviceStateLog.timestamp == latest.c.timestamp
+            )).all()
+            if state in SAVING_STATES
+        }
+        return {device_id: _day_start(opened.get(device_id, first)) for device_id, first in changed.items()}
+
+    def _load_logs(self, starts: Dict[Any, datetime], until: datetime) -> List[LogRow]:
+        """Cihaz başına start..until log'ları + start anındaki durum; cihaz ve zamana göre sıralı."""
+        columns = (
+            DeviceStateLog.device_id, DeviceStateLog.timestamp, DeviceStateLog.state,
+            DeviceStateLog.power_level, DeviceStateLog.triggered_by, DeviceStateLog.automation_id,
+        )
+        rows = []
+        for day, device_ids in _group_by_day(starts).items():
+            start = _day_start(datetime(day.year, day.month, day.day))
+            previous = db.session.query(
+                DeviceStateLog.device_id.label("device_id"), func.max(DeviceStateLog.timestamp).label("timestamp")
+            ).filter(
+                DeviceStateLog.device_id.in_(device_ids), DeviceStateLog.timestamp < start
+            ).group_by(DeviceStateLog.device_id).subquery()
+
+            rows += db.session.query(*columns).join(previous, and_(
+                DeviceStateLog.device_id == previous.c.device_id, DeviceStateLog.timestamp == previous.c.timestamp
+            )).all()
+            rows += db.session.query(*columns).filter(
+                DeviceStateLog.device_id.in_(device_ids),
+                DeviceStateLog.timestamp >= start,
+                DeviceStateLog.timestamp <= until,
+            ).all()
+        return sorted((tuple(row) for row in rows), key=lambda row: (str(row[0]), _epoch(row[1])))
+
+    def _load_devices(self, device_ids: List[Any]) -> Tuple[DeviceInfo, OrgInfo]:
+        rows = db.session.query(
+            SmartDevice.id, SmartDevice.organization_id, SmartDevice.power_rating_watt, SmartAsset.nominal_power_watt
+        ).outerjoin(SmartAsset, SmartAsset.device_id == SmartDevice.id).filter(SmartDevice.id.in_(device_ids)).all()
+        devices = {
+            str(device_id): (org_id, int(power or nominal or 0)) for device_id, org_id, power, nominal in rows
+        }
+
+        org_ids = list({org_id for org_id, _ in devices.values()})
+        orgs = {
+            str(org_id): (float(price) if price else DEFAULT_PRICE_KWH, currency or MARKET_CURRENCY)
+            for org_id, price, currency in db.session.query(
+                Organization.id, Organization.electricity_price_kwh, Organization.currency
+            ).filter(Organization.id.in_(org_ids)).all()
+        } if org_ids else {}
+        return devices, orgs
+
+    def _load_prices(self, start: datetime, end: datetime) -> Dict[int, float]:
+        rows = db.session.query(MarketPrice.time, MarketPrice.price).filter(
+            MarketPrice.time >= start, MarketPrice.time <= end
+        ).all()
+        return {int(_epoch(ts)) // 3600: float(price) for ts, price in rows if price is not None}
+
+    def _client(self):
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[SavingsEngine] Redis kullanılamıyor, watermark bellek içinde tutuluyor: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+# Singleton instance
+_savings_engine: Optional[SavingsEngine] = None
+
+
+def get_savings_engine() -> SavingsEngine:
+    """Savings engine singleton'ı döndür."""
+    global _savings_engine
+    if _savings_engine is None:
+        _savings_engine = SavingsEngine()
+    return _savings_engine
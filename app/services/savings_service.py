@@ -4,13 +4,12 @@ Awaxen Services - Energy Savings Calculator.
 Otomasyon kaynaklı enerji tasarruflarını hesaplar ve kaydeder.
 
 Tasarruf Hesaplama Mantığı:
-1. Cihaz kapandığında veya dimmer düşürüldüğünde DeviceStateLog'a kayıt yapılır
-2. Cihaz tekrar açıldığında, kapalı kalma süresi hesaplanır
-3. Tasarruf = Kapalı Süre (saat) × Cihaz Gücü (kW) × Elektrik Fiyatı
+1. Her durum değişikliği (on, off, dimmed) DeviceStateLog'a kayıt yapılır
+2. SavingsEngine log'lardan aralıkları toplu olarak kurar (app/services/savings_engine.py)
+3. Tasarruf = Süre (saat) × Cihaz Gücü (kW) × Güç Azalması × Saatlik Fiyat
 """
 from datetime import datetime, timezone, date, timedelta
 from typing import Optional, Dict, Any, List
-from decimal import Decimal
 import logging
 
 from sqlalchemy import func, and_
@@ -43,7 +42,10 @@ class SavingsService:
         automation_id: str = None
     ) -> Optional[Dict[str, Any]]:
         """
-        Cihaz durum değişikliğini kaydet ve tasarruf hesapla.
+        Cihaz durum değişikliğini kaydet.
+        
+        Tasarruf burada hesaplanmaz; aralıklar SavingsEngine tarafından
+        (compute_energy_savings beat job'ı) toplu olarak fiyatlanır.
         
         Args:
             device_id: Cihaz UUID
@@ -53,157 +55,26 @@ class SavingsService:
             automation_id: Otomasyon UUID (varsa)
         
         Returns:
-            dict: Hesaplanan tasarruf bilgisi veya None
+            dict: Kaydedilen durum bilgisi veya None
         """
         try:
-            device = SmartDevice.query.get(device_id)
-            if not device:
-                logger.warning(f"Device not found: {device_id}")
-                return None
-            
-            now = datetime.now(timezone.utc)
-            
-            # Get last state
-            last_state = DeviceStateLog.query.filter_by(
-                device_id=device_id
-            ).order_by(DeviceStateLog.timestamp.desc()).first()
-            
-            # Record new state
             state_log = DeviceStateLog(
                 device_id=device_id,
-                timestamp=now,
+                timestamp=datetime.now(timezone.utc),
                 state=new_state,
                 power_level=power_level,
                 triggered_by=triggered_by,
                 automation_id=automation_id
             )
             db.session.add(state_log)
-            
-            savings_result = None
-            
-            # Calculate savings if device was off and now turning on
-            if last_state and last_state.state == "off" and new_state == "on":
-                savings_result = cls._calculate_and_record_savings(
-                    device=device,
-                    off_start=last_state.timestamp,
-                    off_end=now,
-                    triggered_by=last_state.triggered_by,
-                    automation_id=last_state.automation_id
-                )
-            
-            # Calculate savings for dimmer reduction
-            elif last_state and new_state == "dimmed" and last_state.state == "on":
-                # Partial savings from dimming
-                power_reduction = (100 - power_level) / 100
-                if power_reduction > 0:
-                    # Record as ongoing dimmed state - savings calculated when turned off or back to full
-                    pass
-            
             db.session.commit()
-            return savings_result
+            return state_log.to_dict()
             
         except Exception as e:
             logger.error(f"Error recording device state change: {e}")
             db.session.rollback()
             return None
     
-    @classmethod
-    def _calculate_and_record_savings(
-        cls,
-        device: SmartDevice,
-        off_start: datetime,
-        off_end: datetime,
-        triggered_by: str,
-        automation_id: str = None
-    ) -> Dict[str, Any]:
-        """
-        Tasarruf hesapla ve kaydet.
-        
-        Args:
-            device: SmartDevice instance
-            off_start: Kapanma zamanı
-            off_end: Açılma zamanı
-            triggered_by: Tetikleyen kaynak
-            automation_id: Otomasyon ID
-        
-        Returns:
-            dict: Tasarruf bilgisi
-        """
-        # Get organization for electricity price
-        org = Organization.query.get(device.organization_id)
-        electricity_price = float(org.electricity_price_kwh) if org and org.electricity_price_kwh else 2.5
-        currency = org.currency if org else "TRY"
-        
-        # Calculate duration in minutes
-        duration = off_end - off_start
-        duration_minutes = int(duration.total_seconds() / 60)
-        
-        # Get device power rating
-        power_watt = device.power_rating_watt or 0
-        if power_watt == 0:
-            # Try to get from asset nominal power
-            if device.asset and device.asset.nominal_power_watt:
-                power_watt = device.asset.nominal_power_watt
-        
-        # Calculate savings
-        savings = EnergySavings.calculate_savings(
-            power_watt=power_watt,
-            duration_minutes=duration_minutes,
-            price_per_kwh=electricity_price
-        )
-        
-        # Record savings
-        today = off_end.date()
-        
-        # Check if there's already a record for this device today
-        existing = EnergySavings.query.filter_by(
-            organization_id=device.organization_id,
-            device_id=device.id,
-            date=today,
-            source_type=triggered_by
-        ).first()
-        
-        if existing:
-            # Update existing record
-            existing.off_duration_minutes += duration_minutes
-            existing.energy_saved_kwh = Decimal(str(
-                float(existing.energy_saved_kwh or 0) + savings["energy_saved_kwh"]
-            ))
-            existing.money_saved = Decimal(str(
-                float(existing.money_saved or 0) + savings["money_saved"]
-            ))
-        else:
-            # Create new record
-            savings_record = EnergySavings(
-                organization_id=device.organization_id,
-                device_id=device.id,
-                automation_id=automation_id,
-                date=today,
-                off_duration_minutes=duration_minutes,
-                power_rating_watt=power_watt,
-                energy_saved_kwh=Decimal(str(savings["energy_saved_kwh"])),
-                money_saved=Decimal(str(savings["money_saved"])),
-                currency=currency,
-                source_type=triggered_by,
-                details={
-                    "off_start": off_start.isoformat(),
-                    "off_end": off_end.isoformat(),
-                    "electricity_price": electricity_price
-                }
-            )
-            db.session.add(savings_record)
-        
-        return {
-            "device_id": str(device.id),
-            "device_name": device.name,
-            "duration_minutes": duration_minutes,
-            "power_watt": power_watt,
-            "energy_saved_kwh": savings["energy_saved_kwh"],
-            "money_saved": savings["money_saved"],
-            "currency": currency,
-            "source_type": triggered_by
-        }
-    
     @classmethod
     def get_organization_savings(
         cls,
@@ -3,13 +3,18 @@ Shelly Cloud Service - Shelly cihazlarını kontrol et.
 
 Shelly Cloud API: https://shelly-api-docs.shelly.cloud/cloud-control-api/
 """
+import threading
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any
-
-import requests
+from typing import Optional, Dict, Any, Tuple
+from uuid import UUID
 
 from app.extensions import db
 from app.models import Integration, SmartDevice
+from app.services.device_resolver import get_device_resolver
+from app.services.http_client import get_http_client
+
+SHELLY_SERVICE_TTL_SECONDS = 300  # Registry'deki servisin entegrasyondan yeniden okunma aralığı
 
 
 class ShellyService:
@@ -32,7 +37,9 @@ class ShellyService:
         if integration.provider != 'shelly':
             raise ValueError("Integration must be a Shelly integration")
         
-        self.integration = integration
+        # ORM nesnesi tutulmaz: servis registry'de request'ler ve thread'ler arasında paylaşılır
+        self.integration_id = integration.id
+        self.organization_id = integration.organization_id
         self.auth_key = integration.access_token
         
         provider_data = integration.provider_data or {}
@@ -54,8 +61,8 @@ class ShellyService:
             server_uri = f"https://{server_uri}"
         return server_uri.rstrip("/")
     
-    def _make_request(self, endpoint: str, data: dict = None) -> dict:
-        """API isteği yap."""
+    def _make_request(self, endpoint: str, data: dict = None, timeout: Optional[float] = None, retry: bool = True) -> dict:
+        """API isteği yap (retry=False: HTTP client retry'ı yapılmaz, çağıran tekrarlar)."""
         if not self.auth_key:
             raise ValueError("No access token available")
         
@@ -64,7 +71,10 @@ class ShellyService:
         if data:
             payload.update(data)
         
-        response = requests.post(url, data=payload, timeout=self.TIMEOUT)
+        response = get_http_client().post(url, data=payload, timeout=timeout or self.TIMEOUT, retry=retry)
+        if response.status_code in (401, 403):
+            # Token başka bir process'te yenilenmiş olabilir; bir sonraki çağrı entegrasyonu yeniden okur
+            get_shelly_registry().invalidate(self.organization_id)
         response.raise_for_status()
         
         result = response.json()
@@ -137,11 +147,7 @@ class ShellyService:
             raise ValueError("Device has no external_id")
         
         try:
-            self._make_request('device/relay/control', {
-                'id': device.external_id,
-                'channel': 0,
-                'turn': action
-            })
+            self.relay_control(device.external_id, action)
             
             # Cihaz durumunu güncelle
             device.last_seen = datetime.utcnow()
@@ -153,6 +159,30 @@ class ShellyService:
             print(f"Shelly control error: {e}")
             return False
     
+    def relay_control(self, external_id: str, action: str, timeout: Optional[float] = None, retry: bool = True) -> None:
+        """
+        Röleyi kontrol et (sadece API çağrısı; DB'ye dokunmaz, hata fırlatır).
+        
+        Args:
+            action: 'on', 'off', 'toggle'
+            timeout: İstek zaman aşımı (varsayılan TIMEOUT)
+            retry: False ise HTTP client bağlantı retry'ı yapmaz (DeviceCommandDispatcher kendi retry'ını yapar)
+        """
+        self._make_request('device/relay/control', {
+            'id': external_id,
+            'channel': 0,
+            'turn': action
+        }, timeout=timeout, retry=retry)
+    
+    def light_control(self, external_id: str, brightness: int, timeout: Optional[float] = None, retry: bool = True) -> None:
+        """Dimmer/RGBW parlaklığını ayarla (sadece API çağrısı; DB'ye dokunmaz, hata fırlatır)."""
+        self._make_request('device/light/control', {
+            'id': external_id,
+            'channel': 0,
+            'brightness': max(0, min(100, brightness)),
+            'turn': 'on' if brightness > 0 else 'off'
+        }, timeout=timeout, retry=retry)
+    
     def set_power_limit(self, device: SmartDevice, power_limit: int) -> bool:
         """
         Güç limitini veya parlaklık seviyesini ayarla (dimmer/RGBW için).
@@ -170,13 +200,7 @@ class ShellyService:
         # Dimmer cihazlar için parlaklık ayarı
         if device.device_type in ['dimmer', 'rgbw']:
             try:
-                # Shelly Cloud API - Light control
-                self._make_request('device/light/control', {
-                    'id': device.external_id,
-                    'channel': 0,
-                    'brightness': max(0, min(100, power_limit)),
-                    'turn': 'on' if power_limit > 0 else 'off'
-                })
+                self.light_control(device.external_id, power_limit)
                 
                 device.last_seen = datetime.utcnow()
                 db.session.commit()
@@ -235,7 +259,7 @@ class ShellyService:
             is_online = cloud_info.get('connected', False)
             
             existing = SmartDevice.query.filter_by(
-                integration_id=self.integration.id,
+                integration_id=self.integration_id,
                 external_id=device_id
             ).first()
             
@@ -256,8 +280,8 @@ class ShellyService:
                 existing.settings = {**(existing.settings or {}), **{k: v for k, v in settings_payload.items() if v}}
             else:
                 new_device = SmartDevice(
-                    organization_id=self.integration.organization_id,
-                    integration_id=self.integration.id,
+                    organization_id=self.organization_id,
+                    integration_id=self.integration_id,
                     external_id=device_id,
                     name=name,
                     brand='shelly',
@@ -278,9 +302,14 @@ class ShellyService:
                 'online': is_online,
             })
         
-        self.integration.last_sync_at = datetime.utcnow()
+        integration = db.session.get(Integration, self.integration_id)
+        if integration:
+            integration.last_sync_at = datetime.utcnow()
         db.session.commit()
         
+        # Yeni cihazlar için negatif cache kayıtlarını temizle
+        get_device_resolver().clear()
+        
         return synced
     
     @staticmethod
@@ -297,9 +326,72 @@ class ShellyService:
         return "relay"
 
 
+class ShellyServiceRegistry:
+    """
+    Process içi ShellyService registry'si (organization başına, TTL'li).
+
+    Her çağrıda Integration sorgusu + token decrypt + yeni servis yerine
+    aynı servis (ve HTTP client'taki keep-alive bağlantısı) yeniden kullanılır.
+    "Entegrasyon yok" sonucu cache'lenmez: başka bir process'te (ör. API) oluşturulan
+    entegrasyon Celery worker'da bir sonraki çağrıda görünür.
+
+    Entegrasyon oluşturulduğunda/güncellendiğinde/silindiğinde ve token
+    yenilendiğinde invalidate() çağrılır; diğer process'ler TTL ile veya
+    Shelly 401/403 döndüğünde yeniler.
+    """
+
+    def __init__(self, ttl: float = SHELLY_SERVICE_TTL_SECONDS):
+        self.ttl = ttl
+        self._services: Dict[str, Tuple[Optional[ShellyService], float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, organization_id) -> Optional[ShellyService]:
+        key = str(organization_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._services.get(key)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+
+        integration = Integration.query.filter_by(
+            organization_id=UUID(key),
+            provider='shelly',
+            is_active=True,
+            status='active'
+        ).first()
+        service = ShellyService(integration) if integration else None
+
+        with self._lock:
+            if service is None:
+                self._services.pop(key, None)
+            else:
+                self._services[key] = (service, now + self.ttl)
+        return service
+
+    def invalidate(self, organization_id=None) -> None:
+        """Organizasyonun (veya None ise tümünün) servisini düşür."""
+        with self._lock:
+            if organization_id is None:
+                self._services.clear()
+            else:
+                self._services.pop(str(organization_id), None)
+
+
+# Singleton instance
+_shelly_registry: Optional[ShellyServiceRegistry] = None
+
+
+def get_shelly_registry() -> ShellyServiceRegistry:
+    """Shelly service registry singleton'ı döndür."""
+    global _shelly_registry
+    if _shelly_registry is None:
+        _shelly_registry = ShellyServiceRegistry()
+    return _shelly_registry
+
+
 def get_shelly_service(organization_id: str) -> Optional[ShellyService]:
     """
-    Organization için Shelly servisini döndür.
+    Organization için Shelly servisini döndür (registry üzerinden).
     
     Args:
         organization_id: Organization UUID
@@ -307,13 +399,4 @@ def get_shelly_service(organization_id: str) -> Optional[ShellyService]:
     Returns:
         ShellyService instance veya None
     """
-    integration = Integration.query.filter_by(
-        organization_id=organization_id,
-        provider='shelly',
-        is_active=True,
-        status='active'
-    ).first()
-    
-    if integration:
-        return ShellyService(integration)
-    return None
+    return get_shelly_registry().get(organization_id)
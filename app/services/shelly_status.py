@@ -0,0 +1,247 @@
+"""
+Shelly Status - device/all_status tabanlı toplu durum snapshot cache'i.
+
+Otomasyon koşulları ve cihaz detay endpoint'i her cihaz için ayrı
+device/status çağrısı yapmak yerine buradaki snapshot'ı okur:
+
+- poll_shelly_statuses beat job'ı entegrasyon başına tek device/all_status çağrısı yapar
+- Cihaz başına röle/güç snapshot'ı polled_at zaman damgasıyla Redis'te (yoksa bellekte) tutulur
+- Okuyucular snapshot max_age'den eskiyse (veya refresh istenirse) organizasyonu yeniden poll eder
+- Eşzamanlı poll'lar kısa bir Redis kilidiyle tekilleştirilir (Shelly Cloud rate limit)
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.shelly_service import get_shelly_service
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+STATUS_KEY_PREFIX = "awaxen:shelly:status:"
+STATUS_LOCK_PREFIX = "awaxen:shelly:status-lock:"
+STATUS_MAX_AGE_SECONDS = 60  # Okuyucuların kabul ettiği en eski snapshot
+STATUS_REDIS_TTL_SECONDS = 600
+STATUS_POLL_LOCK_SECONDS = 2  # Aynı hesaba art arda all_status çağrısı yapılmasın
+REDIS_RETRY_SECONDS = 30
+
+WATT_MINUTES_PER_KWH = 60_000.0
+WH_PER_KWH = 1000.0
+
+Snapshot = Dict[str, Any]
+
+
+def _kwh(total: Any, per_kwh: float) -> Optional[float]:
+    """Shelly sayaç toplamını telemetri 'energy' birimine (kWh) çevir."""
+    if total is None:
+        return None
+    try:
+        return float(total) / per_kwh
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_status(status: Dict[str, Any]) -> Snapshot:
+    """
+    device/all_status kaydını cihaz snapshot'ına çevir (Gen2 switch:0/pm1:0, Gen1 relays/meters).
+
+    energy telemetri store'uyla aynı birimde (kWh) döner: Gen2 aenergy.total ve
+    Gen1 emeters[].total Wh, Gen1 meters[].total ise watt-dakikadır.
+    """
+    if any(key.startswith(("switch:", "pm1:", "light:")) for key in status):
+        switch = status.get("switch:0") or status.get("light:0") or {}
+        meter = status.get("pm1:0") or switch
+        output = switch.get("output", False)
+        power = meter.get("apower")
+        voltage = meter.get("voltage")
+        energy = _kwh((meter.get("aenergy") or {}).get("total"), WH_PER_KWH)
+        temperature = (switch.get("temperature") or status.get("temperature:0") or {}).get("tC")
+    else:
+        relay = (status.get("relays") or status.get("lights") or [{}])[0]
+        if status.get("meters"):
+            meter, per_kwh = status["meters"][0], WATT_MINUTES_PER_KWH
+        else:
+            meter, per_kwh = (status.get("emeters") or [{}])[0], WH_PER_KWH
+        output = relay.get("ison", False)
+        power = meter.get("power")
+        voltage = meter.get("voltage", status.get("voltage"))
+        energy = _kwh(meter.get("total"), per_kwh)
+        temperature = (status.get("tmp") or {}).get("tC", status.get("temperature"))
+
+    cloud = status.get("cloud") or {}
+    online = cloud.get("connected", (status.get("_dev_info") or {}).get("online", False))
+    return {
+        "online": bool(online),
+        "output": bool(output),
+        "power": power,
+        "voltage": voltage,
+        "energy": energy,
+        "temperature": temperature,
+    }
+
+
+class ShellyStatusCache:
+    """
+    Organizasyon başına Shelly durum snapshot'ı.
+
+    Kullanım:
+        cache = get_shelly_status_cache()
+        snapshot = cache.get(device)                 # max_age içindeyse API çağrısı yok
+        snapshot = cache.get(device, refresh=True)   # Zorla yeniden poll
+    """
+
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, max_age: float = STATUS_MAX_AGE_SECONDS):
+        self.redis_url = redis_url
+        self.max_age = max_age
+
+        # Redis yoksa process içi snapshot: org_id -> (polled_at, {external_id: snapshot})
+        self._local: Dict[str, Tuple[float, Dict[str, Snapshot]]] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_failed_at: Optional[float] = None
+
+    def get(self, device, max_age: Optional[float] = None, refresh: bool = False) -> Optional[Snapshot]:
+        """Cihazın snapshot'ı (Shelly Cloud listesinde yoksa None)."""
+        if not device.external_id:
+            return None
+        snapshots, polled_at = self.get_many(device.organization_id, max_age=max_age, refresh=refresh)
+        snapshot = snapshots.get(device.external_id)
+        if snapshot is None:
+            return None
+        return {**snapshot, "polled_at": polled_at}
+
+    def get_many(
+        self, organization_id, max_age: Optional[float] = None, refresh: bool = False,
+    ) -> Tuple[Dict[str, Snapshot], Optional[float]]:
+        """
+        Organizasyonun tüm Shelly cihazlarının snapshot'ı.
+
+        Returns:
+            ({external_id: snapshot}, polled_at epoch) — entegrasyon yoksa ({}, None)
+
+        Raises:
+            Poll hatası (sadece elde hiç snapshot yoksa; varsa eski snapshot döner)
+        """
+        max_age = self.max_age if max_age is None else max_age
+        cached = self._read(organization_id)
+        if cached is not None and not refresh and time.time() - cached[0] <= max_age:
+            return cached[1], cached[0]
+
+        try:
+            polled = self.poll(organization_id, force=refresh)
+        except Exception as e:
+            if cached is None:
+                raise
+            logger.warning(f"[ShellyStatus] Poll başarısız, eski snapshot kullanılıyor ({organization_id}): {e}")
+            return cached[1], cached[0]
+        if polled is None:
+            return ({}, None) if cached is None else (cached[1], cached[0])
+        return polled[1], polled[0]
+
+    def poll(self, organization_id, force: bool = False) -> Optional[Tuple[float, Dict[str, Snapshot]]]:
+        """
+        Organizasyon için tek device/all_status çağrısı yap ve snapshot'ı kaydet.
+
+        Başka bir process az önce poll ettiyse (kilit alınamadı) onun snapshot'ı döner.
+
+        Returns:
+            (polled_at, snapshots) veya entegrasyon yoksa None
+        """
+        service = get_shelly_service(str(organization_id))
+        if service is None:
+            return None
+
+        if not self._acquire(organization_id) and not force:
+            cached = self._read(organization_id)
+            if cached is not None:
+                return cached
+
+        statuses = service.get_all_devices() or {}
+        polled_at = time.time()
+        snapshots = {str(external_id): parse_status(status or {}) for external_id, status in statuses.items()}
+        self._write(organization_id, polled_at, snapshots)
+        return polled_at, snapshots
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _read(self, organization_id) -> Optional[Tuple[float, Dict[str, Snapshot]]]:
+        client = self._client()
+        if client is not None:
+            try:
+                raw = client.get(f"{STATUS_KEY_PREFIX}{organization_id}")
+                if raw is None:
+                    return None
+                payload = json.loads(raw)
+                return payload["polled_at"], payload["devices"]
+            except Exception as e:
+                self._redis_error(e)
+        with self._lock:
+            return self._local.get(str(organization_id))
+
+    def _write(self, organization_id, polled_at: float, snapshots: Dict[str, Snapshot]) -> None:
+        with self._lock:
+            self._local[str(organization_id)] = (polled_at, snapshots)
+        client = self._client()
+        if client is None:
+            return
+        try:
+            client.set(
+                f"{STATUS_KEY_PREFIX}{organization_id}",
+                json.dumps({"polled_at": polled_at, "devices": snapshots}),
+                ex=STATUS_REDIS_TTL_SECONDS,
+            )
+        except Exception as e:
+            self._redis_error(e)
+
+    def _acquire(self, organization_id) -> bool:
+        client = self._client()
+        if client is None:
+            return True
+        try:
+            return bool(client.set(f"{STATUS_LOCK_PREFIX}{organization_id}", "1", nx=True, ex=STATUS_POLL_LOCK_SECONDS))
+        except Exception as e:
+            self._redis_error(e)
+            return True
+
+    def _client(self):
+        if self._redis is not None:
+            return self._redis
+        if not self.redis_url:
+            return None
+        if self._redis_failed_at is not None and time.monotonic() - self._redis_failed_at < REDIS_RETRY_SECONDS:
+            return None
+        try:
+            import redis
+            client = redis.from_url(self.redis_url, decode_responses=True)
+            client.ping()
+            self._redis = client
+            self._redis_failed_at = None
+            return client
+        except Exception as e:
+            self._redis_error(e)
+            return None
+
+    def _redis_error(self, error: Exception) -> None:
+        if self._redis_failed_at is None:
+            logger.warning(f"[ShellyStatus] Redis kullanılamıyor, bellek içi snapshot ile devam: {error}")
+        self._redis = None
+        self._redis_failed_at = time.monotonic()
+
+
+# Singleton instance
+_status_cache: Optional[ShellyStatusCache] = None
+
+
+def get_shelly_status_cache() -> ShellyStatusCache:
+    """Shelly status cache singleton'ı döndür."""
+    global _status_cache
+    if _status_cache is None:
+        _status_cache = ShellyStatusCache()
+    return _status_cache
@@ -0,0 +1,258 @@
+"""
+Socket Auth - Socket.IO bağlantıları için token doğrulama ve kimlik cache'i.
+
+handle_authenticate client'ın gönderdiği user_id/org_id'ye güvenmek yerine
+JWT'yi doğrular ve room'ları DB'deki kullanıcının organizasyonuna göre seçer:
+
+- İmza process genelinde cache'li JWKS ile doğrulanır (app.auth.decode_token)
+- Doğrulanan kimlik bağlantı (sid) başına tutulur; sonraki event'ler token'ı tekrar çözmez
+- auth0_id -> (user_id, organization_id) eşlemesi SOCKET_IDENTITY_TTL_SECONDS boyunca cache'lenir
+- Kullanıcının organizasyonu / aktifliği değişip commit edilince bağlantıları tüm
+  process'lerde eski room'lardan çıkarılır (Redis Pub/Sub, bkz. realtime.revoke_user_sessions)
+
+Deploy sonrası binlerce client aynı anda yeniden bağlandığında Auth0'a tek
+JWKS isteği, Postgres'e kullanıcı başına en fazla bir sorgu gider.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import jwt
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.auth import decode_token
+from app.constants import ErrorCode
+from app.exceptions import AuthenticationError
+from app.extensions import db
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+# Varsayılan ayarlar (config ile override edilir)
+DEFAULT_IDENTITY_TTL_SECONDS = 300
+USER_MISS_TTL_SECONDS = 30  # DB'de olmayan kullanıcı (yeni kayıt olabilir) daha kısa cache'lenir
+
+UserRecord = Tuple[str, Optional[str]]  # (user_id, organization_id)
+SESSION_CHANGES_KEY = "socket_auth_user_changes"
+
+
+class SocketIdentity:
+    """Doğrulanmış socket bağlantısının kimliği."""
+
+    __slots__ = ("auth0_id", "user_id", "organization_id", "expires_at", "token_hash")
+
+    def __init__(self, auth0_id: str, user_id: str, organization_id: Optional[str], expires_at: Optional[float], token_hash: str):
+        self.auth0_id = auth0_id
+        self.user_id = user_id
+        self.organization_id = organization_id
+        self.expires_at = expires_at
+        self.token_hash = token_hash
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return self.expires_at is not None and (now or time.time()) >= self.expires_at
+
+
+class SocketAuthenticator:
+    """
+    Thread-safe socket kimlik doğrulayıcı.
+
+    Kullanım:
+        authenticator = get_socket_authenticator()
+        identity = authenticator.authenticate(request.sid, token)   # AuthenticationError
+        identity = authenticator.identity(request.sid)              # Sonraki event'lerde
+    """
+
+    def __init__(self, identity_ttl: float = DEFAULT_IDENTITY_TTL_SECONDS, decoder: Callable[[str], Dict[str, Any]] = decode_token):
+        self.identity_ttl = identity_ttl
+        self.decoder = decoder
+
+        self._sessions: Dict[str, SocketIdentity] = {}
+        self._sids_by_user: Dict[str, Set[str]] = {}
+        self._users: Dict[str, Tuple[float, Optional[UserRecord]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"verified": 0, "reused": 0, "rejected": 0, "user_lookups": 0, "user_cache_hits": 0}
+
+    def authenticate(self, sid: str, token: Optional[str]) -> SocketIdentity:
+        """
+        Token'ı doğrula ve kimliği bağlantıya bağla.
+
+        Bağlantı aynı token ile zaten doğrulandıysa mevcut kimlik döner.
+
+        Raises:
+            AuthenticationError: Token yok / geçersiz / süresi dolmuş ya da kullanıcı DB'de yok
+        """
+        if not token:
+            self._reject()
+            raise AuthenticationError("Token bulunamadı", ErrorCode.MISSING_TOKEN)
+
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        current = self.identity(sid)
+        if current is not None and current.token_hash == token_hash:
+            with self._lock:
+                self._stats["reused"] += 1
+            return current
+
+        try:
+            claims = self.decoder(token)
+        except jwt.ExpiredSignatureError:
+            self._reject()
+            raise AuthenticationError("Token süresi dolmuş", ErrorCode.TOKEN_EXPIRED)
+        except jwt.PyJWTError as e:
+            self._reject()
+            raise AuthenticationError(f"Token doğrulanamadı: {e}", ErrorCode.INVALID_TOKEN)
+
+        auth0_id = claims.get("sub")
+        user = self._user(auth0_id) if auth0_id else None
+        if user is None:
+            self._reject()
+            raise AuthenticationError("Kullanıcı veritabanında bulunamadı", ErrorCode.USER_NOT_IN_DB)
+
+        identity = SocketIdentity(auth0_id, user[0], user[1], claims.get("exp"), token_hash)
+        with self._lock:
+            self._drop_session(sid)
+            self._sessions[sid] = identity
+            self._sids_by_user.setdefault(identity.user_id, set()).add(sid)
+            self._stats["verified"] += 1
+        return identity
+
+    def identity(self, sid: str) -> Optional[SocketIdentity]:
+        """Bağlantının geçerli kimliği (doğrulanmadıysa veya token süresi dolduysa None)."""
+        with self._lock:
+            identity = self._sessions.get(sid)
+            if identity is not None and identity.expired():
+                self._drop_session(sid)
+                return None
+            return identity
+
+    def forget(self, sid: str) -> None:
+        """Bağlantı kapandığında kimliği bırak."""
+        with self._lock:
+            self._drop_session(sid)
+
+    def revoke_user(self, user_id: str, auth0_id: Optional[str] = None) -> List[str]:
+        """
+        Kullanıcının bu process'teki kimliklerini bırak (organizasyon / aktiflik değişikliği).
+
+        Returns:
+            Kimliği bırakılan bağlantıların sid'leri (room'lardan çıkarılmaları için)
+        """
+        with self._lock:
+            if auth0_id is not None:
+                self._users.pop(auth0_id, None)
+            sids = list(self._sids_by_user.get(str(user_id), ()))
+            for sid in sids:
+                self._drop_session(sid)
+        return sids
+
+    def invalidate_user(self, auth0_id: Optional[str] = None) -> None:
+        """Kullanıcı -> organizasyon cache'ini temizle (organizasyon değişikliğinde)."""
+        with self._lock:
+            if auth0_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(auth0_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "sessions": len(self._sessions), "cached_users": len(self._users)}
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _user(self, auth0_id: str) -> Optional[UserRecord]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(auth0_id)
+            if entry is not None and entry[0] > now:
+                self._stats["user_cache_hits"] += 1
+                return entry[1]
+            self._stats["user_lookups"] += 1
+
+        row = User.query.with_entities(User.id, User.organization_id).filter_by(
+            auth0_id=auth0_id, is_active=True
+        ).first()
+        record = (str(row.id), str(row.organization_id) if row.organization_id else None) if row else None
+        ttl = self.identity_ttl if record is not None else min(self.identity_ttl, USER_MISS_TTL_SECONDS)
+
+        with self._lock:
+            self._users[auth0_id] = (now + ttl, record)
+        return record
+
+    def _drop_session(self, sid: str) -> None:
+        identity = self._sessions.pop(sid, None)
+        if identity is not None:
+            sids = self._sids_by_user.get(identity.user_id)
+            if sids:
+                sids.discard(sid)
+                if not sids:
+                    self._sids_by_user.pop(identity.user_id, None)
+
+    def _reject(self) -> None:
+        with self._lock:
+            self._stats["rejected"] += 1
+
+
+# ==========================================
+# ORM Event'leri - organizasyon / aktiflik değişikliğinde bağlantıları düşür
+# ==========================================
+
+def _collect_user_changes(session: Session, flush_context: Any) -> None:
+    changes: List[Tuple[str, str]] = session.info.setdefault(SESSION_CHANGES_KEY, [])
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            inspected = db.inspect(obj)
+            if any(inspected.attrs[attr].history.has_changes() for attr in ("organization_id", "is_active")):
+                changes.append((str(obj.id), obj.auth0_id))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes.append((str(obj.id), obj.auth0_id))
+
+
+def _apply_user_changes(session: Session) -> None:
+    changes = session.info.pop(SESSION_CHANGES_KEY, None)
+    if not changes:
+        return
+    from app.realtime import redis_pubsub, revoke_user_sessions
+
+    for user_id, auth0_id in dict(changes).items():
+        try:
+            # Yayın bu process'e de döner; Redis yoksa sadece yerel bağlantılar düşürülür
+            if not redis_pubsub.publish_user_access(user_id, auth0_id):
+                revoke_user_sessions(user_id, auth0_id)
+        except Exception as e:
+            logger.warning(f"[SocketAuth] {user_id} bağlantıları düşürülemedi: {e}")
+
+
+def _drop_user_changes(session: Session, *args: Any) -> None:
+    session.info.pop(SESSION_CHANGES_KEY, None)
+
+
+def register_socket_auth_listeners() -> None:
+    """Kullanıcı organizasyon / aktiflik commit'lerini socket oturumlarına bağla (idempotent)."""
+    if event.contains(Session, "after_flush", _collect_user_changes):
+        return
+    event.listen(Session, "after_flush", _collect_user_changes)
+    event.listen(Session, "after_commit", _apply_user_changes)
+    event.listen(Session, "after_rollback", _drop_user_changes)
+
+
+# Singleton instance
+_socket_authenticator: Optional[SocketAuthenticator] = None
+
+
+def get_socket_authenticator() -> SocketAuthenticator:
+    """Socket authenticator singleton'ı döndür (ayarlar app config'inden)."""
+    global _socket_authenticator
+    if _socket_authenticator is None:
+        config = current_app.config if has_app_context() else {}
+        _socket_authenticator = SocketAuthenticator(
+            identity_ttl=config.get("SOCKET_IDENTITY_TTL_SECONDS", DEFAULT_IDENTITY_TTL_SECONDS),
+        )
+    return _socket_authenticator
@@ -0,0 +1,1008 @@
+"""
+Telemetry Store - Telemetri depolama soyutlaması.
+
+Tüm ingest yolları (MQTT writer, HTTP ingest, Home Assistant webhook'ları)
+ve okuyucular (telemetri geçmişi, dashboard, otomasyon, anomaly, export)
+telemetriye bu modül üzerinden erişir. İki depolama düzeni desteklenir:
+
+- narrow: device_telemetry (time, device_id, key, value) - her metrik ayrı satır
+- wide: device_telemetry_wide (time, device_id, power, voltage, ...) - cihaz/zaman başına tek satır
+
+Düzen TELEMETRY_STORAGE_LAYOUT config'i ile seçilir. Wide düzende kanonik
+metrikler dışındaki key'ler narrow tabloya yazılmaya devam eder.
+
+Key'ler yazımda kanonik ada çevrilir (TELEMETRY_KEY_ALIASES); okuyucular yalnızca
+kanonik key'leri sorgular. Eski adlarla (power_w, energy_total_kwh) yazılmış
+satırlar migration 006 ile kanonik key'e taşınır.
+
+Okuyucular her iki düzende de aynı formatı alır:
+    {"time": datetime, "device_id": UUID, "power": 45.5, "voltage": 229.8, ...}
+"""
+from __future__ import annotations
+
+import io
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, func, select, text
+
+from app.extensions import db
+from app.models import SmartDevice, DeviceTelemetry, DeviceTelemetryWide
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_NARROW = "narrow"
+LAYOUT_WIDE = "wide"
+
+# Kanonik metrikler (wide tablonun kolonları)
+METRIC_KEYS: Tuple[str, ...] = ("power", "voltage", "current", "energy", "temperature", "humidity")
+
+# Payload alanı / eski key -> kanonik key eşlemesi
+TELEMETRY_KEY_ALIASES: Dict[str, str] = {
+    "power": "power",
+    "power_w": "power",
+    "current_power_w": "power",
+    "voltage": "voltage",
+    "current": "current",
+    "energy": "energy",
+    "energy_total_kwh": "energy",
+    "total_energy_kwh": "energy",
+    "temperature": "temperature",
+    "temperature_c": "temperature",
+    "temp": "temperature",
+    "humidity": "humidity",
+    "humidity_pct": "humidity",
+}
+
+# Continuous aggregate'ler (migration 003), en kabadan inceye:
+# (bucket genişliği, view soneki). Narrow: telemetry_<sonek>, wide: telemetry_wide_<sonek>
+ROLLUPS: Tuple[Tuple[timedelta, str], ...] = (
+    (timedelta(days=1), "1d"),
+    (timedelta(hours=1), "1h"),
+    (timedelta(minutes=5), "5m"),
+)
+ROLLUP_DETECT_TTL_SECONDS = 300  # Mevcut rollup view'lerinin yeniden kontrol aralığı
+
+# Kayıt: (time, device_id, key, value)
+TelemetryRow = Tuple[datetime, UUID, str, float]
+
+
+def normalize_key(key: str) -> str:
+    """Eski/alternatif metrik adını kanonik key'e çevir (bilinmeyenler aynen kalır)."""
+    return TELEMETRY_KEY_ALIASES.get(key, key)
+
+
+def _dedup(rows: Iterable[TelemetryRow]) -> Dict[Tuple[datetime, UUID, str], float]:
+    """Aynı (time, device_id, key) tekrar ederse son değer kazanır."""
+    unique: Dict[Tuple[datetime, UUID, str], float] = {}
+    for ts, device_id, key, value in rows:
+        unique[(ts, device_id, normalize_key(key))] = value
+    return unique
+
+
+def _device_filter(column, device_ids: Optional[Sequence[UUID]] = None, organization_id: Optional[UUID] = None):
+    """Cihaz listesi veya organizasyon bazlı filtre."""
+    if device_ids is not None:
+        return column.in_(list(device_ids))
+    return column.in_(select(SmartDevice.id).where(SmartDevice.organization_id == organization_id))
+
+
+def _dialect() -> str:
+    return db.engine.dialect.name
+
+
+def _upsert_insert(table):
+    """Dialect'e özel INSERT (on_conflict_* desteği için)."""
+    if _dialect() == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _copy_escape(value: str) -> str:
+    """COPY text formatındaki özel karakterleri escape et."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return _copy_escape(str(value))
+
+
+def _copy_merge(stage_ddl: str, stage: str, columns: Sequence[str], records: Iterable[Sequence[Any]], merge_sql: str) -> int:
+    """
+    Kayıtları COPY FROM STDIN ile geçici staging tabloya akıt ve tek
+    INSERT ... SELECT ... ON CONFLICT ile hedef tabloya aktar (PostgreSQL).
+
+    Commit çağıran tarafa bırakılır.
+    """
+    buffer = io.StringIO()
+    for record in records:
+        buffer.write("\t".join(_copy_value(v) for v in record))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    # Session transaction'ı içindeki DBAPI bağlantısı (psycopg2)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} ({stage_ddl}) ON COMMIT DELETE ROWS")
+        cursor.copy_expert(f"COPY {stage} ({', '.join(columns)}) FROM STDIN", buffer)
+        cursor.execute(merge_sql)
+        written = cursor.rowcount
+        cursor.execute(f"TRUNCATE {stage}")
+    finally:
+        cursor.close()
+    return written
+
+
+def _stats_from_aggregates(count, mean, mean_sq, min_value, max_value) -> Dict[str, float]:
+    """avg(x) ve avg(x²) üzerinden örneklem standart sapması (dialect bağımsız)."""
+    count = int(count or 0)
+    mean = float(mean or 0.0)
+    std = 0.0
+    if count > 1:
+        variance = max(0.0, float(mean_sq or 0.0) - mean * mean) * count / (count - 1)
+        std = math.sqrt(variance)
+    return {
+        "mean": mean,
+        "std": std,
+        "min": float(min_value or 0.0),
+        "max": float(max_value or 0.0),
+        "count": count,
+    }
+
+
+def _aligned(value: datetime, width: timedelta) -> bool:
+    """Zaman, bucket sınırına denk geliyor mu? (UTC epoch bazlı, time_bucket ile aynı)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp() % width.total_seconds() == 0
+
+
+def _device_sql(device_ids: Optional[Sequence[UUID]], organization_id: Optional[UUID]) -> Tuple[str, Dict[str, Any]]:
+    """Rollup sorguları için cihaz filtresi (raw SQL)."""
+    if device_ids is not None:
+        return "device_id = ANY(CAST(:device_ids AS uuid[]))", {"device_ids": [str(d) for d in device_ids]}
+    return (
+        "device_id IN (SELECT id FROM smart_devices WHERE organization_id = :organization_id)",
+        {"organization_id": str(organization_id)},
+    )
+
+
+class NarrowTelemetryStore:
+    """
+    Key-value düzeni: device_telemetry (time, device_id, key, value).
+
+    Aggregasyon okumaları (aggregate, summarize, daily_sums) TimescaleDB
+    continuous aggregate'leri mevcutsa isteği karşılayan en kaba rollup'a
+    yönlendirilir; raw tablo sadece rollup yoksa taranır.
+    """
+
+    layout = LAYOUT_NARROW
+    model = DeviceTelemetry
+    rollup_prefix = "telemetry_"
+
+    def __init__(self):
+        self._rollups: Set[str] = set()
+        self._rollups_checked_at: Optional[float] = None
+
+    # ------------------------------------------
+    # Write API (commit çağıran tarafa bırakılır)
+    # ------------------------------------------
+
+    def write(self, rows: Iterable[TelemetryRow], overwrite: bool = False) -> int:
+        """
+        Satırları multi-row INSERT ile yaz.
+
+        Args:
+            rows: (time, device_id, key, value) tuple'ları
+            overwrite: True ise mevcut değerler güncellenir, False ise çakışmalar yok sayılır
+
+        Returns:
+            Yazılan satır sayısı
+        """
+        unique = _dedup(rows)
+        if not unique:
+            return 0
+        self._insert_narrow(unique, overwrite)
+        return len(unique)
+
+    def bulk_load(self, rows: Iterable[TelemetryRow]) -> int:
+        """
+        Büyük batch'leri tek seferde upsert et (edge ingest).
+
+        PostgreSQL'de COPY + staging tablo, diğer dialect'lerde executemany.
+        """
+        unique = _dedup(rows)
+        if not unique:
+            return 0
+        if _dialect() == "postgresql":
+            return self._copy_narrow(unique)
+        self._insert_narrow(unique, overwrite=True)
+        return len(unique)
+
+    # ------------------------------------------
+    # Read API
+    # ------------------------------------------
+
+    def latest(self, device_id: UUID) -> Optional[Dict[str, Any]]:
+        """Cihazın her metrik için son değeri (tek kayıt halinde)."""
+        return self._latest_narrow(device_id)
+
+    def latest_value(self, device_id: UUID, key: str) -> Optional[Tuple[datetime, float]]:
+        """Tek metrik için son (time, value)."""
+        model, value, filters = self._metric(key)
+        row = db.session.query(model.time, value.label("value")).filter(
+            model.device_id == device_id, value.isnot(None), *filters,
+        ).order_by(model.time.desc()).first()
+        return (row.time, row.value) if row else None
+
+    def latest_values(
+        self,
+        key: str,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+        since: Optional[datetime] = None,
+    ) -> Dict[UUID, float]:
+        """Birden fazla cihaz için tek metriğin son değeri: {device_id: value}."""
+        points = self.latest_points(key, device_ids, organization_id, since)
+        return {device_id: value for device_id, (_, value) in points.items()}
+
+    def latest_points(
+        self,
+        key: str,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+        since: Optional[datetime] = None,
+    ) -> Dict[UUID, Tuple[datetime, float]]:
+        """Birden fazla cihaz için tek metriğin son zamanı ve değeri: {device_id: (time, value)}."""
+        model, value, filters = self._metric(key)
+        filters = [_device_filter(model.device_id, device_ids, organization_id), value.isnot(None), *filters]
+        if since is not None:
+            filters.append(model.time >= since)
+
+        last = db.session.query(
+            model.device_id.label("device_id"),
+            func.max(model.time).label("time"),
+        ).filter(*filters).group_by(model.device_id).subquery()
+
+        rows = db.session.query(model.device_id, model.time, value.label("value")).join(
+            last,
+            and_(model.device_id == last.c.device_id, model.time == last.c.time),
+        ).filter(*filters).all()
+        return {row.device_id: (row.time, row.value) for row in rows if row.value is not None}
+
+    def sum_values(
+        self,
+        key: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+    ) -> float:
+        """Zaman aralığındaki metrik değerlerinin toplamı."""
+        return self.summarize(key, start, end, device_ids, organization_id)["sum"]
+
+    def summarize(
+        self,
+        key: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+    ) -> Dict[str, float]:
+        """Zaman aralığındaki metrik değerleri için {sum, avg, max, count}."""
+        rollup = self._pick_rollup(start, end, aligned=True)
+        if rollup:
+            return self._summarize_rollup(rollup, key, start, end, device_ids, organization_id)
+
+        model, value, filters = self._metric(key)
+        query = db.session.query(
+            func.sum(value), func.avg(value), func.max(value), func.count(value),
+        ).filter(
+            _device_filter(model.device_id, device_ids, organization_id),
+            model.time >= start,
+            *filters,
+        )
+        if end is not None:
+            query = query.filter(model.time <= end)
+        total, avg, peak, count = query.one()
+        return {
+            "sum": float(total or 0.0),
+            "avg": float(avg or 0.0),
+            "max": float(peak or 0.0),
+            "count": int(count or 0),
+        }
+
+    def daily_sums(
+        self,
+        key: str,
+        start: datetime,
+        end: datetime,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+    ) -> List[Tuple[str, float]]:
+        """Gün bazında metrik toplamları [(YYYY-MM-DD, toplam), ...]."""
+        rollup = self._pick_rollup(start, end, bucket=timedelta(days=1), aligned=True)
+        if rollup:
+            return self._daily_sums_rollup(rollup, key, start, end, device_ids, organization_id)
+
+        model, value, filters = self._metric(key)
+        day = func.date(model.time)
+        rows = db.session.query(day.label("day"), func.coalesce(func.sum(value), 0.0)).filter(
+            _device_filter(model.device_id, device_ids, organization_id),
+            model.time >= start,
+            model.time <= end,
+            *filters,
+        ).group_by(day).order_by(day).all()
+        return [(str(row[0]), float(row[1])) for row in rows]
+
+    def daily_summaries(
+        self,
+        key: str,
+        start: datetime,
+        end: datetime,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+    ) -> Dict[str, Dict[str, float]]:
+        """Gün bazında {YYYY-MM-DD: {sum, max, count}} (günler arasında birleştirilebilir özet)."""
+        rollup = self._pick_rollup(start, end, bucket=timedelta(days=1), aligned=True)
+        if rollup:
+            return self._daily_summaries_rollup(rollup, key, start, end, device_ids, organization_id)
+
+        model, value, filters = self._metric(key)
+        day = func.date(model.time)
+        rows = db.session.query(day.label("day"), func.sum(value), func.max(value), func.count(value)).filter(
+            _device_filter(model.device_id, device_ids, organization_id),
+            model.time >= start,
+            model.time < end,
+            *filters,
+        ).group_by(day).all()
+        return {
+            str(row[0]): {"sum": float(row[1] or 0.0), "max": float(row[2] or 0.0), "count": int(row[3] or 0)}
+            for row in rows
+        }
+
+    def series(self, device_id: UUID, key: str, start: datetime, end: Optional[datetime] = None) -> List[Tuple[datetime, float]]:
+        """Tek metrik için zaman serisi [(time, value), ...] (artan sırada)."""
+        model, value, filters = self._metric(key)
+        query = db.session.query(model.time, value.label("value")).filter(
+            model.device_id == device_id,
+            model.time >= start,
+            value.isnot(None),
+            *filters,
+        )
+        if end is not None:
+            query = query.filter(model.time <= end)
+        return [(row.time, row.value) for row in query.order_by(model.time.asc())]
+
+    def stats(self, device_id: UUID, key: str, start: datetime, hour: Optional[int] = None) -> Dict[str, float]:
+        """Metrik istatistikleri: {mean, std, min, max, count}."""
+        model, value, filters = self._metric(key)
+        query = db.session.query(
+            func.count(value), func.avg(value), func.avg(value * value), func.min(value), func.max(value),
+        ).filter(
+            model.device_id == device_id,
+            model.time >= start,
+            value.isnot(None),
+            *filters,
+        )
+        if hour is not None:
+            query = query.filter(func.extract("hour", model.time) == hour)
+        return _stats_from_aggregates(*query.one())
+
+    def hourly_stats(self, device_id: UUID, key: str, start: datetime) -> Dict[int, Dict[str, float]]:
+        """Günün saatine göre metrik istatistikleri: {hour: {mean, std, min, max, count}} (tek sorgu)."""
+        return self.hourly_stats_many([device_id], key, start).get(device_id, {})
+
+    def hourly_stats_many(
+        self,
+        device_ids: Sequence[UUID],
+        key: str,
+        start: datetime,
+    ) -> Dict[UUID, Dict[int, Dict[str, float]]]:
+        """Birden fazla cihaz için saatlik istatistikler: {device_id: {hour: stats}} (tek GROUP BY)."""
+        model, value, filters = self._metric(key)
+        hour = func.extract("hour", model.time)
+        query = db.session.query(
+            model.device_id,
+            hour.label("hour"),
+            func.count(value), func.avg(value), func.avg(value * value), func.min(value), func.max(value),
+        ).filter(
+            model.device_id.in_(list(device_ids)),
+            model.time >= start,
+            value.isnot(None),
+            *filters,
+        ).group_by(model.device_id, hour)
+
+        result: Dict[UUID, Dict[int, Dict[str, float]]] = {}
+        for row in query:
+            result.setdefault(row[0], {})[int(row[1])] = _stats_from_aggregates(*row[2:])
+        return result
+
+    def count(
+        self,
+        start: datetime,
+        end: datetime,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+    ) -> int:
+        """Aralıktaki kayıt (cihaz/zaman) sayısı."""
+        points = db.session.query(DeviceTelemetry.time, DeviceTelemetry.device_id).filter(
+            _device_filter(DeviceTelemetry.device_id, device_ids, organization_id),
+            DeviceTelemetry.time >= start,
+            DeviceTelemetry.time <= end,
+        ).distinct().subquery()
+        return int(db.session.query(func.count()).select_from(points).scalar() or 0)
+
+    def history(
+        self,
+        start: datetime,
+        end: datetime,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """
+        Aralıktaki kayıtlar (cihaz/zaman başına tek kayıt, artan sırada).
+
+        limit/offset kayıt sayısına uygulanır (metrik satırına değil).
+        """
+        points = db.session.query(
+            DeviceTelemetry.time.label("time"),
+            DeviceTelemetry.device_id.label("device_id"),
+        ).filter(
+            _device_filter(DeviceTelemetry.device_id, device_ids, organization_id),
+            DeviceTelemetry.time >= start,
+            DeviceTelemetry.time <= end,
+        ).distinct().order_by(DeviceTelemetry.time.asc(), DeviceTelemetry.device_id.asc())
+        if offset:
+            points = points.offset(offset)
+        if limit is not None:
+            points = points.limit(limit)
+        points = points.subquery()
+
+        rows = db.session.query(
+            DeviceTelemetry.time, DeviceTelemetry.device_id, DeviceTelemetry.key, DeviceTelemetry.value,
+        ).join(
+            points,
+            and_(DeviceTelemetry.time == points.c.time, DeviceTelemetry.device_id == points.c.device_id),
+        ).order_by(DeviceTelemetry.time.asc(), DeviceTelemetry.device_id.asc()).all()
+
+        records: Dict[Tuple[datetime, UUID], Dict[str, Any]] = {}
+        for row in rows:
+            record = records.setdefault((row.time, row.device_id), {"time": row.time, "device_id": row.device_id})
+            record[row.key] = row.value
+        return list(records.values())
+
+    def aggregate(
+        self,
+        device_id: UUID,
+        start: datetime,
+        end: datetime,
+        bucket: timedelta,
+    ) -> List[Dict[str, Any]]:
+        """
+        Zaman kovası (time_bucket) başına metrik ortalamaları.
+
+        Sıra: bucket'ı tam bölen en kaba rollup -> raw tabloda time_bucket
+        (PostgreSQL) -> Python (diğer dialect'ler).
+        """
+        rollup = self._pick_rollup(start, end, bucket=bucket)
+        if rollup:
+            return self._aggregate_rollup(rollup, device_id, start, end, bucket)
+
+        filters = [
+            DeviceTelemetry.device_id == device_id,
+            DeviceTelemetry.time >= start,
+            DeviceTelemetry.time <= end,
+            DeviceTelemetry.key.in_(METRIC_KEYS),
+        ]
+        if _dialect() == "postgresql":
+            bucket_col = func.time_bucket(bucket, DeviceTelemetry.time).label("bucket")
+            rows = db.session.query(
+                bucket_col, DeviceTelemetry.key, func.avg(DeviceTelemetry.value).label("value"),
+            ).filter(*filters).group_by(bucket_col, DeviceTelemetry.key).all()
+            buckets: Dict[datetime, Dict[str, Any]] = {}
+            for row in rows:
+                buckets.setdefault(row.bucket, {"time": row.bucket})[row.key] = _as_float(row.value)
+            return [buckets[b] for b in sorted(buckets)]
+
+        rows = db.session.query(DeviceTelemetry.time, DeviceTelemetry.key, DeviceTelemetry.value).filter(*filters).all()
+        return _bucket_in_python(((r.time, {r.key: r.value}) for r in rows), bucket)
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _metric(self, key: str):
+        """Metrik okumaları için (model, değer kolonu, ek filtreler)."""
+        return DeviceTelemetry, DeviceTelemetry.value, [DeviceTelemetry.key == normalize_key(key)]
+
+    def _rollup_metric(self, key: str) -> Tuple[str, str, str, str, Dict[str, Any]]:
+        """Rollup view'inde metrik: (view öneki, sum kolonu, count kolonu, max kolonu, ek filtre)."""
+        return self.rollup_prefix, '"sum"', '"count"', '"max"', {"key": normalize_key(key)}
+
+    def available_rollups(self) -> Set[str]:
+        """Veritabanında mevcut continuous aggregate view'leri (TTL ile cache'lenir)."""
+        now = time.monotonic()
+        if self._rollups_checked_at is not None and now - self._rollups_checked_at < ROLLUP_DETECT_TTL_SECONDS:
+            return self._rollups
+
+        rollups: Set[str] = set()
+        if _dialect() == "postgresql":
+            try:
+                # Ayrı bağlantı: hata, session transaction'ını bozmasın
+                with db.engine.connect() as conn:
+                    rollups = {
+                        row[0] for row in conn.execute(text(
+                            "SELECT view_name FROM timescaledb_information.continuous_aggregates"
+                        ))
+                    }
+            except Exception as exc:
+                logger.debug(f"[TelemetryStore] Rollup view'leri okunamadı: {exc}")
+        self._rollups = rollups
+        self._rollups_checked_at = now
+        return rollups
+
+    def _pick_rollup(
+        self,
+        start: datetime,
+        end: Optional[datetime],
+        bucket: Optional[timedelta] = None,
+        aligned: bool = False,
+    ) -> Optional[Tuple[timedelta, str]]:
+        """
+        İsteği karşılayan en kaba rollup'ı seç.
+
+        Args:
+            bucket: İstenen bucket genişliği; rollup genişliği bunu tam bölmeli
+            aligned: True ise aralık sınırları rollup bucket'larına denk gelmeli
+                (toplam/özet sorguları). Bitiş şimdiki zaman veya sonrasıysa
+                son bucket kısmi kabul edilir.
+        """
+        available = self.available_rollups()
+        if not available:
+            return None
+
+        now = datetime.now(timezone.utc)
+        for width, suffix in ROLLUPS:
+            view = f"{self.rollup_prefix}{suffix}"
+            if view not in available:
+                continue
+            if bucket is not None and bucket % width:
+                continue
+            if aligned:
+                if not _aligned(start, width):
+                    continue
+                if end is not None and not _aligned(end, width) and _as_utc(end) < now:
+                    continue
+            return width, view
+        return None
+
+    def _aggregate_rollup(self, rollup, device_id: UUID, start: datetime, end: datetime, bucket: timedelta):
+        width, view = rollup
+        rows = db.session.execute(text(f"""
+            SELECT time_bucket(:bucket, bucket) AS b, key,
+                   sum("sum") / NULLIF(sum("count"), 0) AS value
+            FROM {view}
+            WHERE device_id = CAST(:device_id AS uuid)
+              AND bucket >= time_bucket(:width, CAST(:start AS timestamptz))
+              AND bucket <= :end
+              AND key = ANY(:keys)
+            GROUP BY b, key
+        """), {
+            "bucket": bucket, "width": width, "device_id": str(device_id),
+            "start": start, "end": end, "keys": list(METRIC_KEYS),
+        }).all()
+        buckets: Dict[datetime, Dict[str, Any]] = {}
+        for b, key, value in rows:
+            buckets.setdefault(b, {"time": b, **{k: None for k in METRIC_KEYS}})[key] = _as_float(value)
+        return [buckets[b] for b in sorted(buckets)]
+
+    def _summarize_rollup(self, rollup, key, start, end, device_ids, organization_id) -> Dict[str, float]:
+        _, view = rollup
+        prefix, sum_col, count_col, max_col, extra = self._rollup_metric(key)
+        view = view.replace(self.rollup_prefix, prefix, 1)
+        device_sql, params = _device_sql(device_ids, organization_id)
+        key_sql = "AND key = :key" if "key" in extra else ""
+        end_sql = "AND bucket < :end" if end is not None else ""
+        total, peak, count = db.session.execute(text(f"""
+            SELECT sum({sum_col}), max({max_col}), sum({count_col})
+            FROM {view}
+            WHERE {device_sql} AND bucket >= :start {end_sql} {key_sql}
+        """), {**params, **extra, "start": start, "end": end}).one()
+        count = int(count or 0)
+        return {
+            "sum": float(total or 0.0),
+            "avg": float(total or 0.0) / count if count else 0.0,
+            "max": float(peak or 0.0),
+            "count": count,
+        }
+
+    def _daily_sums_rollup(self, rollup, key, start, end, device_ids, organization_id) -> List[Tuple[str, float]]:
+        _, view = rollup
+        prefix, sum_col, _, _, extra = self._rollup_metric(key)
+        view = view.replace(self.rollup_prefix, prefix, 1)
+        device_sql, params = _device_sql(device_ids, organization_id)
+        key_sql = "AND key = :key" if "key" in extra else ""
+        rows = db.session.execute(text(f"""
+            SELECT CAST(time_bucket(INTERVAL '1 day', bucket) AS date) AS day, COALESCE(sum({sum_col}), 0)
+            FROM {view}
+            WHERE {device_sql} AND bucket >= :start AND bucket < :end {key_sql}
+            GROUP BY day
+            ORDER BY day
+        """), {**params, **extra, "start": start, "end": end}).all()
+        return [(str(day), float(total)) for day, total in rows]
+
+    def _daily_summaries_rollup(self, rollup, key, start, end, device_ids, organization_id) -> Dict[str, Dict[str, float]]:
+        _, view = rollup
+        prefix, sum_col, count_col, max_col, extra = self._rollup_metric(key)
+        view = view.replace(self.rollup_prefix, prefix, 1)
+        device_sql, params = _device_sql(device_ids, organization_id)
+        key_sql = "AND key = :key" if "key" in extra else ""
+        rows = db.session.execute(text(f"""
+            SELECT CAST(time_bucket(INTERVAL '1 day', bucket) AS date) AS day,
+                   sum({sum_col}), max({max_col}), sum({count_col})
+            FROM {view}
+            WHERE {device_sql} AND bucket >= :start AND bucket < :end {key_sql}
+            GROUP BY day
+        """), {**params, **extra, "start": start, "end": end}).all()
+        return {
+            str(day): {"sum": float(total or 0.0), "max": float(peak or 0.0), "count": int(count or 0)}
+            for day, total, peak, count in rows
+        }
+
+    @staticmethod
+    def _insert_narrow(unique: Dict[Tuple[datetime, UUID, str], float], overwrite: bool) -> None:
+        table = DeviceTelemetry.__table__
+        stmt = _upsert_insert(table)
+        if overwrite:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["time", "device_id", "key"],
+                set_={"value": stmt.excluded.value},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=["time", "device_id", "key"])
+        db.session.execute(stmt, [
+            {"time": ts, "device_id": device_id, "key": key, "value": value, "quality": 1}
+            for (ts, device_id, key), value in unique.items()
+        ])
+
+    @staticmethod
+    def _copy_narrow(unique: Dict[Tuple[datetime, UUID, str], float]) -> int:
+        return _copy_merge(
+            "time timestamptz, device_id uuid, key varchar(50), value double precision",
+            "_telemetry_stage",
+            ("time", "device_id", "key", "value"),
+            ((ts, device_id, key, float(value)) for (ts, device_id, key), value in unique.items()),
+            "INSERT INTO device_telemetry (time, device_id, key, value, quality) "
+            "SELECT time, device_id, key, value, 1 FROM _telemetry_stage "
+            "ON CONFLICT (time, device_id, key) DO UPDATE SET value = EXCLUDED.value",
+        )
+
+    @staticmethod
+    def _latest_narrow(device_id: UUID, keys: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        filters = [DeviceTelemetry.device_id == device_id]
+        if keys is not None:
+            filters.append(DeviceTelemetry.key.in_(list(keys)))
+
+        last = db.session.query(
+            DeviceTelemetry.key.label("key"),
+            func.max(DeviceTelemetry.time).label("time"),
+        ).filter(*filters).group_by(DeviceTelemetry.key).subquery()
+
+        rows = db.session.query(DeviceTelemetry.time, DeviceTelemetry.key, DeviceTelemetry.value).join(
+            last,
+            and_(DeviceTelemetry.key == last.c.key, DeviceTelemetry.time == last.c.time),
+        ).filter(DeviceTelemetry.device_id == device_id).all()
+        if not rows:
+            return None
+
+        record: Dict[str, Any] = {"time": max(row.time for row in rows), "device_id": device_id}
+        for row in rows:
+            record[row.key] = row.value
+        return record
+
+
+class WideTelemetryStore(NarrowTelemetryStore):
+    """
+    Wide düzen: device_telemetry_wide (time, device_id, power, voltage, ...).
+
+    Aynı (time, device_id) için farklı zamanlarda gelen metrikler tek satırda
+    birleştirilir (COALESCE merge). Kanonik olmayan key'ler narrow tabloya yazılır.
+    """
+
+    layout = LAYOUT_WIDE
+    model = DeviceTelemetryWide
+    rollup_prefix = "telemetry_wide_"
+
+    # ------------------------------------------
+    # Write API
+    # ------------------------------------------
+
+    def write(self, rows: Iterable[TelemetryRow], overwrite: bool = False) -> int:
+        wide, extra = self._split(rows)
+        if wide:
+            self._merge_wide(wide, overwrite)
+        if extra:
+            self._insert_narrow(extra, overwrite)
+        return len(wide) + len(extra)
+
+    def bulk_load(self, rows: Iterable[TelemetryRow]) -> int:
+        wide, extra = self._split(rows)
+        written = 0
+        if wide:
+            if _dialect() == "postgresql":
+                written += self._copy_wide(wide)
+            else:
+                self._merge_wide(wide, overwrite=True)
+                written += len(wide)
+        if extra:
+            if _dialect() == "postgresql":
+                written += self._copy_narrow(extra)
+            else:
+                self._insert_narrow(extra, overwrite=True)
+                written += len(extra)
+        return written
+
+    # ------------------------------------------
+    # Read API
+    # ------------------------------------------
+
+    def latest(self, device_id: UUID) -> Optional[Dict[str, Any]]:
+        """Son satır + (varsa) narrow tablodaki ek metrikler."""
+        record = None
+        row = DeviceTelemetryWide.query.filter_by(device_id=device_id).order_by(
+            DeviceTelemetryWide.time.desc()
+        ).first()
+        if row:
+            record = {"time": row.time, "device_id": device_id}
+            record.update({key: getattr(row, key) for key in METRIC_KEYS if getattr(row, key) is not None})
+
+        extra = self._latest_narrow(device_id)
+        if extra:
+            if record is None:
+                return extra
+            record.update({k: v for k, v in extra.items() if k not in record})
+        return record
+
+    def count(
+        self,
+        start: datetime,
+        end: datetime,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+    ) -> int:
+        return int(db.session.query(func.count()).select_from(DeviceTelemetryWide).filter(
+            _device_filter(DeviceTelemetryWide.device_id, device_ids, organization_id),
+            DeviceTelemetryWide.time >= start,
+            DeviceTelemetryWide.time <= end,
+        ).scalar() or 0)
+
+    def history(
+        self,
+        start: datetime,
+        end: datetime,
+        device_ids: Optional[Sequence[UUID]] = None,
+        organization_id: Optional[UUID] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        query = DeviceTelemetryWide.query.filter(
+            _device_filter(DeviceTelemetryWide.device_id, device_ids, organization_id),
+            DeviceTelemetryWide.time >= start,
+            DeviceTelemetryWide.time <= end,
+        ).order_by(DeviceTelemetryWide.time.asc(), DeviceTelemetryWide.device_id.asc())
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+
+        records = []
+        for row in query:
+            record = {"time": row.time, "device_id": row.device_id}
+            record.update({key: getattr(row, key) for key in METRIC_KEYS if getattr(row, key) is not None})
+            records.append(record)
+        return records
+
+    def aggregate(
+        self,
+        device_id: UUID,
+        start: datetime,
+        end: datetime,
+        bucket: timedelta,
+    ) -> List[Dict[str, Any]]:
+        filters = [
+            DeviceTelemetryWide.device_id == device_id,
+            DeviceTelemetryWide.time >= start,
+            DeviceTelemetryWide.time <= end,
+        ]
+        rollup = self._pick_rollup(start, end, bucket=bucket)
+        if rollup:
+            return self._aggregate_rollup(rollup, device_id, start, end, bucket)
+
+        if _dialect() == "postgresql":
+            bucket_col = func.time_bucket(bucket, DeviceTelemetryWide.time).label("bucket")
+            rows = db.session.query(
+                bucket_col,
+                *(func.avg(getattr(DeviceTelemetryWide, key)).label(key) for key in METRIC_KEYS),
+            ).filter(*filters).group_by(bucket_col).order_by(bucket_col.asc()).all()
+            return [
+                {"time": row.bucket, **{key: _as_float(getattr(row, key)) for key in METRIC_KEYS}}
+                for row in rows
+            ]
+
+        rows = DeviceTelemetryWide.query.filter(*filters).all()
+        return _bucket_in_python(
+            ((row.time, {key: getattr(row, key) for key in METRIC_KEYS}) for row in rows),
+            bucket,
+        )
+
+    # ------------------------------------------
+    # Internal
+    # ------------------------------------------
+
+    def _metric(self, key: str):
+        key = normalize_key(key)
+        if key not in METRIC_KEYS:
+            return super()._metric(key)
+        return DeviceTelemetryWide, getattr(DeviceTelemetryWide, key), []
+
+    def _rollup_metric(self, key: str) -> Tuple[str, str, str, str, Dict[str, Any]]:
+        key = normalize_key(key)
+        if key not in METRIC_KEYS:
+            # Kanonik olmayan key'ler narrow tabloda: narrow rollup'ları kullan
+            return NarrowTelemetryStore.rollup_prefix, '"sum"', '"count"', '"max"', {"key": key}
+        return self.rollup_prefix, f"{key}_sum", f"{key}_count", f"{key}_max", {}
+
+    def _aggregate_rollup(self, rollup, device_id: UUID, start: datetime, end: datetime, bucket: timedelta):
+        width, view = rollup
+        columns = ",\n".join(
+            f"sum({key}_sum) / NULLIF(sum({key}_count), 0) AS {key}" for key in METRIC_KEYS
+        )
+        rows = db.session.execute(text(f"""
+            SELECT time_bucket(:bucket, bucket) AS b,
+                   {columns}
+            FROM {view}
+            WHERE device_id = CAST(:device_id AS uuid)
+              AND bucket >= time_bucket(:width, CAST(:start AS timestamptz))
+              AND bucket <= :end
+            GROUP BY b
+            ORDER BY b
+        """), {
+            "bucket": bucket, "width": width, "device_id": str(device_id), "start": start, "end": end,
+        }).mappings().all()
+        return [
+            {"time": row["b"], **{key: _as_float(row[key]) for key in METRIC_KEYS}}
+            for row in rows
+        ]
+
+    @staticmethod
+    def _split(rows: Iterable[TelemetryRow]):
+        """Kanonik metrikleri wide satırlara pivotla, kalanları narrow'a ayır."""
+        wide: Dict[Tuple[datetime, UUID], Dict[str, float]] = {}
+        extra: Dict[Tuple[datetime, UUID, str], float] = {}
+        for (ts, device_id, key), value in _dedup(rows).items():
+            if key in METRIC_KEYS:
+                wide.setdefault((ts, device_id), {})[key] = value
+            else:
+                extra[(ts, device_id, key)] = value
+        return wide, extra
+
+    @staticmethod
+    def _merge_wide(wide: Dict[Tuple[datetime, UUID], Dict[str, float]], overwrite: bool) -> None:
+        table = DeviceTelemetryWide.__table__
+        stmt = _upsert_insert(table)
+        # overwrite: yeni değer kazanır, aksi halde sadece boş kolonlar doldurulur
+        set_ = {
+            key: (
+                func.coalesce(stmt.excluded[key], table.c[key])
+                if overwrite else
+                func.coalesce(table.c[key], stmt.excluded[key])
+            )
+            for key in METRIC_KEYS
+        }
+        stmt = stmt.on_conflict_do_update(index_elements=["time", "device_id"], set_=set_)
+        db.session.execute(stmt, [
+            {"time": ts, "device_id": device_id, "quality": 1, **{key: values.get(key) for key in METRIC_KEYS}}
+            for (ts, device_id), values in wide.items()
+        ])
+
+    @staticmethod
+    def _copy_wide(wide: Dict[Tuple[datetime, UUID], Dict[str, float]]) -> int:
+        columns = ("time", "device_id") + METRIC_KEYS
+        updates = ", ".join(
+            f"{key} = COALESCE(EXCLUDED.{key}, device_telemetry_wide.{key})" for key in METRIC_KEYS
+        )
+        return _copy_merge(
+            "time timestamptz, device_id uuid, " + ", ".join(f"{key} double precision" for key in METRIC_KEYS),
+            "_telemetry_wide_stage",
+            columns,
+            (
+                (ts, device_id, *(None if values.get(key) is None else float(values[key]) for key in METRIC_KEYS))
+                for (ts, device_id), values in wide.items()
+            ),
+            f"INSERT INTO device_telemetry_wide ({', '.join(columns)}, quality) "
+            f"SELECT {', '.join(columns)}, 1 FROM _telemetry_wide_stage "
+            f"ON CONFLICT (time, device_id) DO UPDATE SET {updates}",
+        )
+
+
+def _as_float(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _bucket_in_python(points: Iterable[Tuple[datetime, Dict[str, Optional[float]]]], bucket: timedelta) -> List[Dict[str, Any]]:
+    """time_bucket olmayan dialect'ler için (SQLite testleri) ortalama hesapla."""
+    width = bucket.total_seconds()
+    sums: Dict[float, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    for ts, values in points:
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        start = math.floor(ts.timestamp() / width) * width
+        for key, value in values.items():
+            if value is not None:
+                sums[start][key].append(value)
+
+    result = []
+    for start in sorted(sums):
+        record: Dict[str, Any] = {"time": datetime.fromtimestamp(start, tz=timezone.utc)}
+        for key in METRIC_KEYS:
+            values = sums[start].get(key)
+            record[key] = sum(values) / len(values) if values else None
+        result.append(record)
+    return result
+
+
+# Singleton instance'lar (düzen başına)
+_stores: Dict[str, NarrowTelemetryStore] = {}
+
+
+def get_telemetry_store(layout: Optional[str] = None) -> NarrowTelemetryStore:
+    """
+    Yapılandırılmış telemetri store'unu döndür.
+
+    Args:
+        layout: "narrow" | "wide" (None ise TELEMETRY_STORAGE_LAYOUT config'i)
+    """
+    if layout is None:
+        if has_app_context():
+            layout = current_app.config.get("TELEMETRY_STORAGE_LAYOUT", LAYOUT_NARROW)
+        else:
+            layout = os.getenv("TELEMETRY_STORAGE_LAYOUT", LAYOUT_NARROW)
+    layout = (layout or LAYOUT_NARROW).lower()
+
+    store = _stores.get(layout)
+    if store is None:
+        if layout == LAYOUT_WIDE:
+            store = WideTelemetryStore()
+        else:
+            if layout != LAYOUT_NARROW:
+                logger.warning(f"[TelemetryStore] Bilinmeyen düzen '{layout}', narrow kullanılıyor")
+            store = NarrowTelemetryStore()
+        _stores[layout] = store
+    return store
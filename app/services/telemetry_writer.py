@@ -0,0 +1,422 @@
+"""
+Telemetry Batch Writer - MQTT ingest için toplu yazma hattı.
+
+MQTT network thread'i artık her mesajda Postgres'e gitmez:
+- _on_message okumaları sınırlı (bounded) bir kuyruğa bırakır
+- Writer worker'ları okumaları mikro-batch'lere toplar (boyut veya süre limiti)
+- Her batch tek bir multi-row INSERT ile telemetri store'una yazılır (narrow/wide düzen)
+- Cihazların is_online/last_seen alanları batch başına tek UPDATE ile güncellenir
+  (her cihaz kendi son okumasının zamanıyla)
+- Batch yazılamazsa ikiye bölünüp tekrar denenir; yalnızca hatalı okuma düşer
+
+Best Practices:
+- Kuyruk doluysa kısa süre bekle, sonra düşür (backpressure metrikleri tutulur)
+- Shutdown'da kuyruk boşaltılır (drain)
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import case, or_, update
+
+from app.extensions import db
+from app.models import SmartDevice
+from app.services.anomaly_stats import get_hourly_stats_store
+from app.services.automation_triggers import get_automation_trigger_index
+from app.services.latest_values import get_latest_value_store
+from app.services.org_kpis import get_org_kpi_store
+from app.services.telemetry_store import TELEMETRY_KEY_ALIASES, get_telemetry_store
+
+logger = logging.getLogger(__name__)
+
+# Varsayılan batch ayarları (config ile override edilir)
+DEFAULT_BATCH_SIZE = 500  # Batch başına maksimum satır
+DEFAULT_BATCH_INTERVAL_MS = 200  # Batch başına maksimum bekleme süresi
+DEFAULT_QUEUE_SIZE = 20000  # Kuyruktaki maksimum okuma sayısı
+DEFAULT_WORKERS = 2
+ENQUEUE_TIMEOUT_SECONDS = 0.05  # Kuyruk doluyken network thread'in bekleme süresi
+
+# Kuyruk elemanı: (device_id, time, {key: value})
+TelemetryItem = Tuple[UUID, datetime, Dict[str, float]]
+
+
+def extract_readings(data: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Payload'daki sayısal ölçümleri kanonik key'lere çevir.
+
+    Örnek: {"power_w": "45.5", "temp": 21} -> {"power": 45.5, "temperature": 21.0}
+    """
+    readings: Dict[str, float] = {}
+    if not isinstance(data, dict):
+        return readings
+
+    for field, key in TELEMETRY_KEY_ALIASES.items():
+        value = data.get(field)
+        if value is None or key in readings:
+            continue
+        try:
+            readings[key] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return readings
+
+
+class TelemetryBatchWriter:
+    """
+    Sınırlı kuyruk + worker havuzu ile telemetri toplu yazıcısı.
+
+    Kullanım:
+        writer = TelemetryBatchWriter(app)
+        writer.start()
+        writer.submit(device.id, datetime.now(timezone.utc), {"power": 45.5})
+        ...
+        writer.stop()  # Kuyruğu boşaltır
+    """
+
+    def __init__(
+        self,
+        app=None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_interval_ms: int = DEFAULT_BATCH_INTERVAL_MS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        workers: int = DEFAULT_WORKERS,
+    ):
+        self.app = app
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = max(0.0, batch_interval_ms / 1000.0)
+        self.workers = max(0, workers)
+
+        self._queue: "queue.Queue[TelemetryItem]" = queue.Queue(maxsize=max(1, queue_size))
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+        # Metrikler
+        self._stats: Dict[str, Any] = {
+            "enqueued": 0,
+            "dropped": 0,
+            "blocked": 0,
+            "batches": 0,
+            "rows_written": 0,
+            "failed_rows": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+            "last_batch_rows": 0,
+            "last_flush_ms": 0.0,
+            "last_flush_at": None,
+        }
+
+    # ------------------------------------------
+    # Lifecycle
+    # ------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        """Worker thread'leri çalışıyor mu?"""
+        return any(t.is_alive() for t in self._threads) and not self._stopping.is_set()
+
+    def start(self) -> None:
+        """Worker thread'lerini başlat."""
+        if self.running:
+            return
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(
+                target=self._worker_loop,
+                daemon=True,
+                name=f"telemetry-writer-{i}",
+            )
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(
+            f"[TelemetryWriter] Başlatıldı: workers={self.workers}, "
+            f"batch={self.batch_size} satır / {self.batch_interval * 1000:.0f}ms"
+        )
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Worker'ları durdur ve kuyrukta kalan okumaları yaz (drain-on-shutdown).
+        """
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+        # Worker'lar kuyruğu bitiremediyse kalanı bu thread'de yaz
+        remaining = self.drain()
+        if remaining:
+            logger.info(f"[TelemetryWriter] Shutdown drain: {remaining} satır yazıldı")
+
+    # ------------------------------------------
+    # Producer API
+    # ------------------------------------------
+
+    def submit(
+        self,
+        device_id: UUID,
+        timestamp: Optional[datetime] = None,
+        readings: Optional[Dict[str, float]] = None,
+    ) -> bool:
+        """
+        Okumayı kuyruğa bırak.
+
+        Boş readings cihazı yalnızca "görüldü" olarak işaretler (heartbeat).
+
+        Returns:
+            True: kuyruğa alındı, False: kuyruk dolu olduğu için düşürüldü
+        """
+        item: TelemetryItem = (
+            device_id,
+            timestamp or datetime.now(timezone.utc),
+            dict(readings or {}),
+        )
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._bump("blocked")
+            try:
+                self._queue.put(item, timeout=ENQUEUE_TIMEOUT_SECONDS)
+            except queue.Full:
+                self._bump("dropped")
+                logger.warning(f"[TelemetryWriter] Kuyruk dolu, okuma düşürüldü: device={device_id}")
+                return False
+
+        self._bump("enqueued")
+        depth = self._queue.qsize()
+        if depth > self._stats["max_queue_depth"]:
+            with self._lock:
+                self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], depth)
+        return True
+
+    def write_now(self, items: Iterable[TelemetryItem]) -> int:
+        """Okumaları kuyruğu atlayarak çağıran thread'de yaz (writer kapalıyken fallback)."""
+        return self._flush(list(items))
+
+    def drain(self) -> int:
+        """Kuyruktaki tüm okumaları çağıran thread'de yaz."""
+        written = 0
+        while True:
+            batch = self._collect(block=False)
+            if not batch:
+                return written
+            written += self._flush(batch)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Backpressure ve throughput metrikleri."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "workers": self.workers,
+            "workers_alive": sum(1 for t in self._threads if t.is_alive()),
+            "batch_size": self.batch_size,
+            "batch_interval_ms": int(self.batch_interval * 1000),
+        })
+        return stats
+
+    # ------------------------------------------
+    # Worker
+    # ------------------------------------------
+
+    def _worker_loop(self) -> None:
+        while True:
+            batch = self._collect(block=True)
+            if batch:
+                self._flush(batch)
+            elif self._stopping.is_set():
+                return
+
+    def _collect(self, block: bool) -> List[TelemetryItem]:
+        """
+        Kuyruktan bir mikro-batch topla.
+
+        İlk eleman geldikten sonra batch_size satıra ya da
+        batch_interval süresine ulaşılana kadar toplamaya devam eder.
+        """
+        batch: List[TelemetryItem] = []
+        try:
+            first = self._queue.get(timeout=0.5) if block else self._queue.get_nowait()
+        except queue.Empty:
+            return batch
+
+        batch.append(first)
+        rows = max(1, len(first[2]))
+        deadline = time.monotonic() + self.batch_interval
+
+        while rows < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if block and remaining > 0 and not self._stopping.is_set():
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += max(1, len(item[2]))
+
+        return batch
+
+    def _flush(self, batch: List[TelemetryItem]) -> int:
+        """
+        Batch'i tek INSERT + tek UPDATE ile yaz.
+
+        Yazma başarısız olursa batch ikiye bölünüp her yarı ayrı denenir; böylece
+        tek bir bozuk okuma tüm batch'i düşürmez, yalnızca kendisi düşer.
+        """
+        if not batch:
+            return 0
+
+        # Aynı (time, device_id, key) primary key'i batch içinde tekrar ederse son değer kazanır
+        rows: Dict[Tuple[datetime, UUID, str], float] = {}
+        last_seen: Dict[UUID, datetime] = {}
+        for device_id, ts, readings in batch:
+            for key, value in readings.items():
+                rows[(ts, device_id, key)] = value
+            if device_id not in last_seen or ts > last_seen[device_id]:
+                last_seen[device_id] = ts
+
+        started = time.monotonic()
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    self._execute(rows, last_seen)
+            else:
+                self._execute(rows, last_seen)
+        except Exception as exc:
+            with self._lock:
+                self._stats["errors"] += 1
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                logger.warning(f"[TelemetryWriter] Batch yazılamadı ({len(rows)} satır), bölünerek tekrar deneniyor: {exc}")
+                return self._flush(batch[:middle]) + self._flush(batch[middle:])
+            logger.error(f"[TelemetryWriter] Okuma yazılamadı ({len(rows)} satır): {exc}")
+            with self._lock:
+                self._stats["failed_rows"] += len(rows)
+            return 0
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["rows_written"] += len(rows)
+            self._stats["last_batch_rows"] = len(rows)
+            self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self._stats["last_flush_at"] = datetime.now(timezone.utc).isoformat()
+        logger.debug(f"[TelemetryWriter] Flush: {len(rows)} satır, {len(last_seen)} cihaz, {elapsed_ms:.1f}ms")
+        return len(rows)
+
+    @staticmethod
+    def _execute(rows: Dict[Tuple[datetime, UUID, str], float], last_seen: Dict[UUID, datetime]) -> None:
+        try:
+            if rows:
+                get_telemetry_store().write(
+                    (ts, device_id, key, value) for (ts, device_id, key), value in rows.items()
+                )
+
+            if last_seen:
+                # Her cihaz kendi son okumasıyla; daha yeni bir last_seen geri alınmaz
+                seen = case(last_seen, value=SmartDevice.id)
+                db.session.execute(
+                    update(SmartDevice)
+                    .where(SmartDevice.id.in_(list(last_seen.keys())))
+                    .values(
+                        is_online=True,
+                        last_seen=case(
+                            (or_(SmartDevice.last_seen.is_(None), SmartDevice.last_seen < seen), seen),
+                            else_=SmartDevice.last_seen,
+                        ),
+                    )
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        publish_ingested(
+            [(ts, device_id, key, value) for (ts, device_id, key), value in rows.items()]
+        )
+
+    def _bump(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+
+def publish_ingested(rows: Sequence[Tuple[datetime, UUID, str, float]]) -> None:
+    """
+    Commit edilen okumaları bellek içi türetilmiş durumlara bildir.
+
+    Last-known-value store'u, anomali saatlik istatistiklerini ve dashboard KPI'larını günceller,
+    sensör eşiğini geçen otomasyonları değerlendirmeye gönderir;
+    hatalar loglanır, yazma akışını bozmaz. Tüm ingest yolları commit sonrası çağırır.
+    """
+    try:
+        get_latest_value_store().record(rows)
+    except Exception as exc:
+        logger.warning(f"[TelemetryWriter] Latest value güncellenemedi: {exc}")
+    try:
+        get_hourly_stats_store().observe_rows(rows)
+    except Exception as exc:
+        logger.warning(f"[TelemetryWriter] Anomali istatistikleri güncellenemedi: {exc}")
+    try:
+        get_automation_trigger_index().on_readings(rows)
+    except Exception as exc:
+        logger.warning(f"[TelemetryWriter] Otomasyon tetikleyicileri bildirilemedi: {exc}")
+    try:
+        get_org_kpi_store().observe_rows(rows)
+    except Exception as exc:
+        logger.warning(f"[TelemetryWriter] Dashboard KPI'ları güncellenemedi: {exc}")
+
+
+def bulk_load_telemetry(rows: Iterable[Tuple[datetime, UUID, str, float]]) -> int:
+    """
+    Büyük telemetri batch'lerini tek seferde yaz (edge ingest için).
+
+    PostgreSQL'de satırlar COPY FROM STDIN ile staging tabloya akıtılır ve
+    ON CONFLICT DO UPDATE semantiğiyle aktarılır (bkz. TelemetryStore.bulk_load).
+    Commit çağıran tarafa bırakılır.
+
+    Args:
+        rows: (time, device_id, key, value) tuple'ları
+
+    Returns:
+        Yazılan satır sayısı
+    """
+    return get_telemetry_store().bulk_load(rows)
+
+
+# Singleton instance
+_telemetry_writer: Optional[TelemetryBatchWriter] = None
+
+
+def init_telemetry_writer(app) -> TelemetryBatchWriter:
+    """Config'e göre writer'ı oluştur ve başlat."""
+    global _telemetry_writer
+    if _telemetry_writer is None or _telemetry_writer.app is None:
+        _telemetry_writer = TelemetryBatchWriter(
+            app,
+            batch_size=app.config.get("TELEMETRY_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+            batch_interval_ms=app.config.get("TELEMETRY_BATCH_INTERVAL_MS", DEFAULT_BATCH_INTERVAL_MS),
+            queue_size=app.config.get("TELEMETRY_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+            workers=app.config.get("TELEMETRY_WRITER_WORKERS", DEFAULT_WORKERS),
+        )
+    _telemetry_writer.start()
+    return _telemetry_writer
+
+
+def get_telemetry_writer() -> TelemetryBatchWriter:
+    """Telemetry writer singleton'ı döndür (başlatılmamış olabilir)."""
+    global _telemetry_writer
+    if _telemetry_writer is None:
+        _telemetry_writer = TelemetryBatchWriter()
+    return _telemetry_writer
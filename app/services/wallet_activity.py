@@ -0,0 +1,245 @@
+"""
+Wallet Activity - Cüzdan başına ödül günü bitmap'i ve aylık özetler.
+
+/wallet/stats streak için gün başına bir sorgu (365'e kadar) ve aylık
+SUM / COUNT / kategori sorguları çalıştırmak yerine wallet_activity satırını okur:
+
+- reward_days: reward_start'tan itibaren gün başına bir bit (pozitif ödül alınan günler, UTC)
+- monthly: {"YYYY-MM": {"earned", "count"}}, category_totals: {kategori: ödül toplamı}
+- Yeni WalletTransaction'lar before_flush'ta aynı transaction içinde indekse yazılır;
+  rollback olan işlem indekse de girmez
+- Satır her güncellemede SELECT ... FOR UPDATE ile kilitlenir (eşzamanlı ödüller sıralanır)
+- Satırı olmayan cüzdanın indeksi ilk okumada / ilk yazımda wallet_transactions'tan kurulur;
+  satır INSERT ... ON CONFLICT DO NOTHING ile açılır, eşzamanlı kurulum IntegrityError vermez
+- Günler ve aylar DB session'ının saat diliminden bağımsız olarak UTC'dir
+
+Streak bitmap üzerinde bit işlemleriyle hesaplanır (tarama yok).
+"""
+from __future__ import annotations
+
+import logging
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from sqlalchemy import String, case, cast, event, func
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import WalletActivity, WalletTransaction
+
+logger = logging.getLogger(__name__)
+
+STREAK_MAX_DAYS = 365  # Eski hesaplamadaki makul limit
+REWARD_TYPE = "reward"
+
+
+def _day(ts: Optional[datetime]) -> date:
+    if ts is None:
+        return datetime.now(timezone.utc).date()
+    return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).date()
+
+
+def _month(day: date) -> str:
+    return day.strftime("%Y-%m")
+
+
+def _bits(activity: WalletActivity) -> int:
+    return int.from_bytes(activity.reward_days or b"", "little")
+
+
+def _set_bits(activity: WalletActivity, bits: int) -> None:
+    activity.reward_days = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _mark_reward_day(activity: WalletActivity, day: date) -> None:
+    """Günü bitmap'e işle (reward_start'tan önceki gün gelirse bitmap kaydırılır)."""
+    bits = _bits(activity)
+    if activity.reward_start is None:
+        activity.reward_start, bits = day, 0
+    elif day < activity.reward_start:
+        bits <<= (activity.reward_start - day).days
+        activity.reward_start = day
+    _set_bits(activity, bits | (1 << (day - activity.reward_start).days))
+
+
+def _apply_transaction(activity: WalletActivity, transaction: WalletTransaction) -> None:
+    day = _day(transaction.created_at)
+    amount = Decimal(str(transaction.amount or 0))
+    is_reward = transaction.transaction_type == REWARD_TYPE
+
+    # JSONB kolonları yerinde değiştirilmez; yeni dict atanır ki ORM değişikliği görsün
+    monthly = dict(activity.monthly or {})
+    month = dict(monthly.get(_month(day), {"earned": 0.0, "count": 0}))
+    month["count"] += 1
+    if is_reward:
+        month["earned"] = float(Decimal(str(month["earned"])) + amount)
+    monthly[_month(day)] = month
+    activity.monthly = monthly
+
+    if is_reward:
+        categories = dict(activity.category_totals or {})
+        key = transaction.category or ""
+        categories[key] = float(Decimal(str(categories.get(key, 0))) + amount)
+        activity.category_totals = categories
+        if amount > 0:
+            _mark_reward_day(activity, day)
+
+
+def _dialect(session: Session) -> str:
+    return session.get_bind().dialect.name
+
+
+def _insert(session: Session, table):
+    """Dialect'e özel INSERT (on_conflict_do_nothing desteği için)."""
+    if _dialect(session) == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _utc(session: Session, column):
+    """timestamptz kolonunu UTC'ye çevir (date/cast session saat dilimini kullanmasın)."""
+    if _dialect(session) == "postgresql":
+        return func.timezone("UTC", column)
+    return column  # SQLite: değerler zaten UTC saklanır
+
+
+def _fill_activity(session: Session, activity: WalletActivity) -> WalletActivity:
+    """İndeks alanlarını wallet_transactions'tan yeniden hesapla."""
+    wallet_id = activity.wallet_id
+    activity.reward_start, activity.reward_days = None, b""
+
+    created_at = _utc(session, WalletTransaction.created_at)
+    day_col = func.date(created_at)
+    reward_days = session.query(day_col).filter(
+        WalletTransaction.wallet_id == wallet_id,
+        WalletTransaction.transaction_type == REWARD_TYPE,
+        WalletTransaction.amount > 0,
+    ).distinct().all()
+    for (day,) in reward_days:
+        _mark_reward_day(activity, day if isinstance(day, date) else date.fromisoformat(str(day)))
+
+    month_col = func.substr(cast(created_at, String), 1, 7)  # YYYY-MM
+    reward_amount = func.sum(case((WalletTransaction.transaction_type == REWARD_TYPE, WalletTransaction.amount), else_=0))
+    monthly = session.query(month_col, reward_amount, func.count(WalletTransaction.id)).filter(
+        WalletTransaction.wallet_id == wallet_id,
+    ).group_by(month_col).all()
+    activity.monthly = {
+        str(month): {"earned": float(earned or 0), "count": int(count)} for month, earned, count in monthly
+    }
+
+    categories = session.query(WalletTransaction.category, func.sum(WalletTransaction.amount)).filter(
+        WalletTransaction.wallet_id == wallet_id,
+        WalletTransaction.transaction_type == REWARD_TYPE,
+    ).group_by(WalletTransaction.category).all()
+    activity.category_totals = {category or "": float(total or 0) for category, total in categories}
+    return activity
+
+
+def build_activity(wallet_id: Any) -> WalletActivity:
+    """Cüzdanın indeksini wallet_transactions'tan kur (session'a eklenir, commit edilmez)."""
+    activity = WalletActivity(wallet_id=wallet_id, reward_days=b"", monthly={}, category_totals={})
+    _fill_activity(db.session, activity)
+    db.session.add(activity)
+    return activity
+
+
+def lock_activity(session: Session, wallet_id: Any) -> WalletActivity:
+    """
+    Cüzdanın indeks satırını kilitle (SELECT ... FOR UPDATE); yoksa aç ve kur.
+
+    Satır INSERT ... ON CONFLICT DO NOTHING ile açılır: eşzamanlı bir transaction
+    aynı satırı açtıysa onun commit'i beklenir ve kurduğu satır kilitlenir.
+    """
+    stmt = _insert(session, WalletActivity.__table__).values(
+        wallet_id=wallet_id, reward_days=b"", monthly={}, category_totals={},
+    ).on_conflict_do_nothing(index_elements=["wallet_id"]).returning(WalletActivity.wallet_id)
+    created = session.execute(stmt).first() is not None
+
+    activity = session.query(WalletActivity).filter(
+        WalletActivity.wallet_id == wallet_id,
+    ).with_for_update().populate_existing().one()
+    if created:
+        _fill_activity(session, activity)
+    return activity
+
+
+def get_activity(wallet_id: Any) -> WalletActivity:
+    """Cüzdanın indeksi (yoksa kurulur ve commit edilir)."""
+    activity = db.session.get(WalletActivity, wallet_id)
+    if activity is None:
+        activity = lock_activity(db.session, wallet_id)
+        db.session.commit()
+        logger.debug(f"[WalletActivity] {wallet_id} indeksi kuruldu")
+    return activity
+
+
+def streak_days(activity: WalletActivity, today: Optional[date] = None) -> int:
+    """
+    Ardışık ödül günü sayısı (bugün ödül yoksa dünden geriye sayılır).
+
+    Örnek: Bugün, dün ve önceki gün ödül aldıysa streak = 3
+    """
+    today = today or datetime.now(timezone.utc).date()
+    bits = _bits(activity)
+    if activity.reward_start is None or not bits or today < activity.reward_start:
+        return 0
+
+    top = (today - activity.reward_start).days
+    if not (bits >> top) & 1:
+        top -= 1
+        limit = STREAK_MAX_DAYS - 1
+    else:
+        limit = STREAK_MAX_DAYS
+    if top < 0:
+        return 0
+
+    # top'tan aşağı doğru ardışık 1'ler: en yüksek 0 bitinin konumuna kadar
+    mask = (1 << (top + 1)) - 1
+    gaps = ~bits & mask
+    streak = top + 1 if not gaps else top - (gaps.bit_length() - 1)
+    return min(streak, limit)
+
+
+def wallet_stats(activity: WalletActivity, today: Optional[date] = None) -> Dict[str, Any]:
+    """/wallet/stats yanıtı: bu ayki kazanç / işlem sayısı, en çok ödül alınan kategori, streak."""
+    today = today or datetime.now(timezone.utc).date()
+    month = (activity.monthly or {}).get(_month(today), {})
+    categories = activity.category_totals or {}
+    top_category = max(categories.items(), key=lambda item: item[1])[0] if categories else None
+    return {
+        "total_earned_this_month": float(month.get("earned", 0)),
+        "total_transactions_this_month": int(month.get("count", 0)),
+        "top_category": top_category or None,
+        "streak_days": streak_days(activity, today),
+    }
+
+
+# ==========================================
+# ORM Event'leri - işlemle aynı transaction'da indeks güncellemesi
+# ==========================================
+
+def _index_transactions(session: Session, flush_context: Any, instances: Any) -> None:
+    transactions = [obj for obj in session.new if isinstance(obj, WalletTransaction)]
+    if not transactions:
+        return
+    # Flush başına cüzdan satırı bir kez kilitlenir
+    activities: Dict[Any, WalletActivity] = {}
+    with session.no_autoflush:
+        for transaction in transactions:
+            wallet_id = transaction.wallet_id or (transaction.wallet.id if transaction.wallet else None)
+            if wallet_id is None:
+                continue
+            activity = activities.get(wallet_id)
+            if activity is None:
+                activity = activities[wallet_id] = lock_activity(session, wallet_id)
+            _apply_transaction(activity, transaction)
+
+
+def register_activity_listeners() -> None:
+    """WalletTransaction yazımlarını aktivite indeksine bağla (idempotent)."""
+    if event.contains(Session, "before_flush", _index_transactions):
+        return
+    event.listen(Session, "before_flush", _index_transactions)
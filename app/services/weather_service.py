@@ -26,6 +26,7 @@ from app.constants import (
     WEATHER_CACHE_TIMEOUT,
     API_TIMEOUT_DEFAULT,
 )
+from app.services.http_client import get_http_client
 
 # Redis cache için (opsiyonel)
 try:
@@ -132,7 +133,7 @@ class OpenWeatherService:
         params["lang"] = "tr"  # Türkçe açıklamalar
         
         try:
-            response = requests.get(url, params=params, timeout=timeout)
+            response = get_http_client().get(url, params=params, timeout=timeout)
             response.raise_for_status()
             return response.json()
             
@@ -270,7 +271,7 @@ class OpenWeatherService:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=API_TIMEOUT_DEFAULT)
+            response = get_http_client().get(url, params=params, timeout=API_TIMEOUT_DEFAULT)
             response.raise_for_status()
             data = response.json()
             
@@ -328,7 +329,7 @@ class OpenWeatherService:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=API_TIMEOUT_DEFAULT)
+            response = get_http_client().get(url, params=params, timeout=API_TIMEOUT_DEFAULT)
             response.raise_for_status()
             data = response.json()
             
@@ -5,11 +5,15 @@ Dakikalık olarak aktif otomasyonları değerlendirir ve tetikler.
 Tüm otomasyon mantığı automation_engine servisinde merkezileştirilmiştir.
 """
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+from sqlalchemy.orm import selectinload
 
 from app.extensions import celery
-from app.models import Automation
+from app.models import Automation, SmartAsset
 from app.services.automation_engine import automation_engine, check_all_automations
+from app.services.automation_rules import EvaluationContext
+from app.services.automation_triggers import get_automation_trigger_index
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +23,11 @@ def check_automations(self) -> Dict[str, Any]:
     """
     Tüm aktif otomasyonları kontrol et ve tetikle.
     
-    Celery Beat tarafından her dakika çağrılır.
+    Celery Beat tarafından her dakika çağrılır ('check-automations-every-minute').
+    Güvenlik ağıdır: girdisi değişen otomasyonlar evaluate_automations ile,
+    zaman sınırı gelenler 'dispatch-automation-time-boundaries' ile anında
+    değerlendirilir; bu tarama ikisinin kaçırdıklarını (düşen task, Redis
+    kesintisi, indeks gecikmesi) en geç bir dakika içinde yakalar.
     Tüm mantık automation_engine servisinde.
     """
     try:
@@ -34,6 +42,55 @@ def check_automations(self) -> Dict[str, Any]:
         raise self.retry(exc=exc)
 
 
+@celery.task
+def evaluate_automations(automation_ids: List[str], source: str = "event") -> Dict[str, Any]:
+    """
+    Girdisi değişen otomasyonları değerlendir (olay bazlı tetikleme).
+    
+    AutomationTriggerIndex tarafından sensör eşiği geçişi, fiyat güncellemesi
+    ve zaman sınırı olaylarında kuyruğa alınır.
+    
+    Args:
+        automation_ids: Otomasyon UUID listesi
+        source: Olay kaynağı ('sensor', 'price', 'time')
+    """
+    automations = Automation.query.filter(
+        Automation.id.in_(automation_ids),
+        Automation.is_active.is_(True),
+    ).options(
+        selectinload(Automation.asset).selectinload(SmartAsset.device)
+    ).order_by(Automation.priority.asc()).all()
+    
+    context = EvaluationContext()
+    context.prefetch(automations)
+    
+    results = automation_engine.run_automations(automations, context)
+    triggered_count = sum(1 for result in results if result.get('triggered'))
+    
+    logger.info(
+        f"[AUTOMATION_TASK] Event ({source}): evaluated {len(automations)}, "
+        f"triggered {triggered_count}"
+    )
+    return {
+        'status': 'success',
+        'source': source,
+        'checked': len(automations),
+        'triggered': triggered_count,
+    }
+
+
+@celery.task
+def dispatch_time_boundaries() -> Dict[str, Any]:
+    """
+    Bu dakikada zaman sınırı olan otomasyonları değerlendirmeye gönder.
+    
+    Celery Beat tarafından her dakika çağrılır; sadece sınırı gelen
+    otomasyonlar değerlendirilir.
+    """
+    dispatched = get_automation_trigger_index().on_time_boundary()
+    return {'status': 'success', 'dispatched': dispatched}
+
+
 @celery.task(bind=True, max_retries=3, default_retry_delay=30)
 def run_single_automation(self, automation_id: str) -> Dict[str, Any]:
     """
@@ -85,26 +142,15 @@ def run_organization_automations(organization_id: str) -> Dict[str, Any]:
         is_active=True
     ).order_by(Automation.priority.asc()).all()
     
-    results = []
-    triggered_count = 0
+    context = EvaluationContext()
+    context.prefetch(automations)
     
-    for automation in automations:
-        try:
-            result = automation_engine.run_automation(automation)
-            result['automation_id'] = str(automation.id)
-            result['name'] = automation.name
-            results.append(result)
-            
-            if result.get('triggered'):
-                triggered_count += 1
-        except Exception as e:
-            logger.exception(f"[AUTOMATION_TASK] Error running automation {automation.id}")
-            results.append({
-                'automation_id': str(automation.id),
-                'name': automation.name,
-                'triggered': False,
-                'error': str(e)
-            })
+    # Tetiklenen otomasyonların cihaz komutları eşzamanlı gönderilir
+    results = automation_engine.run_automations(automations, context)
+    for automation, result in zip(automations, results):
+        result['automation_id'] = str(automation.id)
+        result['name'] = automation.name
+    triggered_count = sum(1 for result in results if result.get('triggered'))
     
     logger.info(
         f"[AUTOMATION_TASK] Organization {organization_id}: "
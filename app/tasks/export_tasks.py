@@ -9,14 +9,16 @@ import csv
 import json
 import logging
 from datetime import datetime, timezone, timedelta
+from uuid import UUID
 
 from celery import shared_task
 
 from app.extensions import db
 from app.models import (
-    DataExport, DeviceTelemetry, SmartDevice, SmartAsset,
+    DataExport, SmartDevice, SmartAsset,
     Automation, Invoice, AuditLog
 )
+from app.services.telemetry_store import get_telemetry_store
 
 logger = logging.getLogger(__name__)
 
@@ -101,33 +103,28 @@ def _export_telemetry(export: DataExport) -> dict:
     if not end_date:
         end_date = utcnow()
     
-    # Query oluştur
-    query = DeviceTelemetry.query.join(SmartDevice).filter(
-        SmartDevice.organization_id == export.organization_id,
-        DeviceTelemetry.time >= start_date,
-        DeviceTelemetry.time <= end_date
-    )
-    
-    if device_id:
-        query = query.filter(DeviceTelemetry.device_id == device_id)
-    
-    query = query.order_by(DeviceTelemetry.time.asc())
+    # Telemetri store'u üzerinden sayfalı okuma (narrow/wide düzenden bağımsız)
+    store = get_telemetry_store()
+    scope = {"device_ids": [UUID(str(device_id))]} if device_id else {"organization_id": export.organization_id}
+
+    def fetch_page(offset: int, limit: int) -> list:
+        return store.history(start_date, end_date, limit=limit, offset=offset, **scope)
     
     # Toplam kayıt sayısı
-    total_rows = query.count()
+    total_rows = store.count(start_date, end_date, **scope)
     export.total_rows = total_rows
     db.session.commit()
     
     # Batch işleme
     batch_size = 5000
-    all_columns = columns or ["time", "device_id", "power_w", "voltage", "current", "energy_total_kwh", "temperature", "humidity"]
+    all_columns = columns or ["time", "device_id", "power", "voltage", "current", "energy", "temperature", "humidity"]
     
     if export.format == "csv":
-        return _write_csv(export, query, all_columns, batch_size, total_rows)
+        return _write_csv(export, fetch_page, all_columns, batch_size, total_rows)
     elif export.format == "excel":
-        return _write_excel(export, query, all_columns, batch_size, total_rows)
+        return _write_excel(export, fetch_page, all_columns, batch_size, total_rows)
     else:
-        return _write_json(export, query, batch_size, total_rows)
+        return _write_json(export, fetch_page, batch_size, total_rows)
 
 
 def _export_devices(export: DataExport) -> dict:
@@ -235,7 +232,7 @@ def _export_audit_logs(export: DataExport) -> dict:
     return _write_data(export, data, columns, "audit_logs")
 
 
-def _write_csv(export: DataExport, query, columns: list, batch_size: int, total_rows: int) -> dict:
+def _write_csv(export: DataExport, fetch_page, columns: list, batch_size: int, total_rows: int) -> dict:
     """CSV dosyası oluştur."""
     output = io.StringIO()
     writer = csv.DictWriter(output, fieldnames=columns)
@@ -243,12 +240,12 @@ def _write_csv(export: DataExport, query, columns: list, batch_size: int, total_
     
     processed = 0
     for offset in range(0, total_rows, batch_size):
-        records = query.offset(offset).limit(batch_size).all()
+        records = fetch_page(offset, batch_size)
         
         for r in records:
             row = {}
             for col in columns:
-                val = getattr(r, col, None)
+                val = r.get(col)
                 if hasattr(val, 'isoformat'):
                     val = val.isoformat()
                 elif hasattr(val, '__str__') and val is not None:
@@ -265,14 +262,14 @@ def _write_csv(export: DataExport, query, columns: list, batch_size: int, total_
     return _save_file(export, content.encode('utf-8'), "csv")
 
 
-def _write_excel(export: DataExport, query, columns: list, batch_size: int, total_rows: int) -> dict:
+def _write_excel(export: DataExport, fetch_page, columns: list, batch_size: int, total_rows: int) -> dict:
     """Excel dosyası oluştur."""
     try:
         import openpyxl
         from openpyxl import Workbook
     except ImportError:
         logger.warning("openpyxl not installed, falling back to CSV")
-        return _write_csv(export, query, columns, batch_size, total_rows)
+        return _write_csv(export, fetch_page, columns, batch_size, total_rows)
     
     wb = Workbook()
     ws = wb.active
@@ -283,12 +280,12 @@ def _write_excel(export: DataExport, query, columns: list, batch_size: int, tota
     
     processed = 0
     for offset in range(0, total_rows, batch_size):
-        records = query.offset(offset).limit(batch_size).all()
+        records = fetch_page(offset, batch_size)
         
         for r in records:
             row = []
             for col in columns:
-                val = getattr(r, col, None)
+                val = r.get(col)
                 if hasattr(val, 'isoformat'):
                     val = val.isoformat()
                 elif hasattr(val, '__str__') and val is not None:
@@ -308,16 +305,16 @@ def _write_excel(export: DataExport, query, columns: list, batch_size: int, tota
     return _save_file(export, content, "xlsx")
 
 
-def _write_json(export: DataExport, query, batch_size: int, total_rows: int) -> dict:
+def _write_json(export: DataExport, fetch_page, batch_size: int, total_rows: int) -> dict:
     """JSON dosyası oluştur."""
     data = []
     
     processed = 0
     for offset in range(0, total_rows, batch_size):
-        records = query.offset(offset).limit(batch_size).all()
+        records = fetch_page(offset, batch_size)
         
         for r in records:
-            data.append(r.to_dict())
+            data.append({k: str(v) if k == "device_id" else v for k, v in r.items()})
         
         processed += len(records)
         export.processed_rows = processed
@@ -3,11 +3,16 @@ Entegrasyon Senkronizasyon Task'ları.
 
 Bulut entegrasyonlarından (Shelly, Tesla, Tapo) cihazları senkronize eder.
 """
+import logging
 from datetime import datetime
 
 from app.extensions import celery, db
 from app.models import Integration, SmartDevice
 from app.data.integration_providers import get_shelly_device_type
+from app.services.shelly_service import get_shelly_registry
+from app.services.shelly_status import get_shelly_status_cache
+
+logger = logging.getLogger(__name__)
 
 
 @celery.task
@@ -45,6 +50,33 @@ def sync_all_integrations():
     }
 
 
+@celery.task
+def poll_shelly_statuses():
+    """
+    Shelly durum snapshot'ını yenile (entegrasyon başına tek device/all_status).
+
+    Celery Beat tarafından 30 saniyede bir çağrılır; otomasyon koşulları ve
+    cihaz detay endpoint'i bu snapshot'ı okur.
+    """
+    organization_ids = [
+        row[0] for row in db.session.query(Integration.organization_id).filter_by(
+            provider='shelly', is_active=True, status='active'
+        ).distinct()
+    ]
+
+    cache = get_shelly_status_cache()
+    polled, failed = 0, 0
+    for organization_id in organization_ids:
+        try:
+            if cache.poll(organization_id) is not None:
+                polled += 1
+        except Exception as e:
+            failed += 1
+            logger.warning(f"[ShellyStatus] {organization_id} poll edilemedi: {e}")
+
+    return {'status': 'success', 'polled': polled, 'failed': failed}
+
+
 @celery.task(bind=True, max_retries=3)
 def sync_integration_devices(self, integration_id: str):
     """
@@ -93,6 +125,8 @@ def _sync_shelly_devices(integration: Integration) -> list:
     API: https://shelly-api-docs.shelly.cloud/cloud-control-api/
     """
     import requests
+
+    from app.services.http_client import get_http_client
     
     access_token = integration.access_token
     if not access_token:
@@ -105,7 +139,7 @@ def _sync_shelly_devices(integration: Integration) -> list:
     url = f"https://{server_uri}/device/all_status"
     
     try:
-        response = requests.post(url, data={
+        response = get_http_client().post(url, data={
             'auth_key': access_token
         }, timeout=30)
         response.raise_for_status()
@@ -238,12 +272,14 @@ def refresh_integration_token(integration_id: str):
         
         integration.status = 'active'
         db.session.commit()
+        get_shelly_registry().invalidate(integration.organization_id)
         
         return {'status': 'success', 'message': 'Token refreshed successfully'}
         
     except Exception as e:
         integration.status = 'expired'
         db.session.commit()
+        get_shelly_registry().invalidate(integration.organization_id)
         return {'status': 'error', 'message': str(e)}
 
 
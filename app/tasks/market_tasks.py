@@ -11,6 +11,8 @@ import logging
 from app.extensions import celery, db
 from app.models import MarketPrice
 from app.realtime import broadcast_price_update, redis_pubsub
+from app.services.automation_triggers import get_automation_trigger_index
+from app.services.org_kpis import get_org_kpi_store
 
 logger = logging.getLogger(__name__)
 
@@ -85,6 +87,10 @@ def fetch_epias_prices(self):
                 "currency": "TRY"
             })
         
+        # Fiyata bağlı otomasyonları hemen değerlendir
+        get_automation_trigger_index().on_price_changed()
+        get_org_kpi_store().invalidate_market()
+        
         logger.info(f"EPİAŞ fiyatları güncellendi: {saved_count} yeni kayıt")
         
         return {
@@ -145,6 +151,8 @@ def fetch_tomorrow_prices(self):
                 saved_count += 1
         
         db.session.commit()
+        get_automation_trigger_index().on_price_changed()
+        get_org_kpi_store().invalidate_market()
         
         logger.info(f"Yarının fiyatları eklendi: {saved_count} kayıt")
         
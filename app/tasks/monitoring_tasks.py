@@ -4,10 +4,15 @@ Monitoring Tasks - Watchdog & Anomaly Detection.
 Periyodik olarak çalışan izleme görevleri:
 - Cihaz sağlık kontrolü (Watchdog)
 - Anormallik tespiti (Anomaly Detection)
+- Dashboard KPI snapshot'ının SQL ile uzlaştırılması
+- Dashboard istatistikleri için günlük özetlerin (daily facts) yenilenmesi
+- Cüzdan sıralamalarının (leaderboard) wallets tablosuyla uzlaştırılması
+- Enerji tasarruflarının cihaz durum log'larından toplu hesaplanması
 """
 from __future__ import annotations
 
 import logging
+from datetime import date
 from typing import Any, Dict, List
 
 from celery import shared_task
@@ -20,8 +25,12 @@ from app.services.watchdog_service import (
 )
 from app.services.anomaly_service import (
     get_anomaly_detector,
-    create_anomaly_notification,
+    create_anomaly_notifications,
 )
+from app.services.dashboard_stats import get_daily_stats_store
+from app.services.leaderboard import get_leaderboard_store
+from app.services.org_kpis import get_org_kpi_store
+from app.services.savings_engine import get_savings_engine
 
 logger = logging.getLogger(__name__)
 
@@ -94,33 +103,24 @@ def check_anomalies(self) -> Dict[str, Any]:
     with app.app_context():
         detector = get_anomaly_detector()
         
-        organizations = Organization.query.filter_by(is_active=True).all()
-        
-        total_anomalies = 0
-        notifications_created = 0
+        organizations_checked = Organization.query.filter_by(is_active=True).count()
         
-        for org in organizations:
-            try:
-                anomalies = detector.check_all_devices(org.id)
-                total_anomalies += len(anomalies)
-                
-                for anomaly in anomalies:
-                    # Yüksek ve orta seviye anomaliler için bildirim
-                    if anomaly.get("severity") in ("high", "medium"):
-                        create_anomaly_notification(anomaly, org.id)
-                        notifications_created += 1
-                
-                if anomalies:
-                    db.session.commit()
-                    
-            except Exception as e:
-                logger.error(f"[Anomaly] Org kontrolü hatası: {org.id} - {e}")
-                db.session.rollback()
+        # Tüm aktif organizasyonlar tek toplu taramada (set-based sorgular + NumPy)
+        try:
+            anomalies = detector.check_devices_batch()
+            notifications_created = create_anomaly_notifications(anomalies)
+            if notifications_created:
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"[Anomaly] Toplu kontrol hatası: {e}")
+            db.session.rollback()
+            raise self.retry(exc=e, countdown=60)
         
+        total_anomalies = len(anomalies)
         logger.info(f"[Anomaly] Kontrol tamamlandı: {total_anomalies} anormallik, {notifications_created} bildirim")
         
         return {
-            "organizations_checked": len(organizations),
+            "organizations_checked": organizations_checked,
             "total_anomalies": total_anomalies,
             "notifications_created": notifications_created,
         }
@@ -161,3 +161,75 @@ def send_device_reset(device_id: str) -> Dict[str, Any]:
         except Exception as e:
             logger.error(f"[Watchdog] Reset hatası: {device_id} - {e}")
             return {"success": False, "error": str(e)}
+
+
+@shared_task
+def reconcile_org_kpis() -> Dict[str, Any]:
+    """
+    Dashboard KPI snapshot'ını SQL'den yeniden hesapla.
+    
+    Artımlı güncellemelerin kaçırdığı değişiklikleri (bulk update, rollback,
+    kaybolan event) düzeltir. Celery Beat ile her 5 dakikada bir çalışır.
+    """
+    store = get_org_kpi_store()
+    organizations = store.reconcile()
+    store.refresh_market()
+    logger.info(f"[OrgKpis] {organizations} organizasyonun KPI'ları uzlaştırıldı")
+    return {"organizations": organizations}
+
+
+@shared_task
+def rollup_daily_stats() -> Dict[str, Any]:
+    """
+    Son kapanmış günlerin istatistik özetlerini (org_daily_stats) yeniden hesapla.
+    
+    Gece yarısından sonra yazılan geç telemetri / tasarruf kayıtlarını özetlere
+    yansıtır. Celery Beat ile her gece çalışır.
+    """
+    organizations = get_daily_stats_store().rollup()
+    logger.info(f"[DashboardStats] {organizations} organizasyonun günlük özetleri yenilendi")
+    return {"organizations": organizations}
+
+
+@shared_task
+def refresh_daily_stats(organization_id: str, first: str, last: str) -> Dict[str, Any]:
+    """
+    Bir organizasyonun kapanmış gün aralığının özetlerini hesapla ve kaydet.
+    
+    Dashboard istatistik isteği tabloda olmayan günleri yazmadan hesaplar ve
+    kaydı bu task'a bırakır (aralık başına tek task; pending işareti burada silinir).
+    """
+    store = get_daily_stats_store()
+    first_day, last_day = date.fromisoformat(first), date.fromisoformat(last)
+    try:
+        organizations = store.refresh([organization_id], first_day, last_day)
+    finally:
+        store.release_refresh(organization_id, first_day, last_day)
+    logger.info(f"[DashboardStats] {organization_id} için {first}..{last} günlük özetleri kaydedildi")
+    return {"organizations": organizations}
+
+
+@shared_task
+def reconcile_leaderboards() -> Dict[str, Any]:
+    """
+    Cüzdan sıralamalarını wallets tablosundan yeniden kur.
+    
+    Kaçırılan / sırası karışan commit event'lerini düzeltir. Celery Beat ile
+    her 15 dakikada bir çalışır.
+    """
+    organizations = get_leaderboard_store().reconcile()
+    logger.info(f"[Leaderboard] {organizations} organizasyonun sıralaması uzlaştırıldı")
+    return {"organizations": organizations}
+
+
+@shared_task
+def compute_energy_savings() -> Dict[str, Any]:
+    """
+    Son çalıştırmadan beri durum değiştiren cihazların tasarruflarını hesapla.
+    
+    Aralıklar saatlik piyasa fiyatıyla fiyatlanır ve energy_savings'e toplu
+    yazılır. Celery Beat ile her 10 dakikada bir çalışır.
+    """
+    result = get_savings_engine().run()
+    logger.info(f"[SavingsEngine] {result['devices']} cihaz, {result['rows']} tasarruf satırı güncellendi")
+    return result
@@ -10,6 +10,8 @@ import time
 import requests
 from flask import current_app
 
+from app.services.http_client import get_http_client
+
 
 def get_ngrok_public_url(max_retries: int = 10, retry_delay: int = 3) -> str | None:
     """
@@ -52,7 +54,7 @@ def set_telegram_webhook(public_url: str) -> bool:
     api_url = f"https://api.telegram.org/bot{token}/setWebhook"
     
     try:
-        response = requests.post(api_url, json={"url": webhook_url}, timeout=10)
+        response = get_http_client().post(api_url, json={"url": webhook_url}, timeout=10)
         result = response.json()
         
         if result.get("ok"):
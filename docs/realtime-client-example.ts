@@ -6,6 +6,7 @@
  * 
  * Kurulum:
  *   npm install socket.io-client
+ *   npm install @msgpack/msgpack   # Sadece telemetryFormat: 'msgpack' için
  * 
  * Kullanım:
  *   import { useAwaxenSocket } from './realtime-client';
@@ -19,6 +20,7 @@
 
 import { io, Socket } from 'socket.io-client';
 import { useEffect, useState, useCallback, useRef } from 'react';
+import { decode as decodeMsgpack } from '@msgpack/msgpack';
 
 // ==========================================
 // Types
@@ -38,6 +40,34 @@ interface TelemetryData {
   timestamp: string;
 }
 
+// Sunucu telemetriyi organizasyon başına birleştirip ~2 Hz'de tek event olarak gönderir
+interface TelemetryBatch {
+  devices: Array<{
+    device_id: string;
+    data?: TelemetryData['data'];
+    status?: Partial<DeviceStatus['status']> & { is_on?: boolean; state?: string };
+    timestamp: string;
+  }>;
+  count: number;
+  timestamp: string;
+}
+
+// Kompakt format: sözlük bir kez gelir, delta'lar sayısal indeks + kısa alan kodu taşır
+type TelemetryFormat = 'json' | 'compact' | 'msgpack';
+
+interface DeviceDictionary {
+  v: string;                                             // Sözlük versiyonu
+  devices: Array<[string, string, string | null, string | null]>;  // [device_id, name, external_id, device_type]
+  fields: Record<string, string>;                        // Kısa kod -> alan adı
+}
+
+interface TelemetryDelta {
+  v: string;                                             // Delta'nın kodlandığı sözlük versiyonu
+  t: number;                                             // Batch zamanı (epoch ms)
+  k?: 1;                                                 // Keyframe (tam durum)
+  d: Array<[number, number, Record<string, unknown>]>;   // [indeks, t'den geriye ms, değişen alanlar]
+}
+
 interface DeviceStatus {
   device_id: string;
   status: {
@@ -86,6 +116,7 @@ interface AwaxenSocketOptions {
   userId: string;
   orgId?: string;
   token?: string;
+  telemetryFormat?: TelemetryFormat;   // Varsayılan 'json'
   onConnect?: () => void;
   onDisconnect?: () => void;
   onTelemetry?: (data: TelemetryData) => void;
@@ -96,6 +127,48 @@ interface AwaxenSocketOptions {
   onEnergySummary?: (data: EnergySummary) => void;
 }
 
+// ==========================================
+// Compact Telemetry Decoder
+// ==========================================
+
+const STATUS_FIELDS = new Set(['is_on', 'state', 'is_online', 'last_seen']);
+
+class CompactTelemetryDecoder {
+  private dictionary: DeviceDictionary | null = null;
+
+  setDictionary(dictionary: DeviceDictionary): void {
+    this.dictionary = dictionary;
+  }
+
+  /** Delta'yı TelemetryBatch'e çevir; sözlük yok / eskiyse null (sözlük yeniden istenmeli). */
+  decode(frame: TelemetryDelta | ArrayBuffer | Uint8Array): TelemetryBatch | null {
+    const delta = (frame instanceof ArrayBuffer || frame instanceof Uint8Array
+      ? decodeMsgpack(frame)
+      : frame) as TelemetryDelta;
+    const dictionary = this.dictionary;
+    if (!dictionary || dictionary.v !== delta.v) return null;
+
+    const devices: TelemetryBatch['devices'] = [];
+    for (const [index, age, fields] of delta.d) {
+      const device = dictionary.devices[index];
+      if (!device) continue;
+      const data: Record<string, unknown> = {};
+      const status: Record<string, unknown> = {};
+      for (const [code, value] of Object.entries(fields)) {
+        const name = dictionary.fields[code] ?? code;
+        (STATUS_FIELDS.has(name) ? status : data)[name] = value;
+      }
+      devices.push({
+        device_id: device[0],
+        ...(Object.keys(data).length ? { data } : {}),
+        ...(Object.keys(status).length ? { status } : {}),
+        timestamp: new Date(delta.t - age).toISOString(),
+      });
+    }
+    return { devices, count: devices.length, timestamp: new Date(delta.t).toISOString() };
+  }
+}
+
 // ==========================================
 // Socket Manager Class
 // ==========================================
@@ -105,6 +178,7 @@ class AwaxenSocketManager {
   private options: AwaxenSocketOptions;
   private reconnectAttempts = 0;
   private maxReconnectAttempts = 5;
+  private decoder = new CompactTelemetryDecoder();
 
   constructor(options: AwaxenSocketOptions) {
     this.options = options;
@@ -160,6 +234,23 @@ class AwaxenSocketManager {
     });
 
     // Real-time data events
+    this.socket.on('telemetry_batch', (batch: TelemetryBatch) => this.handleBatch(batch));
+
+    // Kompakt format (subscribe_telemetry ile 'compact' / 'msgpack' seçildiyse)
+    this.socket.on('device_dictionary', (dictionary: DeviceDictionary) => {
+      this.decoder.setDictionary(dictionary);
+    });
+
+    this.socket.on('telemetry_delta', (frame: TelemetryDelta | ArrayBuffer) => {
+      const batch = this.decoder.decode(frame);
+      if (batch) {
+        this.handleBatch(batch);
+      } else {
+        // Sözlük değişti (yeni cihaz vb.); bir sonraki keyframe tam durumu getirir
+        this.socket?.emit('get_device_dictionary', { org_id: this.options.orgId });
+      }
+    });
+
     this.socket.on('telemetry', (data: TelemetryData) => {
       this.options.onTelemetry?.(data);
     });
@@ -207,12 +298,26 @@ class AwaxenSocketManager {
     });
   }
 
+  private handleBatch(batch: TelemetryBatch): void {
+    for (const entry of batch.devices) {
+      if (entry.data) {
+        this.options.onTelemetry?.({ device_id: entry.device_id, data: entry.data, timestamp: entry.timestamp });
+      }
+      if (entry.status) {
+        this.options.onDeviceStatus?.({
+          device_id: entry.device_id,
+          status: entry.status as DeviceStatus['status'],
+          timestamp: entry.timestamp,
+        });
+      }
+    }
+  }
+
   private authenticate(): void {
     if (!this.socket) return;
 
+    // Sunucu token'ı doğrular; user/org room'ları token'daki kullanıcının DB kaydından seçilir
     this.socket.emit('authenticate', {
-      user_id: this.options.userId,
-      org_id: this.options.orgId,
       token: this.options.token,
     });
   }
@@ -228,6 +333,14 @@ class AwaxenSocketManager {
       this.socket.emit('subscribe_dashboard', {
         org_id: this.options.orgId,
       });
+
+      // Telemetri formatı (json varsayılan; compact/msgpack bant genişliğini düşürür)
+      if (this.options.telemetryFormat && this.options.telemetryFormat !== 'json') {
+        this.socket.emit('subscribe_telemetry', {
+          org_id: this.options.orgId,
+          format: this.options.telemetryFormat,
+        });
+      }
     }
   }
 
@@ -407,9 +520,13 @@ function Dashboard() {
 }
 */
 
-export { AwaxenSocketManager };
+export { AwaxenSocketManager, CompactTelemetryDecoder };
 export type { 
   TelemetryData, 
+  TelemetryBatch,
+  TelemetryFormat,
+  TelemetryDelta,
+  DeviceDictionary,
   DeviceStatus, 
   PriceUpdate, 
   Notification, 
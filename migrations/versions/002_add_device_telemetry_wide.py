@@ -0,0 +1,54 @@
+"""Add wide telemetry table (one row per device/timestamp)
+
+Revision ID: 002_telemetry_wide
+Revises: 001_ai_analysis
+Create Date: 2025-01-20
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '002_telemetry_wide'
+down_revision = '001_ai_analysis'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'device_telemetry_wide',
+        sa.Column('time', sa.DateTime(timezone=True), primary_key=True, nullable=False),
+        sa.Column('device_id', postgresql.UUID(as_uuid=True),
+                  sa.ForeignKey('smart_devices.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('power', sa.Float(), nullable=True),
+        sa.Column('voltage', sa.Float(), nullable=True),
+        sa.Column('current', sa.Float(), nullable=True),
+        sa.Column('energy', sa.Float(), nullable=True),
+        sa.Column('temperature', sa.Float(), nullable=True),
+        sa.Column('humidity', sa.Float(), nullable=True),
+        sa.Column('quality', sa.Integer(), default=1),
+    )
+    op.create_index('idx_telemetry_wide_device_time', 'device_telemetry_wide', ['device_id', 'time'])
+
+    # TimescaleDB kuruluysa hypertable + compression
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb') THEN
+                PERFORM create_hypertable('device_telemetry_wide', 'time', if_not_exists => TRUE);
+                ALTER TABLE device_telemetry_wide SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = 'device_id'
+                );
+                PERFORM add_compression_policy('device_telemetry_wide', INTERVAL '7 days', if_not_exists => TRUE);
+            END IF;
+        END
+        $$;
+    """)
+
+
+def downgrade():
+    op.drop_index('idx_telemetry_wide_device_time', table_name='device_telemetry_wide')
+    op.drop_table('device_telemetry_wide')
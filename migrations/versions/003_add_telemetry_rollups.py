@@ -0,0 +1,95 @@
+"""Add TimescaleDB continuous aggregates for telemetry (5m, 1h, 1d)
+
+Revision ID: 003_telemetry_rollups
+Revises: 002_telemetry_wide
+Create Date: 2025-01-27
+
+Rollup'lar telemetry_store.ROLLUPS ile aynı isimleri kullanır:
+- telemetry_{5m,1h,1d}: device_telemetry (device_id, key) başına avg/min/max/last/sum/count
+- telemetry_wide_{5m,1h,1d}: device_telemetry_wide (device_id) başına metrik kolonları
+
+TimescaleDB kurulu değilse migration hiçbir şey yapmaz; store raw
+tablolara time_bucket ile düşer.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003_telemetry_rollups'
+down_revision = '002_telemetry_wide'
+branch_labels = None
+depends_on = None
+
+METRIC_KEYS = ("power", "voltage", "current", "energy", "temperature", "humidity")
+
+# (view soneki, bucket, refresh start_offset, end_offset, schedule_interval)
+ROLLUPS = (
+    ("5m", "5 minutes", "1 day", "5 minutes", "5 minutes"),
+    ("1h", "1 hour", "3 days", "1 hour", "30 minutes"),
+    ("1d", "1 day", "7 days", "1 day", "1 hour"),
+)
+
+
+def _has_timescaledb(bind) -> bool:
+    return bool(bind.execute(sa.text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+    )).scalar())
+
+
+def upgrade():
+    if not _has_timescaledb(op.get_bind()):
+        return
+
+    wide_columns = ",\n".join(
+        f"avg({m}) AS {m}_avg, min({m}) AS {m}_min, max({m}) AS {m}_max, "
+        f"last({m}, time) AS {m}_last, sum({m}) AS {m}_sum, count({m}) AS {m}_count"
+        for m in METRIC_KEYS
+    )
+
+    # Continuous aggregate'ler transaction içinde oluşturulamaz
+    with op.get_context().autocommit_block():
+        for suffix, bucket, start_offset, end_offset, schedule in ROLLUPS:
+            op.execute(f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS telemetry_{suffix}
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                SELECT time_bucket('{bucket}', time) AS bucket,
+                       device_id,
+                       key,
+                       avg(value) AS avg,
+                       min(value) AS min,
+                       max(value) AS max,
+                       last(value, time) AS last,
+                       sum(value) AS sum,
+                       count(value) AS count
+                FROM device_telemetry
+                GROUP BY bucket, device_id, key
+                WITH NO DATA
+            """)
+            op.execute(f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS telemetry_wide_{suffix}
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                SELECT time_bucket('{bucket}', time) AS bucket,
+                       device_id,
+                       {wide_columns}
+                FROM device_telemetry_wide
+                GROUP BY bucket, device_id
+                WITH NO DATA
+            """)
+            for view in (f"telemetry_{suffix}", f"telemetry_wide_{suffix}"):
+                op.execute(f"""
+                    SELECT add_continuous_aggregate_policy('{view}',
+                        start_offset => INTERVAL '{start_offset}',
+                        end_offset => INTERVAL '{end_offset}',
+                        schedule_interval => INTERVAL '{schedule}',
+                        if_not_exists => TRUE)
+                """)
+
+
+def downgrade():
+    if not _has_timescaledb(op.get_bind()):
+        return
+
+    with op.get_context().autocommit_block():
+        for suffix, *_ in ROLLUPS:
+            op.execute(f"DROP MATERIALIZED VIEW IF EXISTS telemetry_wide_{suffix}")
+            op.execute(f"DROP MATERIALIZED VIEW IF EXISTS telemetry_{suffix}")
@@ -0,0 +1,43 @@
+"""Add per-organization daily statistics facts table
+
+Revision ID: 004_org_daily_stats
+Revises: 003_telemetry_rollups
+Create Date: 2025-02-03
+
+/dashboard/statistics kapanmış günleri bu tablodan okur; satırlar ilk
+istekte veya rollup_daily_stats beat job'ı ile üretilir.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '004_org_daily_stats'
+down_revision = '003_telemetry_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'org_daily_stats',
+        sa.Column('organization_id', postgresql.UUID(as_uuid=True),
+                  sa.ForeignKey('organizations.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('date', sa.Date(), primary_key=True),
+        sa.Column('energy_sum', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('energy_max', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('energy_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('savings_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('energy_saved_kwh', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('money_saved', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('off_duration_minutes', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('savings_by_source', postgresql.JSONB(), nullable=True),
+        sa.Column('automation_triggers', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('automation_success', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('automation_failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('computed_at', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('org_daily_stats')
@@ -0,0 +1,35 @@
+"""Add wallet activity index (reward-day bitmap + monthly aggregates)
+
+Revision ID: 005_wallet_activity
+Revises: 004_org_daily_stats
+Create Date: 2025-02-05
+
+Satırlar ilk okumada veya ilk işlem yazımında wallet_transactions'tan
+kurulur; backfill gerekmez.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '005_wallet_activity'
+down_revision = '004_org_daily_stats'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'wallet_activity',
+        sa.Column('wallet_id', postgresql.UUID(as_uuid=True),
+                  sa.ForeignKey('wallets.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('reward_start', sa.Date(), nullable=True),
+        sa.Column('reward_days', sa.LargeBinary(), nullable=False, server_default=''),
+        sa.Column('monthly', postgresql.JSONB(), nullable=True),
+        sa.Column('category_totals', postgresql.JSONB(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('wallet_activity')
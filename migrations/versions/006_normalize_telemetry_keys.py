@@ -0,0 +1,65 @@
+"""Normalize legacy telemetry keys in device_telemetry
+
+Revision ID: 006_telemetry_keys
+Revises: 005_wallet_activity
+Create Date: 2025-02-07
+
+Home Assistant webhook'u eskiden power_w / energy_total_kwh key'leriyle yazıyordu;
+telemetry_store artık yalnızca kanonik key'leri (power, energy, ...) okur.
+Eski satırlar kanonik key'e taşınır (aynı (time, device_id) için kanonik satır
+varsa o korunur) ve narrow rollup'lar tüm aralık için yeniden hesaplanır.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_telemetry_keys'
+down_revision = '005_wallet_activity'
+branch_labels = None
+depends_on = None
+
+# telemetry_store.TELEMETRY_KEY_ALIASES içindeki kanonik olmayan key'ler
+KEY_ALIASES = {
+    "power_w": "power",
+    "current_power_w": "power",
+    "energy_total_kwh": "energy",
+    "total_energy_kwh": "energy",
+    "temperature_c": "temperature",
+    "temp": "temperature",
+    "humidity_pct": "humidity",
+}
+
+ROLLUP_SUFFIXES = ("5m", "1h", "1d")
+
+
+def upgrade():
+    bind = op.get_bind()
+    for alias, key in KEY_ALIASES.items():
+        op.execute(sa.text("""
+            INSERT INTO device_telemetry (time, device_id, key, value, quality)
+            SELECT time, device_id, :key, value, quality
+            FROM device_telemetry
+            WHERE key = :alias
+            ON CONFLICT (time, device_id, key) DO NOTHING
+        """).bindparams(key=key, alias=alias))
+        op.execute(sa.text("DELETE FROM device_telemetry WHERE key = :alias").bindparams(alias=alias))
+
+    has_timescaledb = bool(bind.execute(sa.text(
+        "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+    )).scalar())
+    if not has_timescaledb:
+        return
+
+    # Refresh policy'leri yalnızca son günleri yeniler; eski bucket'lar burada yeniden hesaplanır
+    views = [
+        f"telemetry_{suffix}" for suffix in ROLLUP_SUFFIXES
+        if bind.execute(sa.text("SELECT to_regclass(:view)").bindparams(view=f"telemetry_{suffix}")).scalar()
+    ]
+    with op.get_context().autocommit_block():
+        for view in views:
+            op.execute(f"CALL refresh_continuous_aggregate('{view}', NULL, NULL)")
+
+
+def downgrade():
+    # Key normalizasyonu geri alınamaz (hangi satırın eski key'le yazıldığı tutulmaz)
+    pass
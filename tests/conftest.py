@@ -70,7 +70,8 @@ def db_session(app):
         from app.models import (
             Organization, User, SmartDevice, SmartAsset,
             Automation, AutomationLog, Wallet, WalletTransaction,
-            MarketPrice, Notification, AuditLog, Gateway, Integration
+            MarketPrice, Notification, AuditLog, Gateway, Integration,
+            DeviceTelemetry, DeviceTelemetryWide
         )
         
         # Sıralı silme (foreign key constraints)
@@ -81,6 +82,8 @@ def db_session(app):
         Notification.query.delete()
         AuditLog.query.delete()
         SmartAsset.query.delete()
+        DeviceTelemetry.query.delete()
+        DeviceTelemetryWide.query.delete()
         SmartDevice.query.delete()
         Gateway.query.delete()
         Integration.query.delete()
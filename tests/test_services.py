@@ -113,6 +113,77 @@ class TestAutomationEngine:
         assert result['executed'] is True
 
 
+    def test_shared_context_and_rule_cache(self, db_session, sample_automation):
+        """Test compiled rules are cached per updated_at and the tick context reads the price once."""
+        from app.services.automation_rules import EvaluationContext, get_rule_cache
+        
+        db_session.add(MarketPrice(time=datetime.now(timezone.utc), price=1.5, ptf=1500.0))
+        db_session.commit()
+        
+        cache = get_rule_cache()
+        compiled = cache.get(sample_automation)
+        assert cache.get(sample_automation) is compiled
+        
+        context = EvaluationContext()
+        assert context.price == 1.5
+        with patch.object(MarketPrice, "query", side_effect=AssertionError("price re-queried")):
+            assert AutomationEngine().evaluate(sample_automation, context)[0] is True
+            assert AutomationEngine().evaluate(sample_automation, context)[0] is True
+        
+        sample_automation.rules = {"trigger": {"type": "always"}, "action": {"type": "turn_on"}}
+        db_session.commit()
+        assert cache.get(sample_automation) is not compiled
+        assert AutomationEngine().evaluate(sample_automation)[1] == "Always trigger"
+
+
+    def test_trigger_index_dispatches_only_on_threshold_crossing(self, db_session, sample_automation, sample_device):
+        """Test sensor readings enqueue an automation only when its threshold is crossed."""
+        from app.services.automation_triggers import AutomationTriggerIndex
+        
+        sample_automation.rules = {
+            "trigger": {"type": "sensor", "key": "power", "operator": ">", "value": 1000},
+            "action": {"type": "turn_off"}
+        }
+        db_session.commit()
+        
+        index = AutomationTriggerIndex()
+        now = datetime.now(timezone.utc)
+        with patch("app.tasks.automation_tasks.evaluate_automations.delay") as delay:
+            assert index.on_readings([(now, sample_device.id, "power", 500.0)]) == 0
+            assert index.on_readings([(now, sample_device.id, "power_w", 1500.0)]) == 1
+            assert index.on_readings([(now, sample_device.id, "power", 1600.0)]) == 0
+            assert index.on_price_changed() == 0
+        
+        delay.assert_called_once_with([str(sample_automation.id)], "sensor")
+
+    def test_trigger_outcomes_are_shared_across_processes(self, db_session, sample_automation, sample_device):
+        """Test a crossing is detected once when readings of a device land on different processes."""
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from app.services.automation_triggers import _SWAP_OUTCOMES, AutomationTriggerIndex
+        
+        sample_automation.rules = {
+            "trigger": {"type": "sensor", "key": "power", "operator": ">", "value": 1000},
+            "action": {"type": "turn_off"}
+        }
+        db_session.commit()
+        
+        server = fakeredis.FakeServer()
+        first, second = AutomationTriggerIndex(redis_url=None), AutomationTriggerIndex(redis_url=None)
+        for index in (first, second):
+            index._redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+            index._script = index._redis.register_script(_SWAP_OUTCOMES)
+        
+        now = datetime.now(timezone.utc)
+        with patch("app.tasks.automation_tasks.evaluate_automations.delay") as delay:
+            assert first.on_readings([(now, sample_device.id, "power", 500.0)]) == 0
+            assert second.on_readings([(now, sample_device.id, "power", 1500.0)]) == 1
+            assert first.on_readings([(now, sample_device.id, "power", 1600.0)]) == 0
+            assert second.on_readings([(now, sample_device.id, "power", 1600.0), (now, sample_device.id, "power", 400.0)]) == 1
+        
+        assert delay.call_count == 2
+
+
 class TestAutomationEngineEdgeCases:
     """Edge case tests for AutomationEngine."""
     
@@ -148,3 +219,1128 @@ class TestAutomationEngineEdgeCases:
         
         # Should fail because no asset
         assert result is False
+
+
+class TestTelemetryBatchWriter:
+    """TelemetryBatchWriter tests."""
+    
+    def test_extract_readings_normalizes_aliases(self):
+        """Test payload aliases map to canonical telemetry keys."""
+        from app.services.telemetry_writer import extract_readings
+        
+        readings = extract_readings({"power_w": "45.5", "temp": 21, "state": "ON"})
+        
+        assert readings == {"power": 45.5, "temperature": 21.0}
+    
+    def test_drain_writes_batched_rows(self, db_session, sample_device):
+        """Test queued readings are flushed as telemetry rows on drain."""
+        from app.models import DeviceTelemetry
+        from app.services.telemetry_writer import TelemetryBatchWriter
+        
+        writer = TelemetryBatchWriter(batch_size=3, workers=0)
+        now = datetime.now(timezone.utc)
+        for i in range(4):
+            writer.submit(sample_device.id, now.replace(microsecond=i), {"power": 10.0 + i, "voltage": 230.0})
+        
+        written = writer.drain()
+        metrics = writer.metrics()
+        
+        assert written == 8
+        assert metrics["batches"] == 2
+        assert metrics["queue_depth"] == 0
+        assert DeviceTelemetry.query.filter_by(device_id=sample_device.id).count() == 8
+    
+    def test_submit_drops_when_queue_full(self, sample_device):
+        """Test backpressure: readings beyond queue capacity are dropped and counted."""
+        from app.services.telemetry_writer import TelemetryBatchWriter
+        
+        writer = TelemetryBatchWriter(queue_size=1, workers=0)
+        assert writer.submit(sample_device.id, None, {"power": 1.0}) is True
+        assert writer.submit(sample_device.id, None, {"power": 2.0}) is False
+        
+        metrics = writer.metrics()
+        assert metrics["enqueued"] == 1
+        assert metrics["dropped"] == 1
+    
+    def test_failed_batch_is_split_and_last_seen_is_per_device(self, db_session, sample_device):
+        """Test a bad reading only drops itself and each device keeps its own last_seen."""
+        from datetime import timedelta
+        from app.models import DeviceTelemetry, SmartDevice
+        from app.services.telemetry_writer import TelemetryBatchWriter
+        
+        other = SmartDevice(organization_id=sample_device.organization_id, external_id="test-device-002", name="Other")
+        db_session.add(other)
+        db_session.commit()
+        
+        writer = TelemetryBatchWriter(workers=0)
+        execute = writer._execute
+        
+        def failing_execute(rows, last_seen):
+            if any(value < 0 for value in rows.values()):
+                raise ValueError("bad reading")
+            execute(rows, last_seen)
+        
+        old = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(hours=1)
+        new = old + timedelta(minutes=30)
+        with patch.object(writer, "_execute", side_effect=failing_execute):
+            written = writer.write_now([
+                (sample_device.id, old, {"power": 1.0}),
+                (other.id, new, {"power": 2.0}),
+                (sample_device.id, new, {"power": -1.0}),
+                (other.id, old, {"voltage": 230.0}),
+            ])
+        
+        assert written == 3
+        assert writer.metrics()["failed_rows"] == 1
+        assert DeviceTelemetry.query.count() == 3
+        db_session.expire_all()
+        assert db_session.get(SmartDevice, sample_device.id).last_seen.replace(tzinfo=timezone.utc) == old
+        assert db_session.get(SmartDevice, other.id).last_seen.replace(tzinfo=timezone.utc) == new
+    
+    def test_unbound_writer_is_created_once(self):
+        """Test get_telemetry_writer keeps one instance so ingest metrics are not reset."""
+        from app.services import telemetry_writer
+        
+        with patch.object(telemetry_writer, "_telemetry_writer", None):
+            assert telemetry_writer.get_telemetry_writer() is telemetry_writer.get_telemetry_writer()
+
+
+class TestDeviceResolver:
+    """DeviceResolver cache tests."""
+    
+    def test_resolve_caches_positive_result(self, db_session, sample_device):
+        """Test repeated lookups are served from memory without SQL."""
+        from app.services.device_resolver import DeviceResolver
+        
+        resolver = DeviceResolver()
+        ref = resolver.resolve("test-device-001")
+        assert ref.id == sample_device.id
+        assert ref.organization_id == sample_device.organization_id
+        
+        with patch("app.services.device_resolver._query", side_effect=AssertionError("SQL executed")):
+            assert resolver.resolve("test-device-001") == ref
+        
+        assert resolver.stats()["hits"] >= 1
+    
+    def test_negative_cache_invalidated_on_create(self, db_session, sample_organization):
+        """Test unknown IDs are cached until a device is created."""
+        from app.services.device_resolver import get_device_resolver
+        from app.services.device_service import create_device_logic
+        
+        resolver = get_device_resolver()
+        resolver.clear()
+        
+        assert resolver.resolve("new-plug-42") is None
+        with patch("app.services.device_resolver._query", side_effect=AssertionError("SQL executed")):
+            assert resolver.resolve("new-plug-42") is None
+        
+        device = create_device_logic(sample_organization.id, {"external_id": "new-plug-42", "name": "Plug"})
+        
+        ref = resolver.resolve("new-plug-42")
+        assert ref is not None
+        assert ref.id == device.id
+        resolver.clear()
+    
+    def test_invalidation_reaches_other_processes(self, db_session, sample_device):
+        """Test a device moved in one process stops resolving to its old org in another."""
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from app.models import Organization
+        from app.services.device_resolver import (
+            DeviceResolver, _PUBLISH_INVALIDATION, _READ_INVALIDATIONS,
+        )
+        
+        server = fakeredis.FakeServer()
+        
+        def process():
+            resolver = DeviceResolver(sync_interval=0, redis_url=None)
+            resolver._redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+            resolver._publish_script = resolver._redis.register_script(_PUBLISH_INVALIDATION)
+            resolver._read_script = resolver._redis.register_script(_READ_INVALIDATIONS)
+            return resolver
+        
+        api, ingest = process(), process()
+        old_org = sample_device.organization_id
+        assert ingest.resolve("test-device-001").organization_id == old_org
+        assert ingest.resolve("unknown-plug") is None
+        
+        other = Organization(name="Other Org", slug="resolver-other-org")
+        db_session.add(other)
+        db_session.commit()
+        sample_device.organization_id = other.id
+        db_session.commit()
+        api.invalidate_device(sample_device)
+        
+        try:
+            assert ingest.resolve("test-device-001").organization_id == other.id
+            assert ("ext", "unknown-plug") not in ingest._entries
+        finally:
+            sample_device.organization_id = old_org
+            db_session.commit()
+
+
+class TestTelemetryIngest:
+    """Edge batch ingest tests."""
+    
+    def test_partial_batch_reports_rejected_entries(self, client, db_session, sample_device):
+        """Test unknown devices are rejected per entry without dropping the batch."""
+        from app.models import DeviceTelemetry
+        
+        payload = [
+            {"device_id": "test-device-001", "power": 120.5, "voltage": 229.8},
+            {"device_id": "unknown-device", "power": 5.0},
+            {"device_id": "test-device-001", "timestamp": "2024-01-01T00:00:00Z", "data": {"power": "n/a"}},
+        ]
+        response = client.post("/api/v1/ingest", json=payload)
+        body = response.get_json()
+        
+        assert response.status_code == 201
+        assert body["status"] == "partial"
+        assert body["accepted"] == 1
+        assert body["rejected"] == 2
+        assert body["accepted_rows"] == 2
+        assert [e["index"] for e in body["errors"]] == [1, 2]
+        assert DeviceTelemetry.query.filter_by(device_id=sample_device.id).count() == 2
+    
+    def test_device_online_event_follows_database_state(self, client, db_session, sample_device):
+        """Test device_online is emitted when the DB row was offline, even if the resolver cache says online."""
+        from app.services.device_resolver import get_device_resolver
+        
+        get_device_resolver().clear()
+        assert get_device_resolver().resolve("test-device-001").is_online is True
+        sample_device.is_online = False  # Başka bir process / watchdog offline işaretledi
+        db_session.commit()
+        
+        emitter = Mock()
+        with patch("app.api.routes_telemetry.get_telemetry_emitter", return_value=emitter):
+            client.post("/api/v1/ingest", json=[{"device_id": "test-device-001", "power": 10.0}])
+            client.post("/api/v1/ingest", json=[{"device_id": "test-device-001", "power": 11.0}])
+        
+        statuses = [call.kwargs["status"] for call in emitter.update.call_args_list]
+        assert statuses[0]["event"] == "device_online"
+        assert statuses[1] is None
+        get_device_resolver().clear()
+
+
+class TestTelemetryStore:
+    """TelemetryStore narrow/wide layout tests."""
+    
+    def test_narrow_history_pivots_rows(self, db_session, sample_device):
+        """Test key/value rows are read back as one record per timestamp."""
+        from app.services.telemetry_store import get_telemetry_store
+        
+        store = get_telemetry_store("narrow")
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        store.write([
+            (now, sample_device.id, "power_w", 45.5),
+            (now, sample_device.id, "voltage", 229.8),
+        ])
+        db_session.commit()
+        
+        records = store.history(now.replace(hour=0, minute=0, second=0), now, device_ids=[sample_device.id])
+        
+        assert len(records) == 1
+        assert records[0]["power"] == 45.5
+        assert records[0]["voltage"] == 229.8
+        assert store.latest_value(sample_device.id, "power")[1] == 45.5
+    
+    def test_wide_write_merges_metrics_into_one_row(self, db_session, sample_device):
+        """Test wide layout merges metrics for the same timestamp and keeps extra keys."""
+        from app.models import DeviceTelemetry, DeviceTelemetryWide
+        from app.services.telemetry_store import get_telemetry_store
+        
+        store = get_telemetry_store("wide")
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        store.write([(now, sample_device.id, "power", 10.0), (now, sample_device.id, "rssi", -60.0)])
+        store.write([(now, sample_device.id, "voltage", 230.0)])
+        db_session.commit()
+        
+        assert DeviceTelemetryWide.query.filter_by(device_id=sample_device.id).count() == 1
+        assert DeviceTelemetry.query.filter_by(device_id=sample_device.id, key="rssi").count() == 1
+        
+        latest = store.latest(sample_device.id)
+        assert latest["power"] == 10.0
+        assert latest["voltage"] == 230.0
+        assert latest["rssi"] == -60.0
+    
+    def test_rollup_router_picks_coarsest_matching_view(self):
+        """Test aggregation requests are routed to the coarsest usable continuous aggregate."""
+        from datetime import timedelta
+        from app.services.telemetry_store import NarrowTelemetryStore
+        
+        store = NarrowTelemetryStore()
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        end = start + timedelta(days=30)
+        
+        with patch.object(store, "available_rollups", return_value={"telemetry_5m", "telemetry_1h", "telemetry_1d"}):
+            assert store._pick_rollup(start, end, bucket=timedelta(hours=1))[1] == "telemetry_1h"
+            assert store._pick_rollup(start, end, bucket=timedelta(hours=6))[1] == "telemetry_1h"
+            assert store._pick_rollup(start, end, bucket=timedelta(minutes=15))[1] == "telemetry_5m"
+            assert store._pick_rollup(start, end, bucket=timedelta(days=1))[1] == "telemetry_1d"
+            assert store._pick_rollup(start + timedelta(minutes=30), end, aligned=True)[1] == "telemetry_5m"
+        
+        with patch.object(store, "available_rollups", return_value=set()):
+            assert store._pick_rollup(start, end, bucket=timedelta(hours=1)) is None
+
+
+class TestLatestValueStore:
+    """LatestValueStore (last-known-value) tests."""
+    
+    def test_record_serves_latest_without_sql(self, db_session, sample_device):
+        """Test recorded readings are served from memory and older readings are ignored."""
+        from datetime import timedelta
+        from app.services.latest_values import LatestValueStore
+        
+        lkv = LatestValueStore(redis_url=None)
+        now = datetime.now(timezone.utc)
+        lkv.record([(now - timedelta(hours=1), sample_device.id, "power", 1.0)])
+        lkv.get_org_snapshot(sample_device.organization_id)  # Cold start yüklemesi (tek seferlik)
+        
+        with patch("app.services.telemetry_store.db.session.query", side_effect=AssertionError("SQL executed")):
+            lkv.record([(now, sample_device.id, "power_w", 120.0)])
+            lkv.record([(now - timedelta(minutes=1), sample_device.id, "power", 5.0)])
+            assert lkv.get_latest(sample_device, "power") == (now, 120.0)
+            snapshot = lkv.get_org_snapshot(sample_device.organization_id)
+        
+        assert snapshot[sample_device.id]["power"][1] == 120.0
+    
+    def test_cold_start_loads_from_telemetry_store(self, db_session, sample_device):
+        """Test an empty store is warmed from persisted telemetry on first read."""
+        from app.services.latest_values import LatestValueStore
+        from app.services.telemetry_store import get_telemetry_store
+        
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        get_telemetry_store().write([(now, sample_device.id, "voltage", 231.0)])
+        db_session.commit()
+        
+        lkv = LatestValueStore(redis_url=None)
+        _, value = lkv.get_latest(sample_device, "voltage")
+        
+        assert value == 231.0
+    
+    def test_redis_script_keeps_newest_value_across_processes(self, db_session, sample_device):
+        """Test the compare-and-set script against Redis: values are shared and older writes lose."""
+        from datetime import timedelta
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from app.services.latest_values import _HSET_IF_NEWER, LKV_REDIS_TTL_SECONDS, LatestValueStore
+        
+        server = fakeredis.FakeServer()
+        
+        def process():
+            lkv = LatestValueStore(redis_url=None, local_ttl=0)
+            lkv._redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+            lkv._script = lkv._redis.register_script(_HSET_IF_NEWER)
+            return lkv
+        
+        writer, stale_writer, reader = process(), process(), process()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        writer.record([(now, sample_device.id, "power", 120.0), (now, sample_device.id, "voltage", 230.0)])
+        stale_writer.record([(now - timedelta(minutes=1), sample_device.id, "power", 5.0)])
+        
+        assert writer._redis is not None and stale_writer._redis is not None  # Script hata vermedi
+        assert reader.get_latest(sample_device, "power") == (now, 120.0)
+        assert reader.get_latest(sample_device, "voltage") == (now, 230.0)
+        key = f"awaxen:lkv:{sample_device.organization_id}"
+        assert 0 < reader._redis.ttl(key) <= LKV_REDIS_TTL_SECONDS
+
+
+class TestHourlyStatsStore:
+    """HourlyStatsStore (incremental anomaly statistics) tests."""
+    
+    def test_incremental_stats_match_sql_aggregates(self, db_session, sample_device):
+        """Test stats warmed from history and updated on ingest match the SQL aggregates."""
+        from datetime import timedelta
+        from app.services.anomaly_stats import HourlyStatsStore
+        from app.services.telemetry_store import get_telemetry_store
+        
+        base = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        values = [40.0, 50.0, 60.0, 55.0]
+        get_telemetry_store().write([
+            (base + timedelta(minutes=i), sample_device.id, "power", v) for i, v in enumerate(values[:2])
+        ])
+        db_session.commit()
+        
+        stats = HourlyStatsStore(redis_url=None)
+        stats.get(sample_device.id, hour=base.hour)  # Cold start: geçmişten yükle
+        
+        with patch("app.services.telemetry_store.db.session.query", side_effect=AssertionError("SQL executed")):
+            for i, v in enumerate(values[2:], start=2):
+                stats.observe(sample_device.id, base + timedelta(minutes=i), v)
+            result = stats.get(sample_device.id, hour=base.hour)
+        
+        assert result["count"] == 4
+        assert result["mean"] == pytest.approx(51.25, rel=1e-3)
+        assert result["std"] == pytest.approx(8.539, rel=1e-2)
+        assert (result["min"], result["max"]) == (40.0, 60.0)
+    
+    def test_flushes_from_several_processes_are_added(self, db_session, sample_device):
+        """Test concurrent flushes of the same device/hour merge in Redis instead of overwriting."""
+        from datetime import timedelta
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from app.services.anomaly_stats import _MERGE_CELLS, HourlyStatsStore
+        
+        server = fakeredis.FakeServer()
+        
+        def process():
+            stats = HourlyStatsStore(redis_url=None)
+            stats._redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+            stats._script = stats._redis.register_script(_MERGE_CELLS)
+            return stats
+        
+        base = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        first, second = process(), process()
+        for stats, values in ((first, [40.0, 50.0]), (second, [60.0, 55.0])):
+            stats.get(sample_device.id, hour=base.hour)  # Geçmiş yok: boş başlar
+            for i, value in enumerate(values):
+                stats.observe(sample_device.id, base + timedelta(minutes=i), value)
+        assert first.flush() == 1
+        assert second.flush() == 1
+        
+        result = process().get(sample_device.id, hour=base.hour)
+        assert result["count"] == 4
+        assert result["mean"] == pytest.approx(51.25, rel=1e-3)
+        assert result["std"] == pytest.approx(8.539, rel=1e-2)
+        assert (result["min"], result["max"]) == (40.0, 60.0)
+    
+    def test_weights_stay_bounded_far_from_epoch(self):
+        """Test sums are kept relative to the last reading, so distant timestamps don't overflow."""
+        import math
+        from app.services.anomaly_stats import RunningStats
+        
+        tau = 7 * 86400.0
+        ts = datetime(2100, 1, 1, tzinfo=timezone.utc).timestamp()
+        cell, other = RunningStats(), RunningStats()
+        cell.update(40.0, ts, tau)
+        cell.update(50.0, ts + 60, tau)
+        other.update(60.0, ts + tau, tau)
+        cell.merge(other, tau)
+        
+        assert cell.weight <= 2.0
+        result = cell.snapshot(ts + tau, tau)
+        # İki eski okuma bir tau sonra e^-1 ağırlıkta
+        expected_weight = 1.0 + math.exp(-1.0) + math.exp(-(tau - 60) / tau)
+        assert result["count"] == round(expected_weight)
+        assert cell.weight == pytest.approx(expected_weight)
+        assert result["mean"] == pytest.approx(
+            (60.0 + 40.0 * math.exp(-1.0) + 50.0 * math.exp(-(tau - 60) / tau)) / expected_weight
+        )
+
+
+class TestAnomalyBatchScan:
+    """AnomalyDetector.check_devices_batch tests."""
+    
+    def test_batch_scan_flags_spike_and_notifies_admins(self, db_session, sample_device, sample_user):
+        """Test the vectorized scan flags a spiking device and bulk-creates notifications."""
+        from app.models import Notification
+        from app.services import anomaly_service
+        from app.services.anomaly_service import AnomalyDetector, create_anomaly_notifications
+        from app.services.anomaly_stats import HourlyStatsStore
+        from app.services.latest_values import LatestValueStore
+        
+        now = datetime.now(timezone.utc)
+        stats = HourlyStatsStore(redis_url=None)
+        for i, value in enumerate([50.0, 52.0, 48.0, 51.0, 49.0] * 4):
+            stats.observe(sample_device.id, now.replace(second=i % 60), value)
+        lkv = LatestValueStore(redis_url=None)
+        lkv.record([(now, sample_device.id, "power", 2000.0)])
+        
+        with patch.object(anomaly_service, "get_hourly_stats_store", return_value=stats), \
+                patch.object(anomaly_service, "get_latest_value_store", return_value=lkv):
+            anomalies = AnomalyDetector().check_devices_batch([sample_device.organization_id])
+        
+        assert [a["type"] for a in anomalies] == ["high_power"]
+        assert anomalies[0]["organization_id"] == str(sample_device.organization_id)
+        
+        assert create_anomaly_notifications(anomalies) == 1
+        with patch("app.services.org_kpis.get_org_kpi_store") as kpi_store:
+            db_session.commit()
+        assert Notification.query.filter_by(type="anomaly", user_id=sample_user.id).count() == 1
+        # Core INSERT'ler alerts_unread KPI'ını commit'te artırır
+        kpi_store.return_value.apply.assert_called_once_with([("alerts", str(sample_device.organization_id), 1)])
+
+
+class TestDeviceCommandDispatcher:
+    """DeviceCommandDispatcher tests."""
+    
+    def test_commands_fan_out_concurrently_with_retry(self):
+        """Test commands run in parallel, transient failures are retried and results keep order."""
+        import time
+        import uuid
+        import requests
+        from app.services.device_commands import DeviceCommand, DeviceCommandDispatcher
+        
+        org_id = uuid.uuid4()
+        devices = [
+            Mock(id=uuid.uuid4(), brand="shelly", device_type="relay", external_id=f"ext-{i}",
+                 organization_id=org_id)
+            for i in range(8)
+        ]
+        failed_once = set()
+        
+        def relay_control(external_id, action, timeout=None, retry=True):
+            time.sleep(0.1)
+            if external_id == "ext-3" and external_id not in failed_once:
+                failed_once.add(external_id)
+                raise requests.ConnectionError("reset")
+        
+        service = Mock(TIMEOUT=30, relay_control=Mock(side_effect=relay_control))
+        dispatcher = DeviceCommandDispatcher(workers=8, per_integration=8, deadline=5, retries=2)
+        
+        started = time.monotonic()
+        with patch("app.services.device_commands.get_shelly_service", return_value=service):
+            results = dispatcher.dispatch([DeviceCommand(d, "off") for d in devices])
+        elapsed = time.monotonic() - started
+        
+        assert [r.command.device_id for r in results] == [d.id for d in devices]
+        assert all(r.success for r in results)
+        assert results[3].attempts == 2
+        assert elapsed < 0.8  # Sıralı çalışma en az 0.9 sn sürerdi
+
+    def test_toggle_is_not_resent_after_read_timeout(self):
+        """Test toggle is not retried once it may have reached the device and paired steps are not resent."""
+        import time
+        import uuid
+        import requests
+        from app.services.device_commands import DeviceCommand, DeviceCommandDispatcher
+        
+        org_id = uuid.uuid4()
+        relay = Mock(id=uuid.uuid4(), brand="shelly", device_type="relay", external_id="relay", organization_id=org_id)
+        dimmer = Mock(id=uuid.uuid4(), brand="shelly", device_type="dimmer", external_id="dimmer", organization_id=org_id)
+        slow = Mock(id=uuid.uuid4(), brand="shelly", device_type="relay", external_id="slow", organization_id=org_id)
+        
+        def relay_control(external_id, action, timeout=None, retry=True):
+            if external_id == "relay":
+                raise requests.ReadTimeout("read timed out")
+            if external_id == "slow":
+                time.sleep(2.5)
+        
+        light_failures = [requests.ConnectionError("reset")]
+        
+        def light_control(external_id, brightness, timeout=None, retry=True):
+            if light_failures:
+                raise light_failures.pop()
+        
+        service = Mock(TIMEOUT=30, relay_control=Mock(side_effect=relay_control),
+                       light_control=Mock(side_effect=light_control))
+        dispatcher = DeviceCommandDispatcher(workers=4, per_integration=4, deadline=1.0, retries=2)
+        
+        with patch("app.services.device_commands.get_shelly_service", return_value=service):
+            toggled, dimmed, in_flight = dispatcher.dispatch([
+                DeviceCommand(relay, "toggle"), DeviceCommand(dimmer, "on", 40), DeviceCommand(slow, "off"),
+            ])
+        
+        assert (toggled.success, toggled.attempts) == (False, 1)
+        assert (dimmed.success, dimmed.attempts) == (True, 2)
+        assert [c.args[0] for c in service.relay_control.call_args_list].count("dimmer") == 1
+        assert (in_flight.success, in_flight.message) == (False, "Result unknown: command still in flight")
+
+
+class TestHttpClient:
+    """HttpClient tests."""
+    
+    def test_circuit_opens_per_host_and_recovers(self):
+        """Test consecutive failures open the host circuit, other hosts are unaffected and a probe closes it."""
+        import time
+        import requests
+        from app.services.http_client import CircuitOpenError, HttpClient
+        
+        client = HttpClient(retries=0, circuit_failures=2, circuit_reset=0.1)
+        ok = Mock(status_code=200)
+        
+        with patch("requests.Session.request", side_effect=requests.ConnectionError("refused")) as send:
+            for _ in range(2):
+                with pytest.raises(requests.ConnectionError):
+                    client.post("https://shelly.example/device/relay/control", data={})
+            with pytest.raises(CircuitOpenError):
+                client.post("https://shelly.example/device/relay/control", data={})
+            assert send.call_count == 2
+        
+        with patch("requests.Session.request", return_value=ok):
+            assert client.get("https://weather.example/data").status_code == 200
+            time.sleep(0.15)
+            assert client.post("https://shelly.example/device/relay/control", data={}).status_code == 200
+        
+        metrics = client.metrics()
+        assert metrics["shelly.example"]["circuit"] == "closed"
+        assert metrics["shelly.example"]["errors"] == 2
+        assert metrics["shelly.example"]["rejected"] == 1
+        assert metrics["weather.example"]["requests"] == 1
+
+    def test_probe_released_on_unexpected_error_and_retry_can_be_disabled(self):
+        """Test a crashing half-open probe does not wedge the circuit and retry=False skips adapter retries."""
+        import time
+        import requests
+        from app.services.http_client import HttpClient
+        
+        client = HttpClient(retries=2, circuit_failures=1, circuit_reset=0.05)
+        with patch("requests.Session.request", side_effect=requests.ConnectionError("refused")):
+            with pytest.raises(requests.ConnectionError):
+                client.post("https://shelly.example/device/relay/control", data={})
+        
+        time.sleep(0.1)
+        with patch("requests.Session.request", side_effect=RuntimeError("boom")):
+            with pytest.raises(RuntimeError):
+                client.post("https://shelly.example/device/relay/control", data={})
+        with patch("requests.Session.request", return_value=Mock(status_code=200)):
+            assert client.post("https://shelly.example/device/relay/control", data={}, retry=False).status_code == 200
+        
+        direct, _, _ = client._host("shelly.example", retry=False)
+        pooled, _, _ = client._host("shelly.example")
+        assert direct.get_adapter("https://shelly.example").max_retries.connect == 0
+        assert pooled.get_adapter("https://shelly.example").max_retries.connect == 2
+
+
+class TestShellyServiceRegistry:
+    """ShellyServiceRegistry tests."""
+    
+    def test_service_reused_until_invalidated(self, db_session, sample_organization, monkeypatch):
+        """Test the registry serves one service per organization, never caches a missing integration and rebuilds after invalidation."""
+        from cryptography.fernet import Fernet
+        from app.models import Integration
+        from app.services.shelly_service import ShellyServiceRegistry
+        from app.utils.encryption import _get_fernet
+        
+        monkeypatch.setenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
+        _get_fernet.cache_clear()
+        
+        registry = ShellyServiceRegistry(ttl=300)
+        assert registry.get(sample_organization.id) is None  # Entegrasyon yok (cache'lenmez)
+        
+        integration = Integration(
+            organization_id=sample_organization.id,
+            provider="shelly",
+            provider_data={"server_uri": "shelly-77-eu.shelly.cloud"},
+        )
+        integration.access_token = "key-1"
+        db_session.add(integration)
+        db_session.commit()
+        
+        # Başka process'te oluşturulmuş gibi: invalidate olmadan görünür
+        service = registry.get(sample_organization.id)
+        assert service.auth_key == "key-1"
+        assert service.base_url == "https://shelly-77-eu.shelly.cloud"
+        assert registry.get(str(sample_organization.id)) is service
+        
+        integration.access_token = "key-2"
+        db_session.commit()
+        registry.invalidate(sample_organization.id)
+        assert registry.get(sample_organization.id).auth_key == "key-2"
+        _get_fernet.cache_clear()
+
+
+class TestShellyStatusCache:
+    """ShellyStatusCache tests."""
+    
+    def test_snapshot_served_until_stale_or_refreshed(self):
+        """Test one all_status call serves all devices until the snapshot ages out or a refresh is forced."""
+        import uuid
+        from app.services.shelly_status import ShellyStatusCache
+        
+        org_id = uuid.uuid4()
+        service = Mock(get_all_devices=Mock(return_value={
+            "gen2": {"switch:0": {"output": True, "apower": 850.5, "voltage": 229.1, "aenergy": {"total": 12.5}},
+                     "cloud": {"connected": True}},
+            "gen1": {"relays": [{"ison": False}], "meters": [{"power": 0.0, "total": 90}],
+                     "cloud": {"connected": False}},
+            "em": {"relays": [{"ison": True}], "emeters": [{"power": 120.0, "total": 2500.0}]},
+        }))
+        cache = ShellyStatusCache(redis_url=None, max_age=60)
+        gen2 = Mock(external_id="gen2", organization_id=org_id)
+        gen1 = Mock(external_id="gen1", organization_id=org_id)
+        
+        with patch("app.services.shelly_status.get_shelly_service", return_value=service):
+            first = cache.get(gen2)
+            second = cache.get(gen1)
+            assert service.get_all_devices.call_count == 1
+            
+            cache.get(gen1, refresh=True)
+            assert service.get_all_devices.call_count == 2
+        
+        assert first["output"] is True and first["power"] == 850.5 and first["online"] is True
+        assert second["output"] is False and second["online"] is False
+        # kWh: Gen2 Wh, Gen1 meters watt-dakika, Gen1 emeters Wh
+        assert first["energy"] == pytest.approx(0.0125)
+        assert second["energy"] == pytest.approx(0.0015)
+        assert cache.get(Mock(external_id="em", organization_id=org_id))["energy"] == pytest.approx(2.5)
+        assert first["polled_at"] is not None
+
+
+class TestRealtimePubSub:
+    """RedisPubSub tests."""
+    
+    def test_pubsub_delivery_skips_message_queue(self, app):
+        """Test Redis channel messages are emitted only to local clients while direct emits use the queue."""
+        import json
+        from app import realtime
+        
+        message = {
+            "type": "message",
+            "channel": b"awaxen:telemetry",
+            "data": json.dumps({"org_id": "org-1", "device_id": "dev-1", "data": {"power": 12.5}}),
+        }
+        with patch.object(realtime.socketio, "emit") as emit:
+            realtime.redis_pubsub._message_handler(message)
+            assert emit.call_count == 2
+            assert all(call.kwargs.get("ignore_queue") is True for call in emit.call_args_list)
+            
+            emit.reset_mock()
+            realtime.emit_telemetry("org-1", "dev-1", {"power": 12.5})
+            assert all("ignore_queue" not in call.kwargs for call in emit.call_args_list)
+
+
+class TestTelemetryEmitter:
+    """TelemetryEmitter tests."""
+    
+    def test_updates_coalesce_into_one_batch_per_org(self):
+        """Test updates within a flush interval merge per device and go out as one org-scoped event."""
+        from app.services.realtime_emitter import TelemetryEmitter
+        
+        emitter = TelemetryEmitter(rate_hz=2, max_pending=2, compact=False, autostart=False)
+        for power in (100, 200, 300):
+            emitter.update("org-1", "dev-1", data={"power_w": power})
+        emitter.update("org-1", "dev-1", data={"voltage": 230}, status={"is_on": True})
+        emitter.update("org-1", "dev-2", data={"power_w": 5})
+        assert emitter.update("org-2", "dev-3", data={"power_w": 7}) is False  # Kapasite dolu
+        assert emitter.metrics()["pending_devices"] == 2
+        
+        with patch("app.services.realtime_emitter.emit_telemetry_frame") as emit:
+            assert emitter.flush() == 1
+        
+        event, payload, org_id = emit.call_args.args
+        assert (event, org_id, payload["count"]) == ("telemetry_batch", "org-1", 2)
+        first = next(d for d in payload["devices"] if d["device_id"] == "dev-1")
+        assert first["data"] == {"power_w": 300, "voltage": 230}
+        assert first["status"] == {"is_on": True}
+        metrics = emitter.metrics()
+        assert (metrics["coalesced"], metrics["dropped"], metrics["pending_devices"]) == (3, 1, 0)
+    
+    def test_deltas_are_computed_only_for_orgs_with_compact_subscribers(self):
+        """Test compact encoding is skipped for orgs whose clients all use the json stream."""
+        from app.services.realtime_codec import CompactSubscribers
+        from app.services.realtime_emitter import TelemetryEmitter
+        
+        subscribers = CompactSubscribers(redis_url=None)
+        with patch("app.services.realtime_codec.socketio.start_background_task"):
+            subscribers.add("org-1", "sid-1")
+            subscribers.add("org-2", "sid-2")
+        subscribers.remove("sid-2")
+        
+        emitter = TelemetryEmitter(autostart=False)
+        emitter.update("org-1", "dev-1", data={"power_w": 1})
+        emitter.update("org-2", "dev-2", data={"power_w": 2})
+        with patch("app.services.realtime_emitter.get_compact_subscribers", return_value=subscribers), \
+                patch("app.services.realtime_emitter.emit_telemetry_frame"), \
+                patch.object(emitter, "_emit_delta", return_value=(1, 0)) as emit_delta:
+            assert emitter.flush() == 2
+        
+        assert [call.args[0] for call in emit_delta.call_args_list] == ["org-1"]
+        assert emitter.metrics()["delta_orgs_skipped"] == 1
+
+
+class TestCompactEncoder:
+    """CompactEncoder tests."""
+    
+    def test_deltas_carry_only_changed_fields_between_keyframes(self, db_session, sample_device):
+        """Test compact frames use dictionary indices, skip unchanged fields and resend full state on keyframes."""
+        from app.services.realtime_codec import CompactEncoder, DeviceDictionaryRegistry
+        
+        registry = DeviceDictionaryRegistry()
+        encoder = CompactEncoder(registry, keyframe_interval=30, redis_url=None)
+        org_id, device_id = sample_device.organization_id, str(sample_device.id)
+        dictionary = registry.get(org_id)
+        assert dictionary.index == {device_id: 0}
+        
+        entry = {"device_id": device_id, "data": {"power_w": 1200.12345, "voltage": 230}}
+        first = encoder.encode(org_id, [entry], now=1000.0)
+        assert (first["v"], first["k"], first["d"]) == (dictionary.version, 1, [[0, 0, {"p": 1200.123, "v": 230}]])
+        
+        entry = {"device_id": device_id, "data": {"power_w": 1500, "voltage": 230}, "status": {"is_on": True}}
+        delta = encoder.encode(org_id, [entry], now=1001.0)
+        assert "k" not in delta and delta["d"][0][2] == {"p": 1500, "o": True}
+        assert encoder.encode(org_id, [entry], now=1002.0) is None
+        
+        keyframe = encoder.encode(org_id, [], now=1031.0)
+        assert keyframe["k"] == 1 and keyframe["d"] == [[0, 0, {"p": 1500, "v": 230, "o": True}]]
+
+    def test_baseline_is_shared_between_emitters(self, db_session, sample_device):
+        """Test deltas from several processes are computed against the shared baseline and rename bumps the version."""
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        from app.services.realtime_codec import _MERGE_BASELINE, CompactEncoder, DeviceDictionaryRegistry
+        
+        server = fakeredis.FakeServer()
+        registry = DeviceDictionaryRegistry()
+        first, second = (CompactEncoder(registry, keyframe_interval=30, redis_url=None) for _ in range(2))
+        for encoder in (first, second):
+            encoder._redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+            encoder._script = encoder._redis.register_script(_MERGE_BASELINE)
+        org_id, device_id = sample_device.organization_id, str(sample_device.id)
+        
+        def entry(power):
+            return {"device_id": device_id, "data": {"power_w": power, "voltage": 230}}
+        
+        assert first.encode(org_id, [entry(100)], now=1000.0)["d"] == [[0, 0, {"p": 100, "v": 230}]]
+        assert second.encode(org_id, [entry(200)], now=1000.5)["k"] == 1
+        # İkinci process'in gönderdiği 200 client'ta; birinci process 100'ü yeniden göndermeli
+        assert first.encode(org_id, [entry(100)], now=1001.0)["d"] == [[0, 0, {"p": 100}]]
+        assert second.encode(org_id, [entry(100)], now=1001.5) is None
+        assert second.encode(org_id, [], now=1031.0)["d"] == [[0, 0, {"p": 100, "v": 230}]]
+        
+        version = registry.get(org_id).version
+        sample_device.name = "Renamed"
+        db_session.commit()
+        assert registry.get(org_id, refresh=True).version != version
+
+
+class TestSocketAuthenticator:
+    """SocketAuthenticator tests."""
+    
+    def test_rooms_come_from_db_user_and_lookups_are_cached(self, db_session, sample_user):
+        """Test verified identities use the DB user's org, reuse the cached lookup and reject bad tokens."""
+        import time
+        import jwt
+        from app.exceptions import AuthenticationError
+        from app.services.socket_auth import SocketAuthenticator
+        
+        def decoder(token):
+            if token == "expired":
+                raise jwt.ExpiredSignatureError("expired")
+            return {"sub": token, "exp": time.time() + 60}
+        
+        authenticator = SocketAuthenticator(decoder=decoder)
+        identity = authenticator.authenticate("sid-1", sample_user.auth0_id)
+        assert (identity.user_id, identity.organization_id) == (str(sample_user.id), str(sample_user.organization_id))
+        assert authenticator.authenticate("sid-1", sample_user.auth0_id) is identity
+        authenticator.authenticate("sid-2", sample_user.auth0_id)
+        
+        for token, code in (("expired", "token_expired"), ("auth0|unknown", "user_not_in_db"), (None, "missing_token")):
+            with pytest.raises(AuthenticationError) as error:
+                authenticator.authenticate("sid-3", token)
+            assert error.value.code == code
+        
+        metrics = authenticator.metrics()
+        assert (metrics["verified"], metrics["reused"], metrics["user_lookups"], metrics["user_cache_hits"]) == (2, 1, 2, 1)
+        authenticator.forget("sid-1")
+        assert authenticator.identity("sid-1") is None and authenticator.identity("sid-2") is not None
+    
+    def test_deactivated_user_is_removed_from_org_rooms(self, db_session, sample_user):
+        """Test committing an org/active change drops the user's sockets from their rooms and identity cache."""
+        import time
+        from app.services.socket_auth import SocketAuthenticator
+        
+        authenticator = SocketAuthenticator(decoder=lambda token: {"sub": token, "exp": time.time() + 60})
+        authenticator.authenticate("sid-1", sample_user.auth0_id)
+        org_room = f"org:{sample_user.organization_id}"
+        
+        with patch("app.services.socket_auth.get_socket_authenticator", return_value=authenticator), \
+                patch("app.realtime.redis_pubsub.publish", return_value=False), \
+                patch("app.realtime.socketio.server") as server, \
+                patch("app.realtime.socketio.emit") as emit:
+            server.rooms.return_value = ["sid-1", f"user:{sample_user.id}", org_room]
+            sample_user.is_active = False
+            db_session.commit()
+        
+        try:
+            assert authenticator.identity("sid-1") is None
+            left = [call.args[1] for call in server.leave_room.call_args_list]
+            assert left == [f"user:{sample_user.id}", org_room]
+            assert emit.call_args.args[0] == "auth_error"
+            assert emit.call_args.kwargs["room"] == "sid-1"
+        finally:
+            sample_user.is_active = True
+            db_session.commit()
+
+
+class TestTokenVerificationCache:
+    """JwksCache / TokenCache tests."""
+    
+    def test_keys_and_validated_tokens_are_cached(self, monkeypatch):
+        """Test JWKS is fetched once, repeated tokens skip verification and unknown kids trigger one refetch."""
+        import time
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from app import auth
+        
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+        response = Mock(json=Mock(return_value={"keys": [{**jwk, "kid": "k1", "use": "sig"}]}))
+        client = Mock(get=Mock(return_value=response))
+        monkeypatch.setattr(auth, "_jwks_cache", auth.JwksCache(url="https://auth.test/jwks.json"))
+        monkeypatch.setattr(auth, "_token_cache", auth.TokenCache(maxsize=2))
+        
+        def sign(kid, sub="auth0|1"):
+            claims = {"sub": sub, "aud": auth.AUTH0_AUDIENCE, "iss": f"https://{auth.AUTH0_DOMAIN}/", "exp": int(time.time()) + 600}
+            return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+        
+        token = sign("k1")
+        with patch("app.services.http_client.get_http_client", return_value=client), \
+                patch("app.auth.jwt.decode", wraps=jwt.decode) as decode:
+            assert auth.decode_token(token)["sub"] == "auth0|1"
+            assert auth.decode_token(token)["sub"] == "auth0|1"
+            assert (client.get.call_count, decode.call_count) == (1, 1)
+            
+            for _ in range(2):
+                with pytest.raises(jwt.InvalidTokenError):
+                    auth.decode_token(sign("rotated"))
+            assert client.get.call_count == 2  # İkinci kid miss cooldown içinde
+
+
+class TestRequestUserLoader:
+    """load_db_user / RolePermissionCache tests."""
+    
+    def test_user_and_permissions_load_once_per_request(self, app, db_session, sample_user):
+        """Test the user is queried once per request and permission checks use the cached role code set."""
+        from flask import g
+        from sqlalchemy import event
+        from app.auth import get_db_user, get_role_permission_cache, load_db_user
+        from app.extensions import db
+        
+        get_role_permission_cache().invalidate()
+        auth0_id = sample_user.auth0_id
+        statements = []
+        
+        def count(*args):
+            statements.append(args[2])
+        
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            with app.test_request_context():
+                g.current_user = {"sub": auth0_id}
+                user = load_db_user()
+                assert load_db_user() is user and get_db_user() is user
+                assert user.has_any_permission("unknown", "can_view_devices")
+                assert not user.has_all_permissions("can_view_devices", "unknown")
+                assert "can_edit_devices" in g.permissions
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        assert len(statements) == 2  # Kullanıcı (+organizasyon, rol) ve rol yetki kodları
+
+
+class TestOrgKpiStore:
+    """OrgKpiStore (dashboard KPI snapshot) tests."""
+    
+    def test_snapshot_reconciles_and_applies_incremental_updates(self, db_session, sample_device):
+        """Test the snapshot is seeded from SQL and then kept current by ORM events and ingested rows."""
+        from app.services.org_kpis import OrgKpiStore
+        
+        org_id = str(sample_device.organization_id)
+        device_id = str(sample_device.id)
+        store = OrgKpiStore(redis_url=None)
+        
+        summary = store.summary(org_id)
+        assert (summary["devices_total"], summary["devices_online"], summary["alerts_unread"]) == (1, 1, 0)
+        assert summary["stale_after"] and summary["stale"] is False
+        
+        store.apply([("online", org_id, device_id, False), ("alerts", org_id, 2)])
+        store.observe_rows([(datetime.now(timezone.utc), sample_device.id, "energy", 1.5)])
+        store.observe_rows([(datetime.now(timezone.utc), sample_device.id, "power", 100.0)])
+        
+        with patch("app.services.org_kpis.db.session.query", side_effect=AssertionError("SQL executed")):
+            summary = store.summary(org_id)
+        assert (summary["devices_online"], summary["alerts_unread"]) == (1, 2)
+        assert summary["energy_today_kwh"] == 1.5
+        
+        assert store.reconcile([org_id]) == 1
+        assert store.summary(org_id)["alerts_unread"] == 0
+
+
+class TestDailyStatsStore:
+    """DailyStatsStore (dashboard statistics daily facts) tests."""
+    
+    def test_closed_days_are_computed_once_and_today_stays_live(self, db_session, sample_device):
+        """Test missing closed days are computed without writes, persisted by the refresh task and then read back."""
+        from datetime import timedelta
+        from app.models import OrgDailyStats
+        from app.services.dashboard_stats import DailyStatsStore
+        from app.services.telemetry_store import get_telemetry_store
+        
+        org_id = sample_device.organization_id
+        now = datetime.now(timezone.utc)
+        today = now.date()
+        yesterday = now - timedelta(days=1)
+        get_telemetry_store().write([
+            (yesterday.replace(hour=10, minute=0, second=0, microsecond=0), sample_device.id, "energy", 2.0),
+            (yesterday.replace(hour=11, minute=0, second=0, microsecond=0), sample_device.id, "energy", 4.0),
+            (now.replace(hour=0, minute=0, second=1, microsecond=0), sample_device.id, "energy", 1.0),
+        ])
+        db_session.commit()
+        
+        store = DailyStatsStore(redis_url=None)
+        with patch("app.tasks.monitoring_tasks.refresh_daily_stats.delay") as delay, \
+                patch.object(db_session, "commit", side_effect=AssertionError("GET path committed")):
+            facts = store.facts(org_id, today - timedelta(days=2), today)
+            store.facts(org_id, today - timedelta(days=2), today)  # Aynı aralık tekrar kuyruğa alınmaz
+        assert [(day["date"], day["energy_sum"], day["energy_count"]) for day in facts] == [
+            ((today - timedelta(days=2)).isoformat(), 0.0, 0),
+            (yesterday.date().isoformat(), 6.0, 2),
+            (today.isoformat(), 1.0, 1),
+        ]
+        delay.assert_called_once_with(str(org_id), (today - timedelta(days=2)).isoformat(), yesterday.date().isoformat())
+        assert OrgDailyStats.query.filter_by(organization_id=org_id).count() == 0
+        
+        store.refresh([org_id], today - timedelta(days=2), today)
+        assert OrgDailyStats.query.filter_by(organization_id=org_id).count() == 2  # Bugün kaydedilmez
+        
+        with patch.object(store, "compute", wraps=store.compute) as compute:
+            facts = store.facts(org_id, today - timedelta(days=2), today)
+        compute.assert_called_once_with(org_id, today, today)
+        assert facts[1]["energy_max"] == 4.0
+        
+        store.set_cached(org_id, today, today, {"energy": {}})
+        assert store.get_cached(org_id, today, today) == {"energy": {}}
+        store.invalidate(org_id)
+        assert store.get_cached(org_id, today, today) is None
+
+
+class TestLeaderboardStore:
+    """LeaderboardStore (wallet ranking sorted set) tests."""
+    
+    def test_rank_follows_committed_wallet_changes(self, db_session, sample_user):
+        """Test ranks are served from the board and follow committed (not rolled back) balance changes."""
+        from decimal import Decimal
+        from app.models import User, Wallet
+        from app.services.leaderboard import LeaderboardStore
+        
+        other = User(organization_id=sample_user.organization_id, auth0_id="auth0|other", email="other@example.com")
+        db_session.add(other)
+        db_session.flush()
+        mine = Wallet(user_id=sample_user.id, balance=Decimal("50"))
+        db_session.add_all([mine, Wallet(user_id=other.id, balance=Decimal("100"))])
+        db_session.commit()
+        org_id, user_id, other_id = sample_user.organization_id, str(sample_user.id), str(other.id)
+        
+        store = LeaderboardStore(redis_url=None)
+        with patch("app.services.leaderboard.get_leaderboard_store", return_value=store):
+            assert store.rank(org_id, user_id) == 2
+            
+            mine.balance = Decimal("150")
+            db_session.commit()
+            mine.balance = Decimal("10")
+            db_session.flush()
+            db_session.rollback()
+        
+        with patch("app.services.leaderboard.db.session.query", side_effect=AssertionError("SQL executed")):
+            assert store.rank(org_id, user_id) == 1
+            assert store.top(org_id, offset=1, limit=5) == [(other_id, 100.0)]
+            assert store.size(org_id) == 2
+
+
+class TestWalletActivity:
+    """Wallet activity index (reward-day bitmap + monthly aggregates) tests."""
+    
+    def test_index_matches_transaction_history(self, db_session, sample_user):
+        """Test the index written with transactions matches one rebuilt from SQL and yields the streak."""
+        from datetime import timedelta
+        from decimal import Decimal
+        from app.models import Wallet, WalletActivity, WalletTransaction
+        from app.services.wallet_activity import build_activity, get_activity, streak_days, wallet_stats
+        
+        wallet = Wallet(user_id=sample_user.id)
+        db_session.add(wallet)
+        db_session.flush()
+        now = datetime.now(timezone.utc)
+        for days_ago, amount, tx_type, category in [
+            (0, "5", "reward", "savings"), (1, "3", "reward", "manual"), (2, "4", "reward", "savings"),
+            (4, "1", "reward", "manual"), (0, "-2", "spend", None),
+        ]:
+            db_session.add(WalletTransaction(
+                wallet_id=wallet.id, amount=Decimal(amount), transaction_type=tx_type,
+                category=category, created_at=now - timedelta(days=days_ago),
+            ))
+        db_session.commit()
+        
+        with patch("app.services.wallet_activity.db.session.query", side_effect=AssertionError("SQL executed")):
+            stats = wallet_stats(get_activity(wallet.id))
+        this_month = [d for d in (0, 1, 2, 4, 0) if (now - timedelta(days=d)).month == now.month]
+        assert stats["streak_days"] == 3
+        assert stats["total_transactions_this_month"] == len(this_month)
+        assert stats["top_category"] == "savings"
+        assert streak_days(get_activity(wallet.id), now.date() + timedelta(days=1)) == 3
+        
+        db_session.delete(db_session.get(WalletActivity, wallet.id))
+        db_session.commit()
+        assert wallet_stats(build_activity(wallet.id)) == stats
+
+
+class TestSavingsEngine:
+    """SavingsEngine (batch savings over DeviceStateLog intervals) tests."""
+    
+    def test_intervals_are_priced_hourly_and_recomputed_idempotently(self, db_session, sample_device):
+        """Test off/dimmed intervals are split per hour, priced from MarketPrice and rewritten per day."""
+        from datetime import timedelta
+        from app.models.savings import DeviceStateLog, EnergySavings
+        from app.services.savings_engine import SavingsEngine
+        from app.services.savings_service import SavingsService
+        
+        sample_device.power_rating_watt = 1000
+        base = (datetime.now(timezone.utc) - timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+        db_session.add(MarketPrice(time=base, price=4.0))
+        
+        def log(minutes, state, power_level=100, triggered_by="automation"):
+            db_session.add(DeviceStateLog(
+                device_id=sample_device.id, timestamp=base + timedelta(minutes=minutes),
+                state=state, power_level=power_level, triggered_by=triggered_by,
+            ))
+        
+        log(0, "off")
+        log(90, "on")
+        log(120, "dimmed", power_level=50, triggered_by="manual")
+        log(180, "on", triggered_by="manual")
+        db_session.commit()
+        
+        def savings():
+            rows = EnergySavings.query.filter_by(device_id=sample_device.id).all()
+            return {
+                row.source_type: (float(row.energy_saved_kwh), float(row.money_saved), row.off_duration_minutes)
+                for row in rows
+            }
+        
+        engine = SavingsEngine(redis_url=None)
+        assert engine.run(now=base + timedelta(minutes=200)) == {"devices": 1, "rows": 2}
+        # 60 dk piyasa fiyatı (4.0) + 30 dk sabit fiyat (2.5); dimmed %50 güç
+        expected = {"automation": (1.5, 5.25, 90), "manual": (0.5, 1.25, 30)}
+        assert savings() == expected
+        assert engine.watermark() == base + timedelta(minutes=195)  # now - COMMIT_LAG_SECONDS
+        
+        engine.set_watermark((base - timedelta(hours=1)).timestamp())
+        engine.run(now=base + timedelta(minutes=200))
+        assert savings() == expected  # Tekrar işlenen aralıklar çift sayılmaz
+        
+        log(240, "off")
+        log(270, "on")
+        db_session.commit()
+        assert engine.run(now=base + timedelta(minutes=300)) == {"devices": 1, "rows": 2}
+        assert savings()["automation"] == (2.0, 6.5, 120)
+        assert engine.run(now=base + timedelta(minutes=310)) == {"devices": 0, "rows": 0}
+        
+        result = SavingsService.record_device_state_change(sample_device.id, "off")
+        assert result["state"] == "off"
+
+    def test_long_running_on_state_does_not_reopen_old_days(self, db_session, sample_device):
+        """Test a device that was on for months recomputes only from its new log's day and then settles."""
+        from datetime import timedelta
+        from decimal import Decimal
+        from app.models.savings import DeviceStateLog, EnergySavings
+        from app.services.savings_engine import SavingsEngine
+        
+        sample_device.power_rating_watt = 1000
+        base = (datetime.now(timezone.utc) - timedelta(days=3)).replace(hour=10, minute=0, second=0, microsecond=0)
+        db_session.add(DeviceStateLog(device_id=sample_device.id, timestamp=base - timedelta(days=60), state="on"))
+        old_day = (base - timedelta(days=30)).date()
+        db_session.add(EnergySavings(
+            organization_id=sample_device.organization_id, device_id=sample_device.id, date=old_day,
+            energy_saved_kwh=Decimal("1.0"), money_saved=Decimal("2.5"), source_type="manual",
+        ))
+        db_session.commit()
+        
+        engine = SavingsEngine(redis_url=None)
+        engine.set_watermark((base - timedelta(days=1)).timestamp())
+        for minutes, state in ((0, "off"), (60, "on")):
+            db_session.add(DeviceStateLog(device_id=sample_device.id, timestamp=base + timedelta(minutes=minutes), state=state))
+        db_session.commit()
+        
+        assert engine.run(now=base + timedelta(minutes=70)) == {"devices": 1, "rows": 1}
+        assert EnergySavings.query.filter_by(device_id=sample_device.id, date=old_day).count() == 1
+        assert engine.run(now=base + timedelta(minutes=80)) == {"devices": 0, "rows": 0}